@@ -1,8 +1,12 @@
-import aipy
+import hashlib
+import os
+
 import numpy as np
 
 from apercal.exceptions import ApercalException
-from apercal.libs import lib
+from apercal.subs import managetmp
+from apercal.subs import metadata
+from apercal.subs import mirio
 
 
 def calc_scal_interval(flux, noise, obstime, baselines, nfbin, feeds, snr, cycle):
@@ -48,32 +52,230 @@ def calc_dr_maj(drinit, dr0, majorcycles, func):
     return dr_maj
 
 
-def calc_theoretical_noise(dataset):
+# Correlator efficiency and system temperature in K used if the dataset has no system temperatures
+CORRELATOR_EFFICIENCY = 0.88
+DEFAULT_TSYS = 30.0
+
+# Polarisations that contribute to the noise in Stokes I (I, RR, LL, XX, YY)
+PARALLEL_HANDS = (1, -1, -2, -5, -6)
+
+# Number of flags to read at once when streaming over the dataset
+FLAG_BLOCK_SIZE = 2 ** 24
+
+# Channel weights by dataset that were calculated before, with the stamp of the dataset
+_weights_cache = {}
+
+# Subdirectory of the temporary directory with the channel weights of the datasets across runs
+WEIGHTS_CACHE_SUBDIR = 'noise_weights'
+
+
+def decode_baseline(baseline):
+    """
+    Function to get the antenna numbers from MIRIAD baseline numbers
+    baseline (numpy array): The baseline numbers
+    returns (numpy array, numpy array): The two antenna numbers starting at 1
+    """
+    baseline = np.rint(baseline).astype(int)
+    large = baseline > 65536
+    ant1 = np.where(large, (baseline - 65536) // 2048, baseline // 256)
+    ant2 = np.where(large, (baseline - 65536) % 2048, baseline % 256)
+    return ant1, ant2
+
+
+def get_record_tsys(systemp, ant, nants, nspect):
+    """
+    Function to get the system temperature of an antenna in every spectral window for all records
+    systemp (numpy array): The systemp variable of every record, one value, one per antenna or one per antenna
+                           and spectral window with the antenna varying fastest
+    ant (numpy array): The antenna number of every record starting at 1
+    nants (int): The number of antennas
+    nspect (int): The number of spectral windows
+    returns (numpy array): The system temperatures with shape (records, windows), one window if the
+                           dataset has the same system temperatures for all windows
+    """
+    nrecords, nvalues = systemp.shape
+    if nvalues == 1:
+        return systemp
+    if nants is not None and nvalues == nants * nspect:
+        return systemp.reshape(nrecords, nspect, nants)[np.arange(nrecords), :, ant - 1]
+    return systemp[np.arange(nrecords), (ant - 1) % nvalues][:, np.newaxis]
+
+
+def calc_record_weights(dataset):
+    """
+    Function to calculate the inverse variance per Hz of bandwidth of the records of a dataset with the radiometer
+    equation, sigma = jyperk * sqrt(tsys1 * tsys2) / (eta * sqrt(2 * bandwidth * inttime))
+    Autocorrelations and cross-hand polarisations get a weight of zero.
+    dataset (string): The MIRIAD uv dataset
+    returns (numpy array, numpy array): The weights with shape (records, windows), one window if the system
+                                        temperatures are the same for all windows, and the number of channels of
+                                        all records
+    """
+    meta = metadata.get_metadata(dataset)
+    records = mirio.read_uv_records(dataset, ['baseline', 'pol', 'inttime', 'systemp', 'jyperk'])
+    nchans = records['nchan']
+    if len(nchans) == 0:
+        return np.zeros((0, 1)), nchans
+    ant1, ant2 = decode_baseline(records['baseline'][:, 0])
+    pol = records['pol'][:, 0] if 'pol' in records else np.ones(len(nchans))
+    used = (ant1 != ant2) & np.in1d(pol, PARALLEL_HANDS)
+
+    jyperk = records['jyperk'][:, 0] if 'jyperk' in records else np.full(len(nchans), np.nan)
+    if meta['jyperk'] is not None:
+        jyperk = np.where(np.isnan(jyperk), meta['jyperk'], jyperk)
+    if np.any(np.isnan(jyperk[used])):
+        raise ApercalException('Dataset ' + dataset + ' has no jyperk. Cannot calculate theoretical noise!')
+    inttime = records['inttime'][:, 0] if 'inttime' in records else np.full(len(nchans), np.nan)
+    if meta['inttime'] is not None:
+        inttime = np.where(np.isnan(inttime), meta['inttime'], inttime)
+
+    systemp = records.get('systemp', np.full((len(nchans), 1), DEFAULT_TSYS))
+    nspect = len(meta['nschan'])
+    tsys1 = get_record_tsys(systemp, ant1, meta['nants'], nspect)
+    tsys2 = get_record_tsys(systemp, ant2, meta['nants'], nspect)
+    with np.errstate(invalid='ignore'):
+        bad = ~((tsys1 > 0) & (tsys2 > 0) & np.isfinite(tsys1 * tsys2))
+    tsys1 = np.where(bad, DEFAULT_TSYS, tsys1)
+    tsys2 = np.where(bad, DEFAULT_TSYS, tsys2)
+
+    weights = np.zeros(tsys1.shape)
+    weights[used] = (2.0 * inttime * CORRELATOR_EFFICIENCY ** 2 / jyperk ** 2)[used, np.newaxis] / (
+        tsys1[used] * tsys2[used])
+    return weights, nchans
+
+
+def get_weights_cache_file(dataset, cache_dir=None):
+    """
+    Function to get the file with the channel weights of a dataset, one file per dataset
+    dataset (string): The MIRIAD uv dataset
+    cache_dir (string): Directory of the files, default the noise_weights temporary directory
+    returns (string): The file name
+    """
+    if cache_dir is None:
+        cache_dir = managetmp.create_tempdir(WEIGHTS_CACHE_SUBDIR)
+    key = hashlib.sha1(os.path.abspath(dataset).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, 'weights_{}.npz'.format(key))
+
+
+def read_cached_weights(cache_file, stamp):
+    """
+    Function to read the channel weights of a dataset from its cache file
+    cache_file (string): The file from get_weights_cache_file
+    stamp (list): The stamp of the dataset from metadata.get_stamp
+    returns (numpy array): The weights, None if there are none for this stamp
+    """
+    if not os.path.isfile(cache_file):
+        return None
+    try:
+        cached = np.load(cache_file)
+        if np.array_equal(cached['stamp'], np.asarray(stamp, dtype=float)):
+            return cached['weights']
+    except (IOError, ValueError, KeyError):
+        pass
+    return None
+
+
+def write_cached_weights(cache_file, stamp, weights):
+    """
+    Function to write the channel weights of a dataset to its cache file, replacing those of an older stamp
+    cache_file (string): The file from get_weights_cache_file
+    stamp (list): The stamp of the dataset from metadata.get_stamp
+    weights (numpy array): The weights
+    """
+    cache_dir = os.path.dirname(cache_file)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # write under a unique name first so that other processes never read a partial file
+    tmp_file = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+    with open(tmp_file, 'wb') as f:
+        np.savez(f, stamp=np.asarray(stamp, dtype=float), weights=weights)
+    os.rename(tmp_file, cache_file)
+
+
+def calc_channel_weights(dataset, cache_dir=None):
+    """
+    Function to calculate the sum of the inverse variances of the unflagged visibilities for each channel in one
+    pass over the dataset. The result is kept in memory and on disk until the dataset changes.
+    dataset (string): The MIRIAD uv dataset
+    cache_dir (string): Directory to keep the weights in across runs, default the noise_weights temporary directory
+    returns (numpy array): The inverse variance in 1/Jy^2 for each channel
+    """
+    key = os.path.abspath(dataset)
+    stamp = metadata.get_stamp(dataset)
+    cached = _weights_cache.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    cache_file = get_weights_cache_file(dataset, cache_dir)
+    weights = read_cached_weights(cache_file, stamp)
+    if weights is not None:
+        _weights_cache[key] = (stamp, weights)
+        return weights
+    meta = metadata.get_metadata(dataset)
+    bandwidth = np.concatenate([np.full(nschan, abs(sdf) * 1E9) for nschan, sdf in zip(meta['nschan'], meta['sdf'])])
+    record_weights, nchans = calc_record_weights(dataset)
+    nchan = len(bandwidth)
+    if np.any(nchans != nchan):
+        raise ApercalException('Records of ' + dataset + ' do not all have ' + str(nchan) + ' channels. Cannot calculate theoretical noise!')
+    # spectral window of every channel, all channels share the weights of a record with a single window
+    if record_weights.shape[1] == 1:
+        windows = [np.ones(nchan, dtype=bool)]
+    else:
+        window = np.repeat(np.arange(len(meta['nschan'])), meta['nschan'])
+        windows = [window == w for w in range(record_weights.shape[1])]
+    has_flags = os.path.isfile(os.path.join(dataset, 'flags'))
+    block = max(1, FLAG_BLOCK_SIZE // nchan)
+    weights = np.zeros(nchan)
+    for first in range(0, len(record_weights), block):
+        block_weights = record_weights[first:first + block]
+        if has_flags:
+            good = mirio.read_mask(dataset, 'flags', first * nchan, len(block_weights) * nchan)
+            good = good.reshape(len(block_weights), nchan)
+        for w, channels in enumerate(windows):
+            if has_flags:
+                weights[channels] += np.dot(block_weights[:, w], good[:, channels])
+            else:
+                weights[channels] += np.sum(block_weights[:, w])
+    weights *= bandwidth
+    _weights_cache[key] = (stamp, weights)
+    write_cached_weights(cache_file, stamp, weights)
+    return weights
+
+
+def calc_channel_noise(dataset, cache_dir=None):
+    """
+    Calculate the theoretical noise of each channel of a dataset
+    dataset (string): The input dataset to calculate the theoretical noise from
+    cache_dir (string): Directory of the channel weights, see calc_channel_weights
+    returns (numpy array): The theoretical Stokes I noise of each channel in Jy, infinite for flagged channels
+    """
+    weights = calc_channel_weights(dataset, cache_dir)
+    with np.errstate(divide='ignore'):
+        return 1.0 / np.sqrt(weights)
+
+
+def calc_chunk_noise(dataset, startchan, endchan, cache_dir=None):
+    """
+    Calculate the theoretical noise of an image of a range of channels
+    dataset (string): The input dataset to calculate the theoretical noise from
+    startchan (int): First channel of the range, zero-based
+    endchan (int): Last channel of the range, zero-based
+    cache_dir (string): Directory of the channel weights, see calc_channel_weights
+    returns (float): The theoretical Stokes I noise in Jy
+    """
+    weight = np.sum(calc_channel_weights(dataset, cache_dir)[int(startchan):int(endchan) + 1])
+    if weight == 0:
+        return np.inf
+    return 1.0 / np.sqrt(weight)
+
+
+def calc_theoretical_noise(dataset, cache_dir=None):
     """
     Calculate the theoretical rms of a given dataset
     dataset (string): The input dataset to calculate the theoretical rms from
+    cache_dir (string): Directory of the channel weights, see calc_channel_weights
     returns (float): The theoretical rms of the input dataset as a float
     """
-    uv = aipy.miriad.UV(dataset)
-    obsrms = lib.miriad('obsrms')
-    try:
-        tsys = np.median(uv['systemp'])
-        if np.isnan(tsys):
-            obsrms.tsys = 30.0
-        else:
-            obsrms.tsys = tsys
-    except KeyError:
-        obsrms.tsys = 30.0
-    obsrms.jyperk = uv['jyperk']
-    obsrms.antdiam = 25
-    obsrms.freq = uv['sfreq']
-    obsrms.theta = 15
-    obsrms.nants = uv['nants']
-    obsrms.bw = np.abs(uv['sdf'] * uv['nschan']) * 1000.0
-    obsrms.inttime = 12.0 * 60.0
-    obsrms.coreta = 0.88
-    theorms = float(obsrms.go()[-1].split()[3]) / 1000.0
-    return theorms
+    return calc_chunk_noise(dataset, 0, len(calc_channel_weights(dataset, cache_dir)) - 1, cache_dir)
 
 
 def calc_theoretical_noise_threshold(theoretical_noise, nsigma):
@@ -152,8 +354,8 @@ def get_freqstart(dataset, startchan):
     dataset: The dataset to get the first frequency from
     returns: The starting frequency of the observation
     """
-    uv = aipy.miriad.UV(dataset)
-    startfreq = (uv['freq'] + int(startchan) * uv['sdf']) * 1E9
+    meta = metadata.get_metadata(dataset)
+    startfreq = (meta['sfreq'][0] + int(startchan) * meta['sdf'][0]) * 1E9
     return startfreq
 
 
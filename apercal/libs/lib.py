@@ -284,17 +284,12 @@ def get_source_names(vis=None):
     """
     get_source_names (vis=None)
     Helper function that uses the MIRIAD task UVINDEX to grab the name of the
-    sources from a MIRIAD visibility file.
+    sources from a MIRIAD visibility file. The names are kept in the metadata
+    index of the dataset, so UVINDEX only runs once per version of the dataset.
     """
     if vis:
-        u = masher(task='uvindex', vis=vis)
-        i = [i for i in range(0, len(u)) if "pointing" in u[i]]
-        N = len(u)
-        s_raw = u[int(i[0] + 2):N - 2]
-        sources = []
-        for s in s_raw:
-            sources.append(s.replace('  ', ' ').split(' ')[0])
-        return sources[0:-1]
+        from apercal.subs import metadata
+        return metadata.get_source_names(vis)
     else:
         raise ApercalException("get_source_names needs a vis!")
 
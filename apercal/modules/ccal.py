@@ -13,6 +13,7 @@ import casacore.tables as pt
 import matplotlib.pyplot as plt
 import logging
 import glob
+import hashlib
 import os
 import numpy as np
 import pandas as pd
@@ -25,6 +26,25 @@ logger = logging.getLogger(__name__)
 
 gencal_cmd = 'gencal(vis="{vis}", caltable="{caltable}", caltype="{caltype}", infile="{infile}")'
 
+# Calibration tables in the order they are derived. For each table: name of the status parameter,
+# calibrator, table extension, tables applied when solving and correlations the solutions are derived from
+ccal_tables = [
+    ('fluxcal_initialphase', 'fluxcal', '.G0ph', [], ['XX', 'YY']),
+    ('fluxcal_globaldelay', 'fluxcal', '.K', ['fluxcal_initialphase'], ['XX', 'YY']),
+    ('fluxcal_bandpass', 'fluxcal', '.Bscan', ['fluxcal_initialphase', 'fluxcal_globaldelay'], ['XX', 'YY']),
+    ('fluxcal_apgains', 'fluxcal', '.G1ap', ['fluxcal_globaldelay', 'fluxcal_bandpass'], ['XX', 'YY']),
+    ('polcal_crosshanddelay', 'polcal', '.Kcross',
+     ['fluxcal_globaldelay', 'fluxcal_bandpass', 'fluxcal_apgains'], ['XY', 'YX']),
+    ('fluxcal_leakage', 'fluxcal', '.Df',
+     ['fluxcal_globaldelay', 'fluxcal_bandpass', 'fluxcal_apgains', 'polcal_crosshanddelay'], ['XY', 'YX']),
+    ('polcal_polarisationangle', 'polcal', '.Xf',
+     ['fluxcal_globaldelay', 'fluxcal_bandpass', 'fluxcal_apgains', 'polcal_crosshanddelay', 'fluxcal_leakage'],
+     ['XY', 'YX'])
+]
+
+# Relative change of the solutions of a table below which the tables applying them are kept
+ccal_solution_tolerance = 1e-3
+
 
 class ccal(BaseModule):
     """
@@ -62,6 +82,7 @@ class ccal(BaseModule):
     crosscal_fluxcal_try_limit = None
     crosscal_autocorrelation_amp_limit = None
     crosscal_autocorrelation_data_fraction_limit = None
+    crosscal_incremental_restart = None
 
     # not for config
     config_file_name = None
@@ -70,6 +91,7 @@ class ccal(BaseModule):
     crosscal_try_restart = False
     crosscal_fluxcal_try_restart = False
     crosscal_flag_list = None
+    crosscal_ant_unflagged = None
     #crosscal_fluxcal_try_restart_no_refant_change = False
 
     def __init__(self, file_=None, **kwargs):
@@ -113,6 +135,11 @@ class ccal(BaseModule):
             logger.info("Limit of the fraction of data with autocorrelation amplitude above maximum value not specified. Setting to default: {}".format(
                 self.crosscal_autocorrelation_data_fraction_limit))
 
+        if self.crosscal_incremental_restart is None:
+            self.crosscal_incremental_restart = True
+            logger.info("Setting for incremental restarts of the calibration not specified. Setting to default: {}".format(
+                self.crosscal_incremental_restart))
+
         if self.crosscal_check_bandpass is None:
             self.crosscal_check_bandpass = True
             logger.info("Check of bandpass solutions not provided. Setting to default: {}".format(
@@ -179,6 +206,10 @@ class ccal(BaseModule):
             # check the reference antenna
             self.check_ref_ant()
 
+            # remove solutions that do not match the reference antenna, flags or model anymore
+            if self.crosscal_incremental_restart:
+                self.invalidate_tables()
+
             # set the model
             self.setflux()
 
@@ -233,9 +264,13 @@ class ccal(BaseModule):
                     crosscal_finished = False
                     break
 
-                # reset first (only fluxcal and polcal need to have theire calibration reset)
-                self.reset(do_clearcal=True, do_clearcal_fluxcal=True,
-                           do_clearcal_polcal=True)
+                if self.crosscal_incremental_restart:
+                    # only restore the flags, the models and unaffected solutions are kept
+                    self.restore_flags()
+                else:
+                    # reset first (only fluxcal and polcal need to have theire calibration reset)
+                    self.reset(do_clearcal=True, do_clearcal_fluxcal=True,
+                               do_clearcal_polcal=True)
 
                 # flagging data
                 # need to do it after restart
@@ -252,6 +287,10 @@ class ccal(BaseModule):
                         "Beam {0}: Found reference antenna in list of flagged antennas. Changing reference antenna".format(self.beam))
                     self.check_ref_ant(check_flags=False, change_ref_ant=True)
 
+                # remove the solutions affected by the new flags or reference antenna
+                if self.crosscal_incremental_restart:
+                    self.invalidate_tables()
+
                 # set the counter up
                 self.crosscal_try_counter += 1
                 # set the status parameter
@@ -313,16 +352,18 @@ class ccal(BaseModule):
 
             # running initial phase calibration
             self.initial_phase()
+            # record the new table and remove the tables applying solutions that changed
+            self.invalidate_tables()
             # if it fails, restart the loop after changing the reference antenna
             if self.crosscal_fluxcal_try_restart:
                 # unless it is the last attempt
                 if self.crosscal_fluxcal_try_counter < self.crosscal_fluxcal_try_limit - 1:
                     logger.warning("Beam {0}: Attempt {1} (out of {2}) failed at initial phase calibration. Trying to restart with different reference antenna".format(
                         self.beam, self.crosscal_fluxcal_try_counter+1, self.crosscal_fluxcal_try_limit))
-                    # reset first
-                    self.reset(do_clearcal=False)
                     # change refant
                     self.check_ref_ant(check_flags=False, change_ref_ant=True)
+                    # remove the affected calibration tables
+                    self.reset_tables()
                     # set the counter up
                     self.crosscal_fluxcal_try_counter += 1
                     # set the status parameter
@@ -335,16 +376,18 @@ class ccal(BaseModule):
 
             # running global delay calibration
             self.global_delay()
+            # record the new table and remove the tables applying solutions that changed
+            self.invalidate_tables()
             # if it fails, restart the loop after changing the reference antenna
             if self.crosscal_fluxcal_try_restart:
                 # unless it is the last attempt
                 if self.crosscal_fluxcal_try_counter < self.crosscal_fluxcal_try_limit - 1:
                     logger.warning(
                         "Beam {0}: Attempt {1} (out of {2}) failed at global delay calibration. Trying to restart with different reference antenna".format(self.beam, self.crosscal_fluxcal_try_counter+1, self.crosscal_fluxcal_try_limit))
-                    # reset first
-                    self.reset(do_clearcal=False)
                     # change refant
                     self.check_ref_ant(check_flags=False, change_ref_ant=True)
+                    # remove the affected calibration tables
+                    self.reset_tables()
                     # set the counter up
                     self.crosscal_fluxcal_try_counter += 1
                     # set the status parameter
@@ -358,6 +401,8 @@ class ccal(BaseModule):
             # running bandpass calibraiton
             # check the bandpass phase solutions
             self.bandpass()
+            # record the new table and remove the tables applying solutions that changed
+            self.invalidate_tables()
             if self.crosscal_check_bandpass:
                 # only check if there is a bandpass table and there is no
                 if not self.crosscal_fluxcal_try_restart:
@@ -381,8 +426,6 @@ class ccal(BaseModule):
                     else:
                         logger.warning(
                             "Beam {0}: Attempt {1} (out of {2}) failed at bandpass calibration. Trying to restart with different reference antenna".format(self.beam, self.crosscal_fluxcal_try_counter+1, self.crosscal_fluxcal_try_limit))
-                    # reset first
-                    self.reset(do_clearcal=False)
                     # do not change refant if there is a flag list
                     if self.crosscal_flag_list is not None:
                         logger.debug("Beam {0}: Found the following new flags: {1}".format(
@@ -418,6 +461,8 @@ class ccal(BaseModule):
                             "Beam {0}: Changing reference antenna".format(self.beam))
                         self.check_ref_ant(
                             check_flags=False, change_ref_ant=True)
+                    # remove the affected calibration tables
+                    self.reset_tables()
                     # set the counter up
                     self.crosscal_fluxcal_try_counter += 1
                     # set the status parameter
@@ -429,16 +474,18 @@ class ccal(BaseModule):
                     break
 
             self.gains()
+            # record the new table and remove the tables applying solutions that changed
+            self.invalidate_tables()
             # if it fails, restart the loop after changing the reference antenna
             if self.crosscal_fluxcal_try_restart:
                 # unless it was the last attempt
                 if self.crosscal_fluxcal_try_counter < self.crosscal_fluxcal_try_limit - 1:
                     logger.warning(
                         "Beam {0}: Attempt {1} (out of {2}) failed at gain calibration. Trying to restart with different reference antenna".format(self.beam, self.crosscal_fluxcal_try_counter+1, self.crosscal_fluxcal_try_limit))
-                    # reset first
-                    self.reset(do_clearcal=False)
                     # change refant
                     self.check_ref_ant(check_flags=False, change_ref_ant=True)
+                    # remove the affected calibration tables
+                    self.reset_tables()
                     # set the counter up
                     self.crosscal_fluxcal_try_counter += 1
                     # set the status parameter
@@ -475,8 +522,12 @@ class ccal(BaseModule):
         """
 
         self.crosshand_delay()
+        self.invalidate_tables()
         self.leakage()
+        self.invalidate_tables()
         self.polarisation_angle()
+        self.invalidate_tables()
+        self.remove_previous_tables()
 
     def apply_solutions(self):
         """
@@ -493,6 +544,45 @@ class ccal(BaseModule):
         query_result = pt.taql(query)
         self.crosscal_ant_list = np.array(query_result.getcol("NAME"))
 
+    def get_unflagged_counts(self):
+        """
+        Get the number of unflagged visibilities for each antenna of the flux calibrator.
+
+        The numbers are derived with a single pass over the flux calibrator and
+        cached until the flags of the flux calibrator are changed.
+
+        returns (array): Number of unflagged visibilities in the order of crosscal_ant_list
+        """
+
+        if self.crosscal_ant_unflagged is None:
+            if self.crosscal_ant_list is None:
+                self.get_antenna_list()
+            ant_unflagged = np.zeros(len(self.crosscal_ant_list), dtype=np.int64)
+            query = "SELECT ANTENNA1 AS ant, GNFALSE(FLAG) AS n_unflagged FROM {0} GROUPBY ANTENNA1".format(
+                self.get_fluxcal_path())
+            query_result = pt.taql(query)
+            if query_result.nrows() != 0:
+                ant_unflagged[query_result.getcol('ant')] = query_result.getcol('n_unflagged')
+            self.crosscal_ant_unflagged = ant_unflagged
+            logger.debug("Beam {0}: Number of unflagged visibilities per antenna: {1}".format(
+                self.beam, dict(zip(self.crosscal_ant_list, ant_unflagged))))
+
+        return self.crosscal_ant_unflagged
+
+    def get_next_ref_ant(self, refant_index):
+        """
+        Get the next antenna after refant_index that is not completely flagged and not excluded
+
+        refant_index (int): Index of the current reference antenna in crosscal_ant_list
+        returns (int): Index of the new reference antenna or None if there is none
+        """
+
+        ant_unflagged = self.get_unflagged_counts()
+        for ant_index in range(refant_index + 1, len(self.crosscal_ant_list)):
+            if ant_unflagged[ant_index] != 0 and self.crosscal_ant_list[ant_index] not in self.crosscal_refant_exclude:
+                return ant_index
+        return None
+
     def check_ref_ant(self, check_flags=True, change_ref_ant=False):
         """
         Check that the default reference antenna.
@@ -504,7 +594,8 @@ class ccal(BaseModule):
         At the moment, the function only tests whether the entire reference
         antenna is flagged.
 
-        Theses tests are based on the flux calibrator
+        Theses tests are based on the flux calibrator. The flags of all antennas are
+        read in a single pass and cached (see get_unflagged_counts).
         """
 
         # get the reference antenna
@@ -545,39 +636,23 @@ class ccal(BaseModule):
 
         if check_flags:
             # check if the entire referance antenna is flagged
-            # dropping "==0" would give the number of non-flagged data points
-            query = "SELECT GNFALSE(FLAG)==0 as all_flagged FROM {0} WHERE ANTENNA1=={1}".format(
-                self.get_fluxcal_path(), refant_fluxcal_index)
-            query_result = pt.taql(query)
+            ant_unflagged = self.get_unflagged_counts()
 
             # if reference antenna is completely flagged, another one needs to be chosen
-            if query_result[0]['all_flagged']:
+            if ant_unflagged[refant_fluxcal_index] == 0:
                 logger.info("Beam {0}: All visibilities of reference antenna {1} are flagged. Choosing another one".format(
                     self.beam, crosscal_refant))
                 # go through the list of antennas
-                ant_name = ""
-                for ant_index in range(refant_fluxcal_index + 1, len(self.crosscal_ant_list)):
-                    # check if it completely flagged
-                    query_ref_search = "SELECT GNFALSE(FLAG)==0 as all_flagged FROM {0} WHERE ANTENNA1=={1}".format(
-                        self.get_fluxcal_path(), ant_index)
-                    query_ref_search_result = pt.taql(query_ref_search)
-                    # if this one is not flagged
-                    if not query_ref_search_result[0]['all_flagged']:
-                        # get the name
-                        ant_name = self.crosscal_ant_list[ant_index]
-                        # check that it is not in the exclude list
-                        if ant_name not in self.crosscal_refant_exclude:
-                            logger.info(
-                                "Beam {0}: Choosing {1} as the reference antenna".format(self.beam, ant_name))
-                            crosscal_refant = ant_name
-                            refant_fluxcal_index = ant_index
-                            break
-                # not sure if this check is necessary
-                if ant_name == "":
+                ant_index = self.get_next_ref_ant(refant_fluxcal_index)
+                if ant_index is None:
                     error = "Beam {0}: Could not find a new reference antenna. Abort crosscal".format(
                         self.beam)
                     logger.error(error)
                     raise RuntimeError(error)
+                crosscal_refant = self.crosscal_ant_list[ant_index]
+                refant_fluxcal_index = ant_index
+                logger.info(
+                    "Beam {0}: Choosing {1} as the reference antenna".format(self.beam, crosscal_refant))
             # reference antenna is not completely flagged
             else:
                 logger.info("Reference antenna {0} is not completely flagged. Keeping it.".format(
@@ -587,16 +662,16 @@ class ccal(BaseModule):
         if change_ref_ant:
             # only if it hasn't already been changed
             if crosscal_refant == self.crosscal_refant:
-                # set the index of the reference antenna one up
-                refant_fluxcal_index += 1
-                # get the corresponding reference antenna
-                crosscal_refant = self.crosscal_ant_list[refant_fluxcal_index]
-                if crosscal_refant not in self.crosscal_refant_exclude:
+                # get the next antenna that still has data and is not excluded
+                ant_index = self.get_next_ref_ant(refant_fluxcal_index)
+                if ant_index is not None:
+                    refant_fluxcal_index = ant_index
+                    crosscal_refant = self.crosscal_ant_list[refant_fluxcal_index]
                     logger.info("Beam {0}: Changing reference antenna to {1}".format(
                         self.beam, crosscal_refant))
                 else:
                     # maybe a restart would be better, in case there is another antenna
-                    error = "Beam {0}: New reference antenna {1} should be excluded. Abort".format(
+                    error = "Beam {0}: Could not find another reference antenna after {1}. Abort".format(
                         self.beam, crosscal_refant)
                     logger.error(error)
                     raise RuntimeError(error)
@@ -695,6 +770,8 @@ class ccal(BaseModule):
                 # Check if model was ingested successfully
                 if subs_msutils.has_good_modeldata(self.get_fluxcal_path()):
                     ccalfluxcalmodel = True
+                    subs_param.add_param(self, cbeam + '_fluxcal_model_spec', [
+                                         srcname, fluxdensity, spix, reffreq, rotmeas])
                 else:
                     ccalfluxcalmodel = False
                     logger.warning(
@@ -733,6 +810,8 @@ class ccal(BaseModule):
                 # Check if model was ingested successfully
                 if subs_msutils.has_good_modeldata(self.get_polcal_path()):
                     ccalpolcalmodel = True
+                    subs_param.add_param(self, cbeam + '_polcal_model_spec', [
+                                         srcname, fluxdensity, spix, reffreq, rotmeas])
                 else:
                     ccalpolcalmodel = False
                     logger.warning(
@@ -1613,6 +1692,8 @@ class ccal(BaseModule):
                         ) + '", gaintable = [' + prevtables + '], interp = [' + interp + '], parang = False, flagbackup = False)'
                         lib.run_casa(
                             [cc_fluxcal_saveflags, cc_fluxcal_apply], timeout=3600)
+                        # applycal can change the flags
+                        self.crosscal_ant_unflagged = None
                         if subs_msutils.has_correcteddata(self.get_fluxcal_path()):
                             ccalfluxcaltransfer = True
                         else:
@@ -1939,22 +2020,28 @@ class ccal(BaseModule):
             else:
                 plot_path = "."
 
-        # take MS file and get calibrated data
-        # amp_ant_array = np.empty(
-        #     (len(ant_names), len(freqs), n_stokes), dtype=np.float64)
+        # take MS file and get calibrated data for all antennas at once
+        try:
+            amp_ant_array = ccal_utils.get_autocorr_amp(
+                msfile, len(ant_names), len(freqs), n_stokes)
+        except Exception as e:
+            logger.warning("Beam {}: Could not get autocorrelation information".format(
+                self.beam))
+            logger.exception(e)
+            amp_ant_array = np.full(
+                (len(ant_names), len(freqs), n_stokes), np.nan)
+        # antennas without any unflagged data do not need to be checked
+        ant_unflagged = self.get_unflagged_counts()
         for ant, ant_name in enumerate(ant_names):
+            if ant < len(ant_unflagged) and ant_unflagged[ant] == 0:
+                logger.info("Beam {0}: Antenna {1} is completely flagged. Skipping autocorrelation check".format(
+                    self.beam, ant_name))
+                continue
             # getting the autocorrelation amplitude
-            try:
-                taql_command = ("SELECT abs(gmeans(CORRECTED_DATA[FLAG])) AS amp "
-                                "FROM {0} "
-                                "WHERE ANTENNA1==ANTENNA2 && (ANTENNA1={1} || ANTENNA2={1})").format(msfile, ant)
-                t = pt.taql(taql_command)
-                test = t.getcol('amp')
-                amp_ant = t.getcol('amp')[0, :, :]
-            except Exception as e:
+            amp_ant = amp_ant_array[ant]
+            if np.all(np.isnan(amp_ant)):
                 logger.warning("Beam {}: Could not get autocorrelation information for antenna {}".format(
                     self.beam, ant_name))
-                logger.exception(e)
                 continue
 
             # get XX and YY
@@ -2008,8 +2095,15 @@ class ccal(BaseModule):
                 plt.title('Antenna {0}'.format(ant_name))
                 plt.ylim(y_min, y_max)
 
-            # run check of fit to autocorrelation
-            logger.info("Checking fit of autocorrelation not yet available")
+        # run check of fit to autocorrelation for all antennas at once, it is only reported
+        try:
+            fit_flags = ccal_utils.polyfit_autocorr(
+                (freqs, amp_ant_array[:, :, 0], amp_ant_array[:, :, 3]), antnames=ant_names)[4]
+            logger.info("Beam {0}: Fit of the autocorrelation is bad for {1} of {2} antenna polarisations".format(
+                self.beam, np.count_nonzero(fit_flags), fit_flags.size))
+        except Exception as e:
+            logger.warning("Beam {}: Could not fit the autocorrelations".format(self.beam))
+            logger.exception(e)
 
         # change the legend and save the file
         if self.crosscal_plot_autocorrelation:
@@ -2091,6 +2185,9 @@ class ccal(BaseModule):
             # add new flags to list of existing flags for this beam
             ccal_flag_list = ccal_flag_list + self.crosscal_flag_list
 
+            # flags have changed
+            self.crosscal_ant_unflagged = None
+
         # save entire flaglist
         subs_param.add_param(self, cbeam + '_flag_list', ccal_flag_list)
 
@@ -2190,6 +2287,278 @@ class ccal(BaseModule):
 
         return df
 
+    def get_table_path(self, cal, ext):
+        """
+        Get the path of a calibration table
+
+        cal (string): Calibrator the table is derived from, 'fluxcal' or 'polcal'
+        ext (string): Extension of the table
+        returns (string): Path of the table
+        """
+
+        if cal == 'fluxcal':
+            return self.get_fluxcal_path().rstrip('.MS') + ext
+        else:
+            return self.get_polcal_path().rstrip('.MS') + ext
+
+    def get_table_inputs(self, cal, corrs):
+        """
+        Get the inputs of the data a calibration table is solved from
+
+        cal (string): Calibrator the table is derived from, 'fluxcal' or 'polcal'
+        corrs (list): Correlations the solutions are derived from
+        returns (dict): Reference antenna, model and the flags on the given correlations
+        """
+
+        cbeam = 'ccal_B' + str(self.beam).zfill(2)
+        ccal_flag_list = get_param_def(self, cbeam + '_flag_list', [])
+        return {'refant': self.crosscal_refant,
+                'model': get_param_def(self, cbeam + '_' + cal + '_model_spec', None),
+                'flags': sorted([list(flag) for flag in ccal_flag_list if flag[1] in corrs])}
+
+    def read_solutions(self, table):
+        """
+        Read the solutions and their flags from a calibration table
+
+        table (string): The calibration table
+        returns (tuple): Solutions and flags, None if the table does not exist
+        """
+
+        if not os.path.isdir(table):
+            return None
+        t = pt.table(table, ack=False)
+        try:
+            column = 'CPARAM' if 'CPARAM' in t.colnames() else 'FPARAM'
+            return t.getcol(column), t.getcol('FLAG')
+        finally:
+            t.close()
+
+    def get_solutions_checksum(self, table):
+        """
+        Get a checksum of the solutions and flags of a calibration table
+
+        table (string): The calibration table
+        returns (string): The checksum, None if the table does not exist
+        """
+
+        solutions = self.read_solutions(table)
+        if solutions is None:
+            return None
+        checksum = hashlib.sha1()
+        for values in solutions:
+            checksum.update(np.ascontiguousarray(values).tobytes())
+        return checksum.hexdigest()
+
+    def solutions_changed(self, table, previous_table):
+        """
+        Check whether the solutions of a table changed more than ccal_solution_tolerance
+
+        Only the solutions that are unflagged in both tables are compared. Newly flagged
+        solutions do not count as a change, as the data they apply to is flagged as well,
+        but newly unflagged solutions do, since no solutions were derived for them before.
+
+        table (string): The calibration table
+        previous_table (string): The table before it was solved for again
+        returns (bool): True if the unflagged solutions changed
+        """
+
+        new = self.read_solutions(table)
+        old = self.read_solutions(previous_table)
+        if new is None or old is None or new[0].shape != old[0].shape or np.any(~new[1] & old[1]):
+            return True
+        good = ~new[1] & ~old[1]
+        if not np.any(good):
+            return False
+        scale = np.max(np.abs(old[0][good]))
+        return not np.allclose(new[0][good], old[0][good], rtol=ccal_solution_tolerance,
+                               atol=ccal_solution_tolerance * scale)
+
+    def record_table_inputs(self):
+        """
+        Store the inputs of all successfully derived calibration tables that have no record yet
+
+        Besides the inputs of the data a table is solved from, the checksums of the
+        solutions applied when solving for it are stored.
+        """
+
+        cbeam = 'ccal_B' + str(self.beam).zfill(2)
+        ccal_table_inputs = get_param_def(self, cbeam + '_table_inputs', {})
+
+        for name, cal, ext, prevtables, corrs in ccal_tables:
+            if name not in ccal_table_inputs and get_param_def(self, cbeam + '_' + name, False):
+                table_inputs = self.get_table_inputs(cal, corrs)
+                table_inputs['applied'] = dict(
+                    (prevname, self.get_solutions_checksum(self.get_table_path(prevcal, prevext)))
+                    for prevname, prevcal, prevext, _, _ in ccal_tables if prevname in prevtables)
+                ccal_table_inputs[name] = table_inputs
+
+        subs_param.add_param(self, cbeam + '_table_inputs', ccal_table_inputs)
+
+    def remove_table(self, name, cal, ext):
+        """
+        Remove a calibration table so that it is solved for again
+
+        The table is kept as <table>.prev until the calibration finished, so that the
+        tables derived from it can check whether its solutions actually changed.
+        """
+
+        cbeam = 'ccal_B' + str(self.beam).zfill(2)
+        table = self.get_table_path(cal, ext)
+        if os.path.isdir(table):
+            subs_managefiles.director(self, 'rm', table + '.prev', ignore_nonexistent=True)
+            subs_managefiles.director(self, 'rn', table + '.prev', file_=table)
+        subs_param.del_param(self, cbeam + '_' + name)
+
+    def check_applied_solutions(self, name, prevtables, table_inputs):
+        """
+        Check whether the solutions applied when a table was solved for are still the same
+
+        name (string): Name of the table
+        prevtables (list): Names of the tables applied when solving
+        table_inputs (dict): Recorded inputs of the table, the checksums are updated for
+                             solutions that changed less than the tolerance
+        returns (bool): False if one of the applied solutions changed
+        """
+
+        cbeam = 'ccal_B' + str(self.beam).zfill(2)
+        applied = table_inputs.get('applied')
+        if applied is None:
+            # tables derived before the applied solutions were recorded are taken as valid
+            return True
+        for prevname, prevcal, prevext, _, _ in ccal_tables:
+            if prevname not in prevtables or not get_param_def(self, cbeam + '_' + prevname, False):
+                # solutions that are not derived again yet are checked once they are
+                continue
+            prevtable = self.get_table_path(prevcal, prevext)
+            checksum = self.get_solutions_checksum(prevtable)
+            if checksum == applied.get(prevname):
+                continue
+            if self.get_solutions_checksum(prevtable + '.prev') == applied.get(prevname) and \
+                    not self.solutions_changed(prevtable, prevtable + '.prev'):
+                logger.info("Beam {0}: Solutions of {1} changed less than the tolerance, keeping {2}".format(
+                    self.beam, prevname, name))
+                applied[prevname] = checksum
+                continue
+            logger.info("Beam {0}: Solutions of {1} applied for {2} changed".format(
+                self.beam, prevname, name))
+            return False
+        return True
+
+    def invalidate_tables(self):
+        """
+        Remove the calibration tables whose inputs changed since they were derived.
+
+        A table is invalid if it was not derived successfully, if the reference antenna,
+        the model or the flags on the correlations it is solved from changed, or if the
+        solutions of a table applied when solving for it changed. Tables applying the
+        solutions of an invalid table are kept until that table is solved for again and
+        only removed if its solutions changed, so this is called again after every
+        calibration step. Valid tables are skipped by the calibration steps, so a restart
+        only solves again for what changed.
+
+        returns (list): Names of the removed tables
+        """
+
+        subs_setinit.setinitdirs(self)
+
+        cbeam = 'ccal_B' + str(self.beam).zfill(2)
+
+        # tables derived before the inputs were recorded are taken as valid
+        self.record_table_inputs()
+        ccal_table_inputs = get_param_def(self, cbeam + '_table_inputs', {})
+
+        invalid_tables = []
+        for name, cal, ext, prevtables, corrs in ccal_tables:
+            table_inputs = ccal_table_inputs.get(name)
+            if not get_param_def(self, cbeam + '_' + name, False):
+                # remove what is left of a table that was not derived successfully
+                subs_managefiles.director(self, 'rm', self.get_table_path(cal, ext), ignore_nonexistent=True)
+                ccal_table_inputs.pop(name, None)
+                continue
+            own_inputs = dict((key, value) for key, value in table_inputs.items() if key != 'applied')
+            if own_inputs != self.get_table_inputs(cal, corrs):
+                logger.info("Beam {0}: Removing calibration table {1}, the data it is solved from changed".format(
+                    self.beam, self.get_table_path(cal, ext)))
+            elif not self.check_applied_solutions(name, prevtables, table_inputs):
+                logger.info("Beam {0}: Removing calibration table {1}, the solutions it applies changed".format(
+                    self.beam, self.get_table_path(cal, ext)))
+            else:
+                logger.info("Beam {0}: Keeping solutions of {1}".format(self.beam, name))
+                continue
+            self.remove_table(name, cal, ext)
+            ccal_table_inputs.pop(name, None)
+            invalid_tables.append(name)
+
+        subs_param.add_param(self, cbeam + '_table_inputs', ccal_table_inputs)
+
+        # solutions need to be applied again
+        if len(invalid_tables) != 0:
+            subs_param.del_param(self, cbeam + '_fluxcal_transfer')
+            subs_param.del_param(self, cbeam + '_polcal_transfer')
+            subs_param.del_param(self, cbeam + '_targetbeams_transfer')
+
+        return invalid_tables
+
+    def remove_previous_tables(self):
+        """
+        Remove the copies of the tables that were solved for again
+        """
+
+        for name, cal, ext, prevtables, corrs in ccal_tables:
+            subs_managefiles.director(self, 'rm', self.get_table_path(cal, ext) + '.prev', ignore_nonexistent=True)
+
+    def reset_tables(self):
+        """
+        Remove calibration tables before restarting the calibration of the flux calibrator.
+
+        Only removes the tables affected by a changed reference antenna or new flags
+        if crosscal_incremental_restart is set, otherwise all of them.
+        """
+
+        if self.crosscal_incremental_restart:
+            self.invalidate_tables()
+        else:
+            self.reset(do_clearcal=False)
+
+    def restore_flags(self):
+        """
+        Restore the flags of the calibrators and the target from before the solutions were applied.
+
+        Unlike reset, this keeps the models and calibration tables.
+        """
+
+        subs_setinit.setinitdirs(self)
+
+        cbeam = 'ccal_B' + str(self.beam).zfill(2)
+
+        datasets = []
+        if self.fluxcal != '' and os.path.isdir(self.get_fluxcal_path()):
+            datasets.append(self.get_fluxcal_path())
+        if self.polcal != '' and os.path.isdir(self.get_polcal_path()):
+            datasets.append(self.get_polcal_path())
+        if self.target != '' and os.path.isdir(self.get_target_path()):
+            datasets.append(self.get_target_path())
+
+        for dataset in datasets:
+            logger.info(
+                "Beam {0}: Restoring flags of {1}".format(self.beam, dataset))
+            try:
+                cc_dataset_resetflags = 'flagmanager(vis = "' + \
+                    dataset + '", mode = "restore", versionname = "ccal")'
+                cc_dataset_removeflagtable = 'flagmanager(vis = "' + \
+                    dataset + '", mode = "delete", versionname = "ccal")'
+                lib.run_casa([cc_dataset_resetflags,
+                              cc_dataset_removeflagtable], timeout=10000)
+            except Exception:
+                logger.error('Beam ' + self.beam + ': Flags of ' +
+                             dataset + ' might not have been properly reset!')
+
+        # flags have changed and the solutions need to be applied again
+        self.crosscal_ant_unflagged = None
+        subs_param.del_param(self, cbeam + '_fluxcal_transfer')
+        subs_param.del_param(self, cbeam + '_polcal_transfer')
+        subs_param.del_param(self, cbeam + '_targetbeams_transfer')
+
     def reset(self, do_clearcal=True, do_clearcal_fluxcal=False, do_clearcal_polcal=False, do_clearcal_target=False):
         """
         Function to reset the current step and clear all calibration from datasets as well as all calibration tables.
@@ -2200,6 +2569,8 @@ class ccal(BaseModule):
 
         logger.warning('Beam ' + self.beam +
                        ': Resetting flags and data values to before cross-calibration step')
+        # flags might be restored
+        self.crosscal_ant_unflagged = None
         # Remove the calibration tables
         # for all beams and calibrators
         subs_managefiles.director(self, 'rm', self.get_fluxcal_path().rstrip(
@@ -2220,6 +2591,7 @@ class ccal(BaseModule):
         subs_managefiles.director(self, 'rm',
                                   self.get_polcal_path().rstrip('.MS') + '.Xf',
                                   ignore_nonexistent=True)
+        self.remove_previous_tables()
         if do_clearcal or do_clearcal_fluxcal:
             # Run a clearcal on the fluxcal and revert to the last flagversion
             logger.info(
@@ -2285,3 +2657,4 @@ class ccal(BaseModule):
         subs_param.del_param(self, cbeam + '_fluxcal_transfer')
         subs_param.del_param(self, cbeam + '_polcal_transfer')
         subs_param.del_param(self, cbeam + '_targetbeams_transfer')
+        subs_param.del_param(self, cbeam + '_table_inputs')
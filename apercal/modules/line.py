@@ -9,7 +9,7 @@ import os
 import pymp
 
 from apercal.modules.base import BaseModule
-from apercal.libs.calculations import calc_dr_maj, calc_theoretical_noise, calc_theoretical_noise_threshold, \
+from apercal.libs.calculations import calc_dr_maj, calc_theoretical_noise_threshold, \
     calc_dynamic_range_threshold, calc_clean_cutoff, calc_noise_threshold, calc_mask_threshold, get_freqstart, \
     calc_dr_min, calc_line_masklevel, calc_miniter
 from apercal.subs import setinit as subs_setinit
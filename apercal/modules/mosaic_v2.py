@@ -3,9 +3,12 @@ import logging
 import numpy as np
 import os
 import socket
-import subprocess
 import glob
+import hashlib
 import time
+import multiprocessing
+
+import pymp
 
 from apercal.modules.base import BaseModule
 from apercal.subs import setinit as subs_setinit
@@ -15,6 +18,12 @@ from apercal.subs import param as subs_param
 from apercal.subs.param import get_param_def
 from apercal.libs import lib
 import apercal.subs.mosaic_utils as mosaic_utils
+from apercal.subs import robuststats as subs_robuststats
+from apercal.subs import mosaic_engine
+from apercal.subs import commonbeam
+from apercal.subs import reproject
+from apercal.subs import fetcher
+from apercal.subs.mosaic_accumulator import MosaicAccumulator
 
 logger = logging.getLogger(__name__)
 
@@ -73,6 +82,14 @@ class mosaic(BaseModule):
     mosaic_beam_map_cutoff = 0.25
     mosaic_use_askap_based_matrix = False
     mosaic_common_beam_type = ''
+    mosaic_math_engine = 'numpy'
+    mosaic_convolution_engine = 'numpy'
+    mosaic_convolution_batch_size = 8
+    mosaic_regrid_engine = 'numpy'
+    mosaic_beam_cache = True
+    mosaic_beam_cache_dir = None
+    mosaic_fetch_workers = 4
+    mosaic_fetch_alta_root = None
 
     # continuumm-specific settings
     mosaic_continuum_subdir = None
@@ -89,6 +106,9 @@ class mosaic(BaseModule):
     mosaic_continuum_clean_up = None
     mosaic_continuum_clean_up_level = None
     mosaic_continuum_image_validation = None
+    mosaic_continuum_tile_size = None
+    mosaic_continuum_tile_padding = None
+    mosaic_continuum_accumulator_dir = None
 
     # polarisation specific settings
     mosaic_polarisation_subdir = None
@@ -106,8 +126,6 @@ class mosaic(BaseModule):
     mosaic_polarisation_clean_up_level = None
     mosaic_polarisation_image_validation = None
 
-    FNULL = open(os.devnull, 'w')
-
     def __init__(self, file_=None, **kwargs):
         self.default = lib.load_config(self, file_)
 
@@ -168,39 +186,43 @@ class mosaic(BaseModule):
         raise RuntimeError(abort_msg)
 
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
-    # Function to check if path on ALTA exist
+    # Function to get the backend to fetch data from ALTA
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
-    def check_alta_path(self, alta_path):
+    def get_alta_backend(self):
         """
-        Function to quickly check the path exists on ALTA
-        """
-        alta_cmd = "ils {}".format(alta_path)
-        logger.debug(alta_cmd)
-        return_msg = subprocess.call(alta_cmd, shell=True,
-                                     stdout=self.FNULL, stderr=self.FNULL)
-        return return_msg
+        Function to get the backend to retrieve files from ALTA
 
-    def getdata_from_alta(self, alta_file_name, output_path):
+        If mosaic_fetch_alta_root is set, the ALTA paths are taken from this local directory instead.
         """
-        Function to get files from ALTA
+        if self.mosaic_fetch_alta_root:
+            logger.info("Using {} in place of ALTA".format(self.mosaic_fetch_alta_root))
+            return fetcher.LocalAltaBackend(self.mosaic_fetch_alta_root)
+        return fetcher.AltaBackend()
 
-        Could be done by getdata_alta package, too.
+    def fetch_beam_files(self, backend, requests, images_dir, on_complete=None):
         """
+        Function to retrieve the files of the beams concurrently
 
-        # set the irod files location
-        irods_status_file = os.path.join(
-            os.getcwd(), "transfer_{}_img-icat.irods-status".format(os.path.basename(alta_file_name).split(".")[0]))
-        irods_status_lf_file = os.path.join(
-            os.getcwd(), "transfer_{}_img-icat.lf-irods-status".format(os.path.basename(alta_file_name).split(".")[0]))
+        The completed files are recorded in a manifest in the images directory
+        so that a restart only retrieves the missing or incomplete files.
 
-        # get the file from alta
-        alta_cmd = "iget -rfPIT -X {0} --lfrestart {1} --retries 5 {2} {3}/".format(
-            irods_status_file, irods_status_lf_file, alta_file_name, output_path)
-        logger.debug(alta_cmd)
-        return_msg = subprocess.check_call(
-            alta_cmd, shell=True, stdout=self.FNULL, stderr=self.FNULL)
+        Args:
+            backend (object): Backend from the fetcher module
+            requests (list(FetchRequest)): Beams with their files
+            images_dir (str): Directory of the images
+            on_complete (function): Called with each beam once all its files have arrived
 
-        return return_msg
+        Returns:
+            list(str): Beams for which not all files could be retrieved
+        """
+        if len(requests) == 0:
+            return []
+        workers = int(self.mosaic_fetch_workers) if self.mosaic_fetch_workers else 1
+        logger.info("Getting files of {0} beams from {1} with {2} workers".format(
+            len(requests), backend.name, workers))
+        beam_fetcher = fetcher.Fetcher(backend, workers=workers,
+                                       manifest_file=os.path.join(images_dir, 'fetch_manifest.json'))
+        return beam_fetcher.fetch(requests, on_complete=on_complete)
 
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
     # Basic setup
@@ -495,68 +517,49 @@ class mosaic(BaseModule):
                 logger.info(
                     "Assuming to get the data from ALTA")
 
+                backend = self.get_alta_backend()
+
                 # store failed beams
                 failed_beams = []
-                # go through the list of beams
-                # but make a copy to be able to remove beams if they are not available
+                # collect the image of each beam to get them all at once
+                requests = []
                 for beam in self.mosaic_beam_list:
                     # /altaZone/archive/apertif_main/visibilities_default/<taskid>_AP_B0XY
                     alta_taskid_beam_dir = "/altaZone/archive/apertif_main/visibilities_default/{0}_AP_B{1}".format(
                         self.mosaic_taskid, beam.zfill(3))
 
                     # check that the beam is available on ALTA
-                    if self.check_alta_path(alta_taskid_beam_dir) == 0:
+                    if backend.exists(alta_taskid_beam_dir):
                         logger.debug("Found beam {} of taskid {} on ALTA".format(
                             beam, self.mosaic_taskid))
 
-                        # look for continuum image
-                        # look for the image file (not perhaps the best way with the current setup)
-                        continuum_image_name = ''
-                        alta_beam_image_path = ''
-                        for k in range(10):
-                            continuum_image_name = "image_mf_{0:02d}.fits".format(
-                                k)
-                            alta_beam_image_path = os.path.join(
-                                alta_taskid_beam_dir, continuum_image_name)
-                            if self.check_alta_path(alta_beam_image_path) == 0:
-                                break
-                            else:
-                                # make empty again when no image was found
-                                continuum_image_name = ''
-                                continue
-                        if continuum_image_name == '':
+                        # look for the first continuum image in a single listing of the beam directory
+                        alta_beam_files = backend.listdir(alta_taskid_beam_dir)
+                        continuum_image_names = [name for name in ["image_mf_{0:02d}.fits".format(k) for k in range(10)]
+                                                 if name in alta_beam_files]
+                        if len(continuum_image_names) == 0:
                             logger.warning(
                                 "No image found on ALTA for beam {0} of taskid {1}".format(beam, self.mosaic_taskid))
                             failed_beams.append(beam)
                         else:
-                            # create directory for beam in the image of the continuum mosaic
+                            alta_beam_image_path = os.path.join(
+                                alta_taskid_beam_dir, continuum_image_names[0])
+                            # the image goes into the directory of the beam in the images of the continuum mosaic
                             continuum_image_beam_dir = os.path.join(
                                 self.mosaic_continuum_images_dir, beam)
-                            if not os.path.exists(continuum_image_beam_dir):
-                                subs_managefiles.director(
-                                    self, 'mk', continuum_image_beam_dir)
-
-                            # check whether file already there:
-                            if not os.path.exists(os.path.join(continuum_image_beam_dir, os.path.basename(alta_beam_image_path))):
-                                # copy the continuum image to this directory
-                                return_msg = self.getdata_from_alta(
-                                    alta_beam_image_path, continuum_image_beam_dir)
-                                if return_msg == 0:
-                                    logger.debug("Getting image of beam {0} of taskid {1} ... Done".format(
-                                        beam, self.mosaic_taskid))
-                                else:
-                                    logger.warning("Getting image of beam {0} of taskid {1} ... Failed".format(
-                                        beam, self.mosaic_taskid))
-                                    failed_beams.append(beam)
-                            else:
-                                logger.debug("Image of beam {0} of taskid {1} already on disk".format(
-                                    beam, self.mosaic_taskid))
+                            requests.append(fetcher.FetchRequest(beam, [(alta_beam_image_path, os.path.join(
+                                continuum_image_beam_dir, continuum_image_names[0]))]))
                     else:
                         logger.warning("Did not find beam {0} of taskid {1}".format(
                             beam, self.mosaic_taskid))
                         # remove the beam
                         failed_beams.append(beam)
 
+                # get the images and convert each beam to miriad as soon as it has arrived
+                failed_beams.extend(self.fetch_beam_files(
+                    backend, requests, self.mosaic_continuum_images_dir,
+                    on_complete=self.convert_continuum_image_to_miriad))
+
             # in case a directory has been specified
             # (not stable)
             # ======================================
@@ -566,6 +569,7 @@ class mosaic(BaseModule):
                     "Assuming to get the data from a specific directory")
                 if os.path.isdir(self.mosaic_continuum_image_origin):
 
+                    requests = []
                     # go through the beams
                     for beam in self.mosaic_beam_list:
 
@@ -595,22 +599,20 @@ class mosaic(BaseModule):
                         # get the first one though there should only be one
                         fits_file = fits_files[0]
 
-                        # create local beam dir only if it doesn't already exists
+                        # copy the image only if the local beam dir is not the original directory
                         local_beam_dir = os.path.join(
                             self.mosaic_continuum_images_dir, beam)
                         if local_beam_dir != image_beam_dir:
-                            subs_managefiles.director(
-                                self, 'mk', local_beam_dir)
-
-                            # copy the fits file to the beam directory
-                            subs_managefiles.director(self, 'cp', os.path.join(
-                                local_beam_dir, os.path.basename(fits_file)), file_=fits_file)
+                            requests.append(fetcher.FetchRequest(beam, [(os.path.abspath(fits_file), os.path.join(
+                                local_beam_dir, os.path.basename(fits_file)))]))
                         else:
                             logger.debug(
                                 "Continuum file of beam {} is already available".format(beam))
 
-                        logger.debug(
-                            "Getting continuum image of beam {} ... Done".format(beam))
+                    # copy the images and convert each beam to miriad as soon as it has arrived
+                    failed_beams.extend(self.fetch_beam_files(
+                        fetcher.LocalBackend(), requests, self.mosaic_continuum_images_dir,
+                        on_complete=self.convert_continuum_image_to_miriad))
                 else:
                     error = "The directory {} does not exists. Abort".format(
                         self.mosaic_continuum_image_origin)
@@ -703,66 +705,49 @@ class mosaic(BaseModule):
                 logger.info(
                     "Assuming to get the data from ALTA")
 
+                backend = self.get_alta_backend()
+
                 # store failed beams
                 failed_beams = []
-                # go through the list of beams
-                # but make a copy to be able to remove beams if they are not available
+                # collect the images of each beam to get them all at once
+                requests = []
                 for beam in self.mosaic_beam_list:
                     # /altaZone/archive/apertif_main/visibilities_default/<taskid>_AP_B0XY
                     alta_taskid_beam_dir = "/altaZone/archive/apertif_main/visibilities_default/{0}_AP_B{1}".format(
                         self.mosaic_taskid, beam.zfill(3))
 
                     # check that the beam is available on ALTA
-                    if self.check_alta_path(alta_taskid_beam_dir) == 0:
+                    if backend.exists(alta_taskid_beam_dir):
                         logger.debug("Found beam {} of taskid {} on ALTA".format(
                             beam, self.mosaic_taskid))
 
-                        # look for continuum image
-                        # look for the image file (not perhaps the best way with the current setup)
-                        polarisation_image_names = ["Qcube.fits","Ucube.fits","image_mf_V.fits"]
-                        alta_beam_image_path = ''
-                        for im in polarisation_image_names:
-                            alta_beam_image_path = os.path.join(
-                                alta_taskid_beam_dir, im)
-                            if self.check_alta_path(alta_beam_image_path) == 0:
-                                break
-                            else:
-                                # make empty again when no image was found
-                                polarisation_image_names = ''
-                                continue
-                        if polarisation_image_names == '':
+                        # look for the polarisation images in a single listing of the beam directory
+                        alta_beam_files = backend.listdir(alta_taskid_beam_dir)
+                        polarisation_image_names = ["Qcube.fits", "Ucube.fits", "image_mf_V.fits"]
+                        missing_images = [name for name in polarisation_image_names if name not in alta_beam_files]
+                        if len(missing_images) != 0:
                             logger.warning(
-                                "No image found on ALTA for beam {0} of taskid {1}".format(beam, self.mosaic_taskid))
+                                "No image {0} found on ALTA for beam {1} of taskid {2}".format(
+                                    ", ".join(missing_images), beam, self.mosaic_taskid))
                             failed_beams.append(beam)
                         else:
-                            # create directory for beam in the image of the continuum mosaic
+                            # the images go into the directory of the beam in the images of the polarisation mosaic
                             polarisation_image_beam_dir = os.path.join(
                                 self.mosaic_polarisation_images_dir, beam)
-                            if not os.path.exists(polarisation_image_beam_dir):
-                                subs_managefiles.director(
-                                    self, 'mk', polarisation_image_beam_dir)
-
-                            # check whether file already there:
-                            if not os.path.exists(os.path.join(polarisation_image_beam_dir, os.path.basename(alta_beam_image_path))):
-                                # copy the continuum image to this directory
-                                return_msg = self.getdata_from_alta(
-                                    alta_beam_image_path, polarisation_image_beam_dir)
-                                if return_msg == 0:
-                                    logger.debug("Getting image of beam {0} of taskid {1} ... Done".format(
-                                        beam, self.mosaic_taskid))
-                                else:
-                                    logger.warning("Getting image of beam {0} of taskid {1} ... Failed".format(
-                                        beam, self.mosaic_taskid))
-                                    failed_beams.append(beam)
-                            else:
-                                logger.debug("Image of beam {0} of taskid {1} already on disk".format(
-                                    beam, self.mosaic_taskid))
+                            requests.append(fetcher.FetchRequest(beam, [
+                                (os.path.join(alta_taskid_beam_dir, name), os.path.join(polarisation_image_beam_dir, name))
+                                for name in polarisation_image_names]))
                     else:
                         logger.warning("Did not find beam {0} of taskid {1}".format(
                             beam, self.mosaic_taskid))
                         # remove the beam
                         failed_beams.append(beam)
 
+                # get the images and convert each beam to miriad as soon as all its images have arrived
+                failed_beams.extend(self.fetch_beam_files(
+                    backend, requests, self.mosaic_polarisation_images_dir,
+                    on_complete=self.convert_polarisation_beam_to_miriad))
+
             # in case a directory has been specified
             # (not stable)
             # ======================================
@@ -772,6 +757,7 @@ class mosaic(BaseModule):
                     "Assuming to get the data from a specific directory")
                 if os.path.isdir(self.mosaic_polarisation_image_origin):
 
+                    requests = []
                     # go through the beams
                     for beam in self.mosaic_beam_list:
 
@@ -798,23 +784,21 @@ class mosaic(BaseModule):
                             failed_beams.append(beam)
                             continue
 
-                        # create local beam dir only if it doesn't already exists
+                        # copy the images only if the local beam dir is not the original directory
                         local_beam_dir = os.path.join(
                             self.mosaic_polarisation_images_dir, beam)
                         if local_beam_dir != image_beam_dir:
-                            subs_managefiles.director(
-                                self, 'mk', local_beam_dir)
-
-                            # copy the fits file to the beam directory
-                            for fits_file in fits_files:
-                                subs_managefiles.director(self, 'cp', os.path.join(
-                                    local_beam_dir, os.path.basename(fits_file)), file_=fits_file)
+                            requests.append(fetcher.FetchRequest(beam, [
+                                (os.path.abspath(fits_file), os.path.join(local_beam_dir, os.path.basename(fits_file)))
+                                for fits_file in fits_files]))
                         else:
                             logger.debug(
                                 "Polarisation files of beam {} is already available".format(beam))
 
-                        logger.debug(
-                            "Getting polarisation images of beam {} ... Done".format(beam))
+                    # copy the images and convert each beam to miriad as soon as all its images have arrived
+                    failed_beams.extend(self.fetch_beam_files(
+                        fetcher.LocalBackend(), requests, self.mosaic_polarisation_images_dir,
+                        on_complete=self.convert_polarisation_beam_to_miriad))
                 else:
                     error = "The directory {} does not exists. Abort".format(
                         self.mosaic_polarisation_image_origin)
@@ -887,7 +871,8 @@ class mosaic(BaseModule):
                                              bm_size=self.mosaic_gaussian_beam_map_size,
                                              cell=self.mosaic_gaussian_beam_map_cellsize,
                                              fwhm=self.mosaic_gaussian_beam_map_fwhm_arcsec,
-                                             cutoff=self.mosaic_beam_map_cutoff)
+                                             cutoff=self.mosaic_beam_map_cutoff,
+                                             cache_dir=self.get_beam_cache_dir())
                 except Exception as e:
                     error = "Creating continuum beam map of beam {} ... Failed".format(beam)
                     logger.warning(error)
@@ -933,7 +918,8 @@ class mosaic(BaseModule):
                                              bm_size=self.mosaic_gaussian_beam_map_size,
                                              cell=self.mosaic_gaussian_beam_map_cellsize,
                                              fwhm=self.mosaic_gaussian_beam_map_fwhm_arcsec,
-                                             cutoff=self.mosaic_beam_map_cutoff)
+                                             cutoff=self.mosaic_beam_map_cutoff,
+                                             cache_dir=self.get_beam_cache_dir())
                 except Exception as e:
                     error = "Creating polarisation beam maps of beam {} ... Failed".format(beam)
                     logger.warning(error)
@@ -957,6 +943,43 @@ class mosaic(BaseModule):
     # Can be moved to mosaic_utils.py
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
 
+    def convert_continuum_image_to_miriad(self, beam):
+        """
+        Convert the continuum fits image of a beam to a miriad image
+
+        Does nothing if the miriad image already exists.
+        """
+
+        # change to directory of continuum images
+        subs_managefiles.director(self, 'ch', self.mosaic_continuum_images_dir)
+
+        mir_map_name = '{0}/image_{0}.map'.format(beam)
+
+        if os.path.isdir(mir_map_name):
+            logger.debug(
+                "Miriad continuum image already exists for beam {}. Did not convert from fits again".format(beam))
+            return
+
+        logger.debug(
+            "Converting continuum fits image of beam {} to miriad image".format(beam))
+
+        # This function will import a FITS image into Miriad placing it in the mosaicdir
+        fits = lib.miriad('fits')
+        fits.op = 'xyin'
+        fits.in_ = glob.glob(os.path.join(beam, "*.fits"))[0]
+        fits.out = mir_map_name
+        try:
+            fits.go()
+        except Exception as e:
+            error = "Converting continuum fits image of beam {} to miriad image ... Failed".format(
+                beam)
+            logger.error(error)
+            logger.exception(e)
+            raise RuntimeError(error)
+        else:
+            logger.debug(
+                "Converting continuum fits image of beam {} to miriad image ... Done".format(beam))
+
     def convert_continuum_images_to_miriad(self):
         """
         Convert continuum fits images to miriad format
@@ -981,37 +1004,10 @@ class mosaic(BaseModule):
         if not mosaic_continuum_convert_fits_images_status:
 
             # go through the list of beams
+            # (beams retrieved by the fetcher have already been converted on arrival)
             for beam in self.mosaic_beam_list:
-
-                logger.debug(
-                    "Converting continuum fits image of beam {} to miriad image".format(beam))
-
-                mir_map_name = '{0}/image_{0}.map'.format(beam)
-
-                if not os.path.isdir(mir_map_name):
-                    # This function will import a FITS image into Miriad placing it in the mosaicdir
-                    fits = lib.miriad('fits')
-                    fits.op = 'xyin'
-                    fits.in_ = glob.glob(os.path.join(beam, "*.fits"))[0]
-                    fits.out = '{0}/image_{0}.map'.format(beam)
-                    try:
-                        fits.go()
-                    except Exception as e:
-                        mosaic_continuum_convert_fits_images_status = False
-                        error = "Converting continuum fits image of beam {} to miriad image ... Failed".format(
-                            beam)
-                        logger.error(error)
-                        logger.exception(e)
-                        raise RuntimeError(error)
-                    else:
-                        mosaic_continuum_convert_fits_images_status = True
-                        logger.debug(
-                            "Converting continuum fits image of beam {} to miriad image ... Done".format(beam))
-
-                else:
-                    logger.warning(
-                        "Miriad continuum image already exists for beam {}. Did not convert from fits again".format(beam))
-                    mosaic_continuum_convert_fits_images_status = True
+                self.convert_continuum_image_to_miriad(beam)
+                mosaic_continuum_convert_fits_images_status = True
 
             if mosaic_continuum_convert_fits_images_status:
                 logger.info(
@@ -1030,6 +1026,37 @@ class mosaic(BaseModule):
     # Function to convert the Q and U cubes and the V image into MIRIAD
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
 
+    def convert_polarisation_beam_to_miriad(self, beam):
+        """
+        Convert the Q and U cubes and the V image of a beam to miriad
+
+        Images that already exist in miriad format are not converted again.
+        """
+
+        # change to directory of polarisation images
+        subs_managefiles.director(self, 'ch', self.mosaic_polarisation_images_dir)
+
+        # Convert the Q and U cubes to MIRIAD
+        try:
+            fits = lib.miriad('fits')
+            fits.op = "xyin"
+            for image in ["Qcube", "Ucube", "image_mf_V"]:
+                if os.path.isdir(os.path.join(beam, image)):
+                    logger.debug("Miriad image {0} already exists for beam {1}".format(image, beam))
+                    continue
+                fits.in_ = os.path.join(beam, "{}.fits".format(image))
+                fits.out = os.path.join(beam, image)
+                fits.go()
+        except Exception as e:
+            error = "Converting polarisation fits images of beam {} to miriad image ... Failed".format(
+                beam)
+            logger.error(error)
+            logger.exception(e)
+            raise RuntimeError(error)
+        else:
+            logger.debug(
+                "Converting polarisation fits images of beam {} to miriad image ... Done".format(beam))
+
     def convert_polarisation_images_to_miriad(self):
         """
         """
@@ -1042,31 +1069,10 @@ class mosaic(BaseModule):
 
         if not mosaic_polarisation_convert_fits_images_status:
 
+            # (beams retrieved by the fetcher have already been converted on arrival)
             for beam in self.mosaic_beam_list:
-                # Convert the Q and U cubes to MIRIAD
-                try:
-                    fits = lib.miriad('fits')
-                    fits.op = "xyin"
-                    fits.in_ = os.path.join(beam, "Qcube.fits")
-                    fits.out = os.path.join(beam, "Qcube")
-                    fits.go()
-                    fits.in_ = os.path.join(beam, "Ucube.fits")
-                    fits.out = os.path.join(beam, "Ucube")
-                    fits.go()
-                    fits.in_ = os.path.join(beam, "image_mf_V.fits")
-                    fits.out = os.path.join(beam, "image_mf_V")
-                    fits.go()
-                except Exception as e:
-                    mosaic_polarisation_convert_fits_images_status = False
-                    error = "Converting polarisation fits images of beam {} to miriad image ... Failed".format(
-                        beam)
-                    logger.error(error)
-                    logger.exception(e)
-                    raise RuntimeError(error)
-                else:
-                    mosaic_polarisation_convert_fits_images_status = True
-                    logger.debug(
-                        "Converting polarisation fits images of beam {} to miriad image ... Done".format(beam))
+                self.convert_polarisation_beam_to_miriad(beam)
+                mosaic_polarisation_convert_fits_images_status = True
 
             if mosaic_polarisation_convert_fits_images_status:
                 logger.info(
@@ -1513,6 +1519,9 @@ class mosaic(BaseModule):
             # This will create a template for the mosaic using "imgen" in Miriad
             # number of pixels of mosaic maps
             imsize = self.mosaic_continuum_imsize
+            # a tiled mosaic only needs the coordinate system of the template
+            if self.mosaic_continuum_tile_size:
+                imsize = min(imsize, self.mosaic_continuum_tile_size)
             # cell size in arcsec
             cell = self.mosaic_continuum_cellsize
 
@@ -1617,6 +1626,86 @@ class mosaic(BaseModule):
             self, 'mosaic_polarisation_template_mosaic_status', mosaic_polarisation_template_mosaic_status)
 
 
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Function to regrid an image onto a template mosaic
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    def regrid_image(self, input_file, output_file, template_file):
+        """
+        Function to regrid an image onto a template mosaic
+
+        With mosaic_regrid_engine = 'numpy' the pixel mapping of the image onto the template
+        is calculated once for every pair of grids and stored in the reprojection directory
+        of the mosaic. The maps are reused for the beam maps, for all Stokes Q/U/V planes of a
+        beam and for later runs. Otherwise miriad regrid is used.
+
+        Args:
+            input_file (str): Image to regrid
+            output_file (str): Regridded image
+            template_file (str): Template mosaic
+        """
+        if self.mosaic_regrid_engine == 'numpy':
+            reprojection_dir = os.path.join(self.mosdir, 'reprojection')
+            reproject.regrid_miriad_image(input_file, output_file, template_file, reprojection_dir)
+        else:
+            regrid = lib.miriad('regrid')
+            regrid.in_ = input_file
+            regrid.out = output_file
+            regrid.tin = template_file
+            regrid.axes = '1,2'
+            regrid.go()
+
+
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Function to get the directory of the beam model cache
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    def get_beam_cache_dir(self):
+        """
+        Function to get the directory of the beam model cache
+
+        The cache keeps the beam response maps, the beam maps with cutoff, the regridded
+        beam maps and the inverse covariance matrices. Set mosaic_beam_cache_dir to a common directory to share them between
+        mosaics. The cache is not removed by the clean up.
+
+        Returns:
+            str: Directory of the cache or None if the cache is not used
+        """
+        if not self.mosaic_beam_cache:
+            return None
+        if self.mosaic_beam_cache_dir:
+            return self.mosaic_beam_cache_dir
+        return os.path.join(self.mosdir, 'beam_cache')
+
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Function to regrid a beam map with the beam model cache
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    def regrid_beam_map(self, input_file, output_file, template_file, template_grid):
+        """
+        Function to regrid a beam map onto a template mosaic or get it from the beam model cache
+
+        The regridded beam maps are identified by the content of the beam map, which includes
+        the coordinates of the image, and the grid of the template.
+
+        Args:
+            input_file (str): Beam map to regrid
+            output_file (str): Regridded beam map
+            template_file (str): Template mosaic
+            template_grid (list): Grid of the template mosaic
+        """
+        beam_cache_dir = self.get_beam_cache_dir()
+        if beam_cache_dir is None:
+            self.regrid_image(input_file, output_file, template_file)
+            return
+
+        key = mosaic_utils.get_regridded_beam_key(input_file, template_grid, engine=self.mosaic_regrid_engine)
+        cached_file = os.path.join(beam_cache_dir, 'regrid_{}.map'.format(key))
+        if os.path.isdir(cached_file):
+            logger.debug("Using cached regridded beam map {0} for {1}".format(cached_file, input_file))
+            subs_managefiles.director(self, 'cp', output_file, file_=cached_file)
+        else:
+            self.regrid_image(input_file, output_file, template_file)
+            mosaic_utils.add_to_cache(output_file, cached_file)
+
+
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
     # Function to regrid continuum images based on mosaic template
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -1634,22 +1723,19 @@ class mosaic(BaseModule):
             # switch to continuum mosaic directory
             subs_managefiles.director(self, 'ch', self.mosaic_continuum_dir)
 
+            template_continuum_mosaic_file = os.path.join(self.mosaic_continuum_mosaic_subdir, "mosaic_continuum_template.map")
+
             # Put images on mosaic template grid
-            for beam in self.mosaic_beam_list:
+            def regrid_beam(beam):
                 logger.debug("Regridding continuum beam {}".format(beam))
-                regrid = lib.miriad('regrid')
                 input_file = os.path.join(self.mosaic_continuum_images_subdir, '{0}/image_{0}.map'.format(beam))
                 output_file = os.path.join(self.mosaic_continuum_images_subdir, 'image_{}_regrid.map'.format(beam))
-                template_continuum_mosaic_file = os.path.join(self.mosaic_continuum_mosaic_subdir, "mosaic_continuum_template.map")
                 if not os.path.isdir(output_file):
                     if os.path.isdir(input_file):
-                        regrid.in_ = input_file
-                        regrid.out = output_file
-                        regrid.tin = template_continuum_mosaic_file
-                        regrid.axes = '1,2'
                         try:
-                            regrid.go()
+                            self.regrid_image(input_file, output_file, template_continuum_mosaic_file)
                         except Exception as e:
+                            subs_managefiles.director(self, 'rm', output_file, ignore_nonexistent=True)
                             error = "Failed regridding continuum image of beam {}".format(beam)
                             logger.error(error)
                             logger.exception(e)
@@ -1661,6 +1747,9 @@ class mosaic(BaseModule):
                 else:
                     logger.warning("Regridded continuum image of beam {} already exists".format(beam))
 
+            failed_beams = self.run_beams_in_parallel(regrid_beam, "Regridding continuum images")
+            self.check_failed_beams(failed_beams, "Regridding continuum images")
+
             logger.info("Regridding continuum images ... Done")
             mosaic_continuum_regrid_images_status = True
         else:
@@ -1687,8 +1776,24 @@ class mosaic(BaseModule):
             # switch to polarisation mosaic directory
             subs_managefiles.director(self, 'ch', self.mosaic_polarisation_dir)
 
+            template_polarisation_mosaic_file = os.path.join(
+                self.mosaic_polarisation_mosaic_subdir, "mosaic_polarisation_template.map")
+
+            def regrid_image(input_file, output_file, description):
+                if not os.path.isdir(output_file):
+                    try:
+                        self.regrid_image(input_file, output_file, template_polarisation_mosaic_file)
+                    except Exception as e:
+                        subs_managefiles.director(self, 'rm', output_file, ignore_nonexistent=True)
+                        error = "Failed regridding {}".format(description)
+                        logger.error(error)
+                        logger.exception(e)
+                        raise RuntimeError(error)
+                else:
+                    logger.warning("Regridded {} already exists".format(description))
+
             # Put images on mosaic template grid
-            for beam in self.mosaic_beam_list:
+            def regrid_beam(beam):
 
                 # Get the needed information from the param files
                 pbeam = 'polarisation_B' + str(beam).zfill(2)
@@ -1697,92 +1802,44 @@ class mosaic(BaseModule):
                 # Do the regridding for each individual image
                 for qplane in range(qimages):
                     logger.debug("Regridding Stokes Q image #{0} of beam {1}".format(qplane, beam))
-                    regrid = lib.miriad('regrid')
                     input_file = os.path.join(
                         self.mosaic_polarisation_images_subdir, beam, "Qcube_" + str(qplane).zfill(3))
                     output_file = os.path.join(
                         self.mosaic_polarisation_images_subdir, "Qcube_" + str(beam).zfill(2) + '_' + str(qplane).zfill(3) + '_regrid.map')
-                    template_polarisation_mosaic_file = os.path.join(
-                        self.mosaic_polarisation_mosaic_subdir, "mosaic_polarisation_template.map")
-                    if not os.path.isdir(output_file):
-                        if os.path.isdir(input_file):
-                            regrid.in_ = input_file
-                            regrid.out = output_file
-                            regrid.tin = template_polarisation_mosaic_file
-                            regrid.axes = '1,2'
-                            try:
-                                regrid.go()
-                            except Exception as e:
-                                error = "Failed regridding Stokes Q image #{0} of beam {1}".format(
-                                    qplane, beam)
-                                logger.error(error)
-                                logger.exception(e)
-                                raise RuntimeError(error)
-                        else:
-                            warning = "Did not find convolved Stokes Q image #{0} for beam {1}".format(
-                                qplane, beam)
-                            logger.warning(warning)
+                    if os.path.isdir(input_file) or os.path.isdir(output_file):
+                        regrid_image(input_file, output_file, "Stokes Q image #{0} of beam {1}".format(qplane, beam))
                     else:
-                        logger.warning(
-                            "Regridded Stokes Q image #{0} of beam {1} already exists".format(qplane, beam))
+                        warning = "Did not find convolved Stokes Q image #{0} for beam {1}".format(
+                            qplane, beam)
+                        logger.warning(warning)
 
                 for uplane in range(qimages):
                     logger.debug("Regridding Stokes U image #{0} of beam {1}".format(uplane, beam))
-                    regrid = lib.miriad('regrid')
                     input_file = os.path.join(
                         self.mosaic_polarisation_images_subdir, beam, "Ucube_" + str(uplane).zfill(3))
                     output_file = os.path.join(
                         self.mosaic_polarisation_images_subdir, "Ucube_" + str(beam).zfill(2) + '_' + str(uplane).zfill(3) + '_regrid.map')
-                    template_polarisation_mosaic_file = os.path.join(
-                        self.mosaic_polarisation_mosaic_subdir, "mosaic_polarisation_template.map")
-                    if not os.path.isdir(output_file):
-                        if os.path.isdir(input_file):
-                            regrid.in_ = input_file
-                            regrid.out = output_file
-                            regrid.tin = template_polarisation_mosaic_file
-                            regrid.axes = '1,2'
-                            try:
-                                regrid.go()
-                            except Exception as e:
-                                error = "Failed regridding Stokes U image #{0} of beam {1}".format(uplane, beam)
-                                logger.error(error)
-                                logger.exception(e)
-                                raise RuntimeError(error)
-                        else:
-                            warning = "Did not find convolved Stokes U image #{0} for beam {1}".format(uplane, beam)
-                            logger.warning(warning)
+                    if os.path.isdir(input_file) or os.path.isdir(output_file):
+                        regrid_image(input_file, output_file, "Stokes U image #{0} of beam {1}".format(uplane, beam))
                     else:
-                        logger.warning("Regridded Stokes U image #{0} of beam {1} already exists".format(uplane, beam))
+                        warning = "Did not find convolved Stokes U image #{0} for beam {1}".format(uplane, beam)
+                        logger.warning(warning)
 
                 logger.debug("Regridding Stokes V image of beam {}".format(beam))
-                regrid = lib.miriad('regrid')
                 input_file = os.path.join(
                     self.mosaic_polarisation_images_subdir, '{0}/image_mf_V'.format(beam))
                 output_file = os.path.join(
                     self.mosaic_polarisation_images_subdir, 'image_mf_V_{0}_regrid.map'.format(beam))
-                template_polarisation_mosaic_file = os.path.join(
-                    self.mosaic_polarisation_mosaic_subdir, "mosaic_polarisation_template.map")
-                if not os.path.isdir(output_file):
-                    if os.path.isdir(input_file):
-                        regrid.in_ = input_file
-                        regrid.out = output_file
-                        regrid.tin = template_polarisation_mosaic_file
-                        regrid.axes = '1,2'
-                        try:
-                            regrid.go()
-                        except Exception as e:
-                            error = "Failed regridding Stokes V image of beam {}".format(
-                                beam)
-                            logger.error(error)
-                            logger.exception(e)
-                            raise RuntimeError(error)
-                    else:
-                        error = "Did not find convolved Stokes V image for beam {}".format(
-                            beam)
-                        logger.error(error)
-                        raise RuntimeError(error)
+                if os.path.isdir(input_file) or os.path.isdir(output_file):
+                    regrid_image(input_file, output_file, "Stokes V image of beam {}".format(beam))
                 else:
-                    logger.warning("Regridded Stokes V image of beam {} already exists".format(beam))
+                    error = "Did not find convolved Stokes V image for beam {}".format(
+                        beam)
+                    logger.error(error)
+                    raise RuntimeError(error)
+
+            failed_beams = self.run_beams_in_parallel(regrid_beam, "Regridding polarisation images")
+            self.check_failed_beams(failed_beams, "Regridding polarisation images")
 
             logger.info("Regridding polarisation images ... Done")
             mosaic_polarisation_regrid_images_status = True
@@ -1810,24 +1867,22 @@ class mosaic(BaseModule):
             # switch to mosaic directory
             subs_managefiles.director(self, 'ch', self.mosaic_continuum_dir)
 
+            template_continuum_mosaic_file = os.path.join(
+                self.mosaic_continuum_mosaic_subdir, "mosaic_continuum_template.map")
+            template_grid = mosaic_utils.get_image_grid(template_continuum_mosaic_file)
+
             # Put images on mosaic template grid
-            for beam in self.mosaic_beam_list:
+            def regrid_beam(beam):
                 input_file = os.path.join(
                     self.mosaic_continuum_beam_subdir, 'beam_{}.map'.format(beam))
                 output_file = os.path.join(
                     self.mosaic_continuum_beam_subdir, 'beam_{}_mos.map'.format(beam))
-                template_continuum_mosaic_file = os.path.join(
-                    self.mosaic_continuum_mosaic_subdir, "mosaic_continuum_template.map")
-                regrid = lib.miriad('regrid')
                 if not os.path.isdir(output_file):
                     if os.path.isdir(input_file):
-                        regrid.in_ = input_file
-                        regrid.out = output_file
-                        regrid.tin = template_continuum_mosaic_file
-                        regrid.axes = '1,2'
                         try:
-                            regrid.go()
+                            self.regrid_beam_map(input_file, output_file, template_continuum_mosaic_file, template_grid)
                         except Exception as e:
+                            subs_managefiles.director(self, 'rm', output_file, ignore_nonexistent=True)
                             error = "Failed regridding continuum beam_maps of beam {}".format(beam)
                             logger.error(error)
                             logger.exception(e)
@@ -1839,6 +1894,9 @@ class mosaic(BaseModule):
                 else:
                     logger.warning("Regridded continuum beam map of beam {} already exists".format(beam))
 
+            failed_beams = self.run_beams_in_parallel(regrid_beam, "Regridding continuum beam maps")
+            self.check_failed_beams(failed_beams, "Regridding continuum beam maps")
+
             logger.info("Regridding continuum beam maps ... Done")
 
             mosaic_continuum_regrid_beam_maps_status = True
@@ -1866,24 +1924,22 @@ class mosaic(BaseModule):
             # switch to mosaic directory
             subs_managefiles.director(self, 'ch', self.mosaic_polarisation_dir)
 
+            template_polarisation_mosaic_file = os.path.join(
+                self.mosaic_polarisation_mosaic_subdir, "mosaic_polarisation_template.map")
+            template_grid = mosaic_utils.get_image_grid(template_polarisation_mosaic_file)
+
             # Put images on mosaic template grid
-            for beam in self.mosaic_beam_list:
+            def regrid_beam(beam):
                 input_file = os.path.join(
                     self.mosaic_polarisation_beam_subdir, 'beam_{}.map'.format(beam))
                 output_file = os.path.join(
                     self.mosaic_polarisation_beam_subdir, 'beam_{}_mos.map'.format(beam))
-                template_polarisation_mosaic_file = os.path.join(
-                    self.mosaic_polarisation_mosaic_subdir, "mosaic_polarisation_template.map")
-                regrid = lib.miriad('regrid')
                 if not os.path.isdir(output_file):
                     if os.path.isdir(input_file):
-                        regrid.in_ = input_file
-                        regrid.out = output_file
-                        regrid.tin = template_polarisation_mosaic_file
-                        regrid.axes = '1,2'
                         try:
-                            regrid.go()
+                            self.regrid_beam_map(input_file, output_file, template_polarisation_mosaic_file, template_grid)
                         except Exception as e:
+                            subs_managefiles.director(self, 'rm', output_file, ignore_nonexistent=True)
                             error = "Failed regridding polarisation beam_maps of beam {}".format(beam)
                             logger.error(error)
                             logger.exception(e)
@@ -1895,6 +1951,9 @@ class mosaic(BaseModule):
                 else:
                     logger.warning("Regridded polarisation beam map of beam {} already exists".format(beam))
 
+            failed_beams = self.run_beams_in_parallel(regrid_beam, "Regridding polarisation beam maps")
+            self.check_failed_beams(failed_beams, "Regridding polarisation beam maps")
+
             logger.info("Regridding polarisation beam maps ... Done")
 
             mosaic_polarisation_regrid_beam_maps_status = True
@@ -2193,7 +2252,7 @@ class mosaic(BaseModule):
 
         if not mosaic_continuum_convolve_images_status:
 
-            for beam in self.mosaic_beam_list:
+            def convolve_beam(beam):
                 logger.info("Convolving continuum image of beam {}".format(beam))
 
                 # output map and input map
@@ -2213,6 +2272,7 @@ class mosaic(BaseModule):
                     try:
                         convol.go()
                     except Exception as e:
+                        subs_managefiles.director(self, 'rm', output_file, ignore_nonexistent=True)
                         error = "Convolving continuum image of beam {} ... Failed".format(beam)
                         logger.error(error)
                         logger.exception(e)
@@ -2222,7 +2282,13 @@ class mosaic(BaseModule):
                 else:
                     logger.warning("Convolved continuum image of beam {} already exists".format(beam))
 
-                    mosaic_continuum_convolve_images_status = True
+            if self.mosaic_convolution_engine == 'numpy':
+                self.convolve_continuum_images_fft(mosaic_continuum_common_beam_values)
+            else:
+                failed_beams = self.run_beams_in_parallel(convolve_beam, "Convolving continuum images")
+                self.check_failed_beams(failed_beams, "Convolving continuum images")
+
+            mosaic_continuum_convolve_images_status = True
 
             logger.info("Convolving continuum images with common beam ... Done")
         else:
@@ -2232,6 +2298,55 @@ class mosaic(BaseModule):
             self, 'mosaic_continuum_convolve_images_status', mosaic_continuum_convolve_images_status)
 
 
+    def convolve_continuum_images_fft(self, common_beam):
+        """
+        Function to convolve the regridded continuum images to the common beam with FFTs
+
+        The images are processed in batches of mosaic_convolution_batch_size beams. Convolved
+        images that already exist are skipped.
+
+        Args:
+            common_beam (list(float)): bmaj (arcsec), bmin (arcsec) and bpa (deg) of the common beam
+        """
+        beams = [beam for beam in self.mosaic_beam_list if not os.path.isdir(
+            os.path.join(self.mosaic_continuum_mosaic_subdir, 'image_{0}_mos.map'.format(beam)))]
+        for beam in self.mosaic_beam_list:
+            if beam not in beams:
+                logger.warning("Convolved continuum image of beam {} already exists".format(beam))
+
+        batch_size = max(1, int(self.mosaic_convolution_batch_size))
+        for start in range(0, len(beams), batch_size):
+            batch = beams[start:start + batch_size]
+            logger.info("Convolving continuum images of beams {}".format(", ".join(batch)))
+
+            images = []
+            headers = []
+            for beam in batch:
+                image, header = mosaic_engine.load_miriad_plane(
+                    os.path.join(self.mosaic_continuum_images_subdir, 'image_{0}_regrid.map'.format(beam)))
+                images.append(image)
+                headers.append(header)
+
+            # the beams in the header are in deg
+            image_beams = [[3600. * header['BMAJ'], 3600. * header['BMIN'], header['BPA']] for header in headers]
+            try:
+                convolved = commonbeam.convolve_to_beam(
+                    np.array(images), image_beams, common_beam, headers[0]['CDELT1'], headers[0]['CDELT2'])
+            except Exception as e:
+                error = "Convolving continuum images of beams {} ... Failed".format(", ".join(batch))
+                logger.error(error)
+                logger.exception(e)
+                raise RuntimeError(error)
+
+            for beam, image, header in zip(batch, convolved, headers):
+                header = header.copy()
+                header['BMAJ'] = common_beam[0] / 3600.
+                header['BMIN'] = common_beam[1] / 3600.
+                header['BPA'] = common_beam[2]
+                output_file = os.path.join(self.mosaic_continuum_mosaic_subdir, 'image_{0}_mos.map'.format(beam))
+                mosaic_engine.write_image(image, header, mirimage=output_file)
+                logger.debug("Convolving continuum image of beam {} ... Done".format(beam))
+
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
     # Function to convolve polarisation images
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -2266,9 +2381,30 @@ class mosaic(BaseModule):
 
         if not mosaic_polarisation_convolve_images_status:
 
-            # Calculate the common beam values for the Stokes Q images
-            for qplane in range(qimages):
-                for beam in self.mosaic_beam_list:
+            def convolve_image(input_file, output_file, common_beam, description):
+                if not os.path.isdir(output_file):
+                    convol = lib.miriad('convol')
+                    convol.map = input_file
+                    convol.out = output_file
+                    convol.fwhm = '{0},{1}'.format(str(common_beam[0]), str(common_beam[1]))
+                    convol.pa = common_beam[2]
+                    convol.options = 'final'
+                    try:
+                        convol.go()
+                    except Exception as e:
+                        subs_managefiles.director(self, 'rm', output_file, ignore_nonexistent=True)
+                        error = "Convolving {} ... Failed".format(description)
+                        logger.error(error)
+                        logger.exception(e)
+                        raise RuntimeError(error)
+                    else:
+                        logger.debug("Convolving {} ... Done".format(description))
+                else:
+                    logger.warning("Convolved {} already exists".format(description))
+
+            def convolve_beam(beam):
+                # Convolve the Stokes Q images with the common beam of each plane
+                for qplane in range(qimages):
                     logger.debug("Convolving Stokes Q image of beam {}".format(beam))
 
                     # output map and input map
@@ -2277,31 +2413,11 @@ class mosaic(BaseModule):
                     output_file = os.path.join(
                         self.mosaic_polarisation_mosaic_subdir, "Qcube_" + str(beam).zfill(2) + '_' + str(qplane).zfill(3) + '_mos.map')
 
-                    if not os.path.isdir(output_file):
-                        convol = lib.miriad('convol')
-                        convol.map = input_file
-                        convol.out = output_file
-                        convol.fwhm = '{0},{1}'.format(
-                            str(mosaic_polarisation_common_beam_values_qu[0, qplane, 0]), str(mosaic_polarisation_common_beam_values_qu[0, qplane, 1]))
-                        convol.pa = mosaic_polarisation_common_beam_values_qu[0, qplane, 2]
-                        convol.options = 'final'
-                        try:
-                            convol.go()
-                        except Exception as e:
-                            error = "Convolving Stokes Q image {0} of beam {1} ... Failed".format(
-                                qplane, beam)
-                            logger.error(error)
-                            logger.exception(e)
-                            raise RuntimeError(error)
-                        else:
-                            logger.debug("Convolving Stokes Q image {0} of beam {1} ... Done".format(qplane, beam))
-                    else:
-                        logger.warning(
-                            "Convolved Stokes Q image {0} of beam {1} already exists".format(qplane, beam))
+                    convolve_image(input_file, output_file, mosaic_polarisation_common_beam_values_qu[0, qplane],
+                                   "Stokes Q image {0} of beam {1}".format(qplane, beam))
 
-            # Calculate the common beam values for the Stokes Q images
-            for uplane in range(qimages):
-                for beam in self.mosaic_beam_list:
+                # Convolve the Stokes U images with the common beam of each plane
+                for uplane in range(qimages):
                     logger.info("Convolving Stokes U image of beam {}".format(beam))
 
                     # output map and input map
@@ -2310,31 +2426,9 @@ class mosaic(BaseModule):
                     output_file = os.path.join(
                         self.mosaic_polarisation_mosaic_subdir, "Ucube_" + str(beam).zfill(2) + '_' + str(uplane).zfill(3) + '_mos.map')
 
-                    if not os.path.isdir(output_file):
-                        convol = lib.miriad('convol')
-                        convol.map = input_file
-                        convol.out = output_file
-                        convol.fwhm = '{0},{1}'.format(
-                            str(mosaic_polarisation_common_beam_values_qu[1, uplane, 0]),
-                            str(mosaic_polarisation_common_beam_values_qu[1, uplane, 1]))
-                        convol.pa = mosaic_polarisation_common_beam_values_qu[1, uplane, 2]
-                        convol.options = 'final'
-                        try:
-                            convol.go()
-                        except Exception as e:
-                            error = "Convolving Stokes U image {0} of beam {1} ... Failed".format(
-                                uplane, beam)
-                            logger.error(error)
-                            logger.exception(e)
-                            raise RuntimeError(error)
-                        else:
-                            logger.debug(
-                                "Convolving Stokes U image {0} of beam {1} ... Done".format(uplane, beam))
-                    else:
-                        logger.warning(
-                            "Convolved Stokes U image {0} of beam {1} already exists".format(uplane, beam))
+                    convolve_image(input_file, output_file, mosaic_polarisation_common_beam_values_qu[1, uplane],
+                                   "Stokes U image {0} of beam {1}".format(uplane, beam))
 
-            for beam in self.mosaic_beam_list:
                 logger.info("Convolving Stokes V image of beam {}".format(beam))
 
                 # output map and input map
@@ -2343,26 +2437,11 @@ class mosaic(BaseModule):
                 output_file = os.path.join(
                     self.mosaic_polarisation_mosaic_subdir, 'image_mf_V_{}_mos.map'.format(beam))
 
-                if not os.path.isdir(output_file):
-                    convol = lib.miriad('convol')
-                    convol.map = input_file
-                    convol.out = output_file
-                    convol.fwhm = '{0},{1}'.format(
-                        str(mosaic_polarisation_common_beam_values_v[0]), str(mosaic_polarisation_common_beam_values_v[1]))
-                    convol.pa = mosaic_polarisation_common_beam_values_v[2]
-                    convol.options = 'final'
-                    try:
-                        convol.go()
-                    except Exception as e:
-                        error = "Convolving Stokes V image of beam {} ... Failed".format(
-                            beam)
-                        logger.error(error)
-                        logger.exception(e)
-                        raise RuntimeError(error)
-                    else:
-                        logger.debug("Convolving Stokes V image of beam {} ... Done".format(beam))
-                else:
-                    logger.warning("Convolved Stokes V image of beam {} already exists".format(beam))
+                convolve_image(input_file, output_file, mosaic_polarisation_common_beam_values_v,
+                               "Stokes V image of beam {}".format(beam))
+
+            failed_beams = self.run_beams_in_parallel(convolve_beam, "Convolving polarisation images")
+            self.check_failed_beams(failed_beams, "Convolving polarisation images")
 
             mosaic_polarisation_convolve_images_status = True
 
@@ -2413,7 +2492,7 @@ class mosaic(BaseModule):
         if mosaic_continuum_correlation_matrix_status:
             if len(mosaic_continuum_inverse_covariance_matrix) == 0:
                 logger.info("Calculating inverse continuum covariance matrix ...")
-                mosaic_continuum_inverse_covariance_matrix = mosaic_utils.inverted_covariance_matrix('images/{0}/image_{0}.map', correlation_matrix_file, self.NBEAMS, self.mosaic_beam_list)
+                mosaic_continuum_inverse_covariance_matrix = mosaic_utils.inverted_covariance_matrix('images/{0}/image_{0}.map', correlation_matrix_file, self.NBEAMS, self.mosaic_beam_list, cache_dir=self.get_beam_cache_dir())
                 logger.info("Calculating inverse continuum covariance matrix ... Done")
             else:
                 logger.info("Inverse of covariance matrix for continuum is available on disk already.")
@@ -2489,7 +2568,7 @@ class mosaic(BaseModule):
                     logger.info("Inverse of covariance matrix for polarisation Stokes Q image {} is available on disk already.".format(qplane))
                 else:
                     try:
-                        mosaic_polarisation_inverse_covariance_matrix_q[qplane] = mosaic_utils.inverted_covariance_matrix('images/{0}/Qcube_' + str(qplane).zfill(3), correlation_matrix_file, self.NBEAMS, self.mosaic_beam_list)
+                        mosaic_polarisation_inverse_covariance_matrix_q[qplane] = mosaic_utils.inverted_covariance_matrix('images/{0}/Qcube_' + str(qplane).zfill(3), correlation_matrix_file, self.NBEAMS, self.mosaic_beam_list, cache_dir=self.get_beam_cache_dir())
                     except:
                         logger.warning("Could not derive inverse covariance matrix for Stokes Q plane {}!".format(qplane))
                         continue
@@ -2501,7 +2580,7 @@ class mosaic(BaseModule):
                     logger.info("Inverse of covariance matrix for polarisation Stokes U image {} is available on disk already.".format(uplane))
                 else:
                     try:
-                        mosaic_polarisation_inverse_covariance_matrix_u[uplane] = mosaic_utils.inverted_covariance_matrix('images/{0}/Ucube_' + str(uplane).zfill(3), correlation_matrix_file, self.NBEAMS, self.mosaic_beam_list)
+                        mosaic_polarisation_inverse_covariance_matrix_u[uplane] = mosaic_utils.inverted_covariance_matrix('images/{0}/Ucube_' + str(uplane).zfill(3), correlation_matrix_file, self.NBEAMS, self.mosaic_beam_list, cache_dir=self.get_beam_cache_dir())
                     except:
                         logger.warning("Could not derive inverse covariance matrix for Stokes U plane {}!".format(uplane))
                         continue
@@ -2509,7 +2588,7 @@ class mosaic(BaseModule):
 
             if len(mosaic_polarisation_inverse_covariance_matrix_v) == 0:
                 logger.info("Calculating inverse polarisation covariance matrix for Stokes V images ...")
-                mosaic_polarisation_inverse_covariance_matrix_v = mosaic_utils.inverted_covariance_matrix('images/{0}/image_mf_V', correlation_matrix_file, self.NBEAMS, self.mosaic_beam_list)
+                mosaic_polarisation_inverse_covariance_matrix_v = mosaic_utils.inverted_covariance_matrix('images/{0}/image_mf_V', correlation_matrix_file, self.NBEAMS, self.mosaic_beam_list, cache_dir=self.get_beam_cache_dir())
                 logger.info("Calculating inverse polarisation covariance matrix for Stokes V images ... Done")
             else:
                 logger.info("Inverse of covariance matrix for polarisation Stokes V is available on disk already.")
@@ -2538,6 +2617,68 @@ class mosaic(BaseModule):
     # Function to calculate the product of continuum beam matrix and continuum covariance matrix
     # ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 
+    def multiply_beam_and_covariance_matrix(self, inv_cov, bm, beam_subdir, mosaic_subdir, btci_map, suffix=''):
+        """
+        Function to calculate the product of the transposed beam matrix and the inverse covariance matrix for a beam
+
+        Uses maths in miriad. Only the beam maps with a non-zero entry in the inverse covariance
+        matrix are multiplied and summed.
+
+        Args:
+            inv_cov (array): Inverse covariance matrix indexed by beam number
+            bm (str): Beam to calculate the product for
+            beam_subdir (str): Directory of the mosaic beam maps
+            mosaic_subdir (str): Directory for the scratch files and the product
+            btci_map (str): Name of the output map in mosaic_subdir
+            suffix (str): Suffix for the names of the scratch files
+        """
+
+        # Using "beams" list to account for missing beams/images
+        # Only doing math where inv_cov value is non-zero
+        beams = [b for b in self.mosaic_beam_list if inv_cov[int(b), int(bm)] != 0.]
+        if len(beams) == 0:
+            # keep an empty map so that the following steps find all products
+            beams = [bm]
+        logger.debug("Using {0} of {1} beams for beam {2}".format(len(beams), len(self.mosaic_beam_list), bm))
+
+        maths = lib.miriad('maths')
+        maths.options = 'unmask'
+        scratch_maps = []
+        total = None
+        for b in beams:
+            beam_map = os.path.join(beam_subdir, "beam_{0}_mos.map".format(b))
+            if not os.path.isdir(beam_map):
+                error = "Could not find mosaic beam map for beam {}".format(b)
+                logger.error(error)
+                raise RuntimeError(error)
+            tmp_map = os.path.join(mosaic_subdir, 'tmp_{0}{1}.map'.format(b, suffix))
+            maths.out = tmp_map
+            maths.exp = "'<{0}>*({1})'".format(beam_map, inv_cov[int(b), int(bm)])
+            logger.debug("for beam combination {0},{1}: operate = {2}".format(bm, b, maths.exp))
+            maths.go()
+            scratch_maps.append(tmp_map)
+            if total is None:
+                total = tmp_map
+            else:
+                sum_map = os.path.join(mosaic_subdir, 'sum_{0}{1}.map'.format(b, suffix))
+                maths.out = sum_map
+                maths.exp = "'<{0}>+<{1}>'".format(tmp_map, total)
+                maths.go()
+                scratch_maps.append(sum_map)
+                total = sum_map
+
+        if os.path.isdir(total):
+            subs_managefiles.director(self, 'rn', os.path.join(mosaic_subdir, btci_map), file_=total)
+        else:
+            error = "Could not find temporary sum map for beam {}".format(bm)
+            logger.error(error)
+            raise RuntimeError(error)
+
+        # remove the scratch files
+        logger.debug("Removing scratch files")
+        for fl in scratch_maps:
+            subs_managefiles.director(self, 'rm', fl, ignore_nonexistent=True)
+
     def math_continuum_multiply_beam_and_covariance_matrix(self):
         """
         Function to multiply the transpose of the continuum beam matrix by the continuum covariance matrix
@@ -2563,72 +2704,11 @@ class mosaic(BaseModule):
 
         if not mosaic_continuum_product_beam_covariance_matrix_status:
             # First calculate transpose of beam matrix multiplied by the inverse covariance matrix
-            # Will use *maths* in Miriad
-
-            # Using "beams" list to account for missing beams/images
-            # Only doing math where inv_cov value is non-zero
-            maths = lib.miriad('maths')
             for bm in self.mosaic_beam_list:
                 logger.debug("Processing beam {}".format(bm))
-                # This was not in the notebook.
-                # Are you it should be here ???? Yes, according to DJ
-                operate = ""
-                for b in self.mosaic_beam_list:
-                    maths.out = os.path.join(
-                        self.mosaic_continuum_mosaic_subdir, 'tmp_{}.map'.format(b))
-                    # since the beam list is made of strings, need to convert to integers
-                    beam_map = os.path.join(
-                        self.mosaic_continuum_beam_subdir, "beam_{0}_mos.map".format(b))
-                    if os.path.isdir(beam_map):
-                        if inv_cov[int(b), int(bm)] != 0.:
-                            operate = "'<{0}>*({1})'".format(beam_map, inv_cov[int(b), int(bm)])
-                        else:
-                            operate = "'<{0}>*(0)'".format(beam_map)
-                        logger.debug("for beam combination {0},{1}: operate = {2}".format(bm, b, operate))
-                        maths.exp = operate
-                        maths.options = 'unmask'
-                        maths.go()
-                    else:
-                        error = "Could not find continuum mosaic beam map for beam {}".format(b)
-                        logger.error(error)
-                        raise RuntimeError(error)
-                i = 1
-                while i < len(self.mosaic_beam_list):
-                    if os.path.isdir(os.path.join(self.mosaic_continuum_mosaic_subdir, "tmp_{}.map".format(self.mosaic_beam_list[i-1]))) and os.path.isdir(os.path.join(self.mosaic_continuum_mosaic_subdir, "tmp_{}.map".format(self.mosaic_beam_list[i]))):
-                        if i == 1:
-                            operate = "'<" + self.mosaic_continuum_mosaic_subdir + "/tmp_{}.map>+<".format(str(
-                                self.mosaic_beam_list[i-1]))+self.mosaic_continuum_mosaic_subdir + "/tmp_{}.map>'".format(str(self.mosaic_beam_list[i]))
-                        else:
-                            operate = "'<" + self.mosaic_continuum_mosaic_subdir + "/tmp_{}.map>".format(str(
-                                self.mosaic_beam_list[i])) + "+<" + self.mosaic_continuum_mosaic_subdir + "/sum_{}.map>'".format(str(self.mosaic_beam_list[i-1]))
-                        maths.out = self.mosaic_continuum_mosaic_subdir + \
-                            '/sum_{}.map'.format(str(self.mosaic_beam_list[i]))
-                        maths.exp = operate
-                        maths.options = 'unmask'
-                        maths.go()
-                    else:
-                        error = "Could not find temporary continuum maps for beam {0} or beam {1}".format(
-                            self.mosaic_beam_list[i-1], self.mosaic_beam_list[i])
-                        logger.error(error)
-                        raise RuntimeError(error)
-                    i += 1
-
-                if os.path.isdir(os.path.join(self.mosaic_continuum_mosaic_subdir, 'sum_{}.map'.format(self.mosaic_beam_list[i-1]))):
-                    subs_managefiles.director(self, 'rn', self.mosaic_continuum_mosaic_subdir + '/btci_{}.map'.format(
-                        bm), file_=self.mosaic_continuum_mosaic_subdir + '/sum_{}.map'.format(str(self.mosaic_beam_list[i-1])))
-                    # os.rename(,self.mosaic_continuum_mosaic_subdir+'/btci_{}.map'.format(bm))
-                else:
-                    error = "Could not find temporary continuum sum map for beam {}".format(
-                        self.mosaic_beam_list[i-1])
-                    logger.error(error)
-                    raise RuntimeError(error)
-
-                # remove the scratch files
-                logger.debug("Removing scratch files")
-                for fl in glob.glob(os.path.join(self.mosaic_continuum_mosaic_dir, 'tmp_*.map')):
-                    subs_managefiles.director(self, 'rm', fl, ignore_nonexistent=True)
-                for fl in glob.glob(os.path.join(self.mosaic_continuum_mosaic_dir, 'sum_*.map')):
-                    subs_managefiles.director(self, 'rm', fl, ignore_nonexistent=True)
+                self.multiply_beam_and_covariance_matrix(
+                    inv_cov, bm, self.mosaic_continuum_beam_subdir, self.mosaic_continuum_mosaic_subdir,
+                    'btci_{}.map'.format(bm))
 
             logger.info(
                 "Multiplying continuum beam matrix by continuum covariance matrix ... Done")
@@ -2674,64 +2754,13 @@ class mosaic(BaseModule):
 
         if not mosaic_polarisation_product_beam_covariance_matrix_status_q:
             # First calculate transpose of beam matrix multiplied by the inverse covariance matrix
-            # Will use *maths* in Miriad
-            # Using "beams" list to account for missing beams/images
-            # Only doing math where inv_cov value is non-zero
             for qplane in range(qimages):
-                maths = lib.miriad('maths')
                 for bm in self.mosaic_beam_list:
                     logger.debug("Processing beam {}".format(bm))
-                    operate = ""
-                    for b in self.mosaic_beam_list:
-                        maths.out = os.path.join(
-                            self.mosaic_polarisation_mosaic_subdir, 'tmp_{0}_{1}.map'.format(b, str(qplane).zfill(3)))
-                        # since the beam list is made of strings, need to convert to integers
-                        beam_map = os.path.join(
-                            self.mosaic_polarisation_beam_subdir, "beam_{0}_mos.map".format(b))
-                        if os.path.isdir(beam_map):
-                            if inv_cov_q[qplane][int(b), int(bm)] != 0.:
-                                operate = "'<{0}>*({1})'".format(beam_map,
-                                                                 inv_cov_q[qplane][int(b), int(bm)])
-                            else:
-                                operate = "'<{0}>*(0)'".format(beam_map)
-                            logger.debug("for beam combination {0},{1}: operate = {2}".format(bm, b, operate))
-                            maths.exp = operate
-                            maths.options = 'unmask'
-                            maths.go()
-                        else:
-                            error = "Could not find polarisation Stokes Q mosaic beam map for beam {0} and image plane {1}".format(b, qplane)
-                            logger.error(error)
-                            raise RuntimeError(error)
-                    i = 1
-                    while i < len(self.mosaic_beam_list):
-                        if os.path.isdir(os.path.join(self.mosaic_polarisation_mosaic_subdir, 'tmp_{0}_{1}.map'.format(self.mosaic_beam_list[i-1], str(qplane).zfill(3)))) and os.path.isdir(os.path.join(self.mosaic_polarisation_mosaic_subdir, 'tmp_{0}_{1}.map'.format(self.mosaic_beam_list[i], str(qplane).zfill(3)))):
-                            if i == 1:
-                                operate = "'<" + self.mosaic_polarisation_mosaic_subdir + "/tmp_{0}_{1}.map>+<".format(self.mosaic_beam_list[i-1], str(qplane).zfill(3)) + self.mosaic_polarisation_mosaic_subdir + "/tmp_{0}_{1}.map>'".format(self.mosaic_beam_list[i], str(qplane).zfill(3))
-                            else:
-                                operate = "'<" + self.mosaic_polarisation_mosaic_subdir + "/tmp_{0}_{1}.map>".format(self.mosaic_beam_list[i], str(qplane).zfill(3)) + "+<" + self.mosaic_polarisation_mosaic_subdir + "/sum_{0}_{1}.map>'".format(str(self.mosaic_beam_list[i-1]), str(qplane).zfill(3))
-                            maths.out = self.mosaic_polarisation_mosaic_subdir + '/sum_{0}_{1}.map'.format(str(self.mosaic_beam_list[i]), str(qplane).zfill(3))
-                            maths.exp = operate
-                            maths.options = 'unmask'
-                            maths.go()
-                        else:
-                            error = "Could not find temporary Stokes Q maps for image plane {2} beam {0} or beam {1}".format(self.mosaic_beam_list[i-1], self.mosaic_beam_list[i], qplane)
-                            logger.error(error)
-                            raise RuntimeError(error)
-                        i += 1
-
-                    if os.path.isdir(os.path.join(self.mosaic_polarisation_mosaic_subdir, 'sum_{0}_{1}.map'.format(str(self.mosaic_beam_list[i-1]), str(qplane).zfill(3)))):
-                        subs_managefiles.director(self, 'rn', self.mosaic_polarisation_mosaic_subdir + '/btci_Q_{0}_{1}.map'.format(bm, str(qplane).zfill(3)), file_=self.mosaic_polarisation_mosaic_subdir + '/sum_{0}_{1}.map'.format(str(self.mosaic_beam_list[i-1]), str(qplane).zfill(3)))
-                    else:
-                        error = "Could not find temporary Stokes Q sum map for image plane {1} and beam {0}".format(self.mosaic_beam_list[i-1], qplane)
-                        logger.error(error)
-                        raise RuntimeError(error)
-
-                    # remove the scratch files
-                    logger.debug("Removing Stokes Q scratch files")
-                    for fl in glob.glob(os.path.join(self.mosaic_polarisation_mosaic_dir, 'tmp_*.map')):
-                        subs_managefiles.director(self, 'rm', fl, ignore_nonexistent=True)
-                    for fl in glob.glob(os.path.join(self.mosaic_polarisation_mosaic_dir, 'sum_*.map')):
-                        subs_managefiles.director(self, 'rm', fl, ignore_nonexistent=True)
+                    self.multiply_beam_and_covariance_matrix(
+                        np.asarray(inv_cov_q[qplane]), bm, self.mosaic_polarisation_beam_subdir,
+                        self.mosaic_polarisation_mosaic_subdir, 'btci_Q_{0}_{1}.map'.format(bm, str(qplane).zfill(3)),
+                        suffix='_{}'.format(str(qplane).zfill(3)))
 
                 logger.info(
                     "Multiplying Stokes Q beam matrix by Stokes Q covariance matrix ... Done")
@@ -2742,64 +2771,13 @@ class mosaic(BaseModule):
 
         if not mosaic_polarisation_product_beam_covariance_matrix_status_u:
             # First calculate transpose of beam matrix multiplied by the inverse covariance matrix
-            # Will use *maths* in Miriad
-            # Using "beams" list to account for missing beams/images
-            # Only doing math where inv_cov value is non-zero
             for uplane in range(qimages):
-                maths = lib.miriad('maths')
                 for bm in self.mosaic_beam_list:
                     logger.debug("Processing beam {}".format(bm))
-                    operate = ""
-                    for b in self.mosaic_beam_list:
-                        maths.out = os.path.join(
-                            self.mosaic_polarisation_mosaic_subdir, 'tmp_{0}_{1}.map'.format(b, str(uplane).zfill(3)))
-                        # since the beam list is made of strings, need to convert to integers
-                        beam_map = os.path.join(
-                            self.mosaic_polarisation_beam_subdir, "beam_{0}_mos.map".format(b))
-                        if os.path.isdir(beam_map):
-                            if inv_cov_u[uplane][int(b), int(bm)] != 0.:
-                                operate = "'<{0}>*({1})'".format(beam_map,
-                                                                 inv_cov_u[uplane][int(b), int(bm)])
-                            else:
-                                operate = "'<{0}>*(0)'".format(beam_map)
-                            logger.debug("for beam combination {0},{1}: operate = {2}".format(bm, b, operate))
-                            maths.exp = operate
-                            maths.options = 'unmask'
-                            maths.go()
-                        else:
-                            error = "Could not find polarisation Stokes U mosaic beam map for beam {0} and image plane {1}".format(b, uplane)
-                            logger.error(error)
-                            raise RuntimeError(error)
-                    i = 1
-                    while i < len(self.mosaic_beam_list):
-                        if os.path.isdir(os.path.join(self.mosaic_polarisation_mosaic_subdir, 'tmp_{0}_{1}.map'.format(self.mosaic_beam_list[i-1], str(uplane).zfill(3)))) and os.path.isdir(os.path.join(self.mosaic_polarisation_mosaic_subdir, 'tmp_{0}_{1}.map'.format(self.mosaic_beam_list[i], str(uplane).zfill(3)))):
-                            if i == 1:
-                                operate = "'<" + self.mosaic_polarisation_mosaic_subdir + "/tmp_{0}_{1}.map>+<".format(self.mosaic_beam_list[i-1], str(uplane).zfill(3)) + self.mosaic_polarisation_mosaic_subdir + "/tmp_{0}_{1}.map>'".format(self.mosaic_beam_list[i], str(uplane).zfill(3))
-                            else:
-                                operate = "'<" + self.mosaic_polarisation_mosaic_subdir + "/tmp_{0}_{1}.map>".format(self.mosaic_beam_list[i], str(uplane).zfill(3)) + "+<" + self.mosaic_polarisation_mosaic_subdir + "/sum_{0}_{1}.map>'".format(str(self.mosaic_beam_list[i-1]), str(uplane).zfill(3))
-                            maths.out = self.mosaic_polarisation_mosaic_subdir + '/sum_{0}_{1}.map'.format(str(self.mosaic_beam_list[i]), str(uplane).zfill(3))
-                            maths.exp = operate
-                            maths.options = 'unmask'
-                            maths.go()
-                        else:
-                            error = "Could not find temporary Stokes U maps for image plane {2} beam {0} or beam {1}".format(self.mosaic_beam_list[i-1], self.mosaic_beam_list[i], uplane)
-                            logger.error(error)
-                            raise RuntimeError(error)
-                        i += 1
-
-                    if os.path.isdir(os.path.join(self.mosaic_polarisation_mosaic_subdir, 'sum_{0}_{1}.map'.format(str(self.mosaic_beam_list[i-1]), str(uplane).zfill(3)))):
-                        subs_managefiles.director(self, 'rn', self.mosaic_polarisation_mosaic_subdir + '/btci_U_{0}_{1}.map'.format(bm, str(uplane).zfill(3)), file_=self.mosaic_polarisation_mosaic_subdir + '/sum_{0}_{1}.map'.format(str(self.mosaic_beam_list[i-1]), str(uplane).zfill(3)))
-                    else:
-                        error = "Could not find temporary Stokes U sum map for image plane {1} and beam {0}".format(self.mosaic_beam_list[i-1], uplane)
-                        logger.error(error)
-                        raise RuntimeError(error)
-
-                    # remove the scratch files
-                    logger.info("Removing Stokes U scratch files")
-                    for fl in glob.glob(os.path.join(self.mosaic_polarisation_mosaic_dir, 'tmp_*.map')):
-                        subs_managefiles.director(self, 'rm', fl, ignore_nonexistent=True)
-                    for fl in glob.glob(os.path.join(self.mosaic_polarisation_mosaic_dir, 'sum_*.map')):
-                        subs_managefiles.director(self, 'rm', fl, ignore_nonexistent=True)
+                    self.multiply_beam_and_covariance_matrix(
+                        np.asarray(inv_cov_u[uplane]), bm, self.mosaic_polarisation_beam_subdir,
+                        self.mosaic_polarisation_mosaic_subdir, 'btci_U_{0}_{1}.map'.format(bm, str(uplane).zfill(3)),
+                        suffix='_{}'.format(str(uplane).zfill(3)))
 
                 logger.info(
                     "Multiplying Stokes U beam matrix by Stokes U covariance matrix ... Done")
@@ -2810,67 +2788,11 @@ class mosaic(BaseModule):
 
         if not mosaic_polarisation_product_beam_covariance_matrix_status_v:
             # First calculate transpose of beam matrix multiplied by the inverse covariance matrix
-            # Will use *maths* in Miriad
-            # Using "beams" list to account for missing beams/images
-            # Only doing math where inv_cov value is non-zero
-            maths = lib.miriad('maths')
             for bm in self.mosaic_beam_list:
                 logger.info("Processing Stokes V image of beam {}".format(bm))
-                operate = ""
-                for b in self.mosaic_beam_list:
-                    maths.out = os.path.join(
-                        self.mosaic_polarisation_mosaic_subdir, 'tmp_{}.map'.format(b))
-                    beam_map = os.path.join(
-                        self.mosaic_polarisation_beam_subdir, "beam_{0}_mos.map".format(b))
-                    if os.path.isdir(beam_map):
-                        if inv_cov_v[int(b), int(bm)] != 0.:
-                            operate = "'<{0}>*({1})'".format(beam_map, inv_cov_v[int(b), int(bm)])
-                        else:
-                            operate = "'<{0}>*(0)'".format(beam_map)
-                        logger.debug("for beam combination {0},{1}: operate = {2}".format(bm, b, operate))
-                        maths.exp = operate
-                        maths.options = 'unmask'
-                        maths.go()
-                    else:
-                        error = "Could not find polaristion Stokes V mosaic beam map for beam {}".format(
-                            b)
-                        logger.error(error)
-                        raise RuntimeError(error)
-                i = 1
-                while i < len(self.mosaic_beam_list):
-                    if os.path.isdir(os.path.join(self.mosaic_polarisation_mosaic_subdir, "tmp_{}.map".format(self.mosaic_beam_list[i-1]))) and os.path.isdir(os.path.join(self.mosaic_polarisation_mosaic_subdir, "tmp_{}.map".format(self.mosaic_beam_list[i]))):
-                        if i == 1:
-                            operate = "'<" + self.mosaic_polarisation_mosaic_subdir + "/tmp_{}.map>+<".format(str(
-                                self.mosaic_beam_list[i-1]))+self.mosaic_polarisation_mosaic_subdir + "/tmp_{}.map>'".format(str(self.mosaic_beam_list[i]))
-                        else:
-                            operate = "'<" + self.mosaic_polarisation_mosaic_subdir + "/tmp_{}.map>".format(str(
-                                self.mosaic_beam_list[i])) + "+<" + self.mosaic_polarisation_mosaic_subdir + "/sum_{}.map>'".format(str(self.mosaic_beam_list[i-1]))
-                        maths.out = self.mosaic_polarisation_mosaic_subdir + \
-                            '/sum_{}.map'.format(str(self.mosaic_beam_list[i]))
-                        maths.exp = operate
-                        maths.options = 'unmask'
-                        maths.go()
-                    else:
-                        error = "Could not find temporary polarisation Stokes V maps for beam {0} or beam {1}".format(
-                            self.mosaic_beam_list[i-1], self.mosaic_beam_list[i])
-                        logger.error(error)
-                        raise RuntimeError(error)
-                    i += 1
-
-                if os.path.isdir(os.path.join(self.mosaic_polarisation_mosaic_subdir, 'sum_{}.map'.format(self.mosaic_beam_list[i-1]))):
-                    subs_managefiles.director(self, 'rn', self.mosaic_polarisation_mosaic_subdir + '/btci_V_{}.map'.format(
-                        bm), file_=self.mosaic_polarisation_mosaic_subdir + '/sum_{}.map'.format(str(self.mosaic_beam_list[i-1])))
-                else:
-                    error = "Could not find temporary Stokes V polarisation sum map for beam {}".format(self.mosaic_beam_list[i-1])
-                    logger.error(error)
-                    raise RuntimeError(error)
-
-                # remove the scratch files
-                logger.debug("Removing scratch files")
-                for fl in glob.glob(os.path.join(self.mosaic_polarisation_mosaic_dir, 'tmp_*.map')):
-                    subs_managefiles.director(self, 'rm', fl, ignore_nonexistent=True)
-                for fl in glob.glob(os.path.join(self.mosaic_polarisation_mosaic_dir, 'sum_*.map')):
-                    subs_managefiles.director(self, 'rm', fl, ignore_nonexistent=True)
+                self.multiply_beam_and_covariance_matrix(
+                    inv_cov_v, bm, self.mosaic_polarisation_beam_subdir, self.mosaic_polarisation_mosaic_subdir,
+                    'btci_V_{}.map'.format(bm))
 
             logger.info("Multiplying polarisation Stokes V beam matrix by polarisation Stokes V covariance matrix ... Done")
             mosaic_polarisation_product_beam_covariance_matrix_status_v = True
@@ -3251,28 +3173,21 @@ class mosaic(BaseModule):
 
         mosaic_continuum_get_max_variance_status = get_param_def(self, 'mosaic_continuum_get_max_variance_status', False)
 
-        mosaic_continuum_max_variance = get_param_def(self, 'mosaic_continuum_beam_max_variance', 0.)
+        mosaic_continuum_max_variance = get_param_def(self, 'mosaic_continuum_max_variance', 0.)
 
         # switch to mosaic directory
         subs_managefiles.director(self, 'ch', self.mosaic_continuum_mosaic_dir)
 
         if not mosaic_continuum_get_max_variance_status and mosaic_continuum_max_variance == 0.:
             # Find maximum value of variance map
-            imstat = lib.miriad('imstat')
-            imstat.in_ = "'variance_mos.map'"
-            imstat.region = "'quarter(1)'"
-            imstat.axes = "'x,y'"
             try:
-                a = imstat.go()
+                var_max = subs_robuststats.region_max('variance_mos.map', region='quarter(1)')
             except Exception as e:
                 error = "Getting maximum of continuum varianc map ... Failed"
                 logger.error(error)
                 logger.exception(e)
                 raise RuntimeError(error)
 
-            # Always outputs max value at same point
-            var_max = a[10].lstrip().split(" ")[3]
-
             logger.debug("Maximum of continuum variance map is {}".format(var_max))
 
             logger.info("Getting maximum of continuum variance map ... Done")
@@ -3304,11 +3219,11 @@ class mosaic(BaseModule):
         qimages = len(polbeamimagestatus)
 
         mosaic_polarisation_get_max_variance_status_q = get_param_def(self, 'mosaic_polarisation_get_max_variance_status_q', False)
-        mosaic_polarisation_max_variance_q = get_param_def(self, 'mosaic_polarisation_beam_max_variance_q', np.zeros(qimages))
+        mosaic_polarisation_max_variance_q = get_param_def(self, 'mosaic_polarisation_max_variance_q', np.zeros(qimages))
         mosaic_polarisation_get_max_variance_status_u = get_param_def(self, 'mosaic_polarisation_get_max_variance_status_u', False)
-        mosaic_polarisation_max_variance_u = get_param_def(self, 'mosaic_polarisation_beam_max_variance_u', np.zeros(qimages))
+        mosaic_polarisation_max_variance_u = get_param_def(self, 'mosaic_polarisation_max_variance_u', np.zeros(qimages))
         mosaic_polarisation_get_max_variance_status_v = get_param_def(self, 'mosaic_polarisation_get_max_variance_status_v', False)
-        mosaic_polarisation_max_variance_v = get_param_def(self, 'mosaic_polarisation_beam_max_variance_v', 0.)
+        mosaic_polarisation_max_variance_v = get_param_def(self, 'mosaic_polarisation_max_variance_v', 0.)
 
         # switch to mosaic directory
         subs_managefiles.director(self, 'ch', self.mosaic_polarisation_mosaic_dir)
@@ -3316,21 +3231,14 @@ class mosaic(BaseModule):
         if not mosaic_polarisation_get_max_variance_status_q:
             for qplane in range(qimages):
                 # Find maximum value of variance map
-                imstat = lib.miriad('imstat')
-                imstat.in_ = "'" + 'variance_Q_{}_mos.map'.format(str(qplane).zfill(3)) + "'"
-                imstat.region = "'quarter(1)'"
-                imstat.axes = "'x,y'"
                 try:
-                    a = imstat.go()
+                    var_max_q = subs_robuststats.region_max('variance_Q_{}_mos.map'.format(str(qplane).zfill(3)), region='quarter(1)')
                 except Exception as e:
                     error = "Getting maximum of Stokes Q variance map {} ... Failed".format(qplane)
                     logger.error(error)
                     logger.exception(e)
                     raise RuntimeError(error)
 
-                # Always outputs max value at same point
-                var_max_q = a[10].lstrip().split(" ")[3]
-
                 logger.debug("Maximum of Stokes Q variance map {0} is {1}".format(qplane, var_max_q))
 
                 mosaic_polarisation_max_variance_q[qplane] = var_max_q
@@ -3345,21 +3253,14 @@ class mosaic(BaseModule):
         if not mosaic_polarisation_get_max_variance_status_u:
             for uplane in range(qimages):
                 # Find maximum value of variance map
-                imstat = lib.miriad('imstat')
-                imstat.in_ = "'" + 'variance_U_{}_mos.map'.format(str(uplane).zfill(3)) + "'"
-                imstat.region = "'quarter(1)'"
-                imstat.axes = "'x,y'"
                 try:
-                    a = imstat.go()
+                    var_max_u = subs_robuststats.region_max('variance_U_{}_mos.map'.format(str(uplane).zfill(3)), region='quarter(1)')
                 except Exception as e:
                     error = "Getting maximum of Stokes U variance map {} ... Failed".format(uplane)
                     logger.error(error)
                     logger.exception(e)
                     raise RuntimeError(error)
 
-                # Always outputs max value at same point
-                var_max_u = a[10].lstrip().split(" ")[3]
-
                 logger.debug("Maximum of Stokes U variance map {0} is {1}".format(uplane, var_max_u))
 
                 mosaic_polarisation_max_variance_u[uplane] = var_max_u
@@ -3373,21 +3274,14 @@ class mosaic(BaseModule):
 
         if not mosaic_polarisation_get_max_variance_status_v and mosaic_polarisation_max_variance_v == 0.:
             # Find maximum value of variance map
-            imstat = lib.miriad('imstat')
-            imstat.in_ = "'variance_V_mos.map'"
-            imstat.region = "'quarter(1)'"
-            imstat.axes = "'x,y'"
             try:
-                a = imstat.go()
+                var_max_v = subs_robuststats.region_max('variance_V_mos.map', region='quarter(1)')
             except Exception as e:
                 error = "Getting maximum of Stokes V variance map ... Failed"
                 logger.error(error)
                 logger.exception(e)
                 raise RuntimeError(error)
 
-            # Always outputs max value at same point
-            var_max_v = a[10].lstrip().split(" ")[3]
-
             logger.debug("Maximum of Stokes V variance map is {}".format(var_max_v))
 
             logger.info("Getting maximum of Stokes V variance map ... Done")
@@ -3419,7 +3313,7 @@ class mosaic(BaseModule):
 
         mosaic_continuum_divide_image_variance_status = get_param_def(self, 'mosaic_continuum_divide_image_variance_status', False)
 
-        mosaic_continuum_max_variance = get_param_def(self, 'mosaic_continuum_beam_max_variance', 0.)
+        mosaic_continuum_max_variance = get_param_def(self, 'mosaic_continuum_max_variance', 0.)
 
         # switch to mosaic directory
         subs_managefiles.director(self, 'ch', self.mosaic_continuum_mosaic_dir)
@@ -3465,9 +3359,9 @@ class mosaic(BaseModule):
         mosaic_polarisation_divide_image_variance_status_u = get_param_def(self, 'mosaic_polarisation_divide_image_variance_status_u', False)
         mosaic_polarisation_divide_image_variance_status_v = get_param_def(self, 'mosaic_polarisation_divide_image_variance_status_v', False)
 
-        mosaic_polarisation_max_variance_q = get_param_def(self, 'mosaic_polarisation_beam_max_variance_q', np.zeros(qimages))
-        mosaic_polarisation_max_variance_u = get_param_def(self, 'mosaic_polarisation_beam_max_variance_u', np.zeros(qimages))
-        mosaic_polarisation_max_variance_v = get_param_def(self, 'mosaic_polarisation_beam_max_variance_v', 0.)
+        mosaic_polarisation_max_variance_q = get_param_def(self, 'mosaic_polarisation_max_variance_q', np.zeros(qimages))
+        mosaic_polarisation_max_variance_u = get_param_def(self, 'mosaic_polarisation_max_variance_u', np.zeros(qimages))
+        mosaic_polarisation_max_variance_v = get_param_def(self, 'mosaic_polarisation_max_variance_v', 0.)
 
         # switch to mosaic directory
         subs_managefiles.director(self, 'ch', self.mosaic_polarisation_mosaic_dir)
@@ -3539,6 +3433,180 @@ class mosaic(BaseModule):
         subs_param.add_param(self, 'mosaic_polarisation_divide_image_variance_status_v', mosaic_polarisation_divide_image_variance_status_v)
 
 
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Function to update the continuum mosaic accumulator
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    def update_continuum_mosaic_accumulator(self, image_files, beam_files, inv_cov, mosaic_file, noise_file):
+        """
+        Function to update the continuum mosaic accumulator and derive the mosaic from it
+
+        The beams are identified by task id and beam number. New beams are added and beams
+        with a changed image, beam map or inverse covariance matrix are replaced. Beams of
+        this task id that are not in the beam list anymore are removed. Unchanged beams and
+        beams of other observations in the same accumulator are not touched.
+
+        The content checksums of the images and beam maps are stored in the param file with
+        their size and modification time, so only images written since the last run are read.
+
+        Args:
+            image_files (list(str)): Regridded and convolved images in the order of the beam list
+            beam_files (list(str)): Regridded beam maps in the order of the beam list
+            inv_cov (array): Inverse covariance matrix in the order of the beam list
+            mosaic_file (str): Output miriad image of the mosaic
+            noise_file (str): Output miriad image of the noise map
+
+        Returns:
+            float: Maximum of the variance map
+        """
+        names = ['{0}_{1}'.format(self.mosaic_taskid, beam) for beam in self.mosaic_beam_list]
+
+        mosaic_continuum_accumulator_stamps = get_param_def(self, 'mosaic_continuum_accumulator_stamps', {})
+
+        def get_checksum(filename):
+            path = os.path.abspath(filename)
+            stamp = mosaic_utils.get_image_stamp(path)
+            if path in mosaic_continuum_accumulator_stamps and mosaic_continuum_accumulator_stamps[path][0] == stamp:
+                return mosaic_continuum_accumulator_stamps[path][1]
+            checksum = mosaic_utils.get_miriad_image_checksum(path)
+            mosaic_continuum_accumulator_stamps[path] = (stamp, checksum)
+            return checksum
+
+        accumulator = None
+        if os.path.exists(os.path.join(self.mosaic_continuum_accumulator_dir, 'accumulator.json')):
+            accumulator = MosaicAccumulator(self.mosaic_continuum_accumulator_dir)
+
+        for index, name in enumerate(names):
+            weights = dict((names[n], float(inv_cov[index, n])) for n in range(len(names)) if inv_cov[index, n] != 0.)
+            checksum = hashlib.sha1(repr(
+                [get_checksum(image_files[index]), get_checksum(beam_files[index]),
+                 sorted(weights.items())]).encode('utf-8')).hexdigest()
+            if accumulator is not None and accumulator.get_checksum(name) == checksum:
+                logger.debug("Beam {} is already part of the mosaic".format(name))
+                continue
+            image, header = mosaic_engine.load_miriad_plane(image_files[index])
+            beam, _ = mosaic_engine.load_miriad_plane(beam_files[index])
+            if accumulator is None:
+                accumulator = MosaicAccumulator(self.mosaic_continuum_accumulator_dir, header)
+            elif not accumulator.same_grid(header):
+                error = "Continuum images do not match the grid of the mosaic accumulator"
+                logger.error(error)
+                raise RuntimeError(error)
+            logger.info("Adding beam {} to the mosaic accumulator".format(name))
+            accumulator.replace_beam(name, image, beam, weights, checksum=checksum)
+
+        if accumulator is None:
+            error = "No continuum beams to create the mosaic accumulator in {}".format(
+                self.mosaic_continuum_accumulator_dir)
+            logger.error(error)
+            raise RuntimeError(error)
+
+        for name in accumulator.beams:
+            if name.startswith('{}_'.format(self.mosaic_taskid)) and name not in names:
+                logger.info("Removing beam {} from the mosaic accumulator".format(name))
+                accumulator.remove_beam(name)
+
+        subs_param.add_param(self, 'mosaic_continuum_accumulator_stamps', mosaic_continuum_accumulator_stamps)
+
+        return accumulator.write_mosaic(mosaic_file, noise_file)
+
+
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Function to calculate the polarisation mosaics with numpy
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    def math_polarisation_linear_mosaic(self):
+        """
+        Function to calculate the Stokes Q, U and V mosaics and noise maps with numpy
+
+        Does the same as the miriad maths steps from the product of the beam matrix and
+        covariance matrix to the noise maps, but for all Stokes and subband planes in a
+        single pass over the beam maps. Planes without an inverse covariance matrix are skipped.
+        """
+
+        logger.info("Calculating polarisation mosaics and noise maps")
+
+        mosaic_polarisation_linear_mosaic_status = get_param_def(self, 'mosaic_polarisation_linear_mosaic_status', False)
+
+        # Get the needed information from the param files
+        pbeam = 'polarisation_B' + str(self.mosaic_beam_list[0]).zfill(2)
+        polbeamimagestatus = get_param_def(self, pbeam + '_targetbeams_qu_imagestatus', False)
+        qimages = len(polbeamimagestatus)
+
+        mosaic_polarisation_max_variance_q = get_param_def(self, 'mosaic_polarisation_max_variance_q', np.zeros(qimages))
+        mosaic_polarisation_max_variance_u = get_param_def(self, 'mosaic_polarisation_max_variance_u', np.zeros(qimages))
+        mosaic_polarisation_max_variance_v = get_param_def(self, 'mosaic_polarisation_max_variance_v', 0.)
+
+        # get polarisation covariance matrices from numpy file
+        inv_cov_q = get_param_def(self, 'mosaic_polarisation_inverse_covariance_matrix_q', [None] * qimages)
+        inv_cov_u = get_param_def(self, 'mosaic_polarisation_inverse_covariance_matrix_u', [None] * qimages)
+        inv_cov_v = get_param_def(self, 'mosaic_polarisation_inverse_covariance_matrix_v', [])
+
+        # switch to mosaic directory
+        subs_managefiles.director(self, 'ch', self.mosaic_polarisation_dir)
+
+        if not mosaic_polarisation_linear_mosaic_status:
+            # the planes as (Stokes parameter, plane number, inverse covariance matrix, image name, output name)
+            planes = []
+            for qplane in range(qimages):
+                planes.append(('Q', qplane, inv_cov_q[qplane], "Qcube_{0}_" + str(qplane).zfill(3) + "_mos.map",
+                               "mosaic_Q_" + str(qplane).zfill(3)))
+            for uplane in range(qimages):
+                planes.append(('U', uplane, inv_cov_u[uplane], "Ucube_{0}_" + str(uplane).zfill(3) + "_mos.map",
+                               "mosaic_U_" + str(uplane).zfill(3)))
+            planes.append(('V', 0, inv_cov_v, "image_mf_V_{0}_mos.map", "mosaic_V"))
+
+            # the covariance matrices are indexed by beam number, the beam list may have missing beams
+            beam_index = [int(b) for b in self.mosaic_beam_list]
+            valid_planes = []
+            for plane in planes:
+                if plane[2] is None or len(plane[2]) == 0:
+                    logger.warning("No inverse covariance matrix for Stokes {0} image plane {1}. Skipping it".format(
+                        plane[0], plane[1]))
+                else:
+                    valid_planes.append(plane)
+
+            inv_covs = [np.asarray(plane[2])[np.ix_(beam_index, beam_index)] for plane in valid_planes]
+            image_files = [[os.path.join(self.mosaic_polarisation_mosaic_subdir, plane[3].format(str(b).zfill(2)))
+                            for plane in valid_planes] for b in self.mosaic_beam_list]
+            beam_files = [os.path.join(self.mosaic_polarisation_beam_subdir, 'beam_{}_mos.map'.format(b))
+                          for b in self.mosaic_beam_list]
+            mosaic_files = [os.path.join(self.mosaic_polarisation_mosaic_subdir, '{}_final.map'.format(plane[4]))
+                            for plane in valid_planes]
+            noise_files = [os.path.join(self.mosaic_polarisation_mosaic_subdir, '{}_noise.map'.format(plane[4]))
+                           for plane in valid_planes]
+
+            try:
+                max_variances = mosaic_engine.stacked_linear_mosaic_files(
+                    image_files, beam_files, inv_covs, mosaic_files, noise_files,
+                    os.path.join(self.mosaic_polarisation_mosaic_dir, 'engine'))
+            except Exception as e:
+                error = "Calculating polarisation mosaics and noise maps ... Failed"
+                logger.error(error)
+                logger.exception(e)
+                raise RuntimeError(error)
+
+            mosaic_polarisation_max_variance_q = np.asarray(mosaic_polarisation_max_variance_q, dtype=np.float64)
+            mosaic_polarisation_max_variance_u = np.asarray(mosaic_polarisation_max_variance_u, dtype=np.float64)
+            for plane, max_variance in zip(valid_planes, max_variances):
+                if plane[0] == 'Q':
+                    mosaic_polarisation_max_variance_q[plane[1]] = max_variance
+                elif plane[0] == 'U':
+                    mosaic_polarisation_max_variance_u[plane[1]] = max_variance
+                else:
+                    mosaic_polarisation_max_variance_v = max_variance
+
+            logger.info("Calculating polarisation mosaics and noise maps ... Done")
+
+            mosaic_polarisation_linear_mosaic_status = True
+        else:
+            logger.info("Polarisation mosaics and noise maps have already been calculated")
+
+        subs_param.add_param(self, 'mosaic_polarisation_linear_mosaic_status', mosaic_polarisation_linear_mosaic_status)
+
+        subs_param.add_param(self, 'mosaic_polarisation_max_variance_q', mosaic_polarisation_max_variance_q)
+        subs_param.add_param(self, 'mosaic_polarisation_max_variance_u', mosaic_polarisation_max_variance_u)
+        subs_param.add_param(self, 'mosaic_polarisation_max_variance_v', mosaic_polarisation_max_variance_v)
+
+
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
     # Function to get continuum mosaic noise map
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -3551,7 +3619,7 @@ class mosaic(BaseModule):
 
         mosaic_continuum_get_mosaic_noise_map_status = get_param_def(self, 'mosaic_continuum_get_mosaic_noise_map_status', False)
 
-        mosaic_continuum_max_variance = get_param_def(self, 'mosaic_continuum_beam_max_variance', 0.)
+        mosaic_continuum_max_variance = get_param_def(self, 'mosaic_continuum_max_variance', 0.)
 
         # switch to mosaic directory
         subs_managefiles.director(self, 'ch', self.mosaic_continuum_mosaic_dir)
@@ -3588,6 +3656,246 @@ class mosaic(BaseModule):
 
         subs_param.add_param(self, 'mosaic_continuum_get_mosaic_noise_map_status', mosaic_continuum_get_mosaic_noise_map_status)
 
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Function to create the continuum mosaic tile by tile
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    def create_continuum_tiled_mosaic(self):
+        """
+        Function to create the continuum mosaic tile by tile
+
+        Replaces regridding, convolving and combining the images on the full template. For every tile only the
+        beams overlapping with it are regridded and convolved, and the tile is written directly into the mosaic
+        fits files. Memory and scratch space depend on the tile size instead of the size of the mosaic.
+        """
+
+        logger.info("Creating continuum mosaic in tiles of {0} pixels".format(self.mosaic_continuum_tile_size))
+
+        mosaic_continuum_tiled_mosaic_status = get_param_def(self, 'mosaic_continuum_tiled_mosaic_status', False)
+
+        mosaic_continuum_max_variance = get_param_def(self, 'mosaic_continuum_max_variance', 0.)
+
+        mosaic_continuum_common_beam_values = get_param_def(
+            self, 'mosaic_continuum_common_beam_values', np.zeros(3))
+
+        mosaic_continuum_inverse_covariance_matrix = get_param_def(
+            self, 'mosaic_continuum_inverse_covariance_matrix', [])
+        if len(mosaic_continuum_inverse_covariance_matrix) == 0:
+            error = "Inverse covariance matrix is not available"
+            logger.error(error)
+            raise RuntimeError(error)
+
+        # switch to mosaic directory
+        subs_managefiles.director(self, 'ch', self.mosaic_continuum_dir)
+
+        # set the mosaic name
+        if not self.mosaic_name:
+            self.mosaic_name = "{}_mosaic.fits".format(self.mosaic_taskid)
+        mosaic_file = os.path.join(self.mosaic_continuum_mosaic_dir, self.mosaic_name)
+        noise_file = os.path.join(self.mosaic_continuum_mosaic_dir, self.mosaic_name.replace(".fits", "_noise.fits"))
+
+        if not mosaic_continuum_tiled_mosaic_status:
+            tile_dir = os.path.join(self.mosaic_continuum_mosaic_subdir, 'tiles')
+            subs_managefiles.director(self, 'mk', tile_dir)
+
+            # the template only has the size of a tile, extend it to the full mosaic
+            _, template_header = mosaic_engine.load_miriad_plane(
+                os.path.join(self.mosaic_continuum_mosaic_subdir, 'mosaic_continuum_template.map'))
+            imsize = self.mosaic_continuum_imsize
+            shape = (imsize, imsize)
+            grid_header = mosaic_engine.get_grid_header(
+                template_header, shape, x0=template_header['NAXIS1'] // 2 - imsize // 2,
+                y0=template_header['NAXIS2'] // 2 - imsize // 2)
+
+            # footprint of the image and beam map of every beam on the mosaic
+            footprints = {}
+            for beam in self.mosaic_beam_list:
+                image_file = os.path.join(self.mosaic_continuum_images_subdir, '{0}/image_{0}.map'.format(beam))
+                beam_file = os.path.join(self.mosaic_continuum_beam_subdir, 'beam_{}.map'.format(beam))
+                _, image_header = mosaic_engine.load_miriad_plane(image_file)
+                _, beam_header = mosaic_engine.load_miriad_plane(beam_file)
+                footprints[beam] = [mosaic_engine.get_sky_footprint(image_header, grid_header),
+                                    mosaic_engine.get_sky_footprint(beam_header, grid_header)]
+                logger.debug("Footprint of beam {0} on the mosaic is {1}".format(beam, footprints[beam]))
+
+            # the tiles are extended to avoid edge effects from the convolution
+            if self.mosaic_continuum_tile_padding is None:
+                padding = int(np.ceil(2. * mosaic_continuum_common_beam_values[0] / self.mosaic_continuum_cellsize))
+            else:
+                padding = int(self.mosaic_continuum_tile_padding)
+
+            # the output files are filled tile by tile with the numerator and the variance
+            output_header = grid_header.copy()
+            output_header['BUNIT'] = 'JY/BEAM'
+            output_header['BMAJ'] = mosaic_continuum_common_beam_values[0] / 3600.
+            output_header['BMIN'] = mosaic_continuum_common_beam_values[1] / 3600.
+            output_header['BPA'] = mosaic_continuum_common_beam_values[2]
+            mosaic_engine.create_empty_fits(mosaic_file, output_header)
+            mosaic_engine.create_empty_fits(noise_file, output_header)
+
+            tiles = mosaic_engine.get_tiles(shape, self.mosaic_continuum_tile_size)
+            for tile_index, tile in enumerate(tiles):
+                padded_tile = mosaic_engine.pad_box(tile, padding, shape)
+                tile_beams = [beam for beam in self.mosaic_beam_list
+                              if any(mosaic_engine.boxes_overlap(padded_tile, fp) for fp in footprints[beam])]
+                if len(tile_beams) == 0:
+                    logger.debug("No beams in tile {0} of {1}".format(tile_index + 1, len(tiles)))
+                    continue
+                logger.info("Processing tile {0} of {1} with beams {2}".format(
+                    tile_index + 1, len(tiles), ", ".join(tile_beams)))
+
+                tile_subdir = os.path.join(tile_dir, 'tile_{}'.format(tile_index))
+                subs_managefiles.director(self, 'mk', tile_subdir)
+
+                # template for this tile
+                tile_shape = (padded_tile[1] - padded_tile[0], padded_tile[3] - padded_tile[2])
+                tile_header = mosaic_engine.get_grid_header(grid_header, tile_shape, x0=padded_tile[2],
+                                                            y0=padded_tile[0])
+                tile_template = os.path.join(tile_subdir, 'template.map')
+                mosaic_engine.write_image(np.zeros(tile_shape, dtype=np.float32), tile_header, mirimage=tile_template)
+
+                image_files = []
+                beam_files = []
+                for beam in tile_beams:
+                    regrid = lib.miriad('regrid')
+                    regrid.in_ = os.path.join(self.mosaic_continuum_images_subdir, '{0}/image_{0}.map'.format(beam))
+                    regrid.out = os.path.join(tile_subdir, 'image_{}_regrid.map'.format(beam))
+                    regrid.tin = tile_template
+                    regrid.axes = '1,2'
+                    try:
+                        regrid.go()
+                    except Exception as e:
+                        error = "Failed regridding continuum image of beam {0} for tile {1}".format(beam, tile_index)
+                        logger.error(error)
+                        logger.exception(e)
+                        raise RuntimeError(error)
+
+                    regrid.in_ = os.path.join(self.mosaic_continuum_beam_subdir, 'beam_{}.map'.format(beam))
+                    regrid.out = os.path.join(tile_subdir, 'beam_{}_mos.map'.format(beam))
+                    try:
+                        regrid.go()
+                    except Exception as e:
+                        error = "Failed regridding continuum beam map of beam {0} for tile {1}".format(beam, tile_index)
+                        logger.error(error)
+                        logger.exception(e)
+                        raise RuntimeError(error)
+
+                    convol = lib.miriad('convol')
+                    convol.map = os.path.join(tile_subdir, 'image_{}_regrid.map'.format(beam))
+                    convol.out = os.path.join(tile_subdir, 'image_{}_mos.map'.format(beam))
+                    convol.fwhm = '{0},{1}'.format(
+                        str(mosaic_continuum_common_beam_values[0]), str(mosaic_continuum_common_beam_values[1]))
+                    convol.pa = mosaic_continuum_common_beam_values[2]
+                    convol.options = 'final'
+                    try:
+                        convol.go()
+                    except Exception as e:
+                        error = "Convolving continuum image of beam {0} for tile {1} ... Failed".format(beam, tile_index)
+                        logger.error(error)
+                        logger.exception(e)
+                        raise RuntimeError(error)
+
+                    image_files.append(convol.out)
+                    beam_files.append(regrid.out)
+
+                images = []
+                beams = []
+                for image_file, beam_file in zip(image_files, beam_files):
+                    images.append(mosaic_engine.load_miriad_plane(image_file)[0])
+                    beams.append(mosaic_engine.load_miriad_plane(beam_file)[0])
+
+                beam_index = [int(b) for b in tile_beams]
+                inv_cov = np.asarray(mosaic_continuum_inverse_covariance_matrix)[np.ix_(beam_index, beam_index)]
+                numerator, variance = mosaic_engine.weighted_sums(images, beams, inv_cov)
+
+                # only the inner part of the tile goes into the mosaic
+                inner = (slice(tile[0] - padded_tile[0], tile[1] - padded_tile[0]),
+                         slice(tile[2] - padded_tile[2], tile[3] - padded_tile[2]))
+                mosaic_engine.write_tile(mosaic_file, numerator[inner], tile)
+                mosaic_engine.write_tile(noise_file, variance[inner], tile)
+
+                del images, beams
+                subs_managefiles.director(self, 'rm', tile_subdir)
+
+            mosaic_continuum_max_variance = mosaic_engine.finalise_mosaic_files(mosaic_file, noise_file)
+            logger.debug("Maximum of continuum variance map is {}".format(mosaic_continuum_max_variance))
+
+            logger.info("Creating continuum mosaic in tiles ... Done")
+            mosaic_continuum_tiled_mosaic_status = True
+        else:
+            logger.info("Continuum mosaic has already been created in tiles")
+
+        subs_param.add_param(self, 'mosaic_continuum_tiled_mosaic_status', mosaic_continuum_tiled_mosaic_status)
+
+        subs_param.add_param(self, 'mosaic_continuum_max_variance', mosaic_continuum_max_variance)
+
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Function to calculate the continuum mosaic with numpy
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    def math_continuum_linear_mosaic(self):
+        """
+        Function to calculate the continuum mosaic and noise map with numpy
+
+        Does the same as the miriad maths steps from the product of the beam matrix and
+        covariance matrix to the noise map, but in a single pass over the images and beam maps
+        without writing the intermediate maps.
+        """
+
+        logger.info("Calculating continuum mosaic and noise map")
+
+        mosaic_continuum_linear_mosaic_status = get_param_def(self, 'mosaic_continuum_linear_mosaic_status', False)
+
+        mosaic_continuum_max_variance = get_param_def(self, 'mosaic_continuum_max_variance', 0.)
+
+        # get continuum covariance matrix from numpy file
+        mosaic_continuum_inverse_covariance_matrix = get_param_def(
+            self, 'mosaic_continuum_inverse_covariance_matrix', [])
+        if len(mosaic_continuum_inverse_covariance_matrix) == 0:
+            error = "Inverse covariance matrix is not available"
+            logger.error(error)
+            raise RuntimeError(error)
+
+        # switch to mosaic directory
+        subs_managefiles.director(self, 'ch', self.mosaic_continuum_dir)
+
+        if not mosaic_continuum_linear_mosaic_status:
+            # the covariance matrix is indexed by beam number, the beam list may have missing beams
+            beam_index = [int(b) for b in self.mosaic_beam_list]
+            inv_cov = np.asarray(mosaic_continuum_inverse_covariance_matrix)[np.ix_(beam_index, beam_index)]
+
+            image_files = [os.path.join(self.mosaic_continuum_mosaic_subdir, 'image_{}_mos.map'.format(b))
+                           for b in self.mosaic_beam_list]
+            beam_files = [os.path.join(self.mosaic_continuum_beam_subdir, 'beam_{}_mos.map'.format(b))
+                          for b in self.mosaic_beam_list]
+
+            try:
+                if self.mosaic_continuum_accumulator_dir:
+                    mosaic_continuum_max_variance = self.update_continuum_mosaic_accumulator(
+                        image_files, beam_files, inv_cov,
+                        os.path.join(self.mosaic_continuum_mosaic_subdir, 'mosaic_final.map'),
+                        os.path.join(self.mosaic_continuum_mosaic_subdir, 'mosaic_noise.map'))
+                else:
+                    mosaic_continuum_max_variance = mosaic_engine.linear_mosaic_files(
+                        image_files, beam_files, inv_cov,
+                        os.path.join(self.mosaic_continuum_mosaic_subdir, 'mosaic_final.map'),
+                        os.path.join(self.mosaic_continuum_mosaic_subdir, 'mosaic_noise.map'))
+            except Exception as e:
+                error = "Calculating continuum mosaic and noise map ... Failed"
+                logger.error(error)
+                logger.exception(e)
+                raise RuntimeError(error)
+
+            logger.debug("Maximum of continuum variance map is {}".format(mosaic_continuum_max_variance))
+
+            logger.info("Calculating continuum mosaic and noise map ... Done")
+
+            mosaic_continuum_linear_mosaic_status = True
+        else:
+            logger.info("Continuum mosaic and noise map have already been calculated")
+
+        subs_param.add_param(self, 'mosaic_continuum_linear_mosaic_status', mosaic_continuum_linear_mosaic_status)
+
+        subs_param.add_param(self, 'mosaic_continuum_max_variance', mosaic_continuum_max_variance)
+
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
     # Function to get continuum mosaic noise map
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -3607,9 +3915,9 @@ class mosaic(BaseModule):
         polbeamimagestatus = get_param_def(self, pbeam + '_targetbeams_qu_imagestatus', False)
         qimages = len(polbeamimagestatus)
 
-        mosaic_polarisation_max_variance_q = get_param_def(self, 'mosaic_polarisation_beam_max_variance_q', np.zeros(qimages))
-        mosaic_polarisation_max_variance_u = get_param_def(self, 'mosaic_polarisation_beam_max_variance_u', np.zeros(qimages))
-        mosaic_polarisation_max_variance_v = get_param_def(self, 'mosaic_polarisation_beam_max_variance_v', 0.)
+        mosaic_polarisation_max_variance_q = get_param_def(self, 'mosaic_polarisation_max_variance_q', np.zeros(qimages))
+        mosaic_polarisation_max_variance_u = get_param_def(self, 'mosaic_polarisation_max_variance_u', np.zeros(qimages))
+        mosaic_polarisation_max_variance_v = get_param_def(self, 'mosaic_polarisation_max_variance_v', 0.)
 
         # switch to mosaic directory
         subs_managefiles.director(self, 'ch', self.mosaic_polarisation_mosaic_dir)
@@ -4012,6 +4320,61 @@ class mosaic(BaseModule):
             self, 'mosaic_continuum_convert_fits_beam_status', mosaic_continuum_convert_fits_beam_status)
 
 
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Functions to run a step for all beams in parallel
+    # +++++++++++++++++++++++++++++++++++++++++++++++++++
+    def run_beams_in_parallel(self, function, description):
+        """
+        Function to run a per-beam function for all beams of the mosaic
+
+        The beams are processed in parallel if mosaic_parallelisation is set, with at most
+        mosaic_parallelisation_cpus processes (default all cpus). A failure of one beam does
+        not stop the other beams.
+
+        Args:
+            function (function): Function taking the beam as argument
+            description (str): Description of the step for the log
+
+        Returns:
+            list(str): Beams for which the function failed
+        """
+        beams = list(self.mosaic_beam_list)
+        if self.mosaic_parallelisation:
+            if self.mosaic_parallelisation_cpus:
+                nprocs = int(self.mosaic_parallelisation_cpus)
+            else:
+                nprocs = multiprocessing.cpu_count()
+            nprocs = max(1, min(nprocs, len(beams)))
+        else:
+            nprocs = 1
+        logger.debug("{0} for {1} beams using {2} processes".format(description, len(beams), nprocs))
+
+        failed_beams = pymp.shared.list()
+        with pymp.Parallel(nprocs) as p:
+            for index in p.range(len(beams)):
+                try:
+                    function(beams[index])
+                except Exception as e:
+                    logger.warning("{0} failed for beam {1}".format(description, beams[index]))
+                    logger.exception(e)
+                    with p.lock:
+                        failed_beams.append(beams[index])
+
+        return sorted(failed_beams)
+
+    def check_failed_beams(self, failed_beams, description):
+        """
+        Function to raise an error if a per-beam step failed for any beam
+
+        Args:
+            failed_beams (list(str)): Beams for which the step failed
+            description (str): Description of the step for the error message
+        """
+        if len(failed_beams) != 0:
+            error = "{0} failed for beams {1}".format(description, ", ".join(failed_beams))
+            logger.error(error)
+            raise RuntimeError(error)
+
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
     # Function to make the mosaic stop after a certain number of steps
     # +++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -4164,27 +4527,29 @@ class mosaic(BaseModule):
                 if self.stop_mosaic(i):
                     return None
 
-                # Regrid images
-                # =============
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.regrid_continuum_images()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                # the tiled mosaic regrids the images and beam maps per tile
+                if not self.mosaic_continuum_tile_size:
+                    # Regrid images
+                    # =============
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.regrid_continuum_images()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
-                # to allow the mosaic to stop earlier
-                if self.stop_mosaic(i):
-                    return None
+                    # to allow the mosaic to stop earlier
+                    if self.stop_mosaic(i):
+                        return None
 
-                # Regrid beam maps
-                # ================
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.regrid_continuum_beam_maps()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                    # Regrid beam maps
+                    # ================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.regrid_continuum_beam_maps()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
                 # to allow the mosaic to stop earlier
                 if self.stop_mosaic(i):
@@ -4203,14 +4568,16 @@ class mosaic(BaseModule):
                 if self.stop_mosaic(i):
                     return None
 
-                # Convolve images
-                # ===============
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.mosaic_continuum_convolve_images()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                # the tiled mosaic convolves the images per tile
+                if not self.mosaic_continuum_tile_size:
+                    # Convolve images
+                    # ===============
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.mosaic_continuum_convolve_images()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
                 # to allow the mosaic to stop earlier
                 if self.stop_mosaic(i):
@@ -4229,79 +4596,98 @@ class mosaic(BaseModule):
                 if self.stop_mosaic(i):
                     return None
 
-                # Calculate product of beam matrix and covariance matrix
-                # ======================================================
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.math_continuum_multiply_beam_and_covariance_matrix()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                if self.mosaic_continuum_tile_size:
+                    # Create mosaic and noise map tile by tile
+                    # ========================================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.create_continuum_tiled_mosaic()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
+                elif self.mosaic_math_engine == 'numpy':
+                    # Calculate mosaic and noise map
+                    # ==============================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.math_continuum_linear_mosaic()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
+                else:
+                    # Calculate product of beam matrix and covariance matrix
+                    # ======================================================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.math_continuum_multiply_beam_and_covariance_matrix()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
-                # to allow the mosaic to stop earlier
-                if self.stop_mosaic(i):
-                    return None
+                    # to allow the mosaic to stop earlier
+                    if self.stop_mosaic(i):
+                        return None
 
-                # Calculate variance map
-                # ======================
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.math_continuum_calculate_variance_map()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                    # Calculate variance map
+                    # ======================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.math_continuum_calculate_variance_map()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
-                # to allow the mosaic to stop earlier
-                if self.stop_mosaic(i):
-                    return None
+                    # to allow the mosaic to stop earlier
+                    if self.stop_mosaic(i):
+                        return None
 
-                # Calculate beam matrix multiplied by covariance matrix
-                # =====================================================
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.math_continuum_multiply_beam_matrix_by_covariance_matrix_and_image()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                    # Calculate beam matrix multiplied by covariance matrix
+                    # =====================================================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.math_continuum_multiply_beam_matrix_by_covariance_matrix_and_image()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
-                # to allow the mosaic to stop earlier
-                if self.stop_mosaic(i):
-                    return None
+                    # to allow the mosaic to stop earlier
+                    if self.stop_mosaic(i):
+                        return None
 
-                # Find maximum variance map
-                # =========================
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.math_continuum_get_max_variance_map()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                    # Find maximum variance map
+                    # =========================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.math_continuum_get_max_variance_map()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
-                # to allow the mosaic to stop earlier
-                if self.stop_mosaic(i):
-                    return None
+                    # to allow the mosaic to stop earlier
+                    if self.stop_mosaic(i):
+                        return None
 
-                # Calculate divide image by variance map
-                # ======================================
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.math_continuum_divide_image_by_variance_map()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                    # Calculate divide image by variance map
+                    # ======================================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.math_continuum_divide_image_by_variance_map()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
-                # to allow the mosaic to stop earlier
-                if self.stop_mosaic(i):
-                    return None
+                    # to allow the mosaic to stop earlier
+                    if self.stop_mosaic(i):
+                        return None
 
-                # Calculate get mosaic noise map
-                # ==============================
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.get_continuum_mosaic_noise_map()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                    # Calculate get mosaic noise map
+                    # ==============================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.get_continuum_mosaic_noise_map()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
                 # Writing files
                 # =============
@@ -4560,79 +4946,89 @@ class mosaic(BaseModule):
                 if self.stop_mosaic(i):
                     return None
 
-                # Calculate product of beam matrix and covariance matrix
-                # ======================================================
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.math_polarisation_multiply_beam_and_covariance_matrix()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                if self.mosaic_math_engine == 'numpy':
+                    # Calculate mosaics and noise maps of all Stokes planes
+                    # =====================================================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.math_polarisation_linear_mosaic()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
+                else:
+                    # Calculate product of beam matrix and covariance matrix
+                    # ======================================================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.math_polarisation_multiply_beam_and_covariance_matrix()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
-                # to allow the mosaic to stop earlier
-                if self.stop_mosaic(i):
-                    return None
+                    # to allow the mosaic to stop earlier
+                    if self.stop_mosaic(i):
+                        return None
 
-                # Calculate variance map
-                # ======================
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.math_polarisation_calculate_variance_map()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                    # Calculate variance map
+                    # ======================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.math_polarisation_calculate_variance_map()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
-                # to allow the mosaic to stop earlier
-                if self.stop_mosaic(i):
-                    return None
+                    # to allow the mosaic to stop earlier
+                    if self.stop_mosaic(i):
+                        return None
 
-                # Calculate beam matrix multiplied by covariance matrix
-                # =====================================================
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.math_polarisation_multiply_beam_matrix_by_covariance_matrix_and_image()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                    # Calculate beam matrix multiplied by covariance matrix
+                    # =====================================================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.math_polarisation_multiply_beam_matrix_by_covariance_matrix_and_image()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
-                # to allow the mosaic to stop earlier
-                if self.stop_mosaic(i):
-                    return None
+                    # to allow the mosaic to stop earlier
+                    if self.stop_mosaic(i):
+                        return None
 
-                # Find maximum variance map
-                # =========================
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.math_polarisation_get_max_variance_map()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                    # Find maximum variance map
+                    # =========================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.math_polarisation_get_max_variance_map()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
-                # to allow the mosaic to stop earlier
-                if self.stop_mosaic(i):
-                    return None
+                    # to allow the mosaic to stop earlier
+                    if self.stop_mosaic(i):
+                        return None
 
-                # Calculate divide image by variance map
-                # ======================================
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.math_polarisation_divide_image_by_variance_map()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                    # Calculate divide image by variance map
+                    # ======================================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.math_polarisation_divide_image_by_variance_map()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
-                # to allow the mosaic to stop earlier
-                if self.stop_mosaic(i):
-                    return None
+                    # to allow the mosaic to stop earlier
+                    if self.stop_mosaic(i):
+                        return None
 
-                # Calculate get mosaic noise map
-                # ==============================
-                logger.info("#### Step {0} ####".format(i))
-                start_time_step = time.time()
-                self.get_polarisation_mosaic_noise_map()
-                logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
-                    i, time.time() - start_time_step))
-                i += 1
+                    # Calculate get mosaic noise map
+                    # ==============================
+                    logger.info("#### Step {0} ####".format(i))
+                    start_time_step = time.time()
+                    self.get_polarisation_mosaic_noise_map()
+                    logger.info("#### Step {0} ... Done (after {1:.0f}s) ####".format(
+                        i, time.time() - start_time_step))
+                    i += 1
 
                 # to allow the mosaic to stop earlier
                 if self.stop_mosaic(i):
@@ -4732,6 +5128,11 @@ class mosaic(BaseModule):
         for fl in glob.glob('out_*.map'):
             subs_managefiles.director(self, 'rm', fl, ignore_nonexistent=True)
 
+        # intermediate files of the numpy and tiled mosaic
+        subs_managefiles.director(self, 'rm', 'engine', ignore_nonexistent=True)
+        subs_managefiles.director(self, 'rm', 'tiles', ignore_nonexistent=True)
+        subs_managefiles.director(self, 'rm', os.path.join(self.mosdir, 'reprojection/scratch'), ignore_nonexistent=True)
+
         # more to remove
         if level >= 1:
             subs_managefiles.director(
@@ -4763,6 +5164,10 @@ class mosaic(BaseModule):
                 subs_managefiles.director(
                     self, 'rm', fl, ignore_nonexistent=True)
 
+            # cached reprojection maps
+            subs_managefiles.director(
+                self, 'rm', os.path.join(self.mosdir, 'reprojection'), ignore_nonexistent=True)
+
         logger.info("Removing scratch files ... Done")
 
     def clean_up_polarisation(self, level=0):
@@ -4805,6 +5210,10 @@ class mosaic(BaseModule):
         for fl in glob.glob('out_*.map'):
             subs_managefiles.director(self, 'rm', fl, ignore_nonexistent=True)
 
+        # intermediate files of the numpy mosaic and the reprojection
+        subs_managefiles.director(self, 'rm', 'engine', ignore_nonexistent=True)
+        subs_managefiles.director(self, 'rm', os.path.join(self.mosdir, 'reprojection/scratch'), ignore_nonexistent=True)
+
         # more to remove
         if level >= 1:
             subs_managefiles.director(
@@ -4836,6 +5245,10 @@ class mosaic(BaseModule):
                 subs_managefiles.director(
                     self, 'rm', fl, ignore_nonexistent=True)
 
+            # cached reprojection maps
+            subs_managefiles.director(
+                self, 'rm', os.path.join(self.mosdir, 'reprojection'), ignore_nonexistent=True)
+
         logger.info("Removing scratch files for polarisation ... Done")
 
 
@@ -4932,6 +5345,9 @@ class mosaic(BaseModule):
             subs_param.del_param(self, 'mosaic_polarisation_divide_image_variance_status_v')
 
             subs_param.del_param(self, 'mosaic_continuum_get_mosaic_noise_map_status')
+            subs_param.del_param(self, 'mosaic_continuum_linear_mosaic_status')
+            subs_param.del_param(self, 'mosaic_polarisation_linear_mosaic_status')
+            subs_param.del_param(self, 'mosaic_continuum_tiled_mosaic_status')
             subs_param.del_param(self, 'mosaic_polarisation_get_mosaic_noise_map_status_q')
             subs_param.del_param(self, 'mosaic_polarisation_get_mosaic_noise_map_status_u')
             subs_param.del_param(self, 'mosaic_polarisation_get_mosaic_noise_map_status_v')
@@ -1138,14 +1138,16 @@ class preflag(BaseModule):
                 preflagaoflaggerbandpassstatus = True
             # If not, calculate the bandpass for the setup of the observation using the flux calibrator
             elif not preflagaoflaggerbandpassstatus:
+                # The table only depends on the channel setup, so share it between all beams of the observation
+                bp_cache_dir = self.basedir if self.subdirification else None
                 if self.fluxcal != '':
-                    create_bandpass(self.get_fluxcal_path(), self.get_bandpass_path())
+                    create_bandpass(self.get_fluxcal_path(), self.get_bandpass_path(), cache_dir=bp_cache_dir)
                 elif self.polcal != '':
-                    create_bandpass(self.get_polcal_path(), self.get_bandpass_path())
+                    create_bandpass(self.get_polcal_path(), self.get_bandpass_path(), cache_dir=bp_cache_dir)
                 else:
                     # logger.debug("self.get_target_path(str(self.beam).zfill(2))= {0}".format(str(self.get_target_path(str(self.beam).zfill(2)))))
                     # create_bandpass(self.get_target_path(str(self.beam).zfill(2)), self.get_bandpass_path())
-                    create_bandpass(self.get_target_path(self.beam), self.get_bandpass_path())
+                    create_bandpass(self.get_target_path(self.beam), self.get_bandpass_path(), cache_dir=bp_cache_dir)
                 if os.path.isfile(self.get_bandpass_path()):
                     preflagaoflaggerbandpassstatus = True
                     logger.info('Beam ' + self.beam + ': Derived preliminary bandpass table for AOFlagging')
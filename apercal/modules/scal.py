@@ -55,6 +55,7 @@ class scal(BaseModule):
     selfcal_parametric_skymodel_radius = None
     selfcal_parametric_skymodel_cutoff = None
     selfcal_parametric_skymodel_distance = None
+    selfcal_parametric_skymodel_index = None
     selfcal_parametric_solint = None
     selfcal_parametric_uvmin = None
     selfcal_parametric_uvmax = None
@@ -307,7 +308,7 @@ class scal(BaseModule):
                 subs_managefiles.director(self, 'ch', self.selfcaldir)
                 logger.info('Beam ' + self.beam + ': Parametric self calibration')
                 subs_managefiles.director(self, 'mk', self.selfcaldir + '/pm')
-                parametric_textfile = lsm.lsm_model(self.target, self.selfcal_parametric_skymodel_radius, self.selfcal_parametric_skymodel_cutoff, self.selfcal_parametric_skymodel_distance)
+                parametric_textfile = lsm.lsm_model(self.target, self.selfcal_parametric_skymodel_radius, self.selfcal_parametric_skymodel_cutoff, self.selfcal_parametric_skymodel_distance, index_dir=self.selfcal_parametric_skymodel_index)
                 lsm.write_model(self.selfcaldir + '/pm/model.txt', parametric_textfile)
                 logger.debug('Beam ' + self.beam + ': Creating model from textfile model.txt')
                 uv = aipy.miriad.UV(self.selfcaldir + '/' + self.target)
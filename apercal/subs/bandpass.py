@@ -1,34 +1,76 @@
+import os
+import shutil
+import sys
+
 import numpy as np
 import casacore.tables as pt
 from apercal.subs import misc
 from apercal.subs.msutils import get_nchan
 
-np.set_printoptions(threshold=np.nan)
+np.set_printoptions(threshold=sys.maxsize)
+
+BANDPASS_TEMPLATE = np.array(
+    [0.70227, 0.73712, 0.80926, 0.89405, 0.96263, 1.00208, 1.00529, 0.98781, 0.9634, 0.93708, 0.92206, 0.92462,
+     0.93452, 0.95439, 0.96635, 0.97066, 0.95942, 0.95291, 0.94206, 0.93929, 0.939, 0.94255, 0.95318, 0.95749,
+     0.96032, 0.95377, 0.95048, 0.94293, 0.94176, 0.94381, 0.95029, 0.95584, 0.95239, 0.95433, 0.95168, 0.94484,
+     0.94459, 0.94238, 0.94807, 0.95948, 0.96151, 0.95937, 0.95313, 0.94635, 0.93813, 0.9386, 0.94353, 0.95085,
+     0.96222, 0.96702, 0.96331, 0.95387, 0.93449, 0.92417, 0.92177, 0.93646, 0.95761, 0.98863, 1.00578, 0.99527,
+     0.95907, 0.89373, 0.81069, 0.73628])
+
+# Tables already built in this process, keyed by (nchannels, antennas, feeds)
+_bandpass_tables = {}
+
+
+def bandpass_table(nchannels, ants=None, feeds=None):
+    """
+    Build the text of a preliminary bandpass table for AOFlagger. The per channel part of the table is formatted
+    only once and then prefixed with every antenna/feed combination. Results are cached per process.
+
+    nchannels (int): Number of channels of the dataset
+    ants (list): Antenna names, default from misc.create_antnames
+    feeds (list): Feed names, default from misc.create_feednames
+    returns (string): The content of the bandpass table
+    """
+    if ants is None:
+        ants = misc.create_antnames()
+    if feeds is None:
+        feeds = misc.create_feednames()
+    key = (nchannels, tuple(ants), tuple(feeds))
+    if key not in _bandpass_tables:
+        # Format the subband bandpass values once, truncated to the same width as the original table
+        values = [str(v)[:6] for v in BANDPASS_TEMPLATE]
+        nbandpass = len(values)
+        chanlines = ['{} {}\n'.format(str(chan)[:5], values[chan % nbandpass]) for chan in range(nchannels)]
+        table = []
+        for ant in ants:
+            for feed in feeds:
+                prefix = '{} {} '.format(ant, feed)
+                table.append(prefix + prefix.join(chanlines))
+        _bandpass_tables[key] = ''.join(table)
+    return _bandpass_tables[key]
+
 
+def create_bandpass(dataset, bp_file, cache_dir=None):
+    """
+    Write the preliminary bandpass table for a dataset. If cache_dir is given the table is stored there once per
+    (number of channels, antenna set) and copied for all other beams of the observation.
 
-def create_bandpass(dataset, bp_file):
-    bandpass = np.array(
-        [0.70227, 0.73712, 0.80926, 0.89405, 0.96263, 1.00208, 1.00529, 0.98781, 0.9634, 0.93708, 0.92206, 0.92462,
-         0.93452, 0.95439, 0.96635, 0.97066, 0.95942, 0.95291, 0.94206, 0.93929, 0.939, 0.94255, 0.95318, 0.95749,
-         0.96032, 0.95377, 0.95048, 0.94293, 0.94176, 0.94381, 0.95029, 0.95584, 0.95239, 0.95433, 0.95168, 0.94484,
-         0.94459, 0.94238, 0.94807, 0.95948, 0.96151, 0.95937, 0.95313, 0.94635, 0.93813, 0.9386, 0.94353, 0.95085,
-         0.96222, 0.96702, 0.96331, 0.95387, 0.93449, 0.92417, 0.92177, 0.93646, 0.95761, 0.98863, 1.00578, 0.99527,
-         0.95907, 0.89373, 0.81069, 0.73628])
+    dataset (string): Measurement set to get the number of channels from
+    bp_file (string): Name of the bandpass table to write
+    cache_dir (string): Directory shared by all beams of an observation, None to disable the shared table
+    """
     # Get the number of channels of the dataset
     nchannels = get_nchan(dataset)
-    channels = range(nchannels)
-    ants = np.array(misc.create_antnames())
-    nants = len(ants)
-    feeds = np.array(misc.create_feednames())
-    nfeeds = len(feeds)
-    nbandpass = len(bandpass)
-    niterbandpass = (nchannels / nbandpass)
-    # Create the single arrays with all the numbers
-    antarray = np.repeat(ants, nchannels * nfeeds)
-    feedarray = np.tile(np.repeat(feeds, nchannels), nants)
-    chanarray = (np.tile(channels, nfeeds * nants)).astype('S5')
-    valuearray = (np.tile(bandpass, niterbandpass * nfeeds * nants)).astype('S6')
-    # Combine the different arrays
-    concatarray = np.stack((antarray, feedarray, chanarray, valuearray), axis=1)
-    # Save the array to file
-    np.savetxt(bp_file, concatarray, fmt='%s %s %s %s', delimiter='\t')
+    ants = misc.create_antnames()
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, 'Bpass_{}ch_{}ant.txt'.format(nchannels, len(ants)))
+        if not os.path.isfile(cache_file):
+            # Write to a unique name first so that beams running in parallel never see a partial table
+            tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+            with open(tmp_file, 'w') as f:
+                f.write(bandpass_table(nchannels, ants))
+            os.rename(tmp_file, cache_file)
+        shutil.copyfile(cache_file, bp_file)
+    else:
+        with open(bp_file, 'w') as f:
+            f.write(bandpass_table(nchannels, ants))
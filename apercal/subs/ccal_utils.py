@@ -36,6 +36,31 @@ def get_ratio_autocorrelation_above_limit(amp, amp_threshold):
     return ratio_vis_above_threshold
 
 
+def get_autocorr_amp(msfile, n_ants, n_chan, n_stokes, column='CORRECTED_DATA'):
+    """
+    Gets the mean amplitude of the autocorrelations of all antennas with a single pass over the dataset
+
+    msfile (string): Input dataset with the autocorrelations
+    n_ants (int): Number of antennas in the dataset
+    n_chan (int): Number of channels in the dataset
+    n_stokes (int): Number of polarisation products in the dataset
+    column (string): Data column to average
+    returns (array): Amplitudes in (antenna, channel, polarisation) order, NaN for antennas without autocorrelations
+    """
+    amp_ant_array = np.full((n_ants, n_chan, n_stokes), np.nan, dtype=np.float32)
+
+    taql_command = ("SELECT ANTENNA1 AS ant, abs(gmeans({1}[FLAG])) AS amp "
+                    "FROM {0} "
+                    "WHERE ANTENNA1==ANTENNA2 "
+                    "GROUPBY ANTENNA1").format(msfile, column)
+    t = pt.taql(taql_command)
+    if t.nrows() != 0:
+        ants = t.getcol('ant')
+        amp_ant_array[ants, :, :] = t.getcol('amp')
+
+    return amp_ant_array
+
+
 def get_autocorr(msfile):
     """
     Gets the autocorrelation data from a dataset
@@ -65,21 +90,11 @@ def get_autocorr(msfile):
     n_stokes = pol_array.shape[2]  # shape is time, one, nstokes
 
     # take MS file and get data
-    amp_ant_array = np.empty(
-        (len(ant_names), len(freqs), n_stokes), dtype=np.float32)
-
-    # get autocorrelation
-    for ant in xrange(len(ant_names)):
-        try:
-            taql_command = ("SELECT abs(gmeans(CORRECTED_DATA[FLAG])) AS amp "
-                            "FROM {0} "
-                            "WHERE ANTENNA1==ANTENNA2 && (ANTENNA1={1} || ANTENNA2={1})").format(msfile, ant)
-            t = pt.taql(taql_command)
-            # phase_ant_array[ant, :, :] = t.getcol('phase')[0, :, :]
-            amp_ant_array[ant, :, :] = t.getcol('amp')[0, :, :]
-        except Exception as e:
-            amp_ant_array[ant, :, :] = np.full((len(freqs), n_stokes), np.nan)
-            logger.exception(e)
+    try:
+        amp_ant_array = get_autocorr_amp(msfile, len(ant_names), len(freqs), n_stokes)
+    except Exception as e:
+        amp_ant_array = np.full((len(ant_names), len(freqs), n_stokes), np.nan, dtype=np.float32)
+        logger.exception(e)
 
     # get XX and YY
     amp_xx = amp_ant_array[:, :, 0]
@@ -88,92 +103,83 @@ def get_autocorr(msfile):
     return freqs, amp_xx, amp_yy
 
 
-def polyfit_autocorr(autocorrdata):
+def polyfit_autocorr(autocorrdata, deg=2, nsigma=3.0, antnames=None):
     """
     Function to remove outliers from the auto-correlations, fit a polynomial of 2nd order and issue flagging of dishes dependent on covariance of the fit and the parameters of determination
-    autocorrdata: Auto-correlation data in frequency, amp_xx, amp_yy order (usually from function get_autocorr)
-    returns: frequency values, cleaned auto-correlation values, polynomially fitted values, covariance of the fit, parameter of determination each for XX and YY
+    All dishes, both polarisations and any number of leading axes (e.g. beams) are fitted at once with a single batched least-squares solve.
+    autocorrdata: Auto-correlation data in frequency, amp_xx, amp_yy order (usually from function get_autocorr). amp_xx and amp_yy can have shape (antenna, channel) or (beam, antenna, channel)
+    deg: Degree of the fitted polynomial
+    nsigma: Clip limit for the outlier removal in units of the standard deviation
+    antnames: Names of the antennas for the log, default from misc.create_antnames
+    returns: polynomial coefficients (..., antenna, pol, deg+1) with the highest power first, covariance matrices (..., antenna, pol, deg+1, deg+1), parameter of determination (..., antenna, pol), mask of the channels used in the fit (..., antenna, pol, channel) and the flags (..., antenna, pol) for XX and YY
     """
-    antnames = misc.create_antnames()
-    freqs = autocorrdata[0]
-    XX_rclean = []
-    XX_rfreq = []
-    XX_rpolyvals = []
-    XX_rcov = []
-    XX_rr2 = []
-    YY_rclean = []
-    YY_rfreq = []
-    YY_rpolyvals = []
-    YY_rcov = []
-    YY_rr2 = []
-    for dish in range(0, 12):
-        XX_remove = np.where(autocorrdata[1][dish] == 0.0)
-        XX_clean = np.asarray(np.delete(autocorrdata[1][dish], XX_remove))
-        XX_freq = np.asarray(np.delete(freqs, XX_remove))
-        XX_mean = np.mean(XX_clean)
-        XX_sd = np.std(XX_clean)
-        XX_out = np.where((XX_clean < XX_mean - 3.0 * XX_sd)
-                          | (XX_clean > XX_mean + 3.0 * XX_sd))
-        XX_clean = np.delete(XX_clean, XX_out)
-        XX_freq = np.delete(XX_freq, XX_out)
-        try:
-            XX_poly, XX_covm = np.polyfit(XX_freq, XX_clean, 2, cov=True)
-            XX_polyvals = np.polyval(XX_poly, XX_freq)
-            XX_polyres = np.sum((XX_clean - XX_polyvals) ** 2.0)
-            XX_polytot = np.sum((XX_clean - np.mean(XX_clean)) ** 2.0)
-            XX_cov = np.sqrt(np.diag(XX_covm))
-            XX_r2 = 1.0 - (XX_polyres / XX_polytot)
-            XX_rclean.append(XX_clean)
-            XX_rfreq.append(XX_freq)
-            XX_rpolyvals.append(XX_polyvals)
-            XX_rcov.append(XX_cov)
-            XX_rr2.append(XX_r2)
-            if XX_r2 < 0.5 or XX_cov[0] >= 2e-16 or XX_cov[1] >= 1e-6 or XX_cov[2] >= 1e3:
-                print 'Dish ' + str(antnames[dish]) + ' XX flagged!'
-            else:
-                continue
-        except:
-            XX_rclean.append(np.asarray(np.nan))
-            XX_rfreq.append(np.asarray(np.nan))
-            XX_rpolyvals.append(np.asarray(np.nan))
-            XX_rcov.append(np.nan)
-            XX_rr2.append(np.nan)
-            print 'Dish ' + str(antnames[dish]) + ' XX flagged!'
-    for dish in range(0, 12):
-        YY_remove = np.where(autocorrdata[2][dish] == 0.0)
-        YY_clean = np.asarray(np.delete(autocorrdata[2][dish], YY_remove))
-        YY_freq = np.asarray(np.delete(freqs, YY_remove))
-        YY_mean = np.mean(YY_clean)
-        YY_sd = np.std(YY_clean)
-        YY_out = np.where((YY_clean < YY_mean - 3.0 * YY_sd)
-                          | (YY_clean > YY_mean + 3.0 * YY_sd))
-        YY_clean = np.delete(YY_clean, YY_out)
-        YY_freq = np.delete(YY_freq, YY_out)
-        try:
-            YY_poly, YY_covm = np.polyfit(YY_freq, YY_clean, 2, cov=True)
-            YY_polyvals = np.polyval(YY_poly, YY_freq)
-            YY_polyres = np.sum((YY_clean - YY_polyvals) ** 2.0)
-            YY_polytot = np.sum((YY_clean - np.mean(YY_clean)) ** 2.0)
-            YY_cov = np.sqrt(np.diag(YY_covm))
-            YY_r2 = 1.0 - (YY_polyres / YY_polytot)
-            YY_rclean.append(YY_clean)
-            YY_rfreq.append(YY_freq)
-            YY_rpolyvals.append(YY_polyvals)
-            YY_rcov.append(YY_cov)
-            YY_rr2.append(YY_r2)
-            if YY_r2 < 0.5 or YY_cov[0] >= 2e-16 or YY_cov[1] >= 1e-6 or YY_cov[2] >= 1e3:
-                print 'Dish ' + str(antnames[dish]) + ' YY flagged!'
-            else:
-                continue
-        except:
-            YY_rclean.append(np.asarray(np.nan))
-            YY_rfreq.append(np.asarray(np.nan))
-            YY_rpolyvals.append(np.asarray(np.nan))
-            YY_rcov.append(np.nan)
-            YY_rr2.append(np.nan)
-            print 'Dish ' + str(antnames[dish]) + ' YY flagged!'
-
-    return XX_rfreq, XX_rclean, XX_rpolyvals, XX_rcov, XX_rr2, YY_rfreq, YY_rclean, YY_rpolyvals, YY_rcov, YY_rr2
+    if antnames is None:
+        antnames = misc.create_antnames()
+    freqs = np.asarray(autocorrdata[0], dtype=np.float64)
+    amp = np.stack((np.asarray(autocorrdata[1], dtype=np.float64),
+                    np.asarray(autocorrdata[2], dtype=np.float64)), axis=-2)
+    npar = deg + 1
+
+    # Remove zero values and outliers beyond nsigma
+    mask = (amp != 0.0) & np.isfinite(amp)
+    amp_ma = np.ma.masked_array(amp, mask=~mask)
+    amp_mean = amp_ma.mean(axis=-1).filled(np.nan)[..., np.newaxis]
+    amp_sd = amp_ma.std(axis=-1).filled(np.nan)[..., np.newaxis]
+    with np.errstate(invalid='ignore'):
+        mask &= (amp >= amp_mean - nsigma * amp_sd) & (amp <= amp_mean + nsigma * amp_sd)
+    weights = mask.astype(np.float64)
+    amp = np.where(mask, amp, 0.0)
+    npoints = weights.sum(axis=-1)
+
+    # Fit in a normalised frequency coordinate to keep the Vandermonde matrix well conditioned
+    fmid = 0.5 * (freqs.max() + freqs.min())
+    fscale = 0.5 * (freqs.max() - freqs.min())
+    if fscale == 0.0:
+        fscale = 1.0
+    vander = np.vander((freqs - fmid) / fscale, npar)
+    ata = np.einsum('...c,ci,cj->...ij', weights, vander, vander)
+    atb = np.einsum('...c,ci->...i', weights * amp, vander)
+
+    # Fits with too few points are replaced by an identity system and set to NaN afterwards
+    good = npoints > npar
+    ata[~good] = np.eye(npar)
+    atb[~good] = 0.0
+    ata_inv = np.linalg.inv(ata)
+    poly_norm = np.einsum('...ij,...j->...i', ata_inv, atb)
+
+    # Residuals and parameter of determination
+    polyvals = np.einsum('ci,...i->...c', vander, poly_norm)
+    polyres = np.sum(weights * (amp - polyvals) ** 2.0, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        amp_cleanmean = np.sum(weights * amp, axis=-1) / npoints
+        polytot = np.sum(weights * (amp - amp_cleanmean[..., np.newaxis]) ** 2.0, axis=-1)
+        r2 = 1.0 - polyres / polytot
+        covm_norm = ata_inv * (polyres / (npoints - npar))[..., np.newaxis, np.newaxis]
+
+    # Transform coefficients and covariances back to frequency in the same units as the input
+    # p(f) = sum_k c_k t^k with t = a * f + b
+    a = 1.0 / fscale
+    b = -fmid / fscale
+    trans = np.zeros((npar, npar))
+    for k in range(npar):
+        # expand (a*f + b)^k into powers of f, highest power first
+        expansion = np.poly1d([a, b]) ** k
+        trans[npar - 1 - k:, npar - 1 - k] = expansion.coeffs
+    poly = np.einsum('ij,...j->...i', trans, poly_norm)
+    covm = np.einsum('ij,...jk,lk->...il', trans, covm_norm, trans)
+
+    poly[~good] = np.nan
+    covm[~good] = np.nan
+    r2[~good] = np.nan
+
+    # Flag dishes with a bad fit
+    cov = np.sqrt(np.abs(np.diagonal(covm, axis1=-2, axis2=-1)))
+    with np.errstate(invalid='ignore'):
+        flags = ~(r2 >= 0.5) | ~(cov[..., 0] < 2e-16) | ~(cov[..., 1] < 1e-6) | ~(cov[..., 2] < 1e3)
+    for index in zip(*np.where(flags)):
+        logger.info('Dish ' + str(antnames[index[-2]]) + ' ' + ['XX', 'YY'][index[-1]] + ' has a bad fit of the autocorrelation')
+
+    return poly, covm, r2, mask, flags
 
 
 # TODO: 1. Adjust the max_std (mb put to config); 2. Consider detrending...
@@ -0,0 +1,162 @@
+"""
+Module to convolve images to a common restoring beam with FFTs.
+
+The convolution kernel for every image is the Gaussian that turns its
+restoring beam into the target beam. The kernel is calculated analytically
+in the Fourier domain, so a batch of images with the same shape is
+convolved with one forward and one inverse real FFT. Images are in
+Jy/beam and are rescaled by the ratio of the beam areas, as MIRIAD convol
+does with options=final.
+
+pyfftw is used if it is installed, otherwise scipy.fft or numpy.fft.
+"""
+
+import logging
+import multiprocessing
+
+import numpy as np
+
+try:
+    import pyfftw.interfaces.numpy_fft as pyfftw_fft
+except ImportError:
+    pyfftw_fft = None
+
+try:
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
+from apercal.exceptions import ApercalException
+
+logger = logging.getLogger(__name__)
+
+# Conversion from FWHM to the standard deviation of a Gaussian
+FWHM_TO_SIGMA = 1. / np.sqrt(8. * np.log(2.))
+
+
+def rfft2(data, threads=None):
+    """
+    Real 2D FFT over the last two axes with the fastest available library
+    """
+    threads = threads or multiprocessing.cpu_count()
+    if pyfftw_fft is not None:
+        return pyfftw_fft.rfft2(data, threads=threads)
+    if scipy_fft is not None:
+        return scipy_fft.rfft2(data, workers=threads)
+    return np.fft.rfft2(data)
+
+
+def irfft2(data, shape, threads=None):
+    """
+    Inverse real 2D FFT over the last two axes with the fastest available library
+    """
+    threads = threads or multiprocessing.cpu_count()
+    if pyfftw_fft is not None:
+        return pyfftw_fft.irfft2(data, s=shape, threads=threads)
+    if scipy_fft is not None:
+        return scipy_fft.irfft2(data, s=shape, workers=threads)
+    return np.fft.irfft2(data, s=shape)
+
+
+def beam_covariance(bmaj, bmin, bpa, cdelt1, cdelt2):
+    """
+    Get the covariance matrix of Gaussian beams in pixel coordinates
+
+    bmaj (array): Major axis FWHM in arcsec
+    bmin (array): Minor axis FWHM in arcsec
+    bpa (array): Position angle in deg, from north through east
+    cdelt1 (float): Pixel size along the first (RA) axis in deg
+    cdelt2 (float): Pixel size along the second (Dec) axis in deg
+    returns (array): Covariance matrices with shape (..., 2, 2) for (x, y)
+    """
+    bmaj = np.asarray(bmaj, dtype=np.float64)
+    bmin = np.asarray(bmin, dtype=np.float64)
+    bpa = np.radians(np.asarray(bpa, dtype=np.float64))
+    # major and minor axis direction in (east, north)
+    major = np.stack([np.sin(bpa), np.cos(bpa)], axis=-1)
+    minor = np.stack([np.cos(bpa), -np.sin(bpa)], axis=-1)
+    sigma_major = (bmaj * FWHM_TO_SIGMA)[..., None, None]
+    sigma_minor = (bmin * FWHM_TO_SIGMA)[..., None, None]
+    cov = (sigma_major ** 2 * major[..., :, None] * major[..., None, :] +
+           sigma_minor ** 2 * minor[..., :, None] * minor[..., None, :])
+    # east is along x with a step of cdelt1, north along y with a step of cdelt2
+    scale = np.array([1. / (cdelt1 * 3600.), 1. / (cdelt2 * 3600.)])
+    return cov * scale[:, None] * scale[None, :]
+
+
+def convolution_kernels(beams, target, cdelt1, cdelt2):
+    """
+    Get the covariance of the Gaussian kernels from the beams of the images to the target beam
+
+    beams (array): bmaj (arcsec), bmin (arcsec), bpa (deg) of every image with shape (nimages, 3)
+    target (array): bmaj (arcsec), bmin (arcsec), bpa (deg) of the target beam
+    cdelt1 (float): Pixel size along the first axis in deg
+    cdelt2 (float): Pixel size along the second axis in deg
+    returns (array, array): Kernel covariances in pixels with shape (nimages, 2, 2) and the flux scale factors
+    """
+    beams = np.atleast_2d(np.asarray(beams, dtype=np.float64))
+    cov_beams = beam_covariance(beams[:, 0], beams[:, 1], beams[:, 2], cdelt1, cdelt2)
+    cov_target = beam_covariance(target[0], target[1], target[2], cdelt1, cdelt2)
+    cov_kernels = cov_target[None] - cov_beams
+
+    # the target beam must contain every beam of the images
+    eigenvalues = np.linalg.eigvalsh(cov_kernels)
+    tolerance = 1e-6 * np.abs(np.linalg.eigvalsh(cov_target)).max()
+    bad = np.flatnonzero(eigenvalues.min(axis=-1) < -tolerance)
+    if len(bad) != 0:
+        error = "Target beam {0} is smaller than the beam of images {1}".format(list(target), [int(i) for i in bad])
+        logger.error(error)
+        raise ApercalException(error)
+
+    # images are in Jy/beam, rescale with the ratio of the beam areas
+    scale = (target[0] * target[1]) / (beams[:, 0] * beams[:, 1])
+    return cov_kernels, scale
+
+
+def convolve_to_beam(images, beams, target, cdelt1, cdelt2, threads=None):
+    """
+    Convolve a batch of images with the same shape to a common beam
+
+    Blanked (NaN) pixels are ignored in the convolution and blanked again afterwards.
+
+    images (array): Images with shape (nimages, ny, nx) or (ny, nx)
+    beams (array): bmaj (arcsec), bmin (arcsec), bpa (deg) of every image with shape (nimages, 3) or (3,)
+    target (array): bmaj (arcsec), bmin (arcsec), bpa (deg) of the target beam
+    cdelt1 (float): Pixel size along the first axis in deg
+    cdelt2 (float): Pixel size along the second axis in deg
+    threads (int): Number of threads for the FFT, default all cpus
+    returns (array): The convolved images with the same shape as images
+    """
+    images = np.asarray(images, dtype=np.float32)
+    single = images.ndim == 2
+    if single:
+        images = images[None]
+    nimages, ny, nx = images.shape
+    cov_kernels, scale = convolution_kernels(beams, target, cdelt1, cdelt2)
+    if len(cov_kernels) != nimages:
+        error = "Number of images ({0}) and beams ({1}) do not match".format(nimages, len(cov_kernels))
+        logger.error(error)
+        raise ApercalException(error)
+
+    # pad the images with the extent of the largest kernel to avoid wrapping around the edges
+    padding = int(np.ceil(4. * np.sqrt(max(np.max(np.linalg.eigvalsh(cov_kernels)), 0.))))
+    shape = (ny + 2 * padding, nx + 2 * padding)
+    blanked = ~np.isfinite(images)
+    padded = np.zeros((nimages,) + shape, dtype=np.float32)
+    padded[:, padding:padding + ny, padding:padding + nx] = np.where(blanked, 0., images)
+
+    # Fourier transform of a unit-sum Gaussian with covariance C is exp(-2 pi^2 k^T C k)
+    ky = np.fft.fftfreq(shape[0])[:, None]
+    kx = np.fft.rfftfreq(shape[1])[None, :]
+    exponent = (cov_kernels[:, 0, 0, None, None] * kx ** 2 +
+                2. * cov_kernels[:, 0, 1, None, None] * kx * ky +
+                cov_kernels[:, 1, 1, None, None] * ky ** 2)
+    kernels = (scale[:, None, None] * np.exp(-2. * np.pi ** 2 * exponent)).astype(np.complex64)
+
+    convolved = irfft2(rfft2(padded, threads=threads) * kernels, shape, threads=threads)
+    convolved = convolved[:, padding:padding + ny, padding:padding + nx].astype(np.float32)
+    convolved[blanked] = np.nan
+
+    if single:
+        return convolved[0]
+    return convolved
@@ -1,4 +1,44 @@
+"""
+Functions to convert MIRIAD images to FITS and back, and to access MIRIAD images from NumPy directly.
+
+The `image` item of a MIRIAD image holds the pixels as big-endian 32 bit floats after a 4 byte
+header, with the first axis varying fastest like in FITS. mirtonumpy maps it into memory without
+converting the image and builds a FITS header from the header items, numpytomir writes an array
+as a MIRIAD image. Blanked pixels are stored in the `mask` item and are NaN in NumPy.
+"""
+
+import logging
+import os
+import shutil
+import struct
+
+import numpy as np
+import astropy.io.fits as pyfits
+from astropy.time import Time
+
 from apercal.libs import lib
+from apercal.subs import mirio
+from apercal.exceptions import ApercalException
+
+logger = logging.getLogger(__name__)
+
+# Size of the header of the image item
+IMAGE_HDR_SIZE = 4
+
+# Scale factors from the units of MIRIAD axes to the units of FITS axes by the start of ctype
+ANGLE_AXES = ('RA', 'DEC', 'GLON', 'GLAT', 'ELON', 'ELAT')
+AXIS_SCALES = {'FREQ': 1e9, 'VELO': 1e3, 'FELO': 1e3, 'VRAD': 1e3, 'VOPT': 1e3}
+
+# Header items copied between MIRIAD and FITS: MIRIAD name, FITS keyword, MIRIAD type, scale to FITS
+HEADER_ITEMS = [('bunit', 'BUNIT', 'text', None), ('btype', 'BTYPE', 'text', None),
+                ('object', 'OBJECT', 'text', None), ('telescop', 'TELESCOP', 'text', None),
+                ('observer', 'OBSERVER', 'text', None), ('epoch', 'EQUINOX', 'real', 1.0),
+                ('bmaj', 'BMAJ', 'real', np.degrees(1.0)), ('bmin', 'BMIN', 'real', np.degrees(1.0)),
+                ('bpa', 'BPA', 'real', 1.0), ('restfreq', 'RESTFREQ', 'double', 1e9),
+                ('obsra', 'OBSRA', 'double', np.degrees(1.0)), ('obsdec', 'OBSDEC', 'double', np.degrees(1.0)),
+                ('vobs', 'VOBS', 'real', 1.0), ('niters', 'NITERS', 'int', None),
+                ('llrot', 'CROTA2', 'double', np.degrees(1.0)),
+                ('datamin', 'DATAMIN', 'real', 1.0), ('datamax', 'DATAMAX', 'real', 1.0)]
 
 
 def mirtofits(mirimage, fitsimage):
@@ -24,4 +64,164 @@ def fitstomir(fitsimage, mirimage):
     fits.op = 'xyin'
     fits.in_ = fitsimage
     fits.out = mirimage
-    fits.go()
\ No newline at end of file
+    fits.go()
+
+
+def get_axis_scale(ctype):
+    """
+    Get the factor to convert the values of an axis from MIRIAD to FITS units
+    ctype (string): Type of the axis
+    returns (float): The factor
+    """
+    name = ctype.split('-')[0].upper()
+    if name in ANGLE_AXES:
+        return np.degrees(1.0)
+    return AXIS_SCALES.get(name, 1.0)
+
+
+def get_shape(header):
+    """
+    Get the shape of the NumPy array of a MIRIAD image, the last axis first
+    header (MiriadHeader): The header items of the image
+    returns (tuple): The shape
+    """
+    return tuple(int(header['naxis{}'.format(axis)]) for axis in range(header['naxis'], 0, -1))
+
+
+def get_fits_header(mirimage):
+    """
+    Build a FITS header from the header items of a MIRIAD image
+    Angles are converted to degrees, frequencies to Hz and velocities to m/s like the MIRIAD task fits does.
+    mirimage (string): The MIRIAD image
+    returns (astropy.io.fits.Header): The header, use astropy.wcs.WCS(header) for the coordinates
+    """
+    header = mirio.get_header(mirimage)
+    shape = get_shape(header)
+    fitsheader = pyfits.Header()
+    fitsheader['SIMPLE'] = True
+    fitsheader['BITPIX'] = -32
+    fitsheader['NAXIS'] = len(shape)
+    for axis in range(1, len(shape) + 1):
+        fitsheader['NAXIS{}'.format(axis)] = shape[-axis]
+    for axis in range(1, len(shape) + 1):
+        ctype = header.get('ctype{}'.format(axis))
+        if ctype is None:
+            continue
+        scale = get_axis_scale(ctype)
+        fitsheader['CTYPE{}'.format(axis)] = ctype
+        fitsheader['CRVAL{}'.format(axis)] = header.get('crval{}'.format(axis), 0.0) * scale
+        fitsheader['CDELT{}'.format(axis)] = header.get('cdelt{}'.format(axis), 1.0) * scale
+        fitsheader['CRPIX{}'.format(axis)] = header.get('crpix{}'.format(axis), 1.0)
+    for name, keyword, _, scale in HEADER_ITEMS:
+        value = header.get(name)
+        if value is not None:
+            fitsheader[keyword] = value * scale if scale is not None else value
+    if 'obstime' in header:
+        fitsheader['DATE-OBS'] = Time(header['obstime'], format='jd').isot
+    return fitsheader
+
+
+def get_miriad_items(fitsheader):
+    """
+    Convert a FITS header to MIRIAD header items
+    fitsheader (astropy.io.fits.Header): The FITS header
+    returns (list(tuple)): Name, value and type of the header items
+    """
+    items = [('naxis', fitsheader['NAXIS'], 'int')]
+    for axis in range(1, fitsheader['NAXIS'] + 1):
+        items.append(('naxis{}'.format(axis), fitsheader['NAXIS{}'.format(axis)], 'int'))
+        ctype = fitsheader.get('CTYPE{}'.format(axis))
+        if ctype is None:
+            continue
+        scale = get_axis_scale(ctype)
+        items.append(('ctype{}'.format(axis), ctype, 'text'))
+        items.append(('crval{}'.format(axis), fitsheader.get('CRVAL{}'.format(axis), 0.0) / scale, 'double'))
+        items.append(('cdelt{}'.format(axis), fitsheader.get('CDELT{}'.format(axis), 1.0) / scale, 'double'))
+        items.append(('crpix{}'.format(axis), fitsheader.get('CRPIX{}'.format(axis), 1.0), 'double'))
+    for name, keyword, type_name, scale in HEADER_ITEMS:
+        if keyword in fitsheader and keyword not in ('DATAMIN', 'DATAMAX'):
+            value = fitsheader[keyword]
+            items.append((name, value / scale if scale is not None else value, type_name))
+    if 'EQUINOX' not in fitsheader and 'EPOCH' in fitsheader:
+        items.append(('epoch', fitsheader['EPOCH'], 'real'))
+    if 'DATE-OBS' in fitsheader:
+        items.append(('obstime', Time(fitsheader['DATE-OBS'], format='isot', scale='utc').jd, 'double'))
+    return items
+
+
+def mirtonumpy(mirimage, mode='r', masked=True):
+    """
+    Get the pixels of a MIRIAD image as a NumPy array without converting the image
+
+    mirimage (string): The MIRIAD image
+    mode (string): 'r' to read, 'r+' to change the pixels in place
+    masked (bool): Set the blanked pixels of the mask item to NaN. This needs a copy of the image if it has a mask.
+    returns (numpy.ndarray, astropy.io.fits.Header): The pixels with the last axis first and the header. The pixels
+        are memory-mapped unless the mask was applied.
+    """
+    image_file = os.path.join(mirimage, 'image')
+    if not os.path.isfile(image_file):
+        error = 'Image {} does not seem to exist!'.format(mirimage)
+        logger.error(error)
+        raise ApercalException(error)
+    shape = get_shape(mirio.get_header(mirimage))
+    if os.path.getsize(image_file) < IMAGE_HDR_SIZE + 4 * int(np.prod(shape)):
+        raise ApercalException('Image item of {} is smaller than its header says'.format(mirimage))
+    data = np.memmap(image_file, dtype='>f4', mode=mode, offset=IMAGE_HDR_SIZE, shape=shape)
+    if masked and os.path.isfile(os.path.join(mirimage, 'mask')):
+        data = np.array(data, dtype=np.float32)
+        planes = data.reshape((-1,) + shape[-2:])
+        plane_size = planes[0].size
+        for plane in range(len(planes)):
+            good = mirio.read_mask(mirimage, 'mask', plane * plane_size, plane_size)
+            planes[plane][~good.reshape(planes[plane].shape)] = np.nan
+    return data, get_fits_header(mirimage)
+
+
+def numpytomir(data, mirimage, header=None, template=None):
+    """
+    Write a NumPy array as a MIRIAD image
+
+    NaN pixels are blanked with the mask item. The header items are taken from a FITS header or
+    copied from a MIRIAD template image with the same shape.
+
+    data (numpy.ndarray): The pixels with the last axis first, like in FITS
+    mirimage (string): The MIRIAD image to write, replaced if it exists
+    header (astropy.io.fits.Header): FITS header of the image
+    template (string): MIRIAD image to copy the header items from
+    """
+    if (header is None) == (template is None):
+        raise ApercalException('Need either a FITS header or a template image to write {}'.format(mirimage))
+    if os.path.isdir(mirimage):
+        shutil.rmtree(mirimage)
+    os.makedirs(mirimage)
+    with open(os.path.join(mirimage, 'header'), 'wb'):
+        pass
+    mirheader = mirio.MiriadHeader(mirimage)
+    if template is not None:
+        template_header = mirio.get_header(template)
+        for name in template_header.items:
+            mirheader.items[name] = template_header.items[name]
+        mirheader.modified = True
+    else:
+        for name, value, type_name in get_miriad_items(header):
+            mirheader.set(name, value, type_name=type_name)
+    data = np.asarray(data)
+    shape = get_shape(mirheader)
+    if int(np.prod(shape)) != data.size:
+        raise ApercalException('Shape {0} of the data does not fit the header of {1}'.format(data.shape, mirimage))
+    planes = data.reshape((-1,) + shape[-2:])
+    blanked = False
+    with open(os.path.join(mirimage, 'image'), 'wb') as f:
+        f.write(struct.pack('>i', mirio.H_REAL))
+        for plane in planes:
+            bad = np.isnan(plane)
+            blanked = blanked or bool(np.any(bad))
+            f.write(np.where(bad, 0, plane).astype('>f4').tobytes())
+    if blanked:
+        mirio.write_mask(mirimage, 'mask', ~np.isnan(planes).ravel())
+    finite = planes[np.isfinite(planes)]
+    if len(finite) > 0:
+        mirheader.set('datamin', float(np.min(finite)), type_name='real')
+        mirheader.set('datamax', float(np.max(finite)), type_name='real')
+    mirheader.save()
@@ -0,0 +1,311 @@
+"""
+Module to retrieve the input files of a pipeline step concurrently.
+
+Files are grouped by a key (usually the beam) and the groups are retrieved
+by a pool of worker threads from a backend: ALTA through iRODS, a local
+directory, or a local directory tree standing in for ALTA. Every file is
+written under a temporary name (or resumed by iRODS), verified against its
+checksum and recorded in a JSON manifest, so that an interrupted retrieval
+continues where it stopped and files that are already complete are not
+retrieved again. The keys are returned as soon as all their files have
+arrived, so processing can start while the other keys are still retrieved.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from apercal.exceptions import ApercalException
+
+logger = logging.getLogger(__name__)
+
+# Size of the blocks in which files are copied and checksummed
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# Files of one key, each a tuple of source path and local destination path
+FetchRequest = collections.namedtuple('FetchRequest', ['key', 'files'])
+
+# Outcome of a request, error is None if all files of the key are available
+FetchResult = collections.namedtuple('FetchResult', ['key', 'files', 'error'])
+
+
+def get_file_checksum(filename, offset=0, checksum=None):
+    """
+    Get the sha1 checksum of a file
+
+    filename (str): Name of the file
+    offset (int): Only use the part of the file after this many bytes
+    checksum (hash): Hash object to update, a new one is created if None
+    returns (hash): The hash object
+    """
+    if checksum is None:
+        checksum = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        block = f.read(BLOCK_SIZE)
+        while block:
+            checksum.update(block)
+            block = f.read(BLOCK_SIZE)
+    return checksum
+
+
+class LocalBackend(object):
+    """
+    Retrieve files from a local or mounted directory
+
+    Partial copies are kept as <destination>.part and continued on the next attempt.
+    """
+
+    name = 'local'
+
+    def exists(self, source):
+        return os.path.exists(source)
+
+    def listdir(self, directory):
+        return sorted(os.listdir(directory))
+
+    def get_checksum(self, source):
+        """
+        Get the sha1 checksum of the source, None if the backend cannot provide it
+        """
+        return get_file_checksum(source).hexdigest()
+
+    def fetch(self, source, destination):
+        """
+        Copy a file, continuing a partial copy
+        """
+        part_file = destination + '.part'
+        source_size = os.path.getsize(source)
+        offset = 0
+        if os.path.exists(part_file):
+            offset = os.path.getsize(part_file)
+            if offset > source_size:
+                os.remove(part_file)
+                offset = 0
+            elif offset > 0:
+                logger.debug("Resuming copy of {0} after {1} bytes".format(source, offset))
+        with open(source, 'rb') as fin:
+            fin.seek(offset)
+            with open(part_file, 'ab' if offset > 0 else 'wb') as fout:
+                shutil.copyfileobj(fin, fout, BLOCK_SIZE)
+        os.rename(part_file, destination)
+
+
+class LocalAltaBackend(LocalBackend):
+    """
+    Stand-in for ALTA that serves the ALTA paths from a local directory tree
+
+    Useful to test the retrieval from ALTA without iRODS.
+
+    root (str): Local directory that takes the place of the root of ALTA
+    """
+
+    name = 'local ALTA'
+
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, source):
+        return os.path.join(self.root, source.lstrip('/'))
+
+    def exists(self, source):
+        return LocalBackend.exists(self, self.local_path(source))
+
+    def listdir(self, directory):
+        return LocalBackend.listdir(self, self.local_path(directory))
+
+    def get_checksum(self, source):
+        return LocalBackend.get_checksum(self, self.local_path(source))
+
+    def fetch(self, source, destination):
+        LocalBackend.fetch(self, self.local_path(source), destination)
+
+
+class AltaBackend(object):
+    """
+    Retrieve files from ALTA with the iRODS icommands
+
+    iget restarts partial transfers from its restart files and verifies the
+    checksum of ALTA itself, so no separate checksum is needed.
+    """
+
+    name = 'ALTA'
+
+    FNULL = open(os.devnull, 'w')
+
+    def exists(self, source):
+        return subprocess.call("ils {}".format(source), shell=True, stdout=self.FNULL, stderr=self.FNULL) == 0
+
+    def listdir(self, directory):
+        output = subprocess.check_output("ils {}".format(directory), shell=True, stderr=self.FNULL)
+        if not isinstance(output, str):
+            output = output.decode('utf-8')
+        # the first line is the collection itself, sub-collections start with C-
+        return sorted(line.strip() for line in output.splitlines()[1:]
+                      if line.strip() and not line.strip().startswith('C-'))
+
+    def get_checksum(self, source):
+        return None
+
+    def fetch(self, source, destination):
+        """
+        Get a file from ALTA, continuing a partial transfer
+        """
+        status_name = os.path.join(os.path.dirname(destination),
+                                   "transfer_{}_img-icat".format(os.path.basename(destination).split(".")[0]))
+        alta_cmd = "iget -rfPIT -K -X {0}.irods-status --lfrestart {0}.lf-irods-status --retries 5 {1} {2}".format(
+            status_name, source, destination)
+        logger.debug(alta_cmd)
+        subprocess.check_call(alta_cmd, shell=True, stdout=self.FNULL, stderr=self.FNULL)
+        for suffix in ['.irods-status', '.lf-irods-status']:
+            if os.path.exists(status_name + suffix):
+                os.remove(status_name + suffix)
+
+
+class Fetcher(object):
+    """
+    Retrieve groups of files concurrently with a manifest of the completed files
+
+    backend (object): Backend to retrieve the files from
+    workers (int): Number of files groups retrieved at the same time
+    manifest_file (str): JSON file recording the completed files, None for no manifest
+    retries (int): Number of additional attempts for a file that failed
+    """
+
+    def __init__(self, backend, workers=4, manifest_file=None, retries=2):
+        self.backend = backend
+        self.workers = max(1, int(workers))
+        self.manifest_file = manifest_file
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.manifest = {}
+        if manifest_file is not None and os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                self.manifest = json.load(f)
+
+    def save_manifest(self):
+        """
+        Write the manifest, replacing the old file at once (call with the lock held)
+        """
+        if self.manifest_file is None:
+            return
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.rename(tmp_file, self.manifest_file)
+
+    def is_complete(self, source, destination):
+        """
+        Check whether a file has already been retrieved according to the manifest
+        """
+        with self.lock:
+            entry = self.manifest.get(os.path.abspath(destination))
+        if entry is None or entry['source'] != source or not os.path.exists(destination):
+            return False
+        return os.path.getsize(destination) == entry['size'] and os.path.getmtime(destination) == entry['mtime']
+
+    def fetch_file(self, source, destination):
+        """
+        Retrieve a single file, verify it and add it to the manifest
+        """
+        if self.is_complete(source, destination):
+            logger.debug("{} is already complete".format(destination))
+            return
+        if not os.path.isdir(os.path.dirname(os.path.abspath(destination))):
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(destination)))
+            except OSError:
+                # created by another worker in the meantime
+                pass
+        for attempt in range(self.retries + 1):
+            try:
+                self.backend.fetch(source, destination)
+                checksum = get_file_checksum(destination).hexdigest()
+                source_checksum = self.backend.get_checksum(source)
+                if source_checksum is not None and source_checksum != checksum:
+                    os.remove(destination)
+                    raise ApercalException("Checksum of {} does not match the source".format(destination))
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning("Getting {0} failed ({1}), trying again".format(source, e))
+            else:
+                break
+        with self.lock:
+            self.manifest[os.path.abspath(destination)] = {
+                'source': source, 'size': os.path.getsize(destination),
+                'mtime': os.path.getmtime(destination), 'sha1': checksum}
+            self.save_manifest()
+
+    def iter_fetch(self, requests):
+        """
+        Retrieve the files of all requests and yield the results as the keys complete
+
+        requests (list(FetchRequest)): Keys with their files
+        returns (generator(FetchResult)): The result of every request in order of completion
+        """
+        requests = list(requests)
+        todo = queue.Queue()
+        done = queue.Queue()
+        for request in requests:
+            todo.put(request)
+
+        def worker():
+            while True:
+                try:
+                    request = todo.get_nowait()
+                except queue.Empty:
+                    return
+                error = None
+                try:
+                    for source, destination in request.files:
+                        self.fetch_file(source, destination)
+                except Exception as e:
+                    error = e
+                done.put(FetchResult(request.key, request.files, error))
+
+        threads = [threading.Thread(target=worker) for _ in range(min(self.workers, len(requests)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for _ in range(len(requests)):
+            result = done.get()
+            if result.error is None:
+                logger.debug("Getting files of {0} from {1} ... Done".format(result.key, self.backend.name))
+            else:
+                logger.warning("Getting files of {0} from {1} ... Failed ({2})".format(
+                    result.key, self.backend.name, result.error))
+            yield result
+        for thread in threads:
+            thread.join()
+
+    def fetch(self, requests, on_complete=None):
+        """
+        Retrieve the files of all requests
+
+        requests (list(FetchRequest)): Keys with their files
+        on_complete (function): Called with the key of every complete request while the others are retrieved
+        returns (list): Keys for which not all files could be retrieved
+        """
+        failed_keys = []
+        for result in self.iter_fetch(requests):
+            if result.error is not None:
+                failed_keys.append(result.key)
+            elif on_complete is not None:
+                try:
+                    on_complete(result.key)
+                except Exception as e:
+                    logger.warning("Processing {} after it was retrieved failed".format(result.key))
+                    logger.exception(e)
+                    failed_keys.append(result.key)
+        return failed_keys
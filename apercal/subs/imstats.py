@@ -1,18 +1,32 @@
 import astropy.io.fits as pyfits
 import numpy as np
 import os
-import random
-import string
 import logging
-from backports import tempfile
 
-from apercal.libs import lib
 from apercal.subs import setinit
+from apercal.subs import convim
 from apercal.exceptions import ApercalException
 
 logger = logging.getLogger(__name__)
 
 
+def load_image(image):
+    """
+    Subroutine to load the pixels of a MIRIAD or FITS image
+    MIRIAD images are read directly without converting them to FITS.
+    image (string): The absolute path to the image file.
+    returns (numpy array): The pixels of the image with the last axis first
+    """
+    if os.path.isdir(image):
+        return convim.mirtonumpy(image)[0]
+    elif os.path.isfile(image):
+        return pyfits.getdata(image)
+    else:
+        error = 'Image does not seem to exist!'
+        logger.error(error)
+        raise ApercalException(error)
+
+
 def getimagestats(self, image):
     """
     Subroutine to calculate the min, max and rms of an image
@@ -20,25 +34,8 @@ def getimagestats(self, image):
     returns (numpy array): The min, max and rms of the image
     """
     setinit.setinitdirs(self)
-    char_set = string.ascii_uppercase + string.digits
     if os.path.isdir(image) or os.path.isfile(image):
-        if os.path.isdir(image):
-            temp_string = ''.join(random.sample(char_set * 8, 8))
-            fits = lib.miriad('fits')
-            fits.op = 'xyout'
-            fits.in_ = image
-            with tempfile.TemporaryDirectory() as tempdir:
-                fits.out = tempdir + '/' + temp_string + '.fits'
-                fits.go()
-                image_data = pyfits.open(tempdir + '/' + temp_string + '.fits')
-        elif os.path.isfile(image):
-            image_data = pyfits.open(image)
-        else:
-            error = 'Image format not supported. Only MIRIAD and FITS formats are supported!'
-            logger.error(error)
-            raise ApercalException(error)
-
-        data = image_data[0].data
+        data = load_image(image)
         imagestats = np.full(3, np.nan)
         if data.shape[-3] == 2:
             imagestats[0] = np.nanmin(data[0,0,:,:])  # Get the maxmimum of the image
@@ -48,7 +45,6 @@ def getimagestats(self, image):
             imagestats[0] = np.nanmin(data)  # Get the maxmimum of the image
             imagestats[1] = np.nanmax(data)  # Get the minimum of the image
             imagestats[2] = np.nanstd(data)  # Get the standard deviation
-        image_data.close()  # Close the image
     else:
         error = 'Image does not seem to exist!'
         logger.error(error)
@@ -65,29 +61,11 @@ def getmaskstats(self, image, size):
     returns (numpy array): The number of pixels and their percentage of the full image
     """
     setinit.setinitdirs(self)
-    char_set = string.ascii_uppercase + string.digits
     if os.path.isdir(image) or os.path.isfile(image):
-        if os.path.isdir(image):
-            temp_string = ''.join(random.sample(char_set * 8, 8))
-            fits = lib.miriad('fits')
-            fits.op = 'xyout'
-            fits.in_ = image
-            with tempfile.TemporaryDirectory() as tempdir:
-                fits.out = tempdir + '/' + temp_string + '.fits'
-                fits.go()
-                mask_data = pyfits.open(tempdir + '/' + temp_string + '.fits')
-        elif os.path.isfile(image):
-            mask_data = pyfits.open(image)
-        else:
-            error = 'Image format not supported. Only MIRIAD and FITS formats are supported!'
-            logger.error(error)
-            raise ApercalException(error)
-
-        data = mask_data[0].data
+        data = load_image(image)
         maskstats = np.full(2, np.nan)
         maskstats[0] = np.count_nonzero(~np.isnan(data))
         maskstats[1] = maskstats[0]/(size**2)
-        mask_data.close()
     else:
         error = 'Image does not seem to exist!'
         logger.error(error)
@@ -103,29 +81,11 @@ def getmodelstats(self, image):
     returns (numpy array): The number of pixels with clean components and their summed flux in Jy
     """
     setinit.setinitdirs(self)
-    char_set = string.ascii_uppercase + string.digits
     if os.path.isdir(image) or os.path.isfile(image):
-        if os.path.isdir(image):
-            temp_string = ''.join(random.sample(char_set * 8, 8))
-            fits = lib.miriad('fits')
-            fits.op = 'xyout'
-            fits.in_ = image
-            with tempfile.TemporaryDirectory() as tempdir:
-                fits.out = tempdir + '/' + temp_string + '.fits'
-                fits.go()
-                model_data = pyfits.open(tempdir + '/' + temp_string + '.fits')
-        elif os.path.isfile(image):
-            model_data = pyfits.open(image)
-        else:
-            error = 'Image format not supported. Only MIRIAD and FITS formats are supported!'
-            logger.error(error)
-            raise ApercalException(error)
-
-        data = model_data[0].data[:,0,:,:]
+        data = load_image(image)[:,0,:,:]
         modelstats = np.full(2, np.nan)
         modelstats[0] = np.count_nonzero(data)
         modelstats[1] = np.sum(data)
-        model_data.close()
     else:
         error = 'Image does not seem to exist!'
         logger.error(error)
@@ -141,30 +101,12 @@ def getcubestats(self, cube):
     returns (numpy array): The min, max and rms of the image
     """
     setinit.setinitdirs(self)
-    char_set = string.ascii_uppercase + string.digits
     if os.path.isdir(cube) or os.path.isfile(cube):
-        if os.path.isdir(cube):
-            temp_string = ''.join(random.sample(char_set * 8, 8))
-            fits = lib.miriad('fits')
-            fits.op = 'xyout'
-            fits.in_ = cube
-            with tempfile.TemporaryDirectory() as tempdir:
-                fits.out = tempdir + '/' + temp_string + '.fits'
-                fits.go()
-                cube_data = pyfits.open(tempdir + '/' + temp_string + '.fits')
-        elif os.path.isfile(cube):
-            cube_data = pyfits.open(cube)
-        else:
-            error = 'Image format not supported. Only MIRIAD and FITS formats are supported!'
-            logger.error(error)
-            raise ApercalException(error)
-
-        data = cube_data[0].data
+        data = load_image(cube)
         cubestats = np.full((3,data.shape[1]), np.nan)
         cubestats[0] = np.nanmin(data, axis=(0, 2, 3))  # Get the maxmimum of the image
         cubestats[1] = np.nanmax(data, axis=(0, 2, 3))  # Get the minimum of the image
         cubestats[2] = np.nanstd(data, axis=(0, 2, 3))  # Get the standard deviation
-        cube_data.close()  # Close the image
     else:
         error = 'Image does not seem to exist!'
         logger.error(error)
@@ -3,53 +3,64 @@ This file uses astropy and miriad to construct a catalogue of apparent and real
 pointing centre in a certain radius
 """
 import logging
-import re
 
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.mlab as mplab
 import numpy as np
+from numpy.lib import recfunctions
 from astropy import units as u
 from astropy.coordinates import Angle, SkyCoord
 from astroquery.vizier import Vizier
 
-from apercal.libs import lib
+from apercal.subs import lsm_index
+from apercal.subs import readmirhead
 from apercal.subs.pb import wsrtBeam
 from apercal.subs.readmirhead import getradec
 
 
-def query_catalogue(infile, catalogue, radius, minflux=0.0):
+def query_catalogue(infile, catalogue, radius, minflux=0.0, index_dir=None, coords=None):
     """
-    query_catalogue: module to query the FIRST, NVSS, or WENSS catalogue from Vizier and write it to a record array
+    query_catalogue: module to query the FIRST, NVSS, or WENSS catalogue from Vizier or a local index and write it
+                     to a record array
 
     skycoords: coordinates of the pointing centre in astropy format
     catalogue: catalogue to ask for (NVSS, WENSS, or FIRST)
     radius: radius around the pointing centre to ask for in degreees
     minflux: minimum real source flux to receive from a VIZIER query. Default is 0.0 since for most operations you
              want all sources in the radius region
+    index_dir: directory with a local index of the catalogues (see lsm_index). Default is None to query Vizier
+    coords: pointing centre as SkyCoord. Default is None to read it from infile
 
     returns: record array with RA, DEC, Major axis, Minor axis, parallactic angle, and flux of the sources in the
              catalogue
     """
+    if coords is None:
+        coords = getradec(infile)
+    if index_dir is not None:
+        if not lsm_index.has_catalogue(index_dir, catalogue):
+            logging.warning(' No local index of ' + catalogue + ' in ' + str(index_dir) + '!')
+            return []
+        cat = lsm_index.query_index(index_dir, catalogue, coords.ra.deg, coords.dec.deg, radius, minflux=minflux)
+        if len(cat) == 0:
+            cat = []
+        return cat
     try:
         if catalogue == 'FIRST':
             v = Vizier(columns=["*", "+_r", "_RAJ2000", "_DEJ2000", "PA"], column_filters={"Fint": ">" + str(minflux)})
             v.ROW_LIMIT = -1
-            sources = v.query_region(getradec(infile), radius=Angle(radius, "deg"), catalog=catalogue)
+            sources = v.query_region(coords, radius=Angle(radius, "deg"), catalog=catalogue)
             maj_axis = sources[0]['Maj']
             min_axis = sources[0]['Min']
             flux = sources[0]['Fint'] / 1000.0
         elif catalogue == 'NVSS':
             v = Vizier(columns=["*", "+_r", "_RAJ2000", "_DEJ2000", "PA"], column_filters={"S1.4": ">" + str(minflux)})
             v.ROW_LIMIT = -1
-            sources = v.query_region(getradec(infile), radius=Angle(radius, "deg"), catalog=catalogue)
+            sources = v.query_region(coords, radius=Angle(radius, "deg"), catalog=catalogue)
             maj_axis = sources[0]['MajAxis']
             min_axis = sources[0]['MinAxis']
             flux = sources[0]['S1.4'] / 1000.0
         elif catalogue == 'WENSS':
             v = Vizier(columns=["*", "+_r", "_RAJ2000", "_DEJ2000", "PA"], column_filters={"Sint": ">" + str(minflux)})
             v.ROW_LIMIT = -1
-            sources = v.query_region(getradec(infile), radius=Angle(radius, "deg"), catalog=catalogue)
+            sources = v.query_region(coords, radius=Angle(radius, "deg"), catalog=catalogue)
             maj_axis = sources[0]['MajAxis']
             min_axis = sources[0]['MinAxis']
             flux = sources[0]['Sint'] / 1000.0
@@ -70,25 +81,41 @@ def query_catalogue(infile, catalogue, radius, minflux=0.0):
     return cat
 
 
-def calc_offset(infile, cat):
+def append_fields(cat, names, data):
+    """
+    append_fields: add float columns to a catalogue
+    cat: The catalogue
+    names: The names of the new columns
+    data: The values of the new columns, arrays of the length of the catalogue
+    returns: A new catalogue with the added columns as a record array
+    """
+    return recfunctions.rec_append_fields(cat, names, [np.asarray(d, dtype=float) for d in data],
+                                          dtypes=[float] * len(names))
+
+
+def calc_offset(infile, cat, coords=None):
     """
     calc_offset: Calculate the offset of the catalogue entries towards the pointing centre
     infile: Input MIRIAD uv-file
     cat: Input catalogue of sources to calculate the offset for
+    coords: pointing centre as SkyCoord. Default is None to read it from infile
     returns: A catalogue with the offsets for the individual sources
     """
-    ra_off = (cat.RA - getradec(infile).ra.deg) * 3600.0 * np.cos(getradec(infile).dec.rad)
-    dec_off = (cat.DEC - getradec(infile).dec.deg) * 3600.0
-    cat = mplab.rec_append_fields(cat, ['RA_off', 'DEC_off'], [ra_off, dec_off], dtypes=[float, float])
+    if coords is None:
+        coords = getradec(infile)
+    ra_off = (np.asarray(cat.RA) - coords.ra.deg) * 3600.0 * np.cos(coords.dec.rad)
+    dec_off = (np.asarray(cat.DEC) - coords.dec.deg) * 3600.0
+    cat = append_fields(cat, ['RA_off', 'DEC_off'], [ra_off, dec_off])
     return cat
 
 
-def calc_appflux(infile, cat, beam):
+def calc_appflux(infile, cat, beam, freq=None):
     """
     calc_appflux: module to calculate the apparent fluxes of sources from an input catalogue using primary beam correction
     infile: Input MIRIAD uv-file
     cat: catalogue (most likely from query_catalogue)
     beam: the beam type to correct for. Only 'WSRT' allowed at the moment
+    freq: central frequency of the observation in GHz. Default is None to read it from infile
     returns: an extended catalogue file including the distances RA- and DEC-offsets and apparent fluxes from th
              pointing centre
     """
@@ -96,11 +123,10 @@ def calc_appflux(infile, cat, beam):
         logging.warning(' Using standard WSRT beam for calculating apparent fluxes!')
     else:
         logging.warning(' Beam model not supported yet! Using standard WSRT beam instead!')
-    sep = cat.dist
-    appflux = np.zeros((len(cat)))
-    for c in range(0, len(cat)):  # calculate the apparent flux of the sources
-        appflux[c] = (cat.flux[c]) * wsrtBeam(sep[c], getfreq(infile))
-    cat = mplab.rec_append_fields(cat, ['appflux'], [appflux], dtypes=[float])
+    if freq is None:
+        freq = getfreq(infile)
+    appflux = np.asarray(cat.flux) * wsrtBeam(np.asarray(cat.dist), freq)
+    cat = append_fields(cat, ['appflux'], [appflux])
     return cat
 
 
@@ -148,45 +174,37 @@ def calc_SI(cat1, cat2, limit):
     limit: Maximum distance in arcseconds for two sources to match each other.
     returns: cat1 with added spectral indices. Sources with no counterpart where set to -0.7.
     """
-    try:  # Handle the exception if the WENSS query did not give any results.
-        coords1 = SkyCoord(ra=cat1.RA, dec=cat1.DEC, unit=(
-            u.deg, u.deg))  # Convert the coordinates of the two source catalogues to the right format
-        coords2 = SkyCoord(ra=cat2.RA, dec=cat2.DEC, unit=(u.deg, u.deg))
-        idx, d2d, d3d = coords1.match_to_catalog_sky(
-            coords2)  # Get the indices of the matches (idx), and their distance on the sky (d2d)
-        dist = (d2d * u.deg * 3600) / (u.deg * u.deg)  # Convert to arcsec
-        nomatch = np.where(dist > limit)  # Index of sources with no match
-        match = np.where(dist <= limit)  # Index of sources with match
-        idx_match = idx[match]
-        flux1 = np.delete(cat1.flux,
-                          nomatch)  # Array of source fluxes at 20cm for all matches including resolved sources
-        flux2 = np.asarray(cat2.flux)[idx_match]  # Array of source fluxes at 90cm for all matches including multiples
-        src, counts = np.unique(idx_match, return_counts=True)
-        logging.debug(' Found ' + str(len(np.asarray(nomatch)[0])) + ' source(s) with no counterparts. Setting their spectral index to -0.7')
-        num, occ = np.unique(counts, return_counts=True)
-        for n, g in enumerate(num):
-            logging.debug(' Found ' + str(occ[n]) + ' source(s) with ' + str(num[n]) + ' counterpart(s)')
-        src_wgt_1 = np.zeros(len(flux2))  # Calculate the fluxes for the matched and resolved sources using weighting
-        for s in src:
-            src_idx = np.where(s == idx_match)
-            src_sum_1 = np.sum(flux1[src_idx])
-            src_wgt_1[src_idx] = flux1[src_idx] / src_sum_1
-        src_flux_2 = flux2 * src_wgt_1
-        src_si = np.log10(flux1 / src_flux_2) / np.log10(1.4 / 0.33)
-        si = np.zeros(len(idx))  # Create the array for the spectral index and put the values into the right position
-        si[nomatch] = -0.7
-        si[match] = src_si
-        si[si < -3] = -0.7
-        # Change the value to -0.7 in case of high absolute values. Maybe wrong source match or variable source
-        si[si > 2] = -0.7
-        cat = mplab.rec_append_fields(cat1, 'SI', si, dtypes=float)
-    except Exception:
+    if len(cat1) == 0:
+        # query_catalogue returns an empty list if there are no sources in the field, there is nothing to match
+        logging.debug(' No sources to calculate the spectral index for')
+        return cat1 if isinstance(cat1, list) else append_fields(cat1, ['SI'], [np.zeros(0)])
+    si = np.full(len(cat1), -0.7)
+    if cat2 is None or len(cat2) == 0:
         # In case the queried area is not covered by WENSS give all sources a spectral index of -0.7.
-        cat = mplab.rec_append_fields(cat1, 'SI', -0.7, dtypes=float)
-    return cat
-
-
-def lsm_model(infile, radius, cutoff, limit):
+        return append_fields(cat1, ['SI'], [si])
+    # Convert the coordinates of the two source catalogues and match them in one go
+    coords1 = SkyCoord(ra=np.asarray(cat1.RA), dec=np.asarray(cat1.DEC), unit=(u.deg, u.deg))
+    coords2 = SkyCoord(ra=np.asarray(cat2.RA), dec=np.asarray(cat2.DEC), unit=(u.deg, u.deg))
+    idx, d2d, d3d = coords1.match_to_catalog_sky(coords2)  # Get the indices of the matches (idx), and their distance
+    match = d2d.arcsec <= limit  # Sources with a match
+    idx_match = idx[match]
+    flux1 = np.asarray(cat1.flux)[match]  # Source fluxes at 20cm for all matches including resolved sources
+    flux2 = np.asarray(cat2.flux)[idx_match]  # Source fluxes at 90cm for all matches including multiples
+    logging.debug(' Found ' + str(np.count_nonzero(~match)) + ' source(s) with no counterparts. Setting their spectral index to -0.7')
+    counts = np.bincount(idx_match, minlength=len(cat2))
+    num, occ = np.unique(counts[counts > 0], return_counts=True)
+    for n, g in enumerate(num):
+        logging.debug(' Found ' + str(occ[n]) + ' source(s) with ' + str(num[n]) + ' counterpart(s)')
+    # Divide the flux of a source matching several ones between them according to their flux
+    src_sum_1 = np.bincount(idx_match, weights=flux1, minlength=len(cat2))
+    src_flux_2 = flux2 * flux1 / src_sum_1[idx_match]
+    si[match] = np.log10(flux1 / src_flux_2) / np.log10(1.4 / 0.33)
+    # Change the value to -0.7 in case of high absolute values. Maybe wrong source match or variable source
+    si[~np.isfinite(si) | (si < -3) | (si > 2)] = -0.7
+    return append_fields(cat1, ['SI'], [si])
+
+
+def lsm_model(infile, radius, cutoff, limit, index_dir=None):
     """
     lsm_model: Create a file to use for the MIRIAD task uvmodel to create a dataset for doing parametric self-calibration
     infile: The MIRIAD (u,v)-dataset to calibrate on to get frequency and pointing information
@@ -194,34 +212,39 @@ def lsm_model(infile, radius, cutoff, limit):
     cutoff: The percentage of total apparent flux of the field to use for the skymodel (0.0-1.0)
     limit: The distance in arcseconds for considering a source as a match for the source matching algorithm to
           calculate the spectral indices
+    index_dir: Directory with a local index of the catalogues. Default is None to query Vizier
     returns: A catalogue of sources with spectral indices and the set cutoff. Used as input for write_model.
     """
-    cat = query_catalogue(infile, 'FIRST', radius)
+    coords = getradec(infile)  # Read the pointing and frequency only once for all sources
+    freq = getfreq(infile)
+    cat = query_catalogue(infile, 'FIRST', radius, index_dir=index_dir, coords=coords)
     if len(cat) == 0:  # Handle the exception if the field to calibrate is not in FIRST. Use NVSS instead.
-        cat = query_catalogue(infile, 'NVSS', radius)
+        cat = query_catalogue(infile, 'NVSS', radius, index_dir=index_dir, coords=coords)
     try:  # Handle the exception if the covered field is not in WENSS
-        low_cat = query_catalogue(infile, 'WENSS', radius)
+        low_cat = query_catalogue(infile, 'WENSS', radius, index_dir=index_dir, coords=coords)
     except Exception:
         low_cat = None
     cat = calc_SI(cat, low_cat, limit)
-    cat = calc_offset(infile, cat)
-    cat = calc_appflux(infile, cat, 'WSRT')
+    cat = calc_offset(infile, cat, coords=coords)
+    cat = calc_appflux(infile, cat, 'WSRT', freq=freq)
     cat = sort_catalogue(cat, 'appflux')
     cat = cutoff_catalogue(cat, cutoff)
     return cat
 
 
-def lsm_mask(infile, radius, cutoff, catalogue):
+def lsm_mask(infile, radius, cutoff, catalogue, index_dir=None):
     """
     lsm_mask: Create a file for the MIRIAD task imgen to create a mask for the first iteration of the self-calibration
     infile: The MIRIAD (u,v)-dataset to calibrate on to get frequency and pointing information
     radius: The radius for the cone search to consider sources for the mask
     cutoff: The percentage of total apparent flux of the field to use for the mask (0.0-1.0)
     catalogue: The source catalogue to query (usually NVSS or FIRST)
+    index_dir: Directory with a local index of the catalogues. Default is None to query Vizier
     returns: A catalogue with the sources for the mask. Usually used for write_mask
     """
-    cat = query_catalogue(infile, catalogue, radius)
-    cat = calc_offset(infile, cat)
+    coords = getradec(infile)
+    cat = query_catalogue(infile, catalogue, radius, index_dir=index_dir, coords=coords)
+    cat = calc_offset(infile, cat, coords=coords)
     cat = calc_appflux(infile, cat, 'WSRT')
     cat = sort_catalogue(cat, 'appflux')
     cat = cutoff_catalogue(cat, cutoff)
@@ -234,13 +257,8 @@ def write_model(outfile, cat):
     outfile: The output file to write to
     cat: The catalogue to use for the file to write
     """
-    srctext = ''
-    appflux = cat.appflux
-    ra_off = cat.RA_off
-    dec_off = cat.DEC_off
-    si = cat.SI
-    for i, x in enumerate(appflux):
-        srctext = srctext + str(ra_off[i]) + ',' + str(dec_off[i]) + ',' + str(appflux[i]) + ',1.4,' + str(si[i]) + '\n'
+    srctext = ''.join(str(ra_off) + ',' + str(dec_off) + ',' + str(appflux) + ',1.4,' + str(si) + '\n'
+                      for ra_off, dec_off, appflux, si in zip(cat.RA_off, cat.DEC_off, cat.appflux, cat.SI))
     mirmdlfile = open(outfile, 'w')
     mirmdlfile.write(srctext)
     mirmdlfile.close()
@@ -297,11 +315,7 @@ def getfreq(infile):
     param infile: infile (name of file)
     returns: the central frequency of the visibility file
     """
-    prthd = lib.basher('prthd in=' + infile)
-    regex = re.compile(".*(GHz).*")
-    freqline = [m.group(0) for l in prthd for m in [regex.search(l)] if m][0].split()
-    freq = float(freqline[2]) + (float(freqline[1]) / 2.0) * float(freqline[3])
-    return freq
+    return readmirhead.getfreq(infile)
 
 
 def getnchan(infile):
@@ -310,8 +324,4 @@ def getnchan(infile):
     param infile: infile (name of file)
     return: the number of channels of the observation
     """
-    prthd = lib.basher('prthd in=' + infile)
-    regex = re.compile(".*(GHz).*")
-    nchanline = [m.group(0) for l in prthd for m in [regex.search(l)] if m][0].split()
-    nchan = int(nchanline[1])
-    return nchan
+    return readmirhead.getnchan(infile)
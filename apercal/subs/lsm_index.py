@@ -0,0 +1,270 @@
+"""
+Module to answer cone searches on the FIRST, NVSS and WENSS catalogues from a local index without
+network access.
+
+A catalogue dump (FITS, VOTable or CSV as written by Vizier) is ingested once into two numpy files
+in the index directory:
+
+    <catalogue>.npy        the sources with RA, DEC, MajAxis, MinAxis, PA and flux
+    <catalogue>_zones.npy  the index of the first source of every declination zone
+
+The sources are sorted by declination zone and by RA inside each zone, so a cone search only reads
+the RA range of the zones that overlap the cone. The files are memory mapped, so only the sources
+near the pointing are read from disk.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from apercal.exceptions import ApercalException
+
+logger = logging.getLogger(__name__)
+
+# Height of the declination zones in degrees
+ZONE_HEIGHT = 0.5
+
+# Number of zones from the south to the north pole
+NZONES = int(np.ceil(180.0 / ZONE_HEIGHT))
+
+# Columns of the catalogue dumps for each catalogue. The fluxes are in mJy in all of them.
+CATALOGUE_COLUMNS = {'FIRST': {'flux': 'Fint', 'maj': 'Maj', 'min': 'Min'},
+                     'NVSS': {'flux': 'S1.4', 'maj': 'MajAxis', 'min': 'MinAxis'},
+                     'WENSS': {'flux': 'Sint', 'maj': 'MajAxis', 'min': 'MinAxis'}}
+
+# Possible names of the coordinate columns, in degrees or sexagesimal
+RA_COLUMNS = ['_RAJ2000', 'RAJ2000', 'RA']
+DEC_COLUMNS = ['_DEJ2000', 'DEJ2000', 'DEC', 'Dec']
+
+# Layout of the index files, flux in Jy
+INDEX_DTYPE = [('RA', float), ('DEC', float), ('MajAxis', float), ('MinAxis', float), ('PA', float),
+               ('flux', float)]
+
+# Layout of the query results, the same as lsm.query_catalogue. The distance is in degrees.
+RESULT_DTYPE = INDEX_DTYPE + [('dist', float)]
+
+# Directory with a small synthetic NVSS and WENSS catalogue around RA=180, DEC=45 for testing
+SYNTHETIC_CATALOGUE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'catalogues')
+
+
+def get_index_files(index_dir, catalogue):
+    """
+    Function to get the names of the index files of a catalogue
+    returns (tuple(str)): The file with the sources and the file with the zone offsets
+    """
+    return (os.path.join(index_dir, catalogue + '.npy'),
+            os.path.join(index_dir, catalogue + '_zones.npy'))
+
+
+def has_catalogue(index_dir, catalogue):
+    """
+    Function to check whether a catalogue was ingested into an index directory
+    """
+    return all(os.path.isfile(f) for f in get_index_files(index_dir, catalogue))
+
+
+def find_column(table, names):
+    for name in names:
+        if name in table.colnames:
+            return table[name]
+    raise ApercalException("None of the columns {0} found in the catalogue".format(', '.join(names)))
+
+
+def read_catalogue_dump(filename, catalogue):
+    """
+    Function to read the sources of a catalogue dump
+
+    filename (str): FITS, VOTable or CSV file with the catalogue columns as in Vizier
+    catalogue (str): FIRST, NVSS or WENSS
+    returns (numpy.ndarray): The sources in the layout of the index
+    """
+    from astropy.table import Table
+    from astropy.coordinates import SkyCoord
+    from astropy import units as u
+
+    if catalogue not in CATALOGUE_COLUMNS:
+        raise ApercalException("Catalogue {} is not supported".format(catalogue))
+    columns = CATALOGUE_COLUMNS[catalogue]
+    table = Table.read(filename)
+    ra = find_column(table, RA_COLUMNS)
+    dec = find_column(table, DEC_COLUMNS)
+    sources = np.zeros(len(table), dtype=INDEX_DTYPE)
+    if ra.dtype.kind in 'SU':
+        coords = SkyCoord(ra, dec, unit=(u.hourangle, u.deg))
+        sources['RA'] = coords.ra.deg
+        sources['DEC'] = coords.dec.deg
+    else:
+        sources['RA'] = np.asarray(ra, dtype=float) % 360.0
+        sources['DEC'] = np.asarray(dec, dtype=float)
+    sources['MajAxis'] = np.ma.filled(table[columns['maj']], np.nan)
+    sources['MinAxis'] = np.ma.filled(table[columns['min']], np.nan)
+    sources['PA'] = np.ma.filled(table['PA'], np.nan) if 'PA' in table.colnames else np.nan
+    sources['flux'] = np.ma.filled(table[columns['flux']], np.nan) / 1000.0
+    return sources
+
+
+def get_zone(dec):
+    return np.clip(np.floor((np.asarray(dec) + 90.0) / ZONE_HEIGHT).astype(int), 0, NZONES - 1)
+
+
+def ingest_catalogue(filenames, catalogue, index_dir):
+    """
+    Function to build the index of a catalogue from one or more catalogue dumps
+
+    filenames (list(str)): The catalogue dumps, for example one per part of the sky
+    catalogue (str): FIRST, NVSS or WENSS
+    index_dir (str): Directory to write the index files to
+    returns (int): The number of sources in the index
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    sources = np.concatenate([read_catalogue_dump(filename, catalogue) for filename in filenames])
+    zones = get_zone(sources['DEC'])
+    order = np.lexsort((sources['RA'], zones))
+    sources = sources[order]
+    offsets = np.searchsorted(zones[order], np.arange(NZONES + 1))
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    source_file, zone_file = get_index_files(index_dir, catalogue)
+    # write to temporary files first so that readers never see half an index
+    for filename, data in [(source_file, sources), (zone_file, offsets)]:
+        tmp_file = '{0}.{1}.tmp.npy'.format(filename[:-4], os.getpid())
+        np.save(tmp_file, data)
+        os.rename(tmp_file, filename)
+    _index_cache.pop((os.path.abspath(index_dir), catalogue), None)
+    logger.info("Ingested {0} sources of {1} into {2}".format(len(sources), catalogue, index_dir))
+    return len(sources)
+
+
+def angular_distance(ra1, dec1, ra2, dec2):
+    """
+    Function to calculate the distance between positions with the haversine formula
+    All coordinates and the result are in degrees
+    """
+    ra1, dec1, ra2, dec2 = np.radians(ra1), np.radians(dec1), np.radians(ra2), np.radians(dec2)
+    hav = np.sin((dec2 - dec1) / 2.0) ** 2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2.0) ** 2
+    return np.degrees(2.0 * np.arcsin(np.sqrt(np.clip(hav, 0.0, 1.0))))
+
+
+class CatalogueIndex(object):
+    """
+    Memory mapped index of a catalogue for cone searches
+
+    index_dir (str): Directory with the index files written by ingest_catalogue
+    catalogue (str): FIRST, NVSS or WENSS
+    """
+
+    def __init__(self, index_dir, catalogue):
+        if not has_catalogue(index_dir, catalogue):
+            raise ApercalException("No index of {0} in {1}".format(catalogue, index_dir))
+        source_file, zone_file = get_index_files(index_dir, catalogue)
+        self.catalogue = catalogue
+        self.sources = np.load(source_file, mmap_mode='r')
+        self.offsets = np.load(zone_file)
+        self.stamp = [os.path.getmtime(f) for f in (source_file, zone_file)]
+
+    def get_ra_ranges(self, ra, dec, radius):
+        """
+        Get the RA ranges in degrees that contain all sources of a cone
+        """
+        if abs(dec) + radius >= 90.0:
+            return [(0.0, 360.0)]
+        width = np.degrees(np.arcsin(min(1.0, np.sin(np.radians(radius)) / np.cos(np.radians(dec)))))
+        if width >= 180.0:
+            return [(0.0, 360.0)]
+        low, high = ra - width, ra + width
+        if low < 0.0:
+            return [(low + 360.0, 360.0), (0.0, high)]
+        if high > 360.0:
+            return [(low, 360.0), (0.0, high - 360.0)]
+        return [(low, high)]
+
+    def get_candidates(self, ra, dec, radius):
+        """
+        Get the indices of the sources in the zones and RA ranges overlapping a cone
+        """
+        first_zone, last_zone = get_zone([max(dec - radius, -90.0), min(dec + radius, 90.0)])
+        ranges = self.get_ra_ranges(ra, dec, radius)
+        candidates = []
+        for zone in range(first_zone, last_zone + 1):
+            start, end = self.offsets[zone], self.offsets[zone + 1]
+            if start == end:
+                continue
+            zone_ra = self.sources['RA'][start:end]
+            for low, high in ranges:
+                first = np.searchsorted(zone_ra, low, side='left')
+                last = np.searchsorted(zone_ra, high, side='right')
+                candidates.append(np.arange(start + first, start + last))
+        if len(candidates) == 0:
+            return np.zeros(0, dtype=int)
+        return np.unique(np.concatenate(candidates))
+
+    def query(self, ra, dec, radius, minflux=0.0):
+        """
+        Get the sources in a cone, sorted by their distance to the centre
+
+        ra (float): RA of the centre in degrees
+        dec (float): DEC of the centre in degrees
+        radius (float): Radius of the cone in degrees
+        minflux (float): Only sources brighter than this flux in mJy, like the Vizier column filters
+        returns (numpy.recarray): The sources with the distance to the centre in degrees
+        """
+        candidates = self.sources[self.get_candidates(ra, dec, radius)]
+        dist = angular_distance(ra, dec, candidates['RA'], candidates['DEC'])
+        selected = (dist <= radius) & (candidates['flux'] * 1000.0 > minflux)
+        cat = np.zeros(np.count_nonzero(selected), dtype=RESULT_DTYPE)
+        for name, _ in INDEX_DTYPE:
+            cat[name] = candidates[name][selected]
+        cat['dist'] = dist[selected]
+        cat = cat[np.argsort(cat['dist'], kind='mergesort')]
+        return np.rec.array(cat)
+
+
+# Opened indices by directory and catalogue
+_index_cache = {}
+
+
+def get_index(index_dir, catalogue):
+    """
+    Function to get the index of a catalogue, opening it only once unless it was ingested again
+
+    index_dir (str): Directory with the index files
+    catalogue (str): FIRST, NVSS or WENSS
+    returns (CatalogueIndex): The index
+    """
+    key = (os.path.abspath(index_dir), catalogue)
+    index = _index_cache.get(key)
+    if index is None or index.stamp != [os.path.getmtime(f) for f in get_index_files(index_dir, catalogue)]:
+        index = CatalogueIndex(index_dir, catalogue)
+        _index_cache[key] = index
+    return index
+
+
+def query_index(index_dir, catalogue, ra, dec, radius, minflux=0.0):
+    """
+    Function to do a cone search on the local index of a catalogue
+
+    index_dir (str): Directory with the index files
+    catalogue (str): FIRST, NVSS or WENSS
+    ra (float): RA of the centre in degrees
+    dec (float): DEC of the centre in degrees
+    radius (float): Radius of the cone in degrees
+    minflux (float): Only sources brighter than this flux in mJy
+    returns (numpy.recarray): The sources in the layout of lsm.query_catalogue
+    """
+    return get_index(index_dir, catalogue).query(ra, dec, radius, minflux=minflux)
+
+
+def ingest_synthetic_catalogues(index_dir):
+    """
+    Function to build an index of the bundled synthetic catalogues, for tests without network access
+    returns (list(str)): The ingested catalogues
+    """
+    catalogues = []
+    for catalogue in sorted(CATALOGUE_COLUMNS):
+        filename = os.path.join(SYNTHETIC_CATALOGUE_DIR, 'synthetic_{}.csv'.format(catalogue))
+        if os.path.isfile(filename):
+            ingest_catalogue(filename, catalogue, index_dir)
+            catalogues.append(catalogue)
+    return catalogues
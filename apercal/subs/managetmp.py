@@ -1,9 +1,27 @@
+import errno
+import json
+import logging
 import os
+import shutil
+import socket
+import tempfile
+
+from apercal.exceptions import ApercalException
+
+logger = logging.getLogger(__name__)
+
+# Environment variables to put the scratch areas on a fast filesystem (tmpfs or local disk) and limit their size
+SCRATCH_DIR_VARIABLE = 'APERCAL_SCRATCH_DIR'
+SCRATCH_QUOTA_VARIABLE = 'APERCAL_SCRATCH_QUOTA_GB'
+
+# File in every scratch area with the host and process that created it
+OWNER_FILE = '.owner'
 
 
 def manage_tempdir(subdir):
     """
     Creates a temporary directory if it does not exist and cleans one if it exists
+    The directory is shared by all processes, use ScratchArea for parallel code
     subdir(string): Name of the temporary subdirectory in /apercal/temp/
     returns (string): absolute path of temporary directory
     """
@@ -20,7 +38,7 @@ def create_tempdir(subdir):
     """
     tempdir = os.path.expanduser('~') + '/apercal/temp/' + str(subdir)
     if not os.path.exists(tempdir):
-        os.system('mkdir -p ' + tempdir)
+        os.makedirs(tempdir)
     return tempdir
 
 
@@ -31,5 +49,180 @@ def clean_tempdir(subdir):
     returns (string): absolute path of temporary directory
     """
     tempdir = os.path.expanduser('~') + '/apercal/temp/' + str(subdir)
-    os.system('rm -rf ' + tempdir + '/*')
+    if os.path.isdir(tempdir):
+        for name in os.listdir(tempdir):
+            remove_path(os.path.join(tempdir, name))
     return tempdir
+
+
+def remove_path(path):
+    """
+    Function to remove a file or a directory tree, ignoring files that are already gone
+    path (string): File or directory to remove
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_scratch_root():
+    """
+    Function to get the directory of the scratch areas
+    returns (string): $APERCAL_SCRATCH_DIR or apercal_scratch in the default temporary directory
+    """
+    root = os.environ.get(SCRATCH_DIR_VARIABLE)
+    if not root:
+        root = os.path.join(tempfile.gettempdir(), 'apercal_scratch')
+    if not os.path.isdir(root):
+        try:
+            os.makedirs(root)
+        except OSError:
+            # created by another process in the meantime
+            if not os.path.isdir(root):
+                raise
+    return root
+
+
+def get_scratch_quota():
+    """
+    Function to get the maximum size of all scratch areas
+    returns (int): $APERCAL_SCRATCH_QUOTA_GB in bytes, None for no limit
+    """
+    quota = os.environ.get(SCRATCH_QUOTA_VARIABLE)
+    if not quota:
+        return None
+    return int(float(quota) * 1024 ** 3)
+
+
+def get_usage(path):
+    """
+    Function to get the size of all files in a directory tree
+    path (string): The directory
+    returns (int): The size in bytes
+    """
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def process_exists(pid):
+    """
+    Function to check whether a process is running on this host
+    pid (int): The process id
+    returns (bool): False only if the process certainly does not exist
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def reclaim_scratch(root=None):
+    """
+    Function to remove the scratch areas of processes on this host that no longer run
+    root (string): Directory of the scratch areas, default from get_scratch_root
+    returns (int): Number of removed scratch areas
+    """
+    if root is None:
+        root = get_scratch_root()
+    hostname = socket.gethostname()
+    reclaimed = 0
+    for name in os.listdir(root):
+        area = os.path.join(root, name)
+        try:
+            with open(os.path.join(area, OWNER_FILE)) as f:
+                owner = json.load(f)
+        except (IOError, OSError, ValueError):
+            continue
+        if owner['host'] == hostname and not process_exists(owner['pid']):
+            logger.debug("Removing scratch area {0} of finished process {1}".format(area, owner['pid']))
+            remove_path(area)
+            reclaimed += 1
+    return reclaimed
+
+
+class ScratchArea(object):
+    """
+    Temporary directory that belongs to a single process and is removed when it is left
+
+    Use as a context manager and get the names of the files in it from add:
+
+        area = ScratchArea('imstats')
+        with area:
+            fits.out = area.add('image.fits')
+
+    Areas left behind by crashed processes are removed when a new area is created. If a
+    quota is set, creating an area or adding a file fails when all areas together exceed
+    it. Files grow after they were added, so the quota limits the usage before each new
+    file and not the final size of the areas.
+
+    name (string): Name of the area, for example the calling module and beam
+    root (string): Directory of the scratch areas, default from get_scratch_root
+    quota (int): Maximum size of all scratch areas in bytes, default from get_scratch_quota
+    """
+
+    def __init__(self, name, root=None, quota=None):
+        self.name = str(name)
+        self.root = root if root is not None else get_scratch_root()
+        self.quota = quota if quota is not None else get_scratch_quota()
+        self.path = None
+
+    def __enter__(self):
+        return self.create()
+
+    def __exit__(self, *args):
+        self.remove()
+
+    def create(self):
+        """
+        Create the scratch area
+        returns (string): absolute path of the scratch area
+        """
+        reclaim_scratch(self.root)
+        self.check_quota()
+        self.path = tempfile.mkdtemp(prefix='{0}_{1}_'.format(self.name, os.getpid()), dir=self.root)
+        with open(os.path.join(self.path, OWNER_FILE), 'w') as f:
+            json.dump({'host': socket.gethostname(), 'pid': os.getpid()}, f)
+        return self.path
+
+    def add(self, filename):
+        """
+        Get the name of a new file or directory in the scratch area after checking the quota
+        filename (string): Name of the file in the scratch area
+        returns (string): absolute path of the file
+        """
+        if self.path is None:
+            raise ApercalException("Scratch area {} has not been created".format(self.name))
+        self.check_quota()
+        return os.path.join(self.path, filename)
+
+    def remove(self):
+        """
+        Remove the scratch area and everything in it
+        """
+        if self.path is not None:
+            remove_path(self.path)
+            self.path = None
+
+    def check_quota(self):
+        """
+        Raise an ApercalException if the scratch areas use more than the quota
+        """
+        if self.quota is None:
+            return
+        usage = get_usage(self.root)
+        if usage > self.quota:
+            error = "Scratch areas in {0} use {1} bytes, more than the quota of {2} bytes".format(
+                self.root, usage, self.quota)
+            logger.error(error)
+            raise ApercalException(error)
@@ -4,9 +4,11 @@ import numpy as np
 import bdsf
 import astropy.io.fits as pyfits
 
+from apercal.libs import calculations
 from apercal.libs import lib
 from apercal.subs import imstats
 from apercal.subs import managefiles
+from apercal.subs import managetmp
 from apercal.subs import convim
 from apercal.subs import qa
 from apercal.exceptions import ApercalException
@@ -93,6 +95,7 @@ def calc_dr_amp(drstart, dr0, minorcycles, function_):
 def get_theoretical_noise(self, dataset, gausslimit, startchan=None, endchan=None):
     """
     Subroutine to create a Stokes V image from a dataset and measure the noise, which should be similar to the theoretical one
+    If the Stokes V image is not gaussian, the noise from the radiometer equation is used instead.
     image (string): The path to the dataset file.
     startchan(int): First channel to use for imaging, zero-based
     endchan(int): Last channel to use for imaging, zero-based
@@ -120,6 +123,18 @@ def get_theoretical_noise(self, dataset, gausslimit, startchan=None, endchan=Non
         managefiles.director(self, 'rm', 'vbeam')
     else:
         raise ApercalException('Stokes V image was not created successfully. Cannot calculate theoretical noise! No iterative selfcal possible!')
+    if not gaussianity:
+        try:
+            if startchan is not None and endchan is not None:
+                noise = calculations.calc_chunk_noise(dataset, startchan, endchan)
+            else:
+                noise = calculations.calc_theoretical_noise(dataset)
+        except ApercalException as e:
+            logger.warning('Could not calculate the theoretical noise with the radiometer equation: ' + str(e))
+        else:
+            if np.isfinite(noise):
+                logger.info('Using the theoretical noise of ' + '%.6f' % noise + ' Jy from the radiometer equation instead of the Stokes V noise')
+                vstd = noise
     return gaussianity, vstd
 
 
@@ -234,7 +249,8 @@ def create_mask(self, image, mask, threshold, theoretical_noise, beampars=None,
     threshold (float): Threshold in Jy to use
     theoretical_noise (float): Theoretical noise for calculating the adaptive threshold parameter inside pybdsf
     """
-    convim.mirtofits(image, image + '.fits')
+    data, header = convim.mirtonumpy(image)
+    pyfits.writeto(image + '.fits', data, header, overwrite=True)
     bdsf_threshold = threshold / theoretical_noise
     if beampars:
 #        bdsf.process_image(image + '.fits', stop_at='isl', thresh_isl=bdsf_threshold, beam=beampars, adaptive_rms_box=True, rms_map=rms_map).export_image(outfile=mask + '.fits', img_format='fits', img_type='island_mask', pad_image=True)
@@ -243,23 +259,14 @@ def create_mask(self, image, mask, threshold, theoretical_noise, beampars=None,
         bdsf.process_image(image + '.fits', stop_at='isl', thresh_isl=bdsf_threshold, adaptive_rms_box=True, rms_map=False, rms_value=theoretical_noise).export_image(outfile=mask + '.fits', img_format='fits', img_type='island_mask', pad_image=True)
     if os.path.isfile(mask + '.fits'):
         # Add a random number to the masks to make it viewable in kvis
-        fitsmask = pyfits.open(mask + '.fits')
-        fitsmask_data = fitsmask[0].data
-        fitsmask_hdr = fitsmask[0].header
-        rand_array = np.random.rand(int(fitsmask_hdr['NAXIS1']), int(fitsmask_hdr['NAXIS2']))
-        fitsmask[0].data = np.multiply(rand_array, fitsmask_data)
-        fitsmask.writeto(mask + '.fits', clobber=True)
-        # Convert mask to MIRIAD and generate a usable one for MIRIAD
-        convim.fitstomir(mask + '.fits', mask + '_pybdsf')
-        maths = lib.miriad('maths')
-        maths.out = mask
-        maths.exp = '"<' + mask + '_pybdsf>"'
-        maths.mask = '"<' + mask + '_pybdsf>.gt.0' + '"'
-        maths.go()
+        fitsmask_data = pyfits.getdata(mask + '.fits')
+        rand_array = np.random.rand(fitsmask_data.shape[-2], fitsmask_data.shape[-1])
+        maskdata = np.multiply(rand_array, fitsmask_data)
+        # Write the mask as MIRIAD image with the pixels outside of the islands blanked
+        convim.numpytomir(np.where(maskdata > 0, maskdata, np.nan), mask, template=image)
         managefiles.director(self, 'rm', image + '.fits.pybdsf.log')
         managefiles.director(self, 'rm', image + '.fits')
         managefiles.director(self, 'rm', mask + '.fits')
-        managefiles.director(self, 'rm', mask + '_pybdsf')
     else:
         pass
 
@@ -271,30 +278,28 @@ def get_beam(self, image, beam):
     beam (string): Beam image for cleaning in MIRIAD format
     return (tuple): Synthesised beam parameters in the order bmaj, bmin, bpa
     """
-    clean = lib.miriad('clean')
-    clean.map = image
-    clean.beam = beam
-    clean.out = 'tmp_beampars.cl'
-    clean.niters = 1
-    clean.region = 'quarter'
-    clean.go()
-    restor = lib.miriad('restor')  # Create the restored image
-    restor.model = 'tmp_beampars.cl'
-    restor.beam = beam
-    restor.map = image
-    restor.out = 'tmp_beampars.rstr'
-    restor.mode = 'clean'
-    restor.go()
-    convim.mirtofits('tmp_beampars.rstr', 'tmp_beampars.fits')
-    pyfile = pyfits.open('tmp_beampars.fits')
-    header = pyfile[0].header
+    # work in a scratch area of this process so that beams processed in parallel do not collide
+    scratch = managetmp.ScratchArea('beampars')
+    with scratch:
+        clean = lib.miriad('clean')
+        clean.map = image
+        clean.beam = beam
+        clean.out = scratch.add('tmp_beampars.cl')
+        clean.niters = 1
+        clean.region = 'quarter'
+        clean.go()
+        restor = lib.miriad('restor')  # Create the restored image
+        restor.model = clean.out
+        restor.beam = beam
+        restor.map = image
+        restor.out = scratch.add('tmp_beampars.rstr')
+        restor.mode = 'clean'
+        restor.go()
+        header = convim.get_fits_header(restor.out)
     bmaj = header['BMAJ']
     bmin = header['BMIN']
     bpa = header['BPA']
     beampars = bmaj, bmin, bpa
-    managefiles.director(self, 'rm', 'tmp_beampars.cl')
-    managefiles.director(self, 'rm', 'tmp_beampars.rstr')
-    managefiles.director(self, 'rm', 'tmp_beampars.fits')
     return beampars
 
 
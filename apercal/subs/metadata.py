@@ -0,0 +1,247 @@
+"""
+Module to keep an index of the observation metadata of MIRIAD uv datasets and Measurement Sets.
+
+The metadata (number of channels, frequencies, channel width, antennas, source names, pointing,
+system temperature and integration time) is extracted once per version of a dataset and kept in
+a small JSON sidecar file in the directory of the dataset. The entries are keyed by the name of
+the dataset and the modification time and size of its files, so they are extracted again after
+the dataset changed. Frequencies are in GHz and coordinates in radians, like in MIRIAD.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+from apercal.libs import lib
+from apercal.subs import mirio
+from apercal.exceptions import ApercalException
+
+logger = logging.getLogger(__name__)
+
+# Name of the sidecar file with the metadata of all datasets in a directory
+SIDECAR_FILE = '.apercal_metadata.json'
+
+# Metadata by dataset that was read before, with the stamp it belongs to
+_metadata_cache = {}
+
+
+def get_stamp(dataset):
+    """
+    Function to get the latest modification time and the total size of the files of a dataset
+    The files of the subtables of Measurement Sets are included.
+    dataset (str): The MIRIAD dataset or Measurement Set
+    returns (list): Modification time and size, changing whenever the dataset is changed
+    """
+    mtime = os.path.getmtime(dataset)
+    size = 0
+    for name in os.listdir(dataset):
+        path = os.path.join(dataset, name)
+        names = [os.path.join(path, subname) for subname in os.listdir(path)] if os.path.isdir(path) else []
+        for filename in [path] + names:
+            status = os.stat(filename)
+            mtime = max(mtime, status.st_mtime)
+            size += status.st_size
+    return [mtime, size]
+
+
+def is_ms(dataset):
+    """
+    Function to check whether a dataset is a Measurement Set
+    """
+    return os.path.isdir(os.path.join(dataset, 'SPECTRAL_WINDOW'))
+
+
+def to_list(value):
+    return [v.item() if hasattr(v, 'item') else v for v in np.atleast_1d(value)]
+
+
+def read_miriad_metadata(dataset):
+    """
+    Function to extract the metadata of a MIRIAD uv dataset from the first record of its visibilities
+    dataset (str): The MIRIAD uv dataset
+    returns (dict): The metadata
+    """
+    variables = mirio.read_first_record(dataset)
+    nschan = to_list(variables['nschan'])
+    sfreq = to_list(variables['sfreq'])
+    sdf = to_list(variables['sdf'])
+    tsys = np.asarray(variables.get('systemp', np.nan), dtype=float)
+    tsys = tsys[np.isfinite(tsys) & (tsys > 0)]
+    metadata = {'format': 'miriad',
+                'nchan': int(nschan[0]),
+                'nschan': nschan,
+                'sfreq': sfreq,
+                'sdf': sdf,
+                'restfreq': float(np.atleast_1d(variables.get('freq', sfreq[0]))[0]),
+                'nants': int(variables['nants']) if 'nants' in variables else None,
+                'source': variables.get('source'),
+                'ra': float(variables['ra']),
+                'dec': float(variables['dec']),
+                'tsys': float(np.median(tsys)) if len(tsys) > 0 else None,
+                'jyperk': float(variables['jyperk']) if 'jyperk' in variables else None,
+                'inttime': float(variables['inttime']) if 'inttime' in variables else None}
+    return metadata
+
+
+def read_source_names(vis):
+    """
+    Function to get the names of the sources in a MIRIAD uv dataset from the output of UVINDEX
+    vis (str): The MIRIAD uv dataset
+    returns (list(str)): The source names
+    """
+    u = lib.masher(task='uvindex', vis=vis)
+    i = [i for i in range(0, len(u)) if "pointing" in u[i]]
+    N = len(u)
+    s_raw = u[int(i[0] + 2):N - 2]
+    sources = []
+    for s in s_raw:
+        sources.append(s.replace('  ', ' ').split(' ')[0])
+    return sources[0:-1]
+
+
+def read_ms_metadata(msname):
+    """
+    Function to extract the metadata of a Measurement Set from its subtables
+    msname (str): The Measurement Set
+    returns (dict): The metadata
+    """
+    import casacore.tables as pt
+
+    spectralwindowtable = pt.table(msname + '::SPECTRAL_WINDOW', ack=False)
+    chan_freq = spectralwindowtable.getcol('CHAN_FREQ')
+    chan_width = spectralwindowtable.getcol('CHAN_WIDTH')
+    spectralwindowtable.close()
+    antennatable = pt.table(msname + '::ANTENNA', ack=False)
+    antennas = [str(name) for name in antennatable.getcol('NAME')]
+    antennatable.close()
+    fieldtable = pt.table(msname + '::FIELD', ack=False)
+    sources = [str(name) for name in fieldtable.getcol('NAME')]
+    phasedir = fieldtable.getcol('PHASE_DIR')[0, 0]
+    fieldtable.close()
+    maintable = pt.table(msname, ack=False)
+    inttime = float(maintable.getcell('INTERVAL', 0)) if maintable.nrows() > 0 else None
+    maintable.close()
+    # the rest frequency of the first line of the source, the first frequency like MIRIAD without one
+    restfreq = float(chan_freq[0, 0])
+    if os.path.isdir(os.path.join(msname, 'SOURCE')):
+        sourcetable = pt.table(msname + '::SOURCE', ack=False)
+        if 'REST_FREQUENCY' in sourcetable.colnames() and sourcetable.nrows() > 0 and \
+                sourcetable.iscelldefined('REST_FREQUENCY', 0):
+            values = np.atleast_1d(sourcetable.getcell('REST_FREQUENCY', 0))
+            values = values[values > 0]
+            if len(values) > 0:
+                restfreq = float(values[0])
+        sourcetable.close()
+    tsys = None
+    if os.path.isdir(os.path.join(msname, 'SYSCAL')):
+        syscaltable = pt.table(msname + '::SYSCAL', ack=False)
+        if 'TSYS' in syscaltable.colnames() and syscaltable.nrows() > 0:
+            values = syscaltable.getcol('TSYS')
+            values = values[np.isfinite(values) & (values > 0)]
+            tsys = float(np.median(values)) if len(values) > 0 else None
+        syscaltable.close()
+    metadata = {'format': 'ms',
+                'nchan': int(chan_freq.shape[1]),
+                'nschan': [int(chan_freq.shape[1])] * chan_freq.shape[0],
+                'sfreq': to_list(chan_freq[:, 0] / 1e9),
+                'sdf': to_list(chan_width[:, 0] / 1e9),
+                'restfreq': restfreq / 1e9,
+                'nants': len(antennas),
+                'antennas': antennas,
+                'source': sources[0],
+                'sources': sources,
+                'ra': float(phasedir[0]),
+                'dec': float(phasedir[1]),
+                'tsys': tsys,
+                'jyperk': None,
+                'inttime': inttime}
+    return metadata
+
+
+def extract_metadata(dataset):
+    """
+    Function to extract the metadata of a MIRIAD uv dataset or a Measurement Set
+    """
+    if mirio.is_uv_dataset(dataset):
+        return read_miriad_metadata(dataset)
+    if is_ms(dataset):
+        return read_ms_metadata(dataset)
+    raise ApercalException("{} is neither a MIRIAD uv dataset nor a Measurement Set".format(dataset))
+
+
+def get_sidecar_file(dataset):
+    return os.path.join(os.path.dirname(os.path.abspath(dataset)), SIDECAR_FILE)
+
+
+def read_sidecar(sidecar_file):
+    try:
+        with open(sidecar_file) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def write_sidecar(dataset, stamp, metadata):
+    """
+    Function to store the metadata of a dataset in the sidecar file of its directory
+    The file is read again and replaced at once, so entries of other processes are kept.
+    """
+    sidecar_file = get_sidecar_file(dataset)
+    entries = read_sidecar(sidecar_file)
+    entries[os.path.basename(os.path.abspath(dataset))] = {'stamp': stamp, 'metadata': metadata}
+    tmp_file = '{0}.{1}.tmp'.format(sidecar_file, os.getpid())
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(entries, f, indent=1, sort_keys=True)
+        os.rename(tmp_file, sidecar_file)
+    except (IOError, OSError) as e:
+        logger.debug("Could not write the metadata of {0} to {1} ({2})".format(dataset, sidecar_file, e))
+
+
+def get_metadata(dataset):
+    """
+    Function to get the metadata of a dataset, extracting it only once per version of the dataset
+
+    dataset (str): The MIRIAD uv dataset or Measurement Set
+    returns (dict): The metadata with the keys nchan, nschan, sfreq and sdf (per spectral window, in GHz),
+                    restfreq, nants, source, ra, dec (in radians), tsys (median in K), jyperk and inttime
+                    (in seconds). Values that are not in the dataset are None.
+    """
+    key = os.path.abspath(dataset)
+    stamp = get_stamp(dataset)
+    cached = _metadata_cache.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    entry = read_sidecar(get_sidecar_file(dataset)).get(os.path.basename(key))
+    if entry is not None and entry['stamp'] == stamp:
+        metadata = entry['metadata']
+    else:
+        logger.debug("Extracting the metadata of {}".format(dataset))
+        metadata = extract_metadata(dataset)
+        write_sidecar(dataset, stamp, metadata)
+    _metadata_cache[key] = (stamp, metadata)
+    return metadata
+
+
+def get_source_names(dataset):
+    """
+    Function to get the names of all sources of a dataset
+    For MIRIAD datasets UVINDEX is only run the first time and the names are added to the metadata.
+    """
+    metadata = get_metadata(dataset)
+    if 'sources' not in metadata:
+        metadata['sources'] = read_source_names(dataset)
+        write_sidecar(dataset, get_stamp(dataset), metadata)
+    return metadata['sources']
+
+
+def get_channel_freqs(dataset):
+    """
+    Function to get the frequencies of all channels of a dataset
+    returns (numpy.ndarray): Frequencies of the channels of all spectral windows in GHz
+    """
+    metadata = get_metadata(dataset)
+    return np.concatenate([sfreq + np.arange(nschan) * sdf for nschan, sfreq, sdf in
+                           zip(metadata['nschan'], metadata['sfreq'], metadata['sdf'])])
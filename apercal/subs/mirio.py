@@ -0,0 +1,566 @@
+"""
+Module to read and write the items of MIRIAD datasets without MIRIAD tasks.
+
+A MIRIAD dataset is a directory of items. Small items (at most 64 bytes)
+are kept together in the `header` item as a stream of records of a 16 byte
+header (name padded with zeros, last byte the size of the item) followed by
+the item data padded to a multiple of 16 bytes. Larger items are files in
+the dataset directory. The data of a typed item starts with a 4 byte type
+code followed by the big-endian value, aligned to the size of its type.
+
+The visibilities of uv datasets are in the `visdata` item as a stream of
+variable updates. The `vartable` item lists the type and name of the
+variables in the order of their numbers. The flags of the correlations
+are in the `flags` mask item, 31 values per integer after a 4 byte header.
+"""
+
+import collections
+import logging
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from apercal.exceptions import ApercalException
+
+logger = logging.getLogger(__name__)
+
+# Size of the record header and the alignment of the header item
+ITEM_HDR_SIZE = 16
+
+# Items up to this size are stored in the header item
+MAX_CACHED_SIZE = 64
+
+# Type codes of typed items and their names
+H_BYTE = 1
+H_INT = 2
+H_INT2 = 3
+H_REAL = 4
+H_DBLE = 5
+H_TXT = 6
+H_CMPLX = 7
+H_INT8 = 8
+
+TYPE_NAMES = {H_BYTE: 'text', H_INT: 'int', H_INT2: 'int2', H_REAL: 'real', H_DBLE: 'double',
+              H_TXT: 'text', H_CMPLX: 'complex', H_INT8: 'int8'}
+
+TYPE_CODES = {'text': H_BYTE, 'int': H_INT, 'int2': H_INT2, 'real': H_REAL, 'double': H_DBLE,
+              'complex': H_CMPLX, 'int8': H_INT8}
+
+# Big-endian numpy types and sizes of the typed items
+NUMPY_TYPES = {H_INT: '>i4', H_INT2: '>i2', H_REAL: '>f4', H_DBLE: '>f8', H_CMPLX: '>c8', H_INT8: '>i8'}
+
+# Type characters of the vartable of uv datasets
+VARTABLE_TYPES = {'a': H_BYTE, 'i': H_INT, 'j': H_INT2, 'r': H_REAL, 'd': H_DBLE, 'c': H_CMPLX, 'l': H_INT8}
+
+# Tokens of the visdata stream and its alignment
+UV_ALIGN = 8
+UV_HDR_SIZE = 4
+VAR_SIZE = 0
+VAR_DATA = 1
+VAR_EOR = 2
+
+
+def roundup(size, alignment):
+    return ((size + alignment - 1) // alignment) * alignment
+
+
+def get_type_size(type_code):
+    """
+    Get the size of a value of a type, 1 for text
+    """
+    if type_code in NUMPY_TYPES:
+        return np.dtype(NUMPY_TYPES[type_code]).itemsize
+    return 1
+
+
+def decode_item(data):
+    """
+    Decode the data of a typed item
+
+    data (bytes): Data of the item including the type code
+    returns: str, int, float, complex or an array for several values, the raw data for binary items
+    """
+    if len(data) < 4:
+        return data
+    type_code = struct.unpack('>i', data[:4])[0]
+    if type_code in (H_BYTE, H_TXT):
+        return data[4:].decode('ascii').rstrip('\x00')
+    if type_code not in NUMPY_TYPES:
+        return data
+    start = roundup(4, get_type_size(type_code))
+    values = np.frombuffer(data[start:], dtype=NUMPY_TYPES[type_code])
+    if len(values) == 1:
+        return values[0].item()
+    return values
+
+
+def encode_item(value, type_code):
+    """
+    Encode a value as a typed item
+
+    value: Value of the item, a sequence for several values
+    type_code (int): Type of the item
+    returns (bytes): Data of the item including the type code
+    """
+    header = struct.pack('>i', type_code)
+    if type_code in (H_BYTE, H_TXT):
+        return header + str(value).encode('ascii')
+    if type_code not in NUMPY_TYPES:
+        raise ApercalException("Cannot encode items of type {}".format(type_code))
+    start = roundup(4, get_type_size(type_code))
+    values = np.atleast_1d(np.asarray(value)).astype(NUMPY_TYPES[type_code])
+    return header + b'\x00' * (start - 4) + values.tobytes()
+
+
+def get_item_type(data):
+    """
+    Get the type code of the data of an item, None for binary items
+    """
+    if len(data) < 4:
+        return None
+    type_code = struct.unpack('>i', data[:4])[0]
+    return type_code if type_code in TYPE_NAMES else None
+
+
+def read_header_stream(filename):
+    """
+    Read the records of a header item
+
+    returns (OrderedDict): Data of the items by name in the order of the file
+    """
+    items = collections.OrderedDict()
+    with open(filename, 'rb') as f:
+        stream = f.read()
+    offset = 0
+    while offset + ITEM_HDR_SIZE <= len(stream):
+        record = stream[offset:offset + ITEM_HDR_SIZE]
+        name = record[:ITEM_HDR_SIZE - 1].split(b'\x00')[0].decode('ascii')
+        size = bytearray(record[ITEM_HDR_SIZE - 1:])[0]
+        offset += ITEM_HDR_SIZE
+        items[name] = stream[offset:offset + size]
+        offset += roundup(size, ITEM_HDR_SIZE)
+    return items
+
+
+def write_header_stream(filename, items):
+    """
+    Write the records of a header item, replacing the old file at once
+
+    items (OrderedDict): Data of the items by name
+    """
+    records = []
+    for name, data in items.items():
+        encoded_name = name.encode('ascii')
+        if len(encoded_name) >= ITEM_HDR_SIZE - 1 or len(data) > MAX_CACHED_SIZE:
+            raise ApercalException("Item {} does not fit into the header".format(name))
+        records.append(encoded_name + b'\x00' * (ITEM_HDR_SIZE - 1 - len(encoded_name)) +
+                       struct.pack('B', len(data)))
+        records.append(data + b'\x00' * (roundup(len(data), ITEM_HDR_SIZE) - len(data)))
+    tmp_file = '{0}.{1}.tmp'.format(filename, os.getpid())
+    with open(tmp_file, 'wb') as f:
+        f.write(b''.join(records))
+    os.rename(tmp_file, filename)
+
+
+class MiriadHeader(object):
+    """
+    Header items of a MIRIAD dataset
+
+    Items are read from the header item and, for larger items, from their own file.
+    Changes are written with save.
+
+    dataset (str): Directory of the MIRIAD dataset
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.header_file = os.path.join(dataset, 'header')
+        if not os.path.isfile(self.header_file):
+            raise ApercalException("{} is not a MIRIAD dataset".format(dataset))
+        self.items = read_header_stream(self.header_file)
+        self.modified = False
+        self.stamp = get_stamp(self.header_file)
+
+    def __contains__(self, name):
+        return name in self.items or os.path.isfile(os.path.join(self.dataset, name))
+
+    def __getitem__(self, name):
+        return decode_item(self.get_data(name))
+
+    def __setitem__(self, name, value):
+        self.set(name, value)
+
+    def get_data(self, name):
+        """
+        Get the raw data of an item
+        """
+        if name in self.items:
+            return self.items[name]
+        item_file = os.path.join(self.dataset, name)
+        if name != 'header' and os.path.isfile(item_file):
+            with open(item_file, 'rb') as f:
+                return f.read()
+        raise KeyError("Item {0} not found in {1}".format(name, self.dataset))
+
+    def get(self, name, default=None):
+        """
+        Get the value of an item or the default if the item does not exist
+        """
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def get_type(self, name):
+        """
+        Get the name of the type of an item, None for binary items
+        """
+        type_code = get_item_type(self.get_data(name))
+        return TYPE_NAMES.get(type_code)
+
+    def set(self, name, value, type_name=None):
+        """
+        Set the value of an item
+
+        The type of an existing item is kept unless type_name is given. New items are
+        text for strings, int for integers and real for other numbers like puthd does.
+
+        name (str): Name of the item
+        value: The value
+        type_name (str): One of text, int, int2, real, double, complex, int8
+        """
+        if type_name is not None:
+            type_code = TYPE_CODES[type_name]
+        elif name in self and get_item_type(self.get_data(name)) is not None:
+            type_code = get_item_type(self.get_data(name))
+        elif isinstance(value, str):
+            type_code = H_BYTE
+        elif isinstance(value, (bool, int, np.integer)):
+            type_code = H_INT
+        elif isinstance(value, complex):
+            type_code = H_CMPLX
+        else:
+            type_code = H_REAL
+        data = encode_item(value, type_code)
+        item_file = os.path.join(self.dataset, name)
+        if len(data) > MAX_CACHED_SIZE:
+            with open(item_file, 'wb') as f:
+                f.write(data)
+            self.items.pop(name, None)
+        else:
+            if os.path.isfile(item_file):
+                os.remove(item_file)
+            self.items[name] = data
+        self.modified = True
+
+    def delete(self, name):
+        """
+        Delete an item
+        """
+        if name in self.items:
+            del self.items[name]
+            self.modified = True
+        elif os.path.isfile(os.path.join(self.dataset, name)):
+            os.remove(os.path.join(self.dataset, name))
+
+    def save(self):
+        """
+        Write the header item if items were changed
+        """
+        if self.modified:
+            write_header_stream(self.header_file, self.items)
+            self.modified = False
+            self.stamp = get_stamp(self.header_file)
+
+
+def get_stamp(filename):
+    """
+    Get the size and modification time of a file to detect changes
+    """
+    status = os.stat(filename)
+    return status.st_size, status.st_mtime, status.st_ino
+
+
+# Headers by dataset that were read before
+_header_cache = {}
+
+
+def get_header(dataset):
+    """
+    Get the header items of a dataset, reading them only if the header changed since the last call
+
+    dataset (str): Directory of the MIRIAD dataset
+    returns (MiriadHeader): The header items
+    """
+    key = os.path.abspath(dataset)
+    header = _header_cache.get(key)
+    if header is not None and not header.modified:
+        try:
+            if get_stamp(header.header_file) == header.stamp:
+                return header
+        except OSError:
+            pass
+    header = MiriadHeader(dataset)
+    _header_cache[key] = header
+    return header
+
+
+def read_vartable(dataset):
+    """
+    Read the variables of a uv dataset
+
+    returns (list(tuple)): Type code and name of the variables in the order of their numbers
+    """
+    with open(os.path.join(dataset, 'vartable')) as f:
+        lines = f.read().split('\n')
+    variables = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 2:
+            variables.append((VARTABLE_TYPES[fields[0]], fields[1]))
+    return variables
+
+
+def read_first_record(dataset):
+    """
+    Read the values of the variables of the first record of a uv dataset
+
+    returns (dict): Values by variable name, as str, a scalar or an array for several values
+    """
+    variables = read_vartable(dataset)
+    lengths = [0] * len(variables)
+    values = {}
+    with open(os.path.join(dataset, 'visdata'), 'rb') as f:
+        offset = 0
+        while True:
+            f.seek(offset)
+            token = bytearray(f.read(UV_HDR_SIZE))
+            if len(token) < UV_HDR_SIZE:
+                raise ApercalException("No complete record in {}".format(dataset))
+            varnum, kind = token[0], token[2]
+            if kind == VAR_EOR:
+                break
+            type_code, name = variables[varnum]
+            if kind == VAR_SIZE:
+                lengths[varnum] = struct.unpack('>i', f.read(4))[0]
+                offset += UV_HDR_SIZE + 4
+            elif kind == VAR_DATA:
+                start = roundup(UV_HDR_SIZE, get_type_size(type_code))
+                f.seek(offset + start)
+                data = f.read(lengths[varnum])
+                if type_code == H_BYTE:
+                    values[name] = data.decode('ascii').rstrip('\x00')
+                else:
+                    array = np.frombuffer(data, dtype=NUMPY_TYPES[type_code])
+                    values[name] = array[0].item() if len(array) == 1 else array
+                offset += start + lengths[varnum]
+            else:
+                raise ApercalException("Unknown token {0} in the visibilities of {1}".format(kind, dataset))
+            offset = roundup(offset, UV_ALIGN)
+    return values
+
+
+# First records of uv datasets that were read before
+_record_cache = {}
+
+
+def get_uv_variables(dataset):
+    """
+    Get the variables of the first record of a uv dataset, reading them only once per version of the data
+
+    dataset (str): Directory of the MIRIAD uv dataset
+    returns (dict): Values of the variables by name
+    """
+    key = os.path.abspath(dataset)
+    stamp = get_stamp(os.path.join(dataset, 'visdata'))
+    cached = _record_cache.get(key)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, read_first_record(dataset))
+        _record_cache[key] = cached
+    return cached[1]
+
+
+def is_uv_dataset(dataset):
+    """
+    Check whether a dataset contains visibilities
+    """
+    return os.path.isfile(os.path.join(dataset, 'visdata'))
+
+
+def parse_uv_record(stream, offset, variables, lengths, values, wanted):
+    """
+    Parse the tokens of one record of the visdata stream
+
+    stream (numpy.ndarray): The visdata item as bytes
+    offset (int): Position of the first token of the record
+    variables (list(tuple)): Type code and name of the variables from read_vartable
+    lengths (list(int)): Current size of every variable in bytes, updated in place
+    values (dict): Current values of the wanted variables by number, updated in place
+    wanted (set(int)): Numbers of the variables to read
+    returns (int, list(tuple), list(tuple)): The position after the record or None if the stream ends
+        before the end of the record, the ranges with the token headers and sizes of the record, and
+        the position, size and number of the wanted variables in the record
+    """
+    first = offset
+    layout = []
+    fields = []
+    while offset + UV_HDR_SIZE <= len(stream):
+        varnum, kind = int(stream[offset]), int(stream[offset + 2])
+        layout.append((offset - first, UV_HDR_SIZE))
+        if kind == VAR_EOR:
+            return roundup(offset + UV_HDR_SIZE, UV_ALIGN), layout, fields
+        type_code, name = variables[varnum]
+        if kind == VAR_SIZE:
+            lengths[varnum] = int(stream[offset + UV_HDR_SIZE:offset + UV_HDR_SIZE + 4].view('>i4')[0])
+            layout.append((offset - first + UV_HDR_SIZE, 4))
+            offset += UV_HDR_SIZE + 4
+        elif kind == VAR_DATA:
+            start = offset + roundup(UV_HDR_SIZE, get_type_size(type_code))
+            if varnum in wanted:
+                values[varnum] = stream[start:start + lengths[varnum]].view(NUMPY_TYPES[type_code]).astype(float)
+                fields.append((start - first, lengths[varnum], varnum))
+            offset = start + lengths[varnum]
+        else:
+            raise ApercalException("Unknown token {} in the visibilities".format(kind))
+        offset = roundup(offset, UV_ALIGN)
+    return None, layout, fields
+
+
+def count_repeated_records(stream, offset, length, layout, block_records=65536):
+    """
+    Count the records following a record that have the same tokens and sizes
+
+    stream (numpy.ndarray): The visdata item as bytes
+    offset (int): Position of the record after the parsed record
+    length (int): Length of the parsed record in bytes
+    layout (list(tuple)): Ranges with the token headers and sizes of the parsed record
+    block_records (int): Number of records compared at once
+    returns (int): The number of records with the same layout
+    """
+    index = np.concatenate([np.arange(start, start + size) for start, size in layout])
+    expected = stream[offset - length + index]
+    count = 0
+    available = (len(stream) - offset) // length
+    while count < available:
+        nrecords = min(block_records, available - count)
+        starts = offset + (count + np.arange(nrecords)) * length
+        same = np.all(stream[starts[:, np.newaxis] + index] == expected, axis=1)
+        if not np.all(same):
+            return count + int(np.argmin(same))
+        count += nrecords
+    return count
+
+
+def read_uv_records(dataset, names):
+    """
+    Read numerical variables of all records of a uv dataset without reading the correlations
+
+    Consecutive records with the same tokens, e.g. all baselines of an integration, are
+    only parsed once and their variables are read for all of them at once.
+
+    dataset (str): Directory of the MIRIAD uv dataset
+    names (list(str)): Numerical variables to read
+    returns (dict): For every variable in the dataset an array with a row of values for every record, NaN
+        before the variable is set, and nchan, the number of correlations of every record
+    """
+    variables = read_vartable(dataset)
+    wanted = set(number for number, (type_code, name) in enumerate(variables)
+                 if name in names and type_code in NUMPY_TYPES and name not in ('corr', 'wcorr'))
+    corr = [number for number, (_, name) in enumerate(variables) if name == 'corr']
+    corr = corr[0] if corr else None
+    lengths = [0] * len(variables)
+    values = {}
+    segments = []
+    filename = os.path.join(dataset, 'visdata')
+    if os.path.getsize(filename) > 0:
+        with open(filename, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            stream = np.frombuffer(mapped, dtype=np.uint8)
+            offset = 0
+            while offset + UV_HDR_SIZE <= len(stream):
+                end, layout, fields = parse_uv_record(stream, offset, variables, lengths, values, wanted)
+                if end is None:
+                    break
+                # complex correlations are stored as pairs of values of the type of corr
+                nchan = 0 if corr is None else lengths[corr] // (
+                    get_type_size(variables[corr][0]) * (1 if variables[corr][0] == H_CMPLX else 2))
+                segments.append((1, nchan, dict((varnum, value[np.newaxis]) for varnum, value in values.items())))
+                length = end - offset
+                offset = end
+                count = count_repeated_records(stream, offset, length, layout)
+                if count == 0:
+                    continue
+                starts = offset + np.arange(count) * length
+                rows = dict((varnum, np.broadcast_to(value, (count, len(value)))) for varnum, value in values.items())
+                for start, size, varnum in fields:
+                    data = stream[(starts + start)[:, np.newaxis] + np.arange(size)]
+                    rows[varnum] = data.view(NUMPY_TYPES[variables[varnum][0]]).astype(float)
+                    values[varnum] = rows[varnum][-1]
+                segments.append((count, nchan, rows))
+                offset += count * length
+        finally:
+            stream = None
+            mapped.close()
+
+    records = {'nchan': np.repeat([segment[1] for segment in segments],
+                                  [segment[0] for segment in segments]).astype(int)}
+    for varnum in wanted:
+        width = max([rows[varnum].shape[1] for _, _, rows in segments if varnum in rows] or [0])
+        if width == 0:
+            continue
+        column = []
+        for count, _, rows in segments:
+            if varnum not in rows:
+                column.append(np.full((count, width), np.nan))
+            elif rows[varnum].shape[1] != width:
+                raise ApercalException("Variable {0} of {1} changes its size".format(variables[varnum][1], dataset))
+            else:
+                column.append(rows[varnum])
+        records[variables[varnum][1]] = np.concatenate(column)
+    return records
+
+
+# Bits per integer of mask items like flags, the highest bit is not used
+MASK_BITS_PER_INT = 31
+
+
+def read_mask(dataset, item, offset, nbits):
+    """
+    Read a range of a mask item like the flags of a uv dataset
+
+    dataset (str): Directory of the MIRIAD dataset
+    item (str): Name of the mask item
+    offset (int): Number of the first value
+    nbits (int): Number of values to read
+    returns (numpy.ndarray): True for the values that are set (good data for flags)
+    """
+    first, shift = divmod(offset, MASK_BITS_PER_INT)
+    nwords = (shift + nbits + MASK_BITS_PER_INT - 1) // MASK_BITS_PER_INT
+    with open(os.path.join(dataset, item), 'rb') as f:
+        # the item starts with a 4 byte header
+        f.seek(4 + 4 * first)
+        words = np.frombuffer(f.read(4 * nwords), dtype='>i4')
+    if len(words) < nwords:
+        raise ApercalException("Mask {0} of {1} is shorter than {2} values".format(item, dataset, offset + nbits))
+    bits = (words[:, np.newaxis] >> np.arange(MASK_BITS_PER_INT)) & 1
+    return bits.ravel()[shift:shift + nbits].astype(bool)
+
+
+def write_mask(dataset, item, values):
+    """
+    Write a mask item like the mask of blanked pixels of an image
+
+    dataset (str): Directory of the MIRIAD dataset
+    item (str): Name of the mask item
+    values (numpy.ndarray): True for the values to set (good pixels)
+    """
+    values = np.asarray(values, dtype=bool).ravel()
+    padding = np.zeros(-len(values) % MASK_BITS_PER_INT, dtype=bool)
+    bits = np.concatenate([values, padding]).reshape(-1, MASK_BITS_PER_INT).astype(np.int64)
+    words = np.sum(bits << np.arange(MASK_BITS_PER_INT), axis=1)
+    with open(os.path.join(dataset, item), 'wb') as f:
+        f.write(struct.pack('>i', H_INT))
+        f.write(words.astype('>i4').tobytes())
@@ -0,0 +1,253 @@
+"""
+Module with an on-disk accumulator of the weighted sums of a linear mosaic.
+
+The linear mosaic is the ratio of two sums over pairs of beams (i, j) with
+a non-zero entry in the inverse noise covariance matrix
+
+    numerator(x) = sum_ij I_i(x) C^-1_ij B_j(x)
+    variance(x) = sum_ij B_i(x) C^-1_ij B_j(x)
+
+Both sums are kept on disk together with compact copies of the image and
+beam map of every beam, cut to their footprint on the mosaic grid. Adding
+or removing a beam only adds or subtracts the terms of that beam with
+itself and with its correlated neighbours, so beams (or new overlapping
+observations) can be added, removed or replaced without touching the other
+beams.
+
+The covariance matrix is C_ij = R_ij sigma_i sigma_j, so a new noise
+sigma of a replaced beam only changes its own row and column of the
+inverse. Beams from different observations are uncorrelated. Removing a
+beam keeps the inverse covariance entries of the remaining beams, which is
+exact if it is not correlated with them.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+import astropy.io.fits as pyfits
+
+from apercal.subs import mosaic_engine
+from apercal.exceptions import ApercalException
+
+logger = logging.getLogger(__name__)
+
+
+def get_box_overlap(box, other):
+    """
+    Get the overlap of two boxes on the mosaic grid
+
+    box (tuple(int)): First row, last row + 1, first column, last column + 1
+    other (tuple(int)): Second box
+    returns (tuple(int)): The overlap or None if the boxes do not overlap
+    """
+    if not mosaic_engine.boxes_overlap(box, other):
+        return None
+    return max(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), min(box[3], other[3])
+
+
+def get_box_slices(box, origin=(0, 0)):
+    """
+    Get the slices of a box in an array that starts at origin on the mosaic grid
+    """
+    return slice(box[0] - origin[0], box[1] - origin[0]), slice(box[2] - origin[1], box[3] - origin[1])
+
+
+class MosaicAccumulator(object):
+    """
+    Weighted sums of a linear mosaic on disk that beams can be added to and removed from
+
+    directory (str): Directory of the accumulator, an existing accumulator is opened
+    header (Header): FITS header of an image on the mosaic grid, needed to create a new accumulator
+    """
+
+    def __init__(self, directory, header=None):
+        self.directory = directory
+        self.state_file = os.path.join(directory, 'accumulator.json')
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                self.state = json.load(f)
+            self.header = pyfits.Header.fromstring(self.state['header'])
+            if header is not None and not self.same_grid(header):
+                error = "Mosaic grid does not match the grid of the accumulator in {}".format(directory)
+                logger.error(error)
+                raise ApercalException(error)
+        else:
+            if header is None:
+                error = "No accumulator in {} and no mosaic grid to create one".format(directory)
+                logger.error(error)
+                raise ApercalException(error)
+            shape = (header['NAXIS2'], header['NAXIS1'])
+            self.header = header.copy()
+            self.state = {'header': self.header.tostring(), 'beams': {}}
+            if not os.path.isdir(os.path.join(directory, 'beams')):
+                os.makedirs(os.path.join(directory, 'beams'))
+            for name in ['numerator', 'variance']:
+                sums = np.lib.format.open_memmap(
+                    os.path.join(directory, '{}.npy'.format(name)), mode='w+', dtype=np.float64, shape=shape)
+                del sums
+            self.save_state()
+            logger.debug("Created mosaic accumulator in {}".format(directory))
+        self.numerator = np.load(os.path.join(directory, 'numerator.npy'), mmap_mode='r+')
+        self.variance = np.load(os.path.join(directory, 'variance.npy'), mmap_mode='r+')
+
+    @property
+    def beams(self):
+        """
+        Names of the beams in the accumulator
+        """
+        return sorted(self.state['beams'].keys())
+
+    def get_checksum(self, name):
+        """
+        Get the checksum given when the beam was added, None for unknown beams
+        """
+        if name not in self.state['beams']:
+            return None
+        return self.state['beams'][name]['checksum']
+
+    def same_grid(self, header):
+        """
+        Check whether a header describes the mosaic grid of the accumulator
+        """
+        keys = ['NAXIS1', 'NAXIS2'] + ['{0}{1}'.format(key, axis)
+                                       for key in mosaic_engine.GRID_KEYWORDS for axis in (1, 2)]
+        return all(header.get(key) == self.header.get(key) for key in keys)
+
+    def save_state(self):
+        """
+        Write the list of beams and their weights, replacing the old file at once
+        """
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.state, f)
+        os.rename(tmp_file, self.state_file)
+
+    def get_beam_files(self, name):
+        """
+        Get the names of the files with the compact image and beam map of a beam
+        """
+        return (os.path.join(self.directory, 'beams', '{}_image.npy'.format(name)),
+                os.path.join(self.directory, 'beams', '{}_beam.npy'.format(name)))
+
+    def load_beam(self, name):
+        """
+        Load the compact image and beam map and the box of a beam
+        """
+        image_file, beam_file = self.get_beam_files(name)
+        box = tuple(self.state['beams'][name]['box'])
+        return np.load(image_file, mmap_mode='r'), np.load(beam_file, mmap_mode='r'), box
+
+    def apply_beam(self, name, sign):
+        """
+        Add (sign=1) or subtract (sign=-1) all terms of a beam with itself and the other beams
+        """
+        image, beam, box = self.load_beam(name)
+        for other, weight in self.state['beams'][name]['weights'].items():
+            if weight == 0. or other not in self.state['beams']:
+                continue
+            if other == name:
+                region = get_box_slices(box)
+                self.numerator[region] += sign * weight * image * beam
+                self.variance[region] += sign * weight * beam * beam
+                continue
+            other_image, other_beam, other_box = self.load_beam(other)
+            overlap = get_box_overlap(box, other_box)
+            if overlap is None:
+                continue
+            region = get_box_slices(overlap)
+            own = get_box_slices(overlap, origin=(box[0], box[2]))
+            others = get_box_slices(overlap, origin=(other_box[0], other_box[2]))
+            # the terms (i, j) and (j, i) of the symmetric inverse covariance matrix
+            self.numerator[region] += sign * weight * (image[own] * other_beam[others] + other_image[others] * beam[own])
+            self.variance[region] += sign * 2. * weight * beam[own] * other_beam[others]
+        self.numerator.flush()
+        self.variance.flush()
+
+    def add_beam(self, name, image, beam, weights, checksum=None):
+        """
+        Add a beam to the mosaic
+
+        image (array): 2D image of the beam on the mosaic grid
+        beam (array): 2D beam response map on the mosaic grid
+        weights (dict): Entries of the inverse covariance matrix of the beam with itself and the
+                        correlated beams by name, beams that are added later can be included
+        checksum (str): Optional identifier of the input to find changed beams later
+        """
+        if name in self.state['beams']:
+            error = "Beam {} is already part of the mosaic".format(name)
+            logger.error(error)
+            raise ApercalException(error)
+        if np.shape(image) != self.numerator.shape or np.shape(beam) != self.numerator.shape:
+            error = "Image or beam map of beam {0} is not on the mosaic grid {1}".format(name, self.numerator.shape)
+            logger.error(error)
+            raise ApercalException(error)
+
+        footprints = [box for box in [mosaic_engine.get_footprint(image), mosaic_engine.get_footprint(beam)]
+                      if box is not None]
+        if len(footprints) == 0:
+            logger.warning("Beam {} does not cover the mosaic".format(name))
+            box = (0, 0, 0, 0)
+        else:
+            box = (min(b[0] for b in footprints), max(b[1] for b in footprints),
+                   min(b[2] for b in footprints), max(b[3] for b in footprints))
+        region = get_box_slices(box)
+        image_file, beam_file = self.get_beam_files(name)
+        np.save(image_file, np.nan_to_num(np.asarray(image[region], dtype=np.float32)))
+        np.save(beam_file, np.nan_to_num(np.asarray(beam[region], dtype=np.float32)))
+
+        weights = dict((str(other), float(weight)) for other, weight in weights.items())
+        self.state['beams'][name] = {'box': [int(b) for b in box], 'weights': weights, 'checksum': checksum}
+        # keep the weights symmetric for the beams already in the mosaic
+        for other, weight in weights.items():
+            if other != name and other in self.state['beams']:
+                self.state['beams'][other]['weights'][name] = weight
+        self.apply_beam(name, 1.)
+        self.save_state()
+        logger.debug("Added beam {} to the mosaic".format(name))
+
+    def remove_beam(self, name):
+        """
+        Remove a beam from the mosaic
+        """
+        if name not in self.state['beams']:
+            error = "Beam {} is not part of the mosaic".format(name)
+            logger.error(error)
+            raise ApercalException(error)
+        self.apply_beam(name, -1.)
+        for other in self.state['beams'].values():
+            other['weights'].pop(name, None)
+        del self.state['beams'][name]
+        self.save_state()
+        for filename in self.get_beam_files(name):
+            os.remove(filename)
+        logger.debug("Removed beam {} from the mosaic".format(name))
+
+    def replace_beam(self, name, image, beam, weights, checksum=None):
+        """
+        Replace the image, beam map and weights of a beam, or add it if it is new
+        """
+        if name in self.state['beams']:
+            self.remove_beam(name)
+        self.add_beam(name, image, beam, weights, checksum=checksum)
+
+    def get_mosaic(self, cutoff=0.01):
+        """
+        Derive the mosaic and noise map from the accumulated sums
+
+        cutoff (float): Relative variance below which the mosaic is blanked
+        returns (array, array, float): The mosaic, the noise map and the maximum variance
+        """
+        return mosaic_engine.finalise_mosaic(np.asarray(self.numerator), np.asarray(self.variance), cutoff=cutoff)
+
+    def write_mosaic(self, mosaic_file=None, noise_file=None, mosaic_fits=None, noise_fits=None, cutoff=0.01):
+        """
+        Write the mosaic and noise map as MIRIAD images, FITS files or both
+
+        returns (float): The maximum of the variance map
+        """
+        mosaic, noise, max_variance = self.get_mosaic(cutoff=cutoff)
+        mosaic_engine.write_image(mosaic, self.header, mosaic_fits, mosaic_file)
+        mosaic_engine.write_image(noise, self.header, noise_fits, noise_file, bunit='JY/BEAM')
+        return max_variance
@@ -0,0 +1,610 @@
+"""
+Module with a NumPy implementation of the weighted linear mosaic.
+
+For every pixel x of the mosaic with beam responses B(x), images I(x) and
+the inverse noise covariance matrix C^-1 of the beams it calculates
+
+    variance(x) = B(x)^T C^-1 B(x)
+    mosaic(x) = I(x)^T C^-1 B(x) / variance(x)
+    noise(x) = 1 / sqrt(variance(x))
+
+which is the same as the chain of MIRIAD maths calls in the mosaic module,
+but with all beams processed together as matrix products.
+
+Only neighbouring beams are correlated, so C^-1 is kept as a sparse matrix
+and only beam pairs with a non-zero entry that both cover a part of the map
+are multiplied.
+
+Polarisation mosaics of many Stokes and subband planes share the beam maps
+and are calculated together in a single pass over the beam maps.
+
+For large mosaics the grid can be split into tiles. The numerator and the
+variance of every tile are written into the output FITS files on disk and
+turned into the mosaic and noise map in a last pass over blocks of rows.
+"""
+
+import logging
+import os
+import resource
+
+import numpy as np
+import astropy.io.fits as pyfits
+from astropy.wcs import WCS
+from scipy import sparse
+
+from apercal.subs import convim
+from apercal.subs import mirio
+from apercal.exceptions import ApercalException
+
+logger = logging.getLogger(__name__)
+
+
+class MaskedPlane(object):
+    """
+    Memory-mapped image plane with the mask item of a MIRIAD image
+
+    The mask is only read for the pixels that are indexed, so blocks of rows can be read
+    with the blanked pixels set to NaN without loading the whole image into memory.
+    """
+
+    def __init__(self, data, mirimage, offset=0):
+        """
+        data (numpy.memmap): 2D pixels of the plane
+        mirimage (str): MIRIAD image with the mask item
+        offset (int): Number of the first pixel of the plane in the mask
+        """
+        self.data = data
+        self.mirimage = mirimage
+        self.offset = offset
+        self.shape = data.shape
+        self.ndim = data.ndim
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        block = np.array(self.data[index], dtype=np.float32)
+        rows = np.arange(self.shape[0])[index[0]]
+        if np.size(rows) == 0:
+            return block
+        first, last = np.min(rows), np.max(rows) + 1
+        nx = self.shape[1]
+        good = mirio.read_mask(self.mirimage, 'mask', self.offset + first * nx, (last - first) * nx)
+        good = good.reshape(last - first, nx)[(rows - first,) + index[1:]]
+        block[~good] = np.nan
+        return block
+
+    def __array__(self, dtype=None):
+        data = self[:]
+        return data if dtype is None else data.astype(dtype)
+
+
+def load_miriad_plane(mirimage):
+    """
+    Load the first plane of a MIRIAD image as a memory-mapped array
+
+    Images with a mask item are returned as MaskedPlane, which applies the mask to the
+    rows that are read.
+
+    mirimage (str): MIRIAD image to load
+    returns (array or MaskedPlane, Header): The 2D image plane and the FITS header
+    """
+    if not os.path.isdir(mirimage):
+        error = "Could not find image {}".format(mirimage)
+        logger.error(error)
+        raise ApercalException(error)
+    data, header = convim.mirtonumpy(mirimage, masked=False)
+    # remove the frequency and stokes axes
+    while data.ndim > 2:
+        data = data[0]
+    if os.path.isfile(os.path.join(mirimage, 'mask')):
+        return MaskedPlane(data, mirimage), header
+    return data, header
+
+
+def get_quarter_region(shape):
+    """
+    Get the slices of the central quarter of an image, the same as the MIRIAD region quarter(1)
+
+    shape (tuple): Shape of the image in (y, x)
+    returns (tuple(slice, slice)): Slices of the region
+    """
+    ny, nx = shape
+    return slice(ny // 4, ny // 4 + ny // 2), slice(nx // 4, nx // 4 + nx // 2)
+
+
+def get_footprint(data, block_rows=256):
+    """
+    Get the bounding box of the valid (finite and non-zero) pixels of an image
+
+    data (array): 2D image
+    block_rows (int): Number of image rows read at once
+    returns (tuple(int)): First row, last row + 1, first column, last column + 1 or None for an empty image
+    """
+    ny, nx = data.shape
+    valid_rows = np.zeros(ny, dtype=bool)
+    valid_cols = np.zeros(nx, dtype=bool)
+    for row in range(0, ny, block_rows):
+        rows = slice(row, min(row + block_rows, ny))
+        block = np.asarray(data[rows])
+        valid = np.isfinite(block) & (block != 0)
+        valid_rows[rows] = valid.any(axis=1)
+        valid_cols |= valid.any(axis=0)
+    if not valid_rows.any():
+        return None
+    row_index = np.flatnonzero(valid_rows)
+    col_index = np.flatnonzero(valid_cols)
+    return row_index[0], row_index[-1] + 1, col_index[0], col_index[-1] + 1
+
+
+def sparse_inverse_covariance(inv_cov):
+    """
+    Convert the inverse covariance matrix to a sparse matrix without explicit zeros
+
+    inv_cov (array or sparse matrix): Inverse covariance matrix of the beams
+    returns (csr_matrix): The sparse inverse covariance matrix
+    """
+    inv_cov = sparse.csr_matrix(inv_cov, dtype=np.float64)
+    inv_cov.eliminate_zeros()
+    return inv_cov
+
+
+def weighted_sums(images, beams, inv_cov, block_rows=256):
+    """
+    Calculate the numerator and the variance of the linear mosaic
+
+    Masked (NaN) pixels are treated as zero, as options=unmask does in MIRIAD maths.
+    For every block of rows only the beams covering the block and the non-zero entries
+    of the inverse covariance matrix between them are used.
+
+    images (list(array)): 2D images of the beams on the mosaic grid
+    beams (list(array)): 2D beam response maps on the mosaic grid, same order as images
+    inv_cov (array or sparse matrix): Inverse covariance matrix of the beams in the same order
+    block_rows (int): Number of image rows processed at once to limit the memory usage
+    returns (array, array): The numerator I^T C^-1 B and the variance B^T C^-1 B
+    """
+    numerator, variance = stacked_weighted_sums(
+        [[image] for image in images], beams, [inv_cov], block_rows=block_rows)
+    return numerator[0], variance[0]
+
+
+def stacked_weighted_sums(images, beams, inv_covs, numerator=None, variance=None, block_rows=256):
+    """
+    Calculate the numerators and variances of the linear mosaics of several planes at once
+
+    All planes (e.g. Stokes Q, U, V and their subbands) share the beam maps, which are read
+    once for every block of rows. Each plane has its own inverse covariance matrix. Planes
+    with the same matrix share the product of beam and covariance matrix and the variance.
+
+    images (list(list(array))): For every beam the 2D images of all planes on the mosaic grid
+    beams (list(array)): 2D beam response maps on the mosaic grid, same order as images
+    inv_covs (list(array or sparse matrix)): Inverse covariance matrix of the beams for every plane
+    numerator (array): Output array for the numerators with shape (nplanes, ny, nx), e.g. a memmap
+    variance (array): Output array for the variances with shape (nplanes, ny, nx), e.g. a memmap
+    block_rows (int): Number of image rows processed at once to limit the memory usage
+    returns (array, array): The numerators I^T C^-1 B and the variances B^T C^-1 B of all planes
+    """
+    nbeams = len(beams)
+    nplanes = len(inv_covs)
+    for inv_cov in inv_covs:
+        if len(images) != nbeams or np.shape(inv_cov) != (nbeams, nbeams):
+            error = "Number of images ({0}), beam maps ({1}) and size of covariance matrix {2} do not match".format(
+                len(images), nbeams, np.shape(inv_cov))
+            logger.error(error)
+            raise ApercalException(error)
+    shape = beams[0].shape
+    for planes in images:
+        if len(planes) != nplanes:
+            error = "Number of image planes ({0}) and covariance matrices ({1}) do not match".format(
+                len(planes), nplanes)
+            logger.error(error)
+            raise ApercalException(error)
+    for data in [image for planes in images for image in planes] + list(beams):
+        if data.shape != shape:
+            error = "Images and beam maps are not on the same grid ({0} and {1})".format(data.shape, shape)
+            logger.error(error)
+            raise ApercalException(error)
+
+    # planes with the same inverse covariance matrix share the weights and the variance
+    groups = []
+    for plane, inv_cov in enumerate(inv_covs):
+        inv_cov = sparse_inverse_covariance(inv_cov)
+        for group in groups:
+            if (group[0] != inv_cov).nnz == 0:
+                group[1].append(plane)
+                break
+        else:
+            groups.append((inv_cov, [plane]))
+    logger.debug("Using {0} different inverse covariance matrices for {1} planes".format(len(groups), nplanes))
+
+    beam_footprints = [get_footprint(beam, block_rows=block_rows) for beam in beams]
+    image_footprints = [[get_footprint(image, block_rows=block_rows) for image in planes] for planes in images]
+
+    if numerator is None:
+        numerator = np.zeros((nplanes,) + shape, dtype=np.float32)
+    if variance is None:
+        variance = np.zeros((nplanes,) + shape, dtype=np.float32)
+    for row in range(0, shape[0], block_rows):
+        rows = slice(row, min(row + block_rows, shape[0]))
+        nrows = rows.stop - rows.start
+
+        def covers(footprint):
+            return footprint is not None and footprint[0] < rows.stop and footprint[1] > rows.start
+
+        beam_active = [b for b in range(nbeams) if covers(beam_footprints[b])]
+        if len(beam_active) == 0:
+            numerator[:, rows] = 0.
+            variance[:, rows] = 0.
+            continue
+        image_active = [set(b for b in range(nbeams) if covers(image_footprints[b][plane]))
+                        for plane in range(nplanes)]
+        beam_block = np.nan_to_num(np.array([beams[b][rows] for b in beam_active], dtype=np.float64))
+
+        for inv_cov, planes in groups:
+            any_image_active = set().union(*[image_active[plane] for plane in planes])
+            # columns of C^-1 that get a contribution from the beams covering this block
+            weights = inv_cov[beam_active]
+            columns = [n for n in np.unique(weights.indices) if n in any_image_active or n in beam_active]
+
+            block_variance = np.zeros((nrows, shape[1]), dtype=np.float64)
+            block_numerators = np.zeros((len(planes), nrows, shape[1]), dtype=np.float64)
+            if len(columns) != 0:
+                # btci[n] = sum_b B[b] * C^-1[b, n]
+                btci = weights[:, columns].T.dot(beam_block.reshape(len(beam_active), -1))
+                btci = np.asarray(btci).reshape(len(columns), nrows, shape[1])
+                for index, n in enumerate(columns):
+                    if n in beam_active:
+                        block_variance += btci[index] * beam_block[beam_active.index(n)]
+                    for plane_index, plane in enumerate(planes):
+                        if n in image_active[plane]:
+                            block_numerators[plane_index] += btci[index] * np.nan_to_num(
+                                np.asarray(images[n][plane][rows], dtype=np.float64))
+            for plane_index, plane in enumerate(planes):
+                variance[plane, rows] = block_variance
+                numerator[plane, rows] = block_numerators[plane_index]
+
+    return numerator, variance
+
+
+def finalise_mosaic(numerator, variance, max_variance=None, cutoff=0.01):
+    """
+    Divide the numerator by the variance and calculate the noise map
+
+    Pixels with a variance below cutoff times the maximum variance are blanked, like the
+    mask '<variance_mos.map>.gt.0.01*max' of the MIRIAD chain.
+
+    numerator (array): Numerator of the mosaic
+    variance (array): Variance map of the mosaic
+    max_variance (float): Maximum of the variance, default from the central quarter of the map
+    cutoff (float): Relative variance below which the mosaic is blanked
+    returns (array, array, float): The mosaic, the noise map and the maximum variance
+    """
+    if max_variance is None:
+        max_variance = float(np.nanmax(variance[get_quarter_region(variance.shape)]))
+    mask = variance > cutoff * max_variance
+    mosaic = np.full(variance.shape, np.nan, dtype=np.float32)
+    noise = np.full(variance.shape, np.nan, dtype=np.float32)
+    mosaic[mask] = numerator[mask] / variance[mask]
+    noise[mask] = 1. / np.sqrt(variance[mask])
+    return mosaic, noise, max_variance
+
+
+def linear_mosaic(images, beams, inv_cov, block_rows=256, cutoff=0.01):
+    """
+    Calculate the linear mosaic and its noise map
+
+    images (list(array)): 2D images of the beams on the mosaic grid
+    beams (list(array)): 2D beam response maps on the mosaic grid, same order as images
+    inv_cov (array or sparse matrix): Inverse covariance matrix of the beams in the same order
+    block_rows (int): Number of image rows processed at once
+    cutoff (float): Relative variance below which the mosaic is blanked
+    returns (array, array, float): The mosaic, the noise map and the maximum variance
+    """
+    numerator, variance = weighted_sums(images, beams, inv_cov, block_rows=block_rows)
+    return finalise_mosaic(numerator, variance, cutoff=cutoff)
+
+
+def write_image(data, header, fitsimage=None, mirimage=None, bunit=None):
+    """
+    Write a 2D array as FITS image, as MIRIAD image or both
+
+    data (array): 2D image
+    header (Header): FITS header of the mosaic grid
+    fitsimage (str): Name of the FITS file, None for no FITS file
+    mirimage (str): Name of the MIRIAD image, None for no MIRIAD image
+    bunit (str): Unit of the image, None to keep the unit of the header
+    """
+    if fitsimage is None and mirimage is None:
+        raise ApercalException("No FITS file or MIRIAD image to write")
+    header = header.copy()
+    if bunit is not None:
+        header['BUNIT'] = bunit
+    shape = tuple(header['NAXIS{}'.format(axis)] for axis in range(header['NAXIS'], 0, -1))
+    if fitsimage is not None:
+        pyfits.writeto(fitsimage, data.reshape(shape), header, overwrite=True)
+    if mirimage is not None:
+        convim.numpytomir(data.reshape(shape), mirimage, header=header)
+
+
+def linear_mosaic_files(image_files, beam_files, inv_cov, mosaic_file, noise_file, block_rows=256, cutoff=0.01):
+    """
+    Calculate the linear mosaic and noise map from MIRIAD images on the mosaic grid
+
+    image_files (list(str)): MIRIAD images of the beams, regridded and convolved
+    beam_files (list(str)): MIRIAD beam response maps, regridded, in the same order
+    inv_cov (array or sparse matrix): Inverse covariance matrix of the beams in the same order
+    mosaic_file (str): Output MIRIAD image of the mosaic
+    noise_file (str): Output MIRIAD image of the noise map
+    block_rows (int): Number of image rows processed at once
+    cutoff (float): Relative variance below which the mosaic is blanked
+    returns (float): The maximum of the variance map
+    """
+    images = []
+    beams = []
+    header = None
+    for image_file, beam_file in zip(image_files, beam_files):
+        image, image_header = load_miriad_plane(image_file)
+        beam, _ = load_miriad_plane(beam_file)
+        images.append(image)
+        beams.append(beam)
+        if header is None:
+            header = image_header
+
+    mosaic, noise, max_variance = linear_mosaic(images, beams, inv_cov, block_rows=block_rows, cutoff=cutoff)
+    logger.debug("Maximum of the variance map is {}".format(max_variance))
+
+    write_image(mosaic, header, mirimage=mosaic_file)
+    write_image(noise, header, mirimage=noise_file, bunit='JY/BEAM')
+
+    return max_variance
+
+
+def raise_open_file_limit(nfiles):
+    """
+    Raise the soft limit of open files of the process for a number of memory mapped files
+
+    Every memory map keeps the file open, which can exceed the default limit for a
+    polarisation mosaic of many planes and beams.
+
+    nfiles (int): Number of files that are opened at the same time
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    # astropy and the memory map each keep a file descriptor, leave room for others
+    needed = 2 * nfiles + 64
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return
+    limit = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+    if limit < needed:
+        logger.warning("Limit of open files ({0}) may be too small for {1} images".format(limit, nfiles))
+
+
+def stacked_linear_mosaic_files(image_files, beam_files, inv_covs, mosaic_files, noise_files, scratch_dir,
+                                block_rows=256, cutoff=0.01):
+    """
+    Calculate the linear mosaics and noise maps of several planes in one pass over the beam maps
+
+    The numerators and variances of all planes are accumulated in memory mapped arrays in
+    the scratch directory, so the memory usage does not grow with the number of planes.
+
+    image_files (list(list(str))): For every beam the MIRIAD images of all planes, regridded and convolved
+    beam_files (list(str)): MIRIAD beam response maps, regridded, in the same order
+    inv_covs (list(array)): Inverse covariance matrix of the beams in the same order for every plane
+    mosaic_files (list(str)): Output MIRIAD image of the mosaic of every plane
+    noise_files (list(str)): Output MIRIAD image of the noise map of every plane
+    scratch_dir (str): Directory for the memory mapped sums
+    block_rows (int): Number of image rows processed at once
+    cutoff (float): Relative variance below which the mosaic is blanked
+    returns (list(float)): The maximum of the variance map of every plane
+    """
+    if not os.path.isdir(scratch_dir):
+        os.makedirs(scratch_dir)
+    raise_open_file_limit(sum(len(plane_files) for plane_files in image_files) + len(beam_files))
+
+    images = []
+    beams = []
+    headers = None
+    for plane_files, beam_file in zip(image_files, beam_files):
+        planes = []
+        plane_headers = []
+        for image_file in plane_files:
+            image, image_header = load_miriad_plane(image_file)
+            planes.append(image)
+            plane_headers.append(image_header)
+        beam, _ = load_miriad_plane(beam_file)
+        images.append(planes)
+        beams.append(beam)
+        if headers is None:
+            headers = plane_headers
+
+    shape = (len(inv_covs),) + beams[0].shape
+    numerator_file = os.path.join(scratch_dir, 'numerator.npy')
+    variance_file = os.path.join(scratch_dir, 'variance.npy')
+    numerator = np.lib.format.open_memmap(numerator_file, mode='w+', dtype=np.float32, shape=shape)
+    variance = np.lib.format.open_memmap(variance_file, mode='w+', dtype=np.float32, shape=shape)
+    stacked_weighted_sums(images, beams, inv_covs, numerator=numerator, variance=variance, block_rows=block_rows)
+
+    max_variances = []
+    for plane in range(shape[0]):
+        mosaic, noise, max_variance = finalise_mosaic(numerator[plane], variance[plane], cutoff=cutoff)
+        logger.debug("Maximum of the variance map of plane {0} is {1}".format(plane, max_variance))
+        write_image(mosaic, headers[plane], mirimage=mosaic_files[plane])
+        write_image(noise, headers[plane], mirimage=noise_files[plane], bunit='JY/BEAM')
+        max_variances.append(max_variance)
+
+    del numerator, variance
+    os.remove(numerator_file)
+    os.remove(variance_file)
+    return max_variances
+
+
+# Header keywords describing the celestial axes of the mosaic grid
+GRID_KEYWORDS = ['CTYPE', 'CRVAL', 'CDELT', 'CRPIX', 'CROTA', 'CUNIT']
+GRID_GLOBAL_KEYWORDS = ['EQUINOX', 'EPOCH', 'RADESYS', 'LONPOLE', 'LATPOLE', 'OBSRA', 'OBSDEC']
+
+
+def get_grid_header(header, shape, x0=0, y0=0):
+    """
+    Get a 2D header for a grid with the coordinate system of an image
+
+    The new grid starts at pixel (x0, y0) of the image (0-based), negative values extend the grid.
+
+    header (Header): FITS header of the image to take the coordinate system from
+    shape (tuple): Shape of the new grid in (y, x)
+    x0 (int): First column of the new grid on the image
+    y0 (int): First row of the new grid on the image
+    returns (Header): Header of the new grid
+    """
+    grid = pyfits.Header()
+    grid['SIMPLE'] = True
+    grid['BITPIX'] = -32
+    grid['NAXIS'] = 2
+    grid['NAXIS1'] = shape[1]
+    grid['NAXIS2'] = shape[0]
+    for axis in (1, 2):
+        for key in GRID_KEYWORDS:
+            if '{0}{1}'.format(key, axis) in header:
+                grid['{0}{1}'.format(key, axis)] = header['{0}{1}'.format(key, axis)]
+    grid['CRPIX1'] = header['CRPIX1'] - x0
+    grid['CRPIX2'] = header['CRPIX2'] - y0
+    for key in GRID_GLOBAL_KEYWORDS:
+        if key in header:
+            grid[key] = header[key]
+    return grid
+
+
+def get_tiles(shape, tile_size):
+    """
+    Split a grid into tiles
+
+    shape (tuple): Shape of the grid in (y, x)
+    tile_size (int): Size of the tiles in pixels, the tiles at the upper edges can be smaller
+    returns (list(tuple(int))): First row, last row + 1, first column, last column + 1 of every tile
+    """
+    ny, nx = shape
+    return [(y, min(y + tile_size, ny), x, min(x + tile_size, nx))
+            for y in range(0, ny, tile_size) for x in range(0, nx, tile_size)]
+
+
+def pad_box(box, padding, shape):
+    """
+    Extend a box by a number of pixels on all sides, limited to the grid
+
+    box (tuple(int)): First row, last row + 1, first column, last column + 1
+    padding (int): Number of pixels to add on each side
+    shape (tuple): Shape of the grid in (y, x)
+    returns (tuple(int)): The padded box
+    """
+    return (max(box[0] - padding, 0), min(box[1] + padding, shape[0]),
+            max(box[2] - padding, 0), min(box[3] + padding, shape[1]))
+
+
+def boxes_overlap(box, other):
+    """
+    Check if two boxes (first row, last row + 1, first column, last column + 1) overlap
+    """
+    if box is None or other is None:
+        return False
+    return box[0] < other[1] and other[0] < box[1] and box[2] < other[3] and other[2] < box[3]
+
+
+def get_sky_footprint(header, grid_header, nsamples=32):
+    """
+    Get the bounding box of an image on a grid with a different coordinate system
+
+    The edges of the image are converted to the pixel coordinates of the grid.
+
+    header (Header): FITS header of the image
+    grid_header (Header): FITS header of the grid
+    nsamples (int): Number of positions along every edge of the image
+    returns (tuple(int)): First row, last row + 1, first column, last column + 1 on the grid or None
+    """
+    wcs = WCS(header).celestial
+    grid_wcs = WCS(grid_header).celestial
+    nx = header['NAXIS1']
+    ny = header['NAXIS2']
+    x = np.linspace(-0.5, nx - 0.5, nsamples)
+    y = np.linspace(-0.5, ny - 0.5, nsamples)
+    edge_x = np.concatenate([x, x, np.full(nsamples, -0.5), np.full(nsamples, nx - 0.5)])
+    edge_y = np.concatenate([np.full(nsamples, -0.5), np.full(nsamples, ny - 0.5), y, y])
+    ra, dec = wcs.wcs_pix2world(edge_x, edge_y, 0)
+    grid_x, grid_y = grid_wcs.wcs_world2pix(ra, dec, 0)
+    valid = np.isfinite(grid_x) & np.isfinite(grid_y)
+    if not valid.any():
+        return None
+    # pixel i covers i - 0.5 to i + 0.5, allow for rounding errors of the conversion
+    tolerance = 1e-6
+    first_y = int(np.floor(grid_y[valid].min() + 0.5 + tolerance))
+    last_y = int(np.ceil(grid_y[valid].max() - 0.5 - tolerance))
+    first_x = int(np.floor(grid_x[valid].min() + 0.5 + tolerance))
+    last_x = int(np.ceil(grid_x[valid].max() - 0.5 - tolerance))
+    box = (first_y, last_y + 1, first_x, last_x + 1)
+    box = pad_box(box, 0, (grid_header['NAXIS2'], grid_header['NAXIS1']))
+    if box[0] >= box[1] or box[2] >= box[3]:
+        return None
+    return box
+
+
+def create_empty_fits(fitsimage, header):
+    """
+    Create a FITS file filled with zeros without holding the data in memory
+
+    fitsimage (str): Name of the FITS file
+    header (Header): Header of the image with BITPIX -32
+    """
+    header = header.copy()
+    header['BITPIX'] = -32
+    header.tofile(fitsimage, overwrite=True)
+    nbytes = 4 * int(np.prod([header['NAXIS{}'.format(axis)] for axis in range(1, header['NAXIS'] + 1)]))
+    # data is padded to a multiple of the FITS block size
+    nbytes = int(np.ceil(nbytes / 2880.)) * 2880
+    with open(fitsimage, 'rb+') as f:
+        f.seek(len(header.tostring()) + nbytes - 1)
+        f.write(b'\0')
+
+
+def write_tile(fitsimage, data, box):
+    """
+    Write a tile into a 2D FITS image on disk
+
+    fitsimage (str): Name of the FITS file
+    data (array): Data of the tile
+    box (tuple(int)): First row, last row + 1, first column, last column + 1 of the tile in the image
+    """
+    with pyfits.open(fitsimage, mode='update', memmap=True) as hdul:
+        hdul[0].data[box[0]:box[1], box[2]:box[3]] = data
+
+
+def finalise_mosaic_files(mosaic_fits, noise_fits, cutoff=0.01, block_rows=256):
+    """
+    Turn the numerator and variance on disk into the mosaic and noise map
+
+    mosaic_fits (str): FITS file with the numerator, overwritten with the mosaic
+    noise_fits (str): FITS file with the variance, overwritten with the noise map
+    cutoff (float): Relative variance below which the mosaic is blanked
+    block_rows (int): Number of image rows processed at once
+    returns (float): The maximum of the variance in the central quarter of the map
+    """
+    with pyfits.open(mosaic_fits, mode='update', memmap=True) as mosaic_hdul, \
+            pyfits.open(noise_fits, mode='update', memmap=True) as noise_hdul:
+        numerator = mosaic_hdul[0].data
+        variance = noise_hdul[0].data
+        ny = variance.shape[0]
+        quarter_rows, quarter_cols = get_quarter_region(variance.shape)
+
+        max_variance = -np.inf
+        for row in range(quarter_rows.start, quarter_rows.stop, block_rows):
+            rows = slice(row, min(row + block_rows, quarter_rows.stop))
+            max_variance = max(max_variance, float(np.nanmax(variance[rows, quarter_cols])))
+
+        for row in range(0, ny, block_rows):
+            rows = slice(row, min(row + block_rows, ny))
+            mosaic, noise, _ = finalise_mosaic(np.array(numerator[rows]), np.array(variance[rows]),
+                                               max_variance=max_variance, cutoff=cutoff)
+            numerator[rows] = mosaic
+            variance[rows] = noise
+
+    return max_variance
@@ -1,12 +1,22 @@
 import numpy as np
+import scipy.linalg
 from apercal.libs import lib
+from apercal.exceptions import ApercalException
+from apercal.subs import robuststats
+import hashlib
 import logging
 import os
 import shutil
-import copy
+import tempfile
 
 logger = logging.getLogger(__name__)
 
+# Inverse covariance matrices by the key of their images and correlation matrix
+_inverse_covariance_cache = {}
+
+# Stamp and content checksum of the images by their path
+_image_checksum_cache = {}
+
 """
 Module with functions to support the mosaic module.
 Based on Beam_Functions.ipnyb by D.J. Pisano available
@@ -18,7 +28,7 @@ in the Apertif-comissioning repository
 # Functions to create the beam maps
 # ++++++++++++++++++++++++++++++++++++++++
 def create_beam(beam, beam_map_dir, corrtype='Gaussian', primary_beam_path=None,
-                bm_size=3073, cell=4.0, fwhm=1950.0, cutoff=0.25):
+                bm_size=3073, cell=4.0, fwhm=1950.0, cutoff=0.25, cache_dir=None):
     """
     Function to create beam maps with miriad
 
@@ -34,6 +44,7 @@ def create_beam(beam, beam_map_dir, corrtype='Gaussian', primary_beam_path=None,
         cell (float): Cell size of a pixel in arcsec (default 4, continuum mfs images)
         fwhm (float): FWHM in arcsec for type='Gaussian' (default 32.5*60)
         cutoff (float): Relative power level to cut beam off at
+        cache_dir (str): Directory of the beam model cache, None to always create the beam map
     """
     # iterate through beams:
     # for beam,beamdir in zip(beam_list,beam_map_dir):
@@ -45,17 +56,20 @@ def create_beam(beam, beam_map_dir, corrtype='Gaussian', primary_beam_path=None,
     # check if file exists:
     if not os.path.isdir(beamoutname):
         # then test type and proceed for different types
-        if corrtype == 'Gaussian':
+        if corrtype == 'Correct' and primary_beam_path is None:
+            error = "Path to primary beam maps not specified"
+            logger.error(error)
+            raise ApercalException(error)
+        if cache_dir is not None and corrtype in ['Gaussian', 'Correct']:
+            cached_beam = get_cached_beam(beam, cache_dir, corrtype=corrtype, primary_beam_path=primary_beam_path,
+                                          bm_size=bm_size, cell=cell, fwhm=fwhm, cutoff=cutoff)
+            shutil.copytree(cached_beam, os.path.join(beam_map_dir, beamoutname))
+        elif corrtype == 'Gaussian':
             make_gaussian_beam(beam_map_dir, beamoutname,
                                bm_size, cell, fwhm, cutoff)
         elif corrtype == 'Correct':
-            if primary_beam_path is None:
-                error = "Path to primary beam maps not specified"
-                logger.error(error)
-                raise ApercalException(error)
-            else:
-                get_measured_beam_maps(
-                    beam, primary_beam_path, beam_map_dir, beamoutname, cutoff)
+            get_measured_beam_maps(
+                beam, primary_beam_path, beam_map_dir, beamoutname, cutoff)
         else:
             error = 'Type of beam map not supported'
             logger.error(error)
@@ -79,13 +93,32 @@ def make_gaussian_beam(beamdir, beamoutname, bm_size, cell, fwhm, cutoff):
     """
     # use a temp beam name because you have to apply a cutoff and then clean up
     tmpbeamname = beamoutname + '_tmp'
+    make_gaussian_response(os.path.join(beamdir, tmpbeamname), bm_size, cell, fwhm)
+
+    # apply beam cutoff
+    beam_cutoff(beamoutname, tmpbeamname, beamdir, cutoff)
+
+    # fix header
+    fixheader(beamoutname, beamdir)
+
+
+def make_gaussian_response(beamname, bm_size, cell, fwhm):
+    """
+    Function to create the response map of a Gaussian beam without cutoff
+
+    Args:
+        beamname (str): name of the response map
+        bm_size (integer): number of pixels for reference map
+        cell (float): cell size of a pixel in arcsec
+        fwhm (float): FWHM of Gaussian in arcsec
+    """
     # set peak level to 1 and PA = 0, plus arbitrary reference pixel
     pk = 1.
     bpa = 0.
     pos = [0., 60.]
     # set up imgen parameters
     imgen = lib.miriad('imgen')
-    imgen.out = os.path.join(beamdir, tmpbeamname)
+    imgen.out = beamname
     imgen.imsize = bm_size
     imgen.cell = cell
     imgen.object = 'gaussian'
@@ -95,12 +128,6 @@ def make_gaussian_beam(beamdir, beamoutname, bm_size, cell, fwhm, cutoff):
     # create image
     imgen.go()
 
-    # apply beam cutoff
-    beam_cutoff(beamoutname, tmpbeamname, beamdir, cutoff)
-
-    # fix header
-    fixheader(beamoutname, beamdir)
-
 # def get_measured_beam_maps(beam, image_path, beam_map_path, output_name):
 
 
@@ -119,8 +146,7 @@ def get_measured_beam_maps(beam, beam_map_input_path, beam_map_output_path, beam
     work_dir = os.getcwd()
 
     # file name of the beam model fits file which will be copied
-    input_beam_model = os.path.join(beam_map_input_path, "{0}_{1}_I_model.fits".format(
-        beam_map_input_path.split("/")[5], beam))
+    input_beam_model = get_beam_model_file(beam_map_input_path, beam)
     # file name of the fits file after copying
     temp_beam_model_name = os.path.join(
         beam_map_output_path, 'beam_model_{0}_temp.fits'.format(beam))
@@ -205,27 +231,261 @@ def get_measured_beam_maps(beam, beam_map_input_path, beam_map_output_path, beam
 
 
 
-def beam_cutoff(beamname, tmpbeamname, beamdir, cutoff):
+def get_beam_model_file(beam_map_input_path, beam):
     """
-    Function to apply a beam cutoff value
+    Function to get the file name of the measured beam model of a beam
 
     Args:
-        beamname (str): final name for beam map
-        tmpbeamname (str): name of temporary map, to be deleted
-        beamdir (str): output directory for beam map
+        beam_map_input_path (str): path to the directory with measured beam maps
+        beam (str): beam number
+    """
+    return os.path.join(beam_map_input_path, "{0}_{1}_I_model.fits".format(
+        beam_map_input_path.split("/")[5], beam))
+
+
+# ++++++++++++++++++++++++++++++++++++++++
+# Functions for the beam model cache
+# ++++++++++++++++++++++++++++++++++++++++
+
+def get_file_checksum(filename, blocksize=2**20):
+    """
+    Function to get the sha1 checksum of the content of a file
+
+    Args:
+        filename (str): name of the file
+        blocksize (int): number of bytes read at once
+    """
+    checksum = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def get_miriad_image_checksum(image):
+    """
+    Function to get a checksum of the content of a miriad image
+
+    The header items, data and mask are used, the history is ignored.
+
+    Args:
+        image (str): name of the miriad image
+    """
+    checksum = hashlib.sha1()
+    for item in sorted(os.listdir(image)):
+        if item != 'history':
+            checksum.update(item.encode('utf-8'))
+            checksum.update(get_file_checksum(os.path.join(image, item)).encode('utf-8'))
+    return checksum.hexdigest()
+
+
+def get_image_stamp(image):
+    """
+    Function to get the size and modification time of the items of a miriad image or of a FITS file
+
+    The stamp is cheap to get and changes whenever the image is written, so content checksums
+    only need to be calculated for images with a new stamp. The history is ignored.
+
+    Args:
+        image (str): name of the image
+    """
+    if os.path.isdir(image):
+        items = [os.path.join(image, item) for item in sorted(os.listdir(image)) if item != 'history']
+    else:
+        items = [image]
+    return [(os.path.basename(item), os.path.getsize(item), os.path.getmtime(item)) for item in items]
+
+
+def get_image_checksum(image):
+    """
+    Function to get the content checksum of a miriad image or of a FITS file
+
+    The checksum is kept by the stamp of the image, so it is only calculated again
+    after the image was written.
+
+    Args:
+        image (str): name of the image
+    """
+    path = os.path.abspath(image)
+    stamp = get_image_stamp(path)
+    if path in _image_checksum_cache and _image_checksum_cache[path][0] == stamp:
+        return _image_checksum_cache[path][1]
+    checksum = get_miriad_image_checksum(path) if os.path.isdir(path) else get_file_checksum(path)
+    _image_checksum_cache[path] = (stamp, checksum)
+    return checksum
+
+
+def get_image_grid(image):
+    """
+    Function to get the header items of a miriad image that define its pixel grid
+
+    Args:
+        image (str): name of the miriad image
+    """
+    gethd = lib.miriad('gethd')
+    grid = []
+    for item in ['naxis1', 'naxis2', 'ctype1', 'ctype2', 'crval1', 'crval2', 'crpix1', 'crpix2', 'cdelt1', 'cdelt2']:
+        gethd.in_ = '{0}/{1}'.format(image, item)
+        grid.append((item, gethd.go()[0].strip()))
+    return grid
+
+
+def get_beam_model_key(beam, corrtype='Gaussian', primary_beam_path=None, bm_size=3073, cell=4.0, fwhm=1950.0):
+    """
+    Function to get the key of a beam response map in the beam model cache
+
+    Gaussian beams are the same for all beams and only depend on the map size, cell size
+    and FWHM, which includes the frequency dependence. Measured beams are identified by
+    the content of their beam model file.
+
+    Args:
+        beam (str): beam number
+        corrtype (str): 'Gaussian' or 'Correct'
+        primary_beam_path (str): directory with the measured beam models
+        bm_size (int): Number of pixels in map
+        cell (float): Cell size of a pixel in arcsec
+        fwhm (float): FWHM in arcsec for type='Gaussian'
+    """
+    if corrtype == 'Gaussian':
+        model = ['Gaussian', int(bm_size), float(cell), float(fwhm)]
+    else:
+        model = ['Correct', get_file_checksum(get_beam_model_file(primary_beam_path, beam))]
+    # miriad limits the length of file names in expressions, keep the key short
+    return hashlib.sha1(repr(model).encode('utf-8')).hexdigest()[:16]
+
+
+def get_regridded_beam_key(beam_map, template_grid, engine=''):
+    """
+    Function to get the key of a regridded beam map in the beam model cache
+
+    Args:
+        beam_map (str): miriad beam map with the coordinates of the image
+        template_grid (list): grid of the template from get_image_grid
+        engine (str): regrid engine used
+    """
+    key = [get_miriad_image_checksum(beam_map), template_grid, engine]
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+
+
+def add_to_cache(image, cached_image):
+    """
+    Function to store a copy of a miriad image in a cache directory
+
+    The image is copied under a unique name first, so parallel processes never see a
+    partial copy. If another process was faster, its copy is kept.
+
+    Args:
+        image (str): miriad image to store
+        cached_image (str): name of the image in the cache
+    """
+    cache_dir = os.path.dirname(cached_image)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    tmpdir = tempfile.mkdtemp(prefix='tmp_', dir=cache_dir)
+    try:
+        tmp_image = os.path.join(tmpdir, os.path.basename(cached_image))
+        shutil.copytree(image, tmp_image)
+        if not os.path.isdir(cached_image):
+            try:
+                os.rename(tmp_image, cached_image)
+            except OSError:
+                logger.debug("{} was added to the cache by another process".format(cached_image))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def get_cached_beam(beam, cache_dir, corrtype='Gaussian', primary_beam_path=None,
+                    bm_size=3073, cell=4.0, fwhm=1950.0, cutoff=0.25):
+    """
+    Function to get a beam map with cutoff from the beam model cache
+
+    The response map and the map with cutoff are created and added to the cache if they
+    are not available yet. A new cutoff only needs the response map.
+
+    Args:
+        beam (str): beam number
+        cache_dir (str): directory of the beam model cache
+        corrtype (str): 'Gaussian' or 'Correct'
+        primary_beam_path (str): directory with the measured beam models
+        bm_size (int): Number of pixels in map
+        cell (float): Cell size of a pixel in arcsec
+        fwhm (float): FWHM in arcsec for type='Gaussian'
+        cutoff (float): Relative power level to cut beam off at
+        returns (str): Name of the beam map with cutoff in the cache
+    """
+    key = get_beam_model_key(beam, corrtype=corrtype, primary_beam_path=primary_beam_path,
+                             bm_size=bm_size, cell=cell, fwhm=fwhm)
+    response_map = os.path.join(cache_dir, 'response_{}.map'.format(key))
+    cutoff_map = os.path.join(cache_dir, 'beam_{0}_cutoff_{1}.map'.format(key, cutoff))
+
+    if os.path.isdir(cutoff_map):
+        logger.debug("Using cached beam map {0} for beam {1}".format(cutoff_map, beam))
+        return cutoff_map
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    workdir = tempfile.mkdtemp(prefix='tmp_', dir=cache_dir)
+    try:
+        if not os.path.isdir(response_map):
+            logger.debug("Creating beam response map of beam {}".format(beam))
+            if corrtype == 'Gaussian':
+                make_gaussian_response(os.path.join(workdir, 'response.map'), bm_size, cell, fwhm)
+            else:
+                beam_model = os.path.join(workdir, 'beam_model.fits')
+                shutil.copy2(get_beam_model_file(primary_beam_path, beam), beam_model)
+                fits = lib.miriad('fits')
+                fits.in_ = beam_model
+                fits.op = 'xyin'
+                fits.out = os.path.join(workdir, 'response.map')
+                fits.go()
+            add_to_cache(os.path.join(workdir, 'response.map'), response_map)
+        else:
+            logger.debug("Using cached beam response map {0} for beam {1}".format(response_map, beam))
+
+        logger.debug("Applying cutoff of {0} to beam response map of beam {1}".format(cutoff, beam))
+        mask_beam(response_map, os.path.join(workdir, 'beam.map'), cutoff)
+        if corrtype == 'Gaussian':
+            fixheader('beam.map', workdir)
+        add_to_cache(os.path.join(workdir, 'beam.map'), cutoff_map)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return cutoff_map
+
+
+def mask_beam(inbeam, outbeam, cutoff):
+    """
+    Function to mask a beam map below a cutoff value
+
+    Args:
+        inbeam (str): beam map to mask
+        outbeam (str): masked beam map
         cutoff (float): relative level at which beam map should be cut off
     """
     # load maths
     maths = lib.miriad('maths')
     # expression is just beam map to have cutoff value applied
     # Use brackets to guard against formatting issues
-    maths.exp = "'<{0}/{1}>'".format(beamdir, tmpbeamname)
+    maths.exp = "'<{0}>'".format(inbeam)
     # Apply cutoff value as mask, using miriad formatting, brackets around image name
-    maths.mask = "'<{0}/{1}>.gt.{2}'".format(beamdir, tmpbeamname, cutoff)
-    maths.out = '{0}/{1}'.format(beamdir, beamname)
+    maths.mask = "'<{0}>.gt.{1}'".format(inbeam, cutoff)
+    maths.out = outbeam
     # run
     maths.go()
 
+
+def beam_cutoff(beamname, tmpbeamname, beamdir, cutoff):
+    """
+    Function to apply a beam cutoff value
+
+    Args:
+        beamname (str): final name for beam map
+        tmpbeamname (str): name of temporary map, to be deleted
+        beamdir (str): output directory for beam map
+        cutoff (float): relative level at which beam map should be cut off
+    """
+    mask_beam('{0}/{1}'.format(beamdir, tmpbeamname), '{0}/{1}'.format(beamdir, beamname), cutoff)
+
     # clean up temp file
     os.system('rm -rf {0}/{1}'.format(beamdir, tmpbeamname))
 
@@ -256,53 +516,120 @@ def fixheader(beamname, beamdir):
 # Functions to calculate the inverse covariance matrix
 # ++++++++++++++++++++++++++++++++++++++++++++++++++++
 
-def inverted_covariance_matrix(imagefiles, corr_matrix, nbeams, beamlist):
+def get_covariance_key(images, corr_matrix, nbeams):
+    """
+    Function to get the key of an inverse covariance matrix in the cache
+
+    The images are identified by their content, so copies of the same images share the
+    key. The checksums are kept by the stamp of the images and only calculated again for
+    images that were written since.
+
+    Args:
+        images (dict): image of each beam number
+        corr_matrix (str): file with the correlation matrix
+        nbeams (int): number of beams of the matrix
+    """
+    key = [int(nbeams), get_file_checksum(corr_matrix),
+           [(bm, get_image_checksum(images[bm])) for bm in sorted(images)]]
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+
+
+def covariance_matrix(noise_cor, sigma_beam):
+    """
+    Function to get the noise covariance matrix from the correlation matrix and the beam noise
+
+    Beams without noise, e.g. missing beams, keep their diagonal element from the correlation
+    matrix and are not correlated with the other beams.
+
+    Args:
+        noise_cor (array): correlation matrix of the beams
+        sigma_beam (array): noise of each beam, 0 for missing beams
+    """
+    noise_cov = noise_cor * np.outer(sigma_beam, sigma_beam)
+    missing = np.flatnonzero(sigma_beam == 0.)
+    noise_cov[missing, missing] = noise_cor[missing, missing]
+    return noise_cov
+
+
+def invert_covariance_matrix(noise_cov):
+    """
+    Function to invert a noise covariance matrix with a Cholesky decomposition
+
+    The pseudo-inverse is used if the matrix is not positive definite.
+
+    Args:
+        noise_cov (array): symmetric noise covariance matrix
+    """
+    try:
+        factor = scipy.linalg.cho_factor(noise_cov, lower=True)
+        return scipy.linalg.cho_solve(factor, np.identity(len(noise_cov)))
+    except (np.linalg.LinAlgError, ValueError):
+        logger.warning("Covariance matrix is not positive definite, using its pseudo-inverse")
+        return np.linalg.pinv(noise_cov)
+
+
+def inverted_covariance_matrix(imagefiles, corr_matrix, nbeams, beamlist, cache_dir=None):
+    """
+    Function to calculate the inverse of the noise covariance matrix of the beams
+
+    The noise of all images is measured once, the covariance matrix is the correlation matrix
+    scaled by the outer product of the noise. Missing images are left out with a warning. The
+    result is kept by the content of the images and of the correlation matrix.
+
+    Args:
+        imagefiles (str): name of the images with {0} for the beam number
+        corr_matrix (str): file with the correlation matrix
+        nbeams (int): number of beams of the matrix
+        beamlist (list): beam numbers to use
+        cache_dir (str): directory to keep the matrices in, None to keep them only in memory
+    """
     noise_cor = np.loadtxt(corr_matrix, dtype=np.float64)
-    # Initialize covariance matrix
-    noise_cov = copy.deepcopy(noise_cor)
-    # Measure noise in the image for each beam
-    # same size as the correlation matrix
-    sigma_beam = np.zeros(nbeams, np.float64)
-    # number of beams used to go through beam list using indices
-    # no need to use indices because the beams are indices themselves
-    n_beams = len(beamlist)
-    # for bm in range(n_beams):
+    images = {}
     for bm in beamlist:
         bmmap = imagefiles.format(str(bm).zfill(2))
-        sigma_beam[int(bm)] = beam_noise(bmmap)
-    # write the matrix
-    # take into account that there are not always 40 beams
-    # this is different from the notebook, because the notebook code
-    # does not set non-diagonal matrix elements to zero
-    # for missing beams
-    # for k in self.mosaic_beam_list:
-    #     for m in self.mosaic_beam_list:
-    #         a = int(k)
-    #         b = int(m)
-    for a in range(nbeams):
-        for b in range(nbeams):
-            # logger.debug("noise_cor[{0},{1}]={2}".format(a,b,noise_cor[a,b]))
-            if (sigma_beam[a] == 0. or sigma_beam[b] == 0) and a == b:
-                noise_cov[a, b] = noise_cor[a, b]
-            else:
-                noise_cov[a, b] = noise_cor[a, b] * sigma_beam[a] * \
-                                  sigma_beam[b]  # The noise covariance matrix is
-            # logger.debug("noise_cov[{0},{1}]={2}".format(a,b,noise_cov[a,b]))
-    invcovmatrix = np.linalg.inv(noise_cov)
-    return invcovmatrix
+        if os.path.exists(bmmap):
+            images[int(bm)] = bmmap
+        else:
+            logger.warning("Image {0} of beam {1} is missing, leaving out the beam".format(bmmap, bm))
+
+    key = get_covariance_key(images, corr_matrix, nbeams)
+    cached_file = os.path.join(cache_dir, 'inv_cov_{}.npy'.format(key)) if cache_dir else None
+    if key in _inverse_covariance_cache:
+        logger.debug("Using inverse covariance matrix {} from memory".format(key))
+        return _inverse_covariance_cache[key].copy()
+    if cached_file is not None and os.path.isfile(cached_file):
+        logger.debug("Using cached inverse covariance matrix {}".format(cached_file))
+        invcovmatrix = np.load(cached_file)
+        _inverse_covariance_cache[key] = invcovmatrix
+        return invcovmatrix.copy()
+
+    # Measure noise in the image for each beam, missing beams have no noise
+    sigma_beam = np.zeros(nbeams, np.float64)
+    beams = sorted(images)
+    sigma_beam[beams] = robuststats.images_noise([images[bm] for bm in beams])
+    bad = ~np.isfinite(sigma_beam)
+    if np.any(bad):
+        logger.warning("Could not measure the noise of beams {}, leaving them out".format(np.flatnonzero(bad)))
+        sigma_beam[bad] = 0.
+    invcovmatrix = invert_covariance_matrix(covariance_matrix(noise_cor, sigma_beam))
+
+    _inverse_covariance_cache[key] = invcovmatrix
+    if cached_file is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_file = '{0}.{1}.npy'.format(cached_file[:-4], os.getpid())
+        np.save(tmp_file, invcovmatrix)
+        os.rename(tmp_file, cached_file)
+    return invcovmatrix.copy()
 
 
 def beam_noise(imagename):
     """
     Funtion to estimate the noise in an image
     imagename (str): MIRIAD image name to estimate the nosie for
-    returns (str): Value of the image noise
+    returns (float): Value of the image noise
     """
-    sigest = lib.miriad('sigest')
-    sigest.in_ = imagename
-    sigstring = sigest.go()
-    noise = float(sigstring[4].lstrip('Estimated rms is '))
-    return noise
+    return robuststats.image_noise(imagename)
 
 
 # ++++++++++++++++++++++++++++++++++++++++
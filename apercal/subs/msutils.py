@@ -3,6 +3,8 @@ import numpy as np
 from astropy.coordinates import Angle
 import astropy.units as u
 
+from apercal.subs import metadata
+
 
 def has_good_modeldata(vis):
     """Test whether a model column exists and is not only 1 or 0
@@ -75,9 +77,7 @@ def get_source_name(msname):
     Returns:
         str: Source name (e.g. 3C295)
     """
-    query = "SELECT NAME FROM {}/FIELD".format(msname)
-    res_table = pt.taql(query)
-    return res_table[0]["NAME"]
+    return metadata.get_metadata(msname)['source']
 
 
 def get_nchan(msname):
@@ -91,9 +91,7 @@ def get_nchan(msname):
         int: number of channels (in first spectral window)
     """
     assert(isinstance(msname, str))
-    spectralwindowtable = pt.table(msname + '::SPECTRAL_WINDOW', ack=False)
-    nchan = spectralwindowtable.getcol("CHAN_FREQ").shape[1]
-    return nchan
+    return metadata.get_metadata(msname)['nchan']
 
 
 def format_dir(dir_rad):
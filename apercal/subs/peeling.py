@@ -7,7 +7,7 @@ import numpy as np
 from apercal.subs import lsm
 
 
-def check_lsm(infile, cutoff, r1, r2):
+def check_lsm(infile, cutoff, r1, r2, index_dir=None):
     """
     checkpeeling: module to check if a source has an apparant flux density in the NVSS-catalogue higher than the
                   cutoff between r1 and r2 from the pointing centre.
@@ -15,8 +15,9 @@ def check_lsm(infile, cutoff, r1, r2):
     cutoff: apparent flux density to consider a source as to be peeled
     r1: radius of primary beam (sources to ignore)
     r2: query radius for NVSS. Only sources between r1 and r2 from the pointing centre will be considered for peeling
+    index_dir: Directory with a local index of the catalogues. Default is None to query Vizier
     """
-    cat = lsm.query_catalogue(infile, 'NVSS', r2, minflux=cutoff)
+    cat = lsm.query_catalogue(infile, 'NVSS', r2, minflux=cutoff, index_dir=index_dir)
     if len(cat) > 0:
         cat = lsm.calc_appflux(infile, cat, 'WSRT')
         limidx = np.delete(np.where(cat.dist) < r1), 0  # Find the index of the sources inside the primary beam (r1)
@@ -1,14 +1,9 @@
 import os
-import random
-import string
 import logging
 
-import astropy.io.fits as pyfits
 import numpy as np
 import scipy.stats
 
-from backports import tempfile
-
 from apercal.libs import lib
 from apercal.subs import setinit
 from apercal.exceptions import ApercalException
@@ -24,30 +19,13 @@ def checkimagegaussianity(self, image, alpha):
     returns (boolean): True if image is ok, False otherwise
     """
     setinit.setinitdirs(self)
-    char_set = string.ascii_uppercase + string.digits
     if os.path.isdir(image) or os.path.isfile(image):
-        with tempfile.TemporaryDirectory() as tempdir:
-            if os.path.isdir(image):
-                temp_string = ''.join(random.sample(char_set * 8, 8))
-                fits = lib.miriad('fits')
-                fits.op = 'xyout'
-                fits.in_ = image
-                fits.out = tempdir + '/' + temp_string + '.fits'
-                fits.go()
-                pyfile = pyfits.open(tempdir + '/' + temp_string + '.fits')
-            elif os.path.isfile(image):
-                pyfile = pyfits.open(image)
-            else:
-                error = 'Image format not supported. Only MIRIAD and FITS formats are supported!'
-                logger.error(error)
-                raise ApercalException(error)
-            image = pyfile[0].data[0][0]
-            pyfile.close()
-            k2, p = scipy.stats.normaltest(image, nan_policy='omit', axis=None)
-            if p < alpha:
-                return True
-            else:
-                return False
+        image = imstats.load_image(image)[0][0]
+        k2, p = scipy.stats.normaltest(image, nan_policy='omit', axis=None)
+        if p < alpha:
+            return True
+        else:
+            return False
     else:
         error = 'Image {} does not seem to exist!'.format(image)
         logger.error(error)
@@ -149,14 +127,7 @@ def fieldflux(infile):
     clean.out = 'fluxmodel'
     clean.niters = 10000
     clean.go()
-    fits = lib.miriad('fits')
-    fits.in_ = clean.out
-    fits.op = 'xyout'
-    fits.out = clean.out + '.fits'
-    fits.go()
-    pyfile = pyfits.open(fits.out)
-    image = pyfile[0].data[0][0]
-    pyfile.close()
+    image = imstats.load_image(clean.out)[0][0]
     intflux = np.sum(image)
     os.system('rm -rf flux*')
     return intflux
@@ -1,10 +1,62 @@
+import logging
 import re
+import struct
 
 import numpy as np
 from astropy import units as u
-from astropy.coordinates import FK5, SkyCoord
+from astropy.coordinates import FK5, SkyCoord, Angle
 
 from apercal.libs import lib
+from apercal.subs import metadata
+from apercal.subs import mirio
+from apercal.exceptions import ApercalException
+
+logger = logging.getLogger(__name__)
+
+# Errors of the native reader after which the values are taken from prthd instead
+NATIVE_ERRORS = (ApercalException, KeyError, IndexError, IOError, OSError, ValueError, struct.error)
+
+
+def get_axis(infile, prefix):
+    """
+    get_axis: Get the number of the first axis of a MIRIAD image with a ctype starting with prefix
+    infile (string): input image file in MIRIAD format
+    returns (int): The axis number (starting at 1)
+    """
+    header = mirio.get_header(infile)
+    for axis in range(1, header['naxis'] + 1):
+        if str(header.get('ctype{}'.format(axis), '')).startswith(prefix):
+            return axis
+    raise KeyError("No {0} axis in {1}".format(prefix, infile))
+
+
+def get_spectral_setup(infile):
+    """
+    get_spectral_setup: Get the number of channels, first frequency and channel width of a uv dataset or image
+    infile (string): input file in MIRIAD format
+    returns (tuple): nchan, frequency of the first channel and channel width in GHz of the first spectral window
+    """
+    if mirio.is_uv_dataset(infile):
+        meta = metadata.get_metadata(infile)
+        return meta['nchan'], meta['sfreq'][0], meta['sdf'][0]
+    header = mirio.get_header(infile)
+    axis = get_axis(infile, 'FREQ')
+    cdelt = header['cdelt{}'.format(axis)]
+    crval = header['crval{}'.format(axis)] + (1.0 - header.get('crpix{}'.format(axis), 1.0)) * cdelt
+    return header['naxis{}'.format(axis)], crval, cdelt
+
+
+def get_pointing(infile):
+    """
+    get_pointing: Get the pointing of a uv dataset or the reference position of an image
+    infile (string): input file in MIRIAD format
+    returns (tuple): RA and DEC in radians
+    """
+    if mirio.is_uv_dataset(infile):
+        meta = metadata.get_metadata(infile)
+        return meta['ra'], meta['dec']
+    header = mirio.get_header(infile)
+    return header['crval{}'.format(get_axis(infile, 'RA'))], header['crval{}'.format(get_axis(infile, 'DEC'))]
 
 
 def getraimage(infile):
@@ -13,10 +65,9 @@ def getraimage(infile):
     infile (string): input image file in MIRIAD format
     returns: RA coordinates of the image in hh:mm:ss.sss
     """
-    prthd = lib.basher('prthd in=' + infile)
-    regex = re.compile(".*(RA---NCP).*")
-    coordline = [m.group(0) for l in prthd for m in [regex.search(l)] if m][0].split()
-    ra = coordline[2]
+    header = mirio.get_header(infile)
+    ra = Angle(header['crval{}'.format(get_axis(infile, 'RA'))], unit=u.rad).to_string(
+        unit=u.hour, sep=':', precision=3, pad=True)
     return ra
 
 
@@ -26,10 +77,9 @@ def getdecimage(infile):
     infile (string): input image file in MIRIAD format
     returns: DEC coordinates dd:mm:ss.sss
     """
-    prthd = lib.basher('prthd in=' + infile)
-    regex = re.compile(".*(DEC--NCP).*")
-    coordline = [m.group(0) for l in prthd for m in [regex.search(l)] if m][0].split()
-    dec = coordline[2]
+    header = mirio.get_header(infile)
+    dec = Angle(header['crval{}'.format(get_axis(infile, 'DEC'))], unit=u.rad).to_string(
+        unit=u.deg, sep=':', precision=2, pad=True)
     return dec
 
 
@@ -39,7 +89,7 @@ def getbmajimage(infile):
     infile (string): input image file in MIRIAD format
     returns (float): BMAJ in arcseconds of the image
     """
-    bmaj = np.float(lib.basher('gethd in=' + infile + '/bmaj')[0]) * 3600.0 * (360.0 / (2.0 * np.pi))
+    bmaj = float(mirio.get_header(infile)['bmaj']) * 3600.0 * (360.0 / (2.0 * np.pi))
     return bmaj
 
 
@@ -49,7 +99,7 @@ def getbminimage(infile):
     infile (string): input image file in MIRIAD format
     returns (float): BMIN in arcseconds of the image
     """
-    bmin = np.float(lib.basher('gethd in=' + infile + '/bmin')[0]) * 3600.0 * (360.0 / (2.0 * np.pi))
+    bmin = float(mirio.get_header(infile)['bmin']) * 3600.0 * (360.0 / (2.0 * np.pi))
     return bmin
 
 
@@ -59,7 +109,7 @@ def getbpaimage(infile):
     infile (string): input image file in MIRIAD format
     returns (float): BPA in degrees of the image
     """
-    bpa = np.float(lib.basher('gethd in=' + infile + '/bpa')[0])
+    bpa = float(mirio.get_header(infile)['bpa'])
     return bpa
 
 
@@ -83,7 +133,9 @@ def putbmajimage(infile, bmajvalue):
     bmajvalue (float): The major axis value in arcseconds
     """
     bmajval = bmajvalue / 3600.0 / (360.0 / (2.0 * np.pi))
-    lib.basher('puthd in=' + infile + '/bmaj value=' + str(bmajval))
+    header = mirio.get_header(infile)
+    header['bmaj'] = bmajval
+    header.save()
 
 
 def putbminimage(infile, bminvalue):
@@ -93,7 +145,9 @@ def putbminimage(infile, bminvalue):
     bminvalue (float): The minor axis value in arcseconds
     """
     bminval = bminvalue / 3600.0 / (360.0 / (2.0 * np.pi))
-    lib.basher('puthd in=' + infile + '/bmin value=' + str(bminval))
+    header = mirio.get_header(infile)
+    header['bmin'] = bminval
+    header.save()
 
 
 def putbpaimage(infile, bpavalue):
@@ -103,7 +157,9 @@ def putbpaimage(infile, bpavalue):
     bpavalue (float): The position angle in degrees
     """
     bpaval = bpavalue
-    lib.basher('puthd in=' + infile + '/bpa value=' + str(bpaval))
+    header = mirio.get_header(infile)
+    header['bpa'] = bpaval
+    header.save()
 
 
 def putbeamimage(infile, beamparams):
@@ -112,17 +168,34 @@ def putbeamimage(infile, beamparams):
     infile (string): input image file in MIRIAD format
     beamparams(array): The major, minor axis and position angle to put in
     """
-    putbmajimage(infile, beamparams[0])
-    putbminimage(infile, beamparams[1])
-    putbpaimage(infile, beamparams[2])
+    header = mirio.get_header(infile)
+    header['bmaj'] = beamparams[0] / 3600.0 / (360.0 / (2.0 * np.pi))
+    header['bmin'] = beamparams[1] / 3600.0 / (360.0 / (2.0 * np.pi))
+    header['bpa'] = beamparams[2]
+    header.save()
 
 
 def getradec(infile):
     """
-    getradec: module to extract the pointing centre ra and dec from a miriad image file. Uses the PRTHD task in miriad
+    getradec: module to extract the pointing centre ra and dec from a miriad image or uv file
     inputs: infile (name of file)
     returns: coords, an instance of the astropy.coordinates SkyCoord class which has a few convenient attributes.
     """
+    try:
+        ra, dec = get_pointing(infile)
+    except NATIVE_ERRORS as e:
+        logger.debug("Could not read the pointing of {0} directly ({1}). Using prthd".format(infile, e))
+        return getradec_prthd(infile)
+    coords = SkyCoord(ra=ra, dec=dec, unit=(u.rad, u.rad), frame=FK5)
+    return coords
+
+
+def getradec_prthd(infile):
+    """
+    getradec_prthd: getradec using the PRTHD task in miriad
+    inputs: infile (name of file)
+    returns: coords, an instance of the astropy.coordinates SkyCoord class
+    """
     prthd = lib.basher('prthd in=' + infile)
     regex = re.compile(".*(J2000).*")
     coordline = [m.group(0) for l in prthd for m in [regex.search(l)] if m][0].split()
@@ -158,10 +231,19 @@ def getradecsex(infile):
     skycoords: The astropy SkyCoord instance values to covert to a string
     returns: String with the RA and DEC in format hh:mm:ss,dd:mm:ss
     """
-    prthd = lib.basher('prthd in=' + infile)
-    regex = re.compile(".*(J2000).*")
-    coordline = [m.group(0) for l in prthd for m in [regex.search(l)] if m][0].split()
-    coords = coordline[3].split('.')[0] + ',' + coordline[5].split('.')[0]
+    try:
+        ra, dec = get_pointing(infile)
+    except NATIVE_ERRORS as e:
+        logger.debug("Could not read the pointing of {0} directly ({1}). Using prthd".format(infile, e))
+        prthd = lib.basher('prthd in=' + infile)
+        regex = re.compile(".*(J2000).*")
+        coordline = [m.group(0) for l in prthd for m in [regex.search(l)] if m][0].split()
+        coords = coordline[3].split('.')[0] + ',' + coordline[5].split('.')[0]
+        return coords
+    # truncate like the sexagesimal values printed by prthd
+    rastr = Angle(ra, unit=u.rad).to_string(unit=u.hour, sep=':', precision=2, pad=True)
+    decstr = Angle(dec, unit=u.rad).to_string(unit=u.deg, sep=':', precision=2, pad=True)
+    coords = rastr.split('.')[0] + ',' + decstr.split('.')[0]
     return coords
 
 
@@ -171,10 +253,15 @@ def getfreq(infile):
     param infile: infile (name of file)
     returns: the central frequency of the visibility file
     """
-    prthd = lib.basher('prthd in=' + infile)
-    regex = re.compile(".*(GHz).*")
-    freqline = [m.group(0) for l in prthd for m in [regex.search(l)] if m][0].split()
-    freq = float(freqline[2]) + (float(freqline[1]) / 2.0) * float(freqline[3])
+    try:
+        nchan, sfreq, sdf = get_spectral_setup(infile)
+    except NATIVE_ERRORS as e:
+        logger.debug("Could not read the frequencies of {0} directly ({1}). Using prthd".format(infile, e))
+        prthd = lib.basher('prthd in=' + infile)
+        regex = re.compile(".*(GHz).*")
+        freqline = [m.group(0) for l in prthd for m in [regex.search(l)] if m][0].split()
+        nchan, sfreq, sdf = float(freqline[1]), float(freqline[2]), float(freqline[3])
+    freq = sfreq + (nchan / 2.0) * sdf
     return freq
 
 
@@ -184,8 +271,12 @@ def getnchan(infile):
     param infile: infile (name of file)
     return: the number of channels of the observation
     """
-    prthd = lib.basher('prthd in=' + infile)
-    regex = re.compile(".*(GHz).*")
-    nchanline = [m.group(0) for l in prthd for m in [regex.search(l)] if m][0].split()
-    nchan = int(nchanline[1])
+    try:
+        nchan = get_spectral_setup(infile)[0]
+    except NATIVE_ERRORS as e:
+        logger.debug("Could not read the frequencies of {0} directly ({1}). Using prthd".format(infile, e))
+        prthd = lib.basher('prthd in=' + infile)
+        regex = re.compile(".*(GHz).*")
+        nchanline = [m.group(0) for l in prthd for m in [regex.search(l)] if m][0].split()
+        nchan = int(nchanline[1])
     return nchan
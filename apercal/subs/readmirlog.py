@@ -1,7 +1,5 @@
 import datetime
 import os
-import random
-import string
 import time
 
 import numpy as np
@@ -9,6 +7,117 @@ from astropy.table import Table
 
 from apercal import subs
 from apercal.libs import lib
+from apercal.subs import mirio
+from apercal.exceptions import ApercalException
+
+# Julian date of the start of datetime's epoch used for the solution times
+JD_1970 = 2440587.5
+
+# Size of the header of the binary calibration items
+CAL_HDR_SIZE = 8
+
+
+def read_cal_item(file_, item, dtype, count):
+    """
+    Read the records of a binary calibration item of a MIRIAD uv dataset
+    file_ (str): u,v file with the calibration
+    item (str): Name of the item
+    dtype (numpy.dtype): Big-endian type of the records
+    count (int): Expected number of records
+    returns (array): The records
+    """
+    filename = os.path.join(file_, item)
+    if not os.path.isfile(filename):
+        raise ApercalException("No {0} item in {1}".format(item, file_))
+    expected = CAL_HDR_SIZE + count * np.dtype(dtype).itemsize
+    if os.path.getsize(filename) < expected:
+        raise ApercalException("The {0} item of {1} has {2} bytes, expected {3}".format(
+            item, file_, os.path.getsize(filename), expected))
+    with open(filename, 'rb') as f:
+        f.seek(CAL_HDR_SIZE)
+        return np.fromfile(f, dtype=dtype, count=count)
+
+
+def jd_to_datetime(jd):
+    """
+    Convert Julian dates to datetimes
+    jd (array): Julian dates
+    returns (list(datetime)): The datetimes
+    """
+    return [datetime.datetime(1970, 1, 1) + datetime.timedelta(days=float(day) - JD_1970) for day in np.atleast_1d(jd)]
+
+
+def read_gains(file_):
+    """
+    Read the antenna gains of a MIRIAD uv dataset without gpplt
+
+    The gains item has an 8 byte header followed by one record for each solution
+    interval of the time (double) and ngains = nants * (nfeeds + ntau) complex gains,
+    with the feeds and then the delay term of each antenna. If the gains were
+    solved in nfbin frequency bins the gainsf item holds for each solution the time
+    and for each bin its frequency (double) and the ngains complex gains.
+    file_ (str): u,v file with the gain calibration
+    returns (dict): gains (antenna, feed, bin, solution), taus (antenna, bin, solution) if ntau is 1,
+                    times (Julian dates of the solutions), freqs (GHz of the bins and solutions) if binned
+    """
+    header = mirio.get_header(file_)
+    ngains = header['ngains']
+    nsols = header['nsols']
+    nfeeds = header.get('nfeeds', 1)
+    ntau = header.get('ntau', 0)
+    nfbin = header.get('nfbin', 0)
+    nterms = nfeeds + ntau
+    nants = ngains // nterms
+    if nfbin > 0:
+        dtype = np.dtype([('time', '>f8'), ('bins', [('freq', '>f8'), ('gains', '>c8', (ngains,))], (nfbin,))])
+        records = read_cal_item(file_, 'gainsf', dtype, nsols)
+        gains = records['bins']['gains']
+        freqs = np.transpose(records['bins']['freq'])
+    else:
+        dtype = np.dtype([('time', '>f8'), ('gains', '>c8', (ngains,))])
+        records = read_cal_item(file_, 'gains', dtype, nsols)
+        gains = records['gains'][:, np.newaxis, :]
+        freqs = None
+    # (solution, bin, antenna, term) to (antenna, term, bin, solution)
+    gains = np.transpose(gains.reshape(nsols, gains.shape[1], nants, nterms), (2, 3, 1, 0)).astype(np.complex64)
+    return {'gains': gains[:, :nfeeds], 'taus': gains[:, nfeeds] if ntau == 1 else None,
+            'times': np.array(records['time'], dtype=np.float64), 'freqs': freqs}
+
+
+def read_freqs(file_):
+    """
+    Read the spectral windows of the bandpass of a MIRIAD uv dataset
+
+    The freqs item has an 8 byte header followed by one record for each spectral
+    window of the number of channels (int, padded to 8 bytes), the frequency of the
+    first channel and the channel width (double, GHz).
+    file_ (str): u,v file with the bandpass calibration
+    returns (array): The frequency of every channel of the bandpass in GHz
+    """
+    nspect = mirio.get_header(file_).get('nspect0', 1)
+    dtype = np.dtype([('nschan', '>i4'), ('pad', '>i4'), ('sfreq', '>f8'), ('sdf', '>f8')])
+    windows = read_cal_item(file_, 'freqs', dtype, nspect)
+    return np.concatenate([window['sfreq'] + window['sdf'] * np.arange(window['nschan']) for window in windows])
+
+
+def read_bandpass(file_):
+    """
+    Read the bandpass of a MIRIAD uv dataset without gpplt
+
+    The bandpass item has an 8 byte header followed by nchan0 complex gains for each
+    antenna and feed, repeated for each of the nbpsols solutions of a time dependent bandpass.
+    file_ (str): u,v file with the bandpass calibration
+    returns (array, array): The complex bandpass (antenna, feed, channel, solution) and the channel frequencies in GHz
+    """
+    header = mirio.get_header(file_)
+    freqs = read_freqs(file_)
+    nchan = header.get('nchan0', len(freqs))
+    nfeeds = header.get('nfeeds', 1)
+    ngains = header['ngains'] // (nfeeds + header.get('ntau', 0)) * nfeeds
+    nsols = max(header.get('nbpsols', 0), 1)
+    passes = read_cal_item(file_, 'bandpass', np.dtype('>c8'), nsols * ngains * nchan)
+    passes = passes.reshape(nsols, ngains // nfeeds, nfeeds, nchan)
+    return np.transpose(passes, (1, 2, 3, 0)).astype(np.complex64), freqs
 
 
 def get_nants(file_):
@@ -66,18 +175,10 @@ def get_ndims(file_):
     file_ (str): u,v file with the gain calibration
     returns (int, int, int): Number of antennas, number of frequency bins, number of time intervals
     """
-    char_set = string.ascii_uppercase + string.digits  # Create a charset for random gain log file generation
-    tempdir = subs.managetmp.manage_tempdir('mirlog')
-    subs.managetmp.clean_tempdir('mirlog')
-    gains_string = ''.join(random.sample(char_set * 8, 8))
-    gpplt = lib.miriad('gpplt')
-    gpplt.vis = file_
-    gpplt.log = tempdir + '/' + gains_string
-    gpplt.yaxis = 'amp'
-    cmd = gpplt.go()
-    nants = get_nants(tempdir + '/' + gains_string)
-    nbins = get_nbins(tempdir + '/' + gains_string)
-    nsols = get_nsols(tempdir + '/' + gains_string)
+    header = mirio.get_header(file_)
+    nants = header['ngains'] // (header.get('nfeeds', 1) + header.get('ntau', 0))
+    nbins = max(header.get('nfbin', 0), 1)
+    nsols = header['nsols']
     return nants, nbins, nsols
 
 
@@ -88,16 +189,13 @@ def reformat_table(file_):
     """
     nants = get_nants(file_)
     if nants > 6:
-        os.system('sed /^#.*/d ' + file_ + ' > ' + file_ + '_tmp')
-        with open(file_ + '_tmp', 'r') as f:
-            content = f.readlines()
-            with open(file_ + '_refor', 'w') as g:
-                for i in xrange(1, len(content) + 1):
-                    if i % 2 == 0:
-                        g.write(content[i - 2].strip() + '   ' + content[i - 1].strip() + '\n')
-                g.close()
-            f.close()
-        os.system('mv ' + file_ + '_refor ' + file_)
+        with open(file_, 'r') as f:
+            content = [line for line in f.readlines() if not line.startswith('#')]
+        with open(file_ + '_refor', 'w') as g:
+            for i in range(1, len(content) + 1):
+                if i % 2 == 0:
+                    g.write(content[i - 2].strip() + '   ' + content[i - 1].strip() + '\n')
+        os.rename(file_ + '_refor', file_)
 
 
 def get_amps(file_):
@@ -107,30 +205,10 @@ def get_amps(file_):
     return(array, array): an array with the phase gains for each antenna, frequency bin and solution interval, a
                           datetime array with the actual solution timesteps
     """
-    char_set = string.ascii_uppercase + string.digits  # Create a charset for random gain log file generation
-    tempdir = subs.managetmp.manage_tempdir('mirlog')
-    subs.managetmp.clean_tempdir('mirlog')
-    gains_string = ''.join(random.sample(char_set * 8, 8))
-    gpplt = lib.miriad('gpplt')
-    gpplt.vis = file_
-    gpplt.log = tempdir + '/' + gains_string
-    gpplt.yaxis = 'amp'
-    cmd = gpplt.go()
-    nants = get_nants(tempdir + '/' + gains_string)
-    nbins = get_nbins(tempdir + '/' + gains_string)
-    nsols = get_nsols(tempdir + '/' + gains_string)
-    reformat_table(tempdir + '/' + gains_string)
-    obsdate = cmd[3].split(' ')[4][0:7]
-    starttime = datetime.datetime(int('20' + obsdate[0:2]), int(time.strptime(obsdate[2:5], '%b').tm_mon),
-                                  int(obsdate[5:7]))
-    s = Table.read(tempdir + '/' + gains_string, format='ascii')
-    days = np.array(s['col1'][0:nsols])
-    times = np.array(s['col2'][0:nsols])
-    time_array = [starttime + datetime.timedelta(days=int(days[step]), hours=int(times[step][0:2]), minutes=int(times[step][3:5]),
-                                       seconds=int(times[step][6:8])) for step in range(nsols)]
-    gain_array = np.zeros([nants, nbins, nsols])
-    for ant in range(nants):
-        gain_array[ant, :, :] = np.reshape(s['col' + str(ant + 3)][nsols:], (1, nbins, nsols))
+    gains = read_gains(file_)
+    # the first feed like gpplt
+    gain_array = np.abs(gains['gains'][:, 0, :, :]).astype(np.float64)
+    time_array = jd_to_datetime(gains['times'])
     return gain_array, time_array
 
 
@@ -141,30 +219,10 @@ def get_phases(file_):
     return(array, array): an array with the phase gains for each antenna, frequency bin and solution interval, a
                           datetime array with the actual solution timesteps
     """
-    char_set = string.ascii_uppercase + string.digits  # Create a charset for random gain log file generation
-    tempdir = subs.managetmp.manage_tempdir('mirlog')
-    subs.managetmp.clean_tempdir('mirlog')
-    gains_string = ''.join(random.sample(char_set * 8, 8))
-    gpplt = lib.miriad('gpplt')
-    gpplt.vis = file_
-    gpplt.log = tempdir + '/' + gains_string
-    gpplt.yaxis = 'phase'
-    cmd = gpplt.go()
-    nants = get_nants(tempdir + '/' + gains_string)
-    nbins = get_nbins(tempdir + '/' + gains_string)
-    nsols = get_nsols(tempdir + '/' + gains_string)
-    reformat_table(tempdir + '/' + gains_string)
-    obsdate = cmd[3].split(' ')[4][0:7]
-    starttime = datetime.datetime(int('20' + obsdate[0:2]), int(time.strptime(obsdate[2:5], '%b').tm_mon),
-                                  int(obsdate[5:7]))
-    s = Table.read(tempdir + '/' + gains_string, format='ascii')
-    days = np.array(s['col1'][0:nsols])
-    times = np.array(s['col2'][0:nsols])
-    time_array = [starttime + datetime.timedelta(days=int(days[step]), hours=int(times[step][0:2]), minutes=int(times[step][3:5]),
-                                       seconds=int(times[step][6:8])) for step in range(nsols)]
-    gain_array = np.zeros([nants, nbins, nsols])
-    for ant in range(nants):
-        gain_array[ant, :, :] = np.reshape(s['col' + str(ant + 3)][nsols:], (1, nbins, nsols))
+    gains = read_gains(file_)
+    # the first feed in degrees like gpplt
+    gain_array = np.angle(gains['gains'][:, 0, :, :], deg=True).astype(np.float64)
+    time_array = jd_to_datetime(gains['times'])
     return gain_array, time_array
 
 
@@ -175,24 +233,9 @@ def get_bp(file_):
     return(array, array): The bandpass array in the following order (antenna, frequencies, solution intervals) and a
                           list of the frequencies
     """
-    char_set = string.ascii_uppercase + string.digits  # Create a charset for random gain log file generation
-    tempdir = subs.managetmp.manage_tempdir('mirlog')
-    # tempdir = os.path.expanduser('~') + '/apercal/temp/mirlog'
-    bp_string = ''.join(random.sample(char_set * 8, 8))
-    gpplt = lib.miriad('gpplt')
-    gpplt.vis = file_
-    gpplt.log = tempdir + '/' + bp_string
-    gpplt.options = 'bandpass'
-    gpplt.go()
-    reformat_table(tempdir + '/' + bp_string)
-    t = Table.read(tempdir + '/' + bp_string, format='ascii')
-    freqs = np.array(np.unique(t['col1']))
-    nfreq = len(freqs)
-    nint = len(t['col1']) / nfreq
-    nant = int(len(t[0]) - 1)
-    bp_array = np.zeros((nant, nfreq, nint))
-    for ant in range(nant):
-        bp_array[ant, :, :] = np.swapaxes(t['col' + str(ant + 2)].reshape(nint, nfreq), 0, 1)
+    bandpass, freqs = read_bandpass(file_)
+    # the amplitudes of the first feed like gpplt
+    bp_array = np.abs(bandpass[:, 0, :, :]).astype(np.float64)
     return bp_array, freqs
 
 
@@ -203,20 +246,18 @@ def get_delays(file_):
     return(array, array): an array with the delays for each antenna and solution interval in nsec, a datetime array
                           with the actual solution timesteps
     """
-    char_set = string.ascii_uppercase + string.digits  # Create a charset for random gain log file_ generation
-    tempdir = subs.managetmp.manage_tempdir('mirlog')
-    # tempdir = os.path.expanduser('~') + '/apercal/temp/mirlog'
-    gains_string = ''.join(random.sample(char_set * 8, 8))
-    gpplt = lib.miriad('gpplt')
-    gpplt.vis = file_
-    gpplt.log = tempdir + '/' + gains_string
-    gpplt.options = 'delays'
-    cmd = gpplt.go()
-    reformat_table(tempdir + '/' + gains_string)
+    scratch = subs.managetmp.ScratchArea('mirlog')
+    with scratch:
+        gpplt = lib.miriad('gpplt')
+        gpplt.vis = file_
+        gpplt.log = scratch.add('delays')
+        gpplt.options = 'delays'
+        cmd = gpplt.go()
+        reformat_table(gpplt.log)
+        t = Table.read(gpplt.log, format='ascii')
     obsdate = cmd[3].split(' ')[4][0:7]
     starttime = datetime.datetime(int('20' + obsdate[0:2]), int(time.strptime(obsdate[2:5], '%b').tm_mon),
                                   int(obsdate[5:7]))
-    t = Table.read(tempdir + '/' + gains_string, format='ascii')
     days = np.array(t['col1'])
     times = np.array(t['col2'])
     nint = len(days)
@@ -0,0 +1,193 @@
+"""
+Module to regrid images onto a template with cached reprojection maps.
+
+The mapping from the pixels of the template to the pixels of an image only
+depends on the coordinate systems of the two. It is calculated once with
+astropy.wcs and stored on disk as the index of the lower left input pixel
+and the fractional offsets for bilinear interpolation. Any number of planes
+(continuum, beam maps, Stokes Q/U/V planes) on the same grid are then
+regridded with a vectorized gather.
+"""
+
+import hashlib
+import logging
+import os
+
+import numpy as np
+from astropy.wcs import WCS
+
+from apercal.subs import convim
+from apercal.subs import mosaic_engine
+from apercal.exceptions import ApercalException
+
+logger = logging.getLogger(__name__)
+
+# Header keywords that define the celestial pixel grid of an image
+WCS_KEYWORDS = ['NAXIS1', 'NAXIS2', 'CTYPE1', 'CTYPE2', 'CRVAL1', 'CRVAL2', 'CDELT1', 'CDELT2',
+                'CRPIX1', 'CRPIX2', 'CROTA1', 'CROTA2', 'EQUINOX', 'EPOCH', 'RADESYS']
+
+# Header keywords of the input image that are kept in the regridded image
+COPY_KEYWORDS = ['BUNIT', 'BMAJ', 'BMIN', 'BPA', 'BTYPE', 'OBJECT', 'TELESCOP', 'DATE-OBS']
+
+
+def get_map_key(header, template_header):
+    """
+    Get the key of the reprojection map between two grids
+
+    header (Header): FITS header of the image
+    template_header (Header): FITS header of the template
+    returns (str): A hash of the celestial grids of both headers
+    """
+    values = []
+    for hdr in (header, template_header):
+        values.append([(key, repr(hdr.get(key))) for key in WCS_KEYWORDS])
+    return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()
+
+
+def compute_reprojection_map(header, template_header, block_rows=256):
+    """
+    Calculate the bilinear reprojection map of an image onto a template
+
+    Only the part of the template covered by the image is stored.
+
+    header (Header): FITS header of the image
+    template_header (Header): FITS header of the template
+    block_rows (int): Number of template rows converted at once
+    returns (dict): box on the template, input shape, base index and fractional offsets
+    """
+    nx = header['NAXIS1']
+    ny = header['NAXIS2']
+    box = mosaic_engine.get_sky_footprint(header, template_header)
+    if box is None:
+        box = (0, 0, 0, 0)
+    wcs = WCS(header).celestial
+    template_wcs = WCS(template_header).celestial
+
+    box_shape = (box[1] - box[0], box[3] - box[2])
+    base = np.full(box_shape, -1, dtype=np.int32)
+    offset_x = np.zeros(box_shape, dtype=np.float32)
+    offset_y = np.zeros(box_shape, dtype=np.float32)
+    template_x = np.arange(box[2], box[3], dtype=np.float64)
+    for row in range(box[0], box[1], block_rows):
+        rows = np.arange(row, min(row + block_rows, box[1]), dtype=np.float64)
+        grid_x, grid_y = np.meshgrid(template_x, rows)
+        ra, dec = template_wcs.wcs_pix2world(grid_x.ravel(), grid_y.ravel(), 0)
+        x, y = wcs.wcs_world2pix(ra, dec, 0)
+        x = x.reshape(grid_x.shape)
+        y = y.reshape(grid_y.shape)
+        # allow for rounding errors of the conversion at the edges of the image
+        tolerance = 1e-6
+        valid = (np.isfinite(x) & np.isfinite(y) & (x >= -tolerance) & (x <= nx - 1 + tolerance) &
+                 (y >= -tolerance) & (y <= ny - 1 + tolerance))
+        x = np.clip(np.where(valid, x, 0), 0, nx - 1)
+        y = np.clip(np.where(valid, y, 0), 0, ny - 1)
+        # the upper neighbours of the last row and column are the pixels themselves
+        x0 = np.clip(np.floor(x), 0, max(nx - 2, 0)).astype(np.int64)
+        y0 = np.clip(np.floor(y), 0, max(ny - 2, 0)).astype(np.int64)
+        block = slice(row - box[0], row - box[0] + len(rows))
+        base[block] = np.where(valid, y0 * nx + x0, -1)
+        offset_x[block] = np.where(valid, x - x0, 0.)
+        offset_y[block] = np.where(valid, y - y0, 0.)
+
+    return {'box': np.array(box), 'shape': np.array([ny, nx]), 'base': base,
+            'offset_x': offset_x, 'offset_y': offset_y}
+
+
+def get_reprojection_map(header, template_header, cache_dir):
+    """
+    Get the reprojection map of an image onto a template from the cache or calculate and store it
+
+    header (Header): FITS header of the image
+    template_header (Header): FITS header of the template
+    cache_dir (str): Directory of the cached maps, None to disable the cache
+    returns (dict): The reprojection map
+    """
+    key = get_map_key(header, template_header)
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, 'reproject_{}.npz'.format(key))
+        if os.path.isfile(cache_file):
+            logger.debug("Using cached reprojection map {}".format(cache_file))
+            with np.load(cache_file) as cached:
+                return dict((name, cached[name]) for name in cached.files)
+
+    rmap = compute_reprojection_map(header, template_header)
+
+    if cache_dir is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # Write to a unique name first so that parallel processes never read a partial map
+        tmp_file = '{}.{}.tmp.npz'.format(cache_file[:-4], os.getpid())
+        np.savez(tmp_file, **rmap)
+        os.rename(tmp_file, cache_file)
+        logger.debug("Stored reprojection map {}".format(cache_file))
+    return rmap
+
+
+def reproject_planes(planes, rmap, template_shape):
+    """
+    Regrid planes of an image with a reprojection map
+
+    Template pixels outside the image or next to blanked pixels are blanked.
+
+    planes (array): Image planes with shape (..., ny, nx)
+    rmap (dict): Reprojection map of the image grid
+    template_shape (tuple): Shape of the template in (y, x)
+    returns (array): Regridded planes with shape (..., template ny, template nx)
+    """
+    planes = np.asarray(planes)
+    ny, nx = rmap['shape']
+    if planes.shape[-2:] != (ny, nx):
+        error = "Image shape {0} does not match reprojection map {1}".format(planes.shape[-2:], (ny, nx))
+        logger.error(error)
+        raise ApercalException(error)
+    leading = planes.shape[:-2]
+    flat = planes.reshape(-1, ny * nx)
+
+    box = rmap['box']
+    base = rmap['base']
+    valid = base >= 0
+    index = base[valid]
+    fx = rmap['offset_x'][valid]
+    fy = rmap['offset_y'][valid]
+    # neighbours beyond the edge of a single row or column image
+    step_x = 1 if nx > 1 else 0
+    step_y = nx if ny > 1 else 0
+
+    output = np.full((flat.shape[0],) + tuple(template_shape), np.nan, dtype=np.float32)
+    for plane in range(flat.shape[0]):
+        data = flat[plane]
+        values = ((1. - fx) * (1. - fy) * data[index] + fx * (1. - fy) * data[index + step_x] +
+                  (1. - fx) * fy * data[index + step_y] + fx * fy * data[index + step_y + step_x])
+        region = output[plane, box[0]:box[1], box[2]:box[3]]
+        region[valid] = values
+    return output.reshape(leading + tuple(template_shape))
+
+
+def regrid_miriad_image(input_file, output_file, template_file, cache_dir):
+    """
+    Regrid a MIRIAD image onto a MIRIAD template with a cached reprojection map
+
+    The first two axes are regridded, further axes are kept.
+
+    input_file (str): MIRIAD image to regrid
+    output_file (str): Regridded MIRIAD image
+    template_file (str): MIRIAD template image
+    cache_dir (str): Directory of the cached reprojection maps
+    """
+    template_header = convim.get_fits_header(template_file)
+    data, header = convim.mirtonumpy(input_file)
+    rmap = get_reprojection_map(header, template_header, cache_dir)
+    template_shape = (template_header['NAXIS2'], template_header['NAXIS1'])
+    regridded = reproject_planes(data, rmap, template_shape)
+
+    output_header = mosaic_engine.get_grid_header(template_header, template_shape)
+    output_header['NAXIS'] = header['NAXIS']
+    for axis in range(3, header['NAXIS'] + 1):
+        for key in ['NAXIS'] + mosaic_engine.GRID_KEYWORDS:
+            if '{0}{1}'.format(key, axis) in header:
+                output_header['{0}{1}'.format(key, axis)] = header['{0}{1}'.format(key, axis)]
+    for key in COPY_KEYWORDS:
+        if key in header:
+            output_header[key] = header[key]
+
+    mosaic_engine.write_image(regridded, output_header, mirimage=output_file)
@@ -0,0 +1,194 @@
+"""
+Module to calculate robust image statistics in-process.
+
+The statistics are calculated with NumPy on the memory-mapped pixels of
+MIRIAD or FITS images, so that no MIRIAD task has to be run and no task
+output has to be parsed. Regions follow the MIRIAD conventions: 'quarter'
+is the inner quarter of the image and 'box(xmin,ymin,xmax,ymax)' a box
+with 1-based inclusive pixel coordinates, both optionally followed by the
+planes '(zmin,zmax)'. The noise of many images, e.g. of all beams, is
+calculated in parallel threads, since NumPy and the reading of the images
+release the interpreter lock.
+"""
+
+import logging
+import multiprocessing
+import re
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from apercal.subs import imstats
+from apercal.subs import mosaic_engine
+from apercal.exceptions import ApercalException
+
+logger = logging.getLogger(__name__)
+
+# Conversion from the median absolute deviation to the standard deviation of a Gaussian
+MAD_TO_SIGMA = 1.482602218505602
+
+# Regions in the MIRIAD syntax, e.g. quarter(1) or box(10,10,200,200)(1,3)
+REGION_PATTERN = re.compile(r'^(quarter|box)(?:\(([-\d,\s]*)\))?(?:\(([-\d,\s]*)\))?$')
+
+
+def parse_numbers(text):
+    if text is None or text.strip() == '':
+        return []
+    return [int(number) for number in text.split(',')]
+
+
+def get_region_slices(shape, region=None):
+    """
+    Get the slices of a region for an image with the planes flattened
+
+    shape (tuple): Shape of the image with the last axis first
+    region (str): 'quarter' or 'box(xmin,ymin,xmax,ymax)', optionally followed by '(zmin,zmax)'. None for all pixels.
+    returns (tuple(slice)): Slices for the planes, rows and columns
+    """
+    ny, nx = shape[-2], shape[-1]
+    if region is None:
+        return slice(None), slice(0, ny), slice(0, nx)
+    match = REGION_PATTERN.match(region.strip().strip('"\'').lower())
+    if match is None:
+        raise ApercalException("Region {} is not supported, use quarter or box".format(region))
+    kind, first, second = match.groups()
+    if kind == 'quarter':
+        y_slice, x_slice = mosaic_engine.get_quarter_region((ny, nx))
+        planes = parse_numbers(first)
+    else:
+        xy = parse_numbers(first)
+        if len(xy) != 4:
+            raise ApercalException("Box region {} needs xmin,ymin,xmax,ymax".format(region))
+        xmin, ymin, xmax, ymax = max(xy[0], 1), max(xy[1], 1), min(xy[2], nx), min(xy[3], ny)
+        if xmin > xmax or ymin > ymax:
+            raise ApercalException("Region {} is outside of the image".format(region))
+        y_slice, x_slice = slice(ymin - 1, ymax), slice(xmin - 1, xmax)
+        planes = parse_numbers(second)
+    if len(planes) not in (0, 1, 2):
+        raise ApercalException("Region {} has more than two planes".format(region))
+    plane_slice = slice(planes[0] - 1, planes[-1]) if len(planes) > 0 else slice(None)
+    return plane_slice, y_slice, x_slice
+
+
+def get_region_data(data, region=None):
+    """
+    Get the pixels of a region of an image
+
+    data (array): Pixels with the last axis first, e.g. from imstats.load_image
+    region (str): Region as in get_region_slices
+    returns (array): View of the region with shape (planes, rows, columns)
+    """
+    data = np.asarray(data)
+    planes = data.reshape((-1,) + data.shape[-2:])
+    plane_slice, y_slice, x_slice = get_region_slices(data.shape, region)
+    selected = planes[plane_slice, y_slice, x_slice]
+    if selected.shape[0] == 0:
+        raise ApercalException("Region {0} has no planes in an image with {1}".format(region, len(planes)))
+    return selected
+
+
+def finite_values(data):
+    values = np.asarray(data, dtype=np.float64).ravel()
+    return values[np.isfinite(values)]
+
+
+def mad_noise(data):
+    """
+    Estimate the noise from the median absolute deviation, ignoring blanked pixels
+
+    data (array): Pixels
+    returns (float): The noise, NaN if there are no valid pixels
+    """
+    values = finite_values(data)
+    if len(values) == 0:
+        return np.nan
+    return MAD_TO_SIGMA * np.median(np.abs(values - np.median(values)))
+
+
+def sigma_clipped_rms(data, nsigma=3., maxiter=10, tolerance=1e-3):
+    """
+    Estimate the noise as rms around the median after clipping outliers iteratively
+
+    The clipping starts from the noise of the median absolute deviation, so that
+    bright sources do not inflate the first estimate.
+
+    data (array): Pixels
+    nsigma (float): Clip pixels deviating more than nsigma times the noise from the median
+    maxiter (int): Maximum number of iterations
+    tolerance (float): Stop once the noise changes less than this fraction
+    returns (float): The noise, NaN if there are no valid pixels
+    """
+    values = finite_values(data)
+    if len(values) == 0:
+        return np.nan
+    centre = np.median(values)
+    sigma = MAD_TO_SIGMA * np.median(np.abs(values - centre))
+    if sigma == 0:
+        return float(np.std(values))
+    for _ in range(maxiter):
+        clipped = values[np.abs(values - centre) <= nsigma * sigma]
+        centre = np.median(clipped)
+        new_sigma = np.sqrt(np.mean((clipped - centre) ** 2))
+        converged = abs(new_sigma - sigma) <= tolerance * sigma
+        sigma = new_sigma
+        if converged:
+            break
+    return float(sigma)
+
+
+def region_max(image, region=None):
+    """
+    Get the maximum of a region of a MIRIAD or FITS image, ignoring blanked pixels
+
+    image (str): MIRIAD image or FITS file
+    region (str): Region as in get_region_slices
+    returns (float): The maximum
+    """
+    return float(np.nanmax(get_region_data(imstats.load_image(image), region)))
+
+
+def region_min(image, region=None):
+    """
+    Get the minimum of a region of a MIRIAD or FITS image, ignoring blanked pixels
+
+    image (str): MIRIAD image or FITS file
+    region (str): Region as in get_region_slices
+    returns (float): The minimum
+    """
+    return float(np.nanmin(get_region_data(imstats.load_image(image), region)))
+
+
+def image_noise(image, region=None, nsigma=3.):
+    """
+    Estimate the noise of a MIRIAD or FITS image with sigma clipping
+
+    image (str): MIRIAD image or FITS file
+    region (str): Region as in get_region_slices, by default all pixels
+    nsigma (float): Clipping threshold
+    returns (float): The noise
+    """
+    return sigma_clipped_rms(get_region_data(imstats.load_image(image), region), nsigma=nsigma)
+
+
+def images_noise(images, region=None, nsigma=3., threads=None):
+    """
+    Estimate the noise of many images in parallel threads
+
+    images (list(str)): MIRIAD images or FITS files, e.g. one per beam
+    region (str): Region as in get_region_slices
+    nsigma (float): Clipping threshold
+    threads (int): Number of threads, by default the number of CPUs
+    returns (numpy.ndarray): The noise of each image
+    """
+    if len(images) == 0:
+        return np.zeros(0)
+    threads = max(1, min(threads or multiprocessing.cpu_count(), len(images)))
+    pool = ThreadPool(threads)
+    try:
+        noise = pool.map(lambda image: image_noise(image, region=region, nsigma=nsigma), images)
+    finally:
+        pool.close()
+        pool.join()
+    for image, value in zip(images, noise):
+        logger.debug("Noise of {0} is {1}".format(image, value))
+    return np.array(noise, dtype=np.float64)
@@ -0,0 +1,48 @@
+import unittest
+import os
+import shutil
+import tempfile
+from apercal.subs import bandpass
+
+
+class TestBandpass(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        bandpass._bandpass_tables.clear()
+        self.get_nchan = bandpass.get_nchan
+        bandpass.get_nchan = lambda dataset: 128
+
+    def tearDown(self):
+        bandpass.get_nchan = self.get_nchan
+        shutil.rmtree(self.tmpdir)
+
+    def test_bandpass_table(self):
+        table = bandpass.bandpass_table(128, ants=['RT2', 'RT3'], feeds=['X', 'Y'])
+        lines = table.splitlines()
+        self.assertEqual(len(lines), 2 * 2 * 128)
+        self.assertEqual(lines[0], 'RT2 X 0 0.7022')
+        self.assertEqual(lines[-1], 'RT3 Y 127 0.7362')
+        # a second call is answered from the cache
+        self.assertIs(bandpass.bandpass_table(128, ants=['RT2', 'RT3'], feeds=['X', 'Y']), table)
+        self.assertEqual(len(bandpass._bandpass_tables), 1)
+        bandpass.bandpass_table(64, ants=['RT2', 'RT3'], feeds=['X', 'Y'])
+        self.assertEqual(len(bandpass._bandpass_tables), 2)
+
+    def test_shared_table(self):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        os.mkdir(cache_dir)
+        bandpass.create_bandpass('00.MS', os.path.join(self.tmpdir, 'Bpass_00.txt'), cache_dir=cache_dir)
+        cache_file = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        self.assertEqual(os.listdir(cache_dir), ['Bpass_128ch_12ant.txt'])
+        # the shared table is copied for the next beam instead of being written again
+        with open(cache_file, 'a') as f:
+            f.write('cached')
+        bandpass.create_bandpass('01.MS', os.path.join(self.tmpdir, 'Bpass_01.txt'), cache_dir=cache_dir)
+        with open(os.path.join(self.tmpdir, 'Bpass_01.txt')) as f:
+            self.assertTrue(f.read().endswith('cached'))
+        with open(os.path.join(self.tmpdir, 'Bpass_00.txt')) as f:
+            self.assertEqual(f.read(), bandpass.bandpass_table(128))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+from apercal.libs import calculations
+from apercal.subs import mirio
+
+
+def variable_tokens(number, type_char, data):
+    """
+    Size and data token of a variable in the visdata item, aligned to 8 bytes
+    """
+    start = 8 if type_char == 'd' else 4
+    token = struct.pack('>BBBB', number, 0, 1, 0) + b'\x00' * (start - 4) + data
+    token += b'\x00' * ((8 - len(token) % 8) % 8)
+    return struct.pack('>BBBBi', number, 0, 0, 0, len(data)) + token
+
+
+class TestTheoreticalNoise(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.uv = os.path.join(self.tmpdir, 'target.mir')
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        calculations._weights_cache.clear()
+        self.nchan, self.sdf, self.jyperk = 16, 1e-4, 12.
+        self.write_uv(1)
+
+    def write_uv(self, nspect):
+        """
+        Write a uv dataset with three antennas and system temperatures per antenna and spectral window
+        """
+        rng = np.random.RandomState(1)
+        if os.path.isdir(self.uv):
+            shutil.rmtree(self.uv)
+        os.mkdir(self.uv)
+        open(os.path.join(self.uv, 'header'), 'wb').close()
+        self.nspect = nspect
+        nschan = self.nchan // nspect
+        names = [('i', 'nschan'), ('d', 'sfreq'), ('d', 'sdf'), ('d', 'ra'), ('d', 'dec'), ('i', 'nants'),
+                 ('r', 'jyperk'), ('r', 'inttime'), ('r', 'systemp'), ('r', 'baseline'), ('i', 'pol'), ('r', 'corr')]
+        number = dict((name, n) for n, (_, name) in enumerate(names))
+        with open(os.path.join(self.uv, 'vartable'), 'w') as f:
+            f.write(''.join('{0} {1}\n'.format(type_char, name) for type_char, name in names))
+        stream = [variable_tokens(number['nschan'], 'i', struct.pack('>' + 'i' * nspect, *[nschan] * nspect)),
+                  variable_tokens(number['sfreq'], 'd', struct.pack('>' + 'd' * nspect,
+                                                                    *[1.3 + w * nschan * self.sdf
+                                                                      for w in range(nspect)])),
+                  variable_tokens(number['sdf'], 'd', struct.pack('>' + 'd' * nspect, *[self.sdf] * nspect)),
+                  variable_tokens(number['ra'], 'd', struct.pack('>d', 1.)),
+                  variable_tokens(number['dec'], 'd', struct.pack('>d', 0.5)),
+                  variable_tokens(number['nants'], 'i', struct.pack('>i', 3)),
+                  variable_tokens(number['jyperk'], 'r', struct.pack('>f', self.jyperk))]
+        # records of all baselines and polarisations for two integrations with different system temperatures,
+        # the antenna varies fastest in systemp
+        self.records = []
+        for inttime, tsys in [(30., [[50., 60., 70.], [55., 65., 75.]]), (10., [[40., 40., 80.], [45., 45., 85.]])]:
+            tsys = tsys[:nspect]
+            stream.append(variable_tokens(number['inttime'], 'r', struct.pack('>f', inttime)))
+            stream.append(variable_tokens(number['systemp'], 'r', struct.pack('>' + 'f' * 3 * nspect,
+                                                                              *np.ravel(tsys))))
+            for ant1, ant2 in [(1, 1), (1, 2), (1, 3), (2, 3)]:
+                for pol in [-5, -6, -7]:
+                    stream.append(variable_tokens(number['baseline'], 'r', struct.pack('>f', 256 * ant1 + ant2)))
+                    stream.append(variable_tokens(number['pol'], 'i', struct.pack('>i', pol)))
+                    stream.append(variable_tokens(number['corr'], 'r', b'\x00' * 8 * self.nchan))
+                    stream.append(struct.pack('>BBBB', 0, 0, 2, 0) + b'\x00' * 4)
+                    self.records.append((ant1, ant2, pol, inttime, tsys))
+        with open(os.path.join(self.uv, 'visdata'), 'wb') as f:
+            f.write(b''.join(stream))
+        # flags with 31 values per integer, set bits are good data
+        self.good = rng.uniform(size=(len(self.records), self.nchan)) > 0.3
+        self.good[:, 3] = False
+        bits = np.concatenate([self.good.ravel(), np.zeros(-self.good.size % 31, dtype=bool)]).reshape(-1, 31)
+        words = np.sum(bits.astype(np.int64) << np.arange(31), axis=1)
+        with open(os.path.join(self.uv, 'flags'), 'wb') as f:
+            f.write(b'\x00' * 4 + words.astype('>i4').tobytes())
+
+    def expected_weights(self):
+        window = np.repeat(np.arange(self.nspect), self.nchan // self.nspect)
+        expected = np.zeros(self.nchan)
+        for (ant1, ant2, pol, inttime, tsys), good in zip(self.records, self.good):
+            if ant1 != ant2 and pol != -7:
+                tsys = np.array(tsys)[window]
+                sigma = self.jyperk * np.sqrt(tsys[:, ant1 - 1] * tsys[:, ant2 - 1]) / (
+                    calculations.CORRELATOR_EFFICIENCY * np.sqrt(2 * self.sdf * 1e9 * inttime))
+                expected += good / sigma ** 2
+        return expected
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_uv_records(self):
+        records = mirio.read_uv_records(self.uv, ['baseline', 'pol', 'systemp', 'corr'])
+        self.assertEqual(sorted(records), ['baseline', 'nchan', 'pol', 'systemp'])
+        np.testing.assert_array_equal(records['nchan'], [self.nchan] * len(self.records))
+        np.testing.assert_array_equal(records['baseline'][:, 0], [256 * r[0] + r[1] for r in self.records])
+        np.testing.assert_array_equal(records['pol'][:, 0], [r[2] for r in self.records])
+        np.testing.assert_array_equal(records['systemp'], [np.ravel(r[4]) for r in self.records])
+
+    def test_channel_noise(self):
+        expected = self.expected_weights()
+        noise = calculations.calc_channel_noise(self.uv, cache_dir=self.cache_dir)
+        self.assertTrue(np.isinf(noise[3]))
+        np.testing.assert_allclose(noise[noise < np.inf], 1 / np.sqrt(expected[expected > 0]), rtol=1e-6)
+        self.assertAlmostEqual(calculations.calc_chunk_noise(self.uv, 4, 7, cache_dir=self.cache_dir) /
+                               (1 / np.sqrt(np.sum(expected[4:8]))), 1.)
+        self.assertAlmostEqual(calculations.calc_theoretical_noise(self.uv, cache_dir=self.cache_dir) /
+                               (1 / np.sqrt(np.sum(expected))), 1.)
+
+    def test_spectral_windows(self):
+        self.write_uv(2)
+        expected = self.expected_weights()
+        weights = calculations.calc_channel_weights(self.uv, cache_dir=self.cache_dir)
+        np.testing.assert_allclose(weights, expected, rtol=1e-6)
+
+    def test_weights_cache(self):
+        weights = calculations.calc_channel_weights(self.uv, cache_dir=self.cache_dir)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        # a new run takes the weights from disk without reading the records again
+        def fail(dataset):
+            raise AssertionError("records read again")
+
+        calc_record_weights = calculations.calc_record_weights
+        calculations.calc_record_weights = fail
+        try:
+            calculations._weights_cache.clear()
+            np.testing.assert_array_equal(calculations.calc_channel_weights(self.uv, cache_dir=self.cache_dir),
+                                          weights)
+            # a changed dataset is read again
+            calculations._weights_cache.clear()
+            with open(os.path.join(self.uv, 'flags'), 'ab') as f:
+                f.write(b'\x00' * 4)
+            self.assertRaises(AssertionError, calculations.calc_channel_weights, self.uv, cache_dir=self.cache_dir)
+        finally:
+            calculations.calc_record_weights = calc_record_weights
+
+
+if __name__ == "__main__":
+    unittest.main()
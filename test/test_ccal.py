@@ -1,8 +1,14 @@
 import unittest
 import matplotlib as mpl
 mpl.use('TkAgg')
-from apercal.modules.ccal import ccal
+from apercal.modules.ccal import ccal, ccal_tables
+from apercal.subs import param as subs_param
+from backports import tempfile
 from os import path
+import os
+import shutil
+import casacore.tables as pt
+import numpy as np
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
@@ -20,5 +26,108 @@ class TestCcal(unittest.TestCase):
         p.go()
 
 
+
+class TestTableInvalidation(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.p = ccal()
+        self.p.basedir = self.tempdir.name + '/'
+        self.p.beam = '00'
+        self.p.rawsubdir = 'raw'
+        self.p.fluxcal = '3C147.MS'
+        self.p.polcal = '3C286.MS'
+        self.p.target = ''
+        self.p.crosscal_refant = 'RT2'
+        self.cbeam = 'ccal_B00'
+        os.makedirs(self.p.get_rawsubdir_path())
+        for name, cal, ext, prevtables, corrs in ccal_tables:
+            self.write_table(name, 1.)
+        self.p.invalidate_tables()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def get_table(self, name):
+        for tablename, cal, ext, prevtables, corrs in ccal_tables:
+            if tablename == name:
+                return self.p.get_table_path(cal, ext)
+
+    def write_table(self, name, value, flagged=()):
+        table = self.get_table(name)
+        if path.isdir(table):
+            shutil.rmtree(table)
+        desc = pt.maketabdesc([pt.makearrcoldesc('CPARAM', 0j, ndim=2),
+                               pt.makearrcoldesc('FLAG', False, ndim=2)])
+        t = pt.table(table, desc, nrow=12, ack=False)
+        t.putcol('CPARAM', np.full((12, 4, 2), value, dtype=np.complex64))
+        flags = np.zeros((12, 4, 2), dtype=bool)
+        flags[list(flagged)] = True
+        t.putcol('FLAG', flags)
+        t.close()
+        subs_param.add_param(self.p, self.cbeam + '_' + name, True)
+
+    def kept_tables(self):
+        return [name for name, cal, ext, prevtables, corrs in ccal_tables if path.isdir(self.get_table(name))]
+
+    def test_crosshand_flags(self):
+        subs_param.add_param(self.p, self.cbeam + '_flag_list', [['RT5', 'XY', '']])
+        removed = self.p.invalidate_tables()
+        self.assertEqual(removed, ['polcal_crosshanddelay', 'fluxcal_leakage', 'polcal_polarisationangle'])
+        self.assertEqual(self.kept_tables(), ['fluxcal_initialphase', 'fluxcal_globaldelay',
+                                              'fluxcal_bandpass', 'fluxcal_apgains'])
+
+    def test_parallel_hand_flags(self):
+        subs_param.add_param(self.p, self.cbeam + '_flag_list', [['RT5', 'XX', '']])
+        removed = self.p.invalidate_tables()
+        self.assertEqual(removed, ['fluxcal_initialphase', 'fluxcal_globaldelay',
+                                   'fluxcal_bandpass', 'fluxcal_apgains'])
+        self.assertEqual(self.kept_tables(), ['polcal_crosshanddelay', 'fluxcal_leakage',
+                                              'polcal_polarisationangle'])
+
+        # the same solutions again keep the cross-hand tables
+        for name in removed[:3]:
+            self.write_table(name, 1.)
+            self.assertEqual(self.p.invalidate_tables(), [])
+        self.write_table('fluxcal_apgains', 1. + 1e-5)
+        self.assertEqual(self.p.invalidate_tables(), [])
+        self.assertEqual(len(self.kept_tables()), len(ccal_tables))
+
+    def test_newly_flagged_antenna(self):
+        subs_param.add_param(self.p, self.cbeam + '_flag_list', [['RT5', 'XX', '']])
+        removed = self.p.invalidate_tables()
+        for name in removed[:3]:
+            self.write_table(name, 1.)
+            self.p.invalidate_tables()
+        # flagging one more antenna keeps the solutions of the others
+        self.write_table('fluxcal_apgains', 1., flagged=[5])
+        self.assertEqual(self.p.invalidate_tables(), [])
+        self.assertEqual(len(self.kept_tables()), len(ccal_tables))
+
+        # unflagging it again gives solutions the cross-hand tables were not solved with
+        self.p.remove_table('fluxcal_apgains', 'fluxcal', '.G1ap')
+        self.write_table('fluxcal_apgains', 1.)
+        self.assertEqual(self.p.invalidate_tables(), ['polcal_crosshanddelay', 'fluxcal_leakage',
+                                                      'polcal_polarisationangle'])
+
+    def test_changed_solutions(self):
+        subs_param.add_param(self.p, self.cbeam + '_flag_list', [['RT5', 'YY', '']])
+        self.p.invalidate_tables()
+        for name in ['fluxcal_initialphase', 'fluxcal_globaldelay', 'fluxcal_bandpass']:
+            self.write_table(name, 1.)
+            self.p.invalidate_tables()
+        self.write_table('fluxcal_apgains', 2.)
+        removed = self.p.invalidate_tables()
+        self.assertEqual(removed, ['polcal_crosshanddelay', 'fluxcal_leakage', 'polcal_polarisationangle'])
+        self.assertEqual(self.kept_tables(), ['fluxcal_initialphase', 'fluxcal_globaldelay',
+                                              'fluxcal_bandpass', 'fluxcal_apgains'])
+
+    def test_refant(self):
+        self.p.crosscal_refant = 'RT3'
+        self.assertEqual(self.p.invalidate_tables(), [name for name, _, _, _, _ in ccal_tables])
+        self.assertEqual(self.kept_tables(), [])
+        self.p.remove_previous_tables()
+        self.assertFalse(path.isdir(self.get_table('fluxcal_bandpass') + '.prev'))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+import numpy as np
+from apercal.subs import ccal_utils
+
+
+class TestPolyfitAutocorr(unittest.TestCase):
+    def test_polyfit_autocorr(self):
+        rng = np.random.RandomState(28)
+        freqs = np.linspace(1.25e9, 1.55e9, 300)
+        amp = 800. + 2e-7 * (freqs - 1.4e9) + 3e-15 * (freqs - 1.4e9) ** 2 + rng.normal(scale=5., size=(2, 12, 300))
+        amp[:, :, :20] = 0.
+        amp[0, 3, 150] = 5000.
+        amp[1, 5] = 0.
+        poly, covm, r2, mask, flags = ccal_utils.polyfit_autocorr((freqs, amp[0], amp[1]))
+        self.assertEqual(poly.shape, (12, 2, 3))
+        self.assertFalse(mask[3, 0, 150])
+        for ant in range(12):
+            for pol in range(2):
+                if ant == 5 and pol == 1:
+                    # a dish without data has no fit and is flagged
+                    self.assertTrue(np.all(np.isnan(poly[ant, pol])))
+                    self.assertTrue(flags[ant, pol])
+                    continue
+                good = mask[ant, pol]
+                ref_poly, ref_covm = np.polyfit(freqs[good], amp[pol, ant][good], 2, cov=True)
+                np.testing.assert_allclose(poly[ant, pol], ref_poly, rtol=1e-6)
+                np.testing.assert_allclose(covm[ant, pol], ref_covm, rtol=1e-5)
+        # leading axes such as beams are fitted in the same call
+        beams = ccal_utils.polyfit_autocorr((freqs, np.stack([amp[0]] * 3), np.stack([amp[1]] * 3)))
+        self.assertEqual(beams[0].shape, (3, 12, 2, 3))
+        np.testing.assert_allclose(beams[0][2], poly)
+
+
+if __name__ == "__main__":
+    unittest.main()
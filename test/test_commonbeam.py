@@ -0,0 +1,50 @@
+import unittest
+import numpy as np
+from apercal.subs import commonbeam
+
+CDELT1 = -4. / 3600.
+CDELT2 = 4. / 3600.
+
+
+def gaussian(bmaj, bmin, bpa, shape, peak):
+    """
+    Image of a point source restored with a Gaussian beam
+    """
+    cov_inv = np.linalg.inv(commonbeam.beam_covariance(bmaj, bmin, bpa, CDELT1, CDELT2))
+    y, x = np.mgrid[0:shape[0], 0:shape[1]]
+    x = x - shape[1] // 2
+    y = y - shape[0] // 2
+    return peak * np.exp(-0.5 * (cov_inv[0, 0] * x ** 2 + 2. * cov_inv[0, 1] * x * y + cov_inv[1, 1] * y ** 2))
+
+
+class TestCommonBeam(unittest.TestCase):
+    def test_position_angle(self):
+        # a beam with a position angle of 0 is elongated north-south, i.e. along y
+        cov = commonbeam.beam_covariance(30., 10., 0., CDELT1, CDELT2)
+        self.assertGreater(cov[1, 1], cov[0, 0])
+        cov = commonbeam.beam_covariance(30., 10., 90., CDELT1, CDELT2)
+        self.assertGreater(cov[0, 0], cov[1, 1])
+
+    def test_convolve_to_beam(self):
+        shape = (128, 160)
+        beams = np.array([[15., 12., 30.], [20., 18., -45.], [14., 14., 0.]])
+        target = [25., 25., 0.]
+        images = np.array([gaussian(b[0], b[1], b[2], shape, 2.5) for b in beams])
+        images[0, :5, :5] = np.nan
+
+        convolved = commonbeam.convolve_to_beam(images, beams, target, CDELT1, CDELT2)
+
+        # a point source keeps its peak flux in Jy/beam
+        expected = gaussian(target[0], target[1], target[2], shape, 2.5)
+        for image in convolved:
+            np.testing.assert_allclose(image[5:, 5:], expected[5:, 5:], atol=1e-5)
+        self.assertTrue(np.isnan(convolved[0, :5, :5]).all())
+
+    def test_target_too_small(self):
+        images = np.zeros((1, 32, 32))
+        with self.assertRaises(Exception):
+            commonbeam.convolve_to_beam(images, [[20., 20., 0.]], [10., 10., 0.], CDELT1, CDELT2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import astropy.io.fits as pyfits
+from astropy.wcs import WCS
+from apercal.subs import convim
+from apercal.subs import mirio
+
+
+class TestConvim(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        self.tmpdir = tempfile.mkdtemp()
+        self.header = pyfits.Header()
+        for key, value in [('NAXIS', 3), ('NAXIS1', 40), ('NAXIS2', 30), ('NAXIS3', 2),
+                           ('CTYPE1', 'RA---SIN'), ('CRVAL1', 180.5), ('CDELT1', -0.001), ('CRPIX1', 21.),
+                           ('CTYPE2', 'DEC--SIN'), ('CRVAL2', 45.2), ('CDELT2', 0.001), ('CRPIX2', 16.),
+                           ('CTYPE3', 'FREQ'), ('CRVAL3', 1.4e9), ('CDELT3', 1e6), ('CRPIX3', 1.),
+                           ('BUNIT', 'JY/BEAM'), ('BMAJ', 0.004), ('BMIN', 0.003), ('BPA', 20.), ('EQUINOX', 2000.),
+                           ('DATE-OBS', '2019-05-01T12:00:00.000')]:
+            self.header[key] = value
+        self.data = rng.normal(size=(2, 30, 40)).astype(np.float32)
+        self.data[1, 5:8, 10:20] = np.nan
+        self.image = os.path.join(self.tmpdir, 'image.map')
+        convim.numpytomir(self.data, self.image, header=self.header)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        header = mirio.MiriadHeader(self.image)
+        self.assertAlmostEqual(header['crval1'], np.radians(180.5))
+        self.assertAlmostEqual(header['crval3'], 1.4)
+        self.assertEqual(header.get_type('bmaj'), 'real')
+        data, fitsheader = convim.mirtonumpy(self.image)
+        np.testing.assert_array_equal(data, self.data)
+        for key in ['CRVAL1', 'CDELT1', 'CRPIX2', 'CRVAL3', 'CDELT3', 'BPA', 'EQUINOX']:
+            self.assertAlmostEqual(fitsheader[key], self.header[key])
+        self.assertAlmostEqual(fitsheader['BMAJ'], 0.004)
+        self.assertEqual(fitsheader['DATE-OBS'], '2019-05-01T12:00:00.000')
+        np.testing.assert_allclose(WCS(fitsheader).wcs_pix2world([[3., 7., 1.]], 0),
+                                   WCS(self.header).wcs_pix2world([[3., 7., 1.]], 0))
+        # without the mask the blanked pixels are zero in the memory-mapped image
+        raw, _ = convim.mirtonumpy(self.image, masked=False)
+        self.assertIsInstance(raw, np.memmap)
+        self.assertEqual(raw[1, 6, 15], 0.)
+
+    def test_template(self):
+        data, _ = convim.mirtonumpy(self.image, mode='r+', masked=False)
+        data[0] *= 2.
+        data.flush()
+        del data
+        output = os.path.join(self.tmpdir, 'double.map')
+        convim.numpytomir(convim.mirtonumpy(self.image)[0] / 2., output, template=self.image)
+        np.testing.assert_allclose(convim.mirtonumpy(output)[0][0], self.data[0], rtol=1e-6)
+        self.assertEqual(mirio.MiriadHeader(output)['ctype2'], 'DEC--SIN')
+        self.assertAlmostEqual(mirio.MiriadHeader(output)['datamax'], np.nanmax(self.data), places=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
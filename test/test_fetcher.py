@@ -0,0 +1,73 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from apercal.subs import fetcher
+
+
+class TestFetcher(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'alta')
+        self.local = os.path.join(self.tmpdir, 'images')
+        self.requests = []
+        for beam in ['00', '01', '02', '03', '04']:
+            alta_dir = '/altaZone/archive/apertif_main/visibilities_default/200505001_AP_B0{}'.format(beam)
+            os.makedirs(os.path.join(self.root, alta_dir.lstrip('/')))
+            files = []
+            for name in ['Qcube.fits', 'Ucube.fits']:
+                with open(os.path.join(self.root, alta_dir.lstrip('/'), name), 'wb') as f:
+                    f.write(os.urandom(100000 + int(beam)))
+                files.append((os.path.join(alta_dir, name), os.path.join(self.local, beam, name)))
+            self.requests.append(fetcher.FetchRequest(beam, files))
+        self.manifest_file = os.path.join(self.tmpdir, 'manifest.json')
+        self.backend = fetcher.LocalAltaBackend(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assert_same(self, source, destination):
+        with open(self.backend.local_path(source), 'rb') as f:
+            expected = f.read()
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_fetch(self):
+        # a partial file of an interrupted run is continued
+        source, destination = self.requests[1].files[0]
+        os.makedirs(os.path.dirname(destination))
+        with open(self.backend.local_path(source), 'rb') as f:
+            with open(destination + '.part', 'wb') as fout:
+                fout.write(f.read(5000))
+        # a beam with a missing file fails without stopping the others
+        os.remove(self.backend.local_path(self.requests[3].files[1][0]))
+
+        completed = []
+        failed = fetcher.Fetcher(self.backend, workers=3, manifest_file=self.manifest_file).fetch(
+            self.requests, on_complete=completed.append)
+        self.assertEqual(failed, ['03'])
+        self.assertEqual(sorted(completed), ['00', '01', '02', '04'])
+        for request in self.requests:
+            if request.key != '03':
+                for source, destination in request.files:
+                    self.assert_same(source, destination)
+                    self.assertFalse(os.path.exists(destination + '.part'))
+        with open(self.manifest_file) as f:
+            self.assertEqual(len(json.load(f)), 9)
+
+        # files in the manifest are not retrieved again
+        mtime = os.path.getmtime(self.requests[0].files[0][1])
+        failed = fetcher.Fetcher(self.backend, workers=3, manifest_file=self.manifest_file).fetch(self.requests[:1])
+        self.assertEqual(failed, [])
+        self.assertEqual(os.path.getmtime(self.requests[0].files[0][1]), mtime)
+
+    def test_listdir(self):
+        alta_dir = os.path.dirname(self.requests[0].files[0][0])
+        self.assertTrue(self.backend.exists(alta_dir))
+        self.assertFalse(self.backend.exists(alta_dir + '_missing'))
+        self.assertEqual(self.backend.listdir(alta_dir), ['Qcube.fits', 'Ucube.fits'])
+
+
+if __name__ == "__main__":
+    unittest.main()
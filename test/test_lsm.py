@@ -0,0 +1,51 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+from astropy.coordinates import SkyCoord
+from apercal.subs import lsm
+from apercal.subs import lsm_index
+from apercal.subs.pb import wsrtBeam
+
+
+class TestLsm(unittest.TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        lsm_index.ingest_synthetic_catalogues(self.index_dir)
+        self.coords = SkyCoord(ra=180.2, dec=45.1, unit='deg')
+        self.cat = lsm.query_catalogue(None, 'NVSS', 2.0, index_dir=self.index_dir, coords=self.coords)
+        self.low_cat = lsm.query_catalogue(None, 'WENSS', 2.0, index_dir=self.index_dir, coords=self.coords)
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def test_appflux(self):
+        cat = lsm.calc_offset(None, self.cat, coords=self.coords)
+        cat = lsm.calc_appflux(None, cat, 'WSRT', freq=1.4)
+        for source in cat[:20]:
+            self.assertAlmostEqual(source.appflux, source.flux * wsrtBeam(source.dist, 1.4))
+            self.assertAlmostEqual(source.DEC_off, (source.DEC - 45.1) * 3600.)
+        cat = lsm.cutoff_catalogue(lsm.sort_catalogue(cat, 'appflux'), 0.8)
+        self.assertTrue(np.all(np.diff(cat.appflux) <= 0))
+        self.assertLess(len(cat), len(self.cat))
+
+    def test_spectral_index(self):
+        cat = lsm.calc_SI(self.cat, self.low_cat, 30)
+        matched = cat.flux > 0.015
+        self.assertTrue(np.all(cat.SI[~matched] == -0.7))
+        # the synthetic WENSS fluxes have spectral indices around -0.7 with a scatter of 0.2
+        self.assertLess(abs(np.mean(cat.SI[matched]) + 0.7), 0.1)
+        self.assertGreater(np.std(cat.SI[matched]), 0.1)
+        # sources with two counterparts share the low frequency flux according to their flux
+        pair = np.rec.array(np.concatenate([self.cat[:1], self.cat[:1]]))
+        pair.flux = [0.03, 0.01]
+        si = lsm.calc_SI(pair, pair[:1], 30).SI
+        np.testing.assert_allclose(si, np.log10(4. / 3.) / np.log10(1.4 / 0.33))
+        np.testing.assert_array_equal(lsm.calc_SI(self.cat, [], 30).SI, -0.7)
+        # an empty field has no sources to match, also with sources in the second catalogue
+        self.assertEqual(lsm.calc_SI([], self.low_cat, 30), [])
+        self.assertEqual(len(lsm.calc_SI(self.cat[:0], self.low_cat, 30).SI), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+from apercal.subs import lsm_index
+
+
+class TestLsmIndex(unittest.TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.assertEqual(lsm_index.ingest_synthetic_catalogues(self.index_dir), ['NVSS', 'WENSS'])
+        self.sources = np.load(lsm_index.get_index_files(self.index_dir, 'NVSS')[0])
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def test_cone_search(self):
+        # the index gives the same sources as a search through the whole catalogue
+        for ra, dec, radius, minflux in [(180., 45., 0.5, 0.), (181., 46.2, 1.5, 10.), (180., 45., 10., 100.)]:
+            cat = lsm_index.query_index(self.index_dir, 'NVSS', ra, dec, radius, minflux=minflux)
+            dist = lsm_index.angular_distance(ra, dec, self.sources['RA'], self.sources['DEC'])
+            expected = (dist <= radius) & (self.sources['flux'] * 1000. > minflux)
+            self.assertEqual(len(cat), np.count_nonzero(expected))
+            self.assertEqual(sorted(cat.RA), sorted(self.sources['RA'][expected]))
+            self.assertTrue(np.all(np.diff(cat.dist) >= 0))
+        self.assertEqual(cat.dtype.names, ('RA', 'DEC', 'MajAxis', 'MinAxis', 'PA', 'flux', 'dist'))
+        self.assertEqual(len(lsm_index.query_index(self.index_dir, 'WENSS', 0., -45., 2.)), 0)
+
+    def test_ra_wrap(self):
+        sources = np.zeros(3, dtype=lsm_index.INDEX_DTYPE)
+        sources['RA'] = [359.9, 0.1, 10.]
+        sources['DEC'] = [60., 60., 60.]
+        sources['flux'] = 1.
+        filename = self.index_dir + '/wrap.csv'
+        with open(filename, 'w') as f:
+            f.write('RAJ2000,DEJ2000,Fint,Maj,Min\n')
+            for source in sources:
+                f.write('{0},{1},1000,5,5\n'.format(source['RA'], source['DEC']))
+        lsm_index.ingest_catalogue(filename, 'FIRST', self.index_dir)
+        cat = lsm_index.query_index(self.index_dir, 'FIRST', 0., 60., 0.5)
+        np.testing.assert_allclose(sorted(cat.RA), [0.1, 359.9])
+        np.testing.assert_allclose(cat.flux, [1., 1.])
+        self.assertTrue(np.all(np.isnan(cat.PA)))
+
+
+if __name__ == "__main__":
+    unittest.main()
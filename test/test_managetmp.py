@@ -0,0 +1,55 @@
+import unittest
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+from apercal.subs import managetmp
+from apercal.exceptions import ApercalException
+
+
+class TestScratchArea(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_isolated_areas(self):
+        with managetmp.ScratchArea('imstats', root=self.root) as first:
+            with managetmp.ScratchArea('imstats', root=self.root) as second:
+                self.assertNotEqual(first, second)
+                with open(os.path.join(second, 'image.fits'), 'w') as f:
+                    f.write('data')
+            self.assertFalse(os.path.exists(second))
+            self.assertTrue(os.path.isdir(first))
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_reclaim(self):
+        # an area of a process that has finished is removed, the area of a running process is kept
+        process = subprocess.Popen(['true'])
+        process.wait()
+        for name, pid in [('crashed', process.pid), ('running', os.getpid())]:
+            os.mkdir(os.path.join(self.root, name))
+            with open(os.path.join(self.root, name, managetmp.OWNER_FILE), 'w') as f:
+                json.dump({'host': socket.gethostname(), 'pid': pid}, f)
+        with managetmp.ScratchArea('mirlog', root=self.root) as tempdir:
+            self.assertEqual(sorted(os.listdir(self.root)), sorted(['running', os.path.basename(tempdir)]))
+        self.assertEqual(os.listdir(self.root), ['running'])
+
+    def test_quota(self):
+        with open(os.path.join(self.root, 'large'), 'wb') as f:
+            f.write(b'\x00' * 2048)
+        self.assertRaises(ApercalException, managetmp.ScratchArea('imstats', root=self.root, quota=1024).create)
+        area = managetmp.ScratchArea('imstats', root=self.root, quota=4096)
+        with area as tempdir:
+            self.assertTrue(os.path.isdir(tempdir))
+            with open(area.add('image.fits'), 'wb') as f:
+                f.write(b'\x00' * 4096)
+            # the usage is checked again for every new file
+            self.assertRaises(ApercalException, area.add, 'mask.fits')
+
+
+if __name__ == "__main__":
+    unittest.main()
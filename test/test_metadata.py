@@ -0,0 +1,116 @@
+import unittest
+import json
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+from apercal.libs import calculations
+from apercal.subs import metadata
+from apercal.subs import readmirhead
+
+
+def variable_tokens(number, type_code, data):
+    """
+    Size and data token of a variable in the visdata item, aligned to 8 bytes
+    """
+    start = 8 if type_code == 'd' else 4
+    token = struct.pack('>BBBB', number, 0, 1, 0) + b'\x00' * (start - 4) + data
+    token += b'\x00' * ((8 - len(token) % 8) % 8)
+    return struct.pack('>BBBBi', number, 0, 0, 0, len(data)) + token
+
+
+class TestMetadata(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.uv = os.path.join(self.tmpdir, 'target.mir')
+        os.mkdir(self.uv)
+        open(os.path.join(self.uv, 'header'), 'wb').close()
+        variables = [('a', 'source', b'3C147'), ('d', 'ra', struct.pack('>d', 1.5)),
+                     ('d', 'dec', struct.pack('>d', 0.87)), ('i', 'nschan', struct.pack('>ii', 64, 64)),
+                     ('d', 'sfreq', struct.pack('>dd', 1.2, 1.21)), ('d', 'sdf', struct.pack('>dd', 1e-4, 1e-4)),
+                     ('i', 'nants', struct.pack('>i', 12)), ('r', 'systemp', struct.pack('>fff', 70., 80., 0.)),
+                     ('r', 'jyperk', struct.pack('>f', 12.)), ('r', 'inttime', struct.pack('>f', 30.)),
+                     ('d', 'freq', struct.pack('>d', 1.4204))]
+        with open(os.path.join(self.uv, 'vartable'), 'w') as f:
+            f.write(''.join('{0} {1}\n'.format(type_char, name) for type_char, name, _ in variables))
+        with open(os.path.join(self.uv, 'visdata'), 'wb') as f:
+            for number, (type_char, _, data) in enumerate(variables):
+                f.write(variable_tokens(number, type_char, data))
+            f.write(struct.pack('>BBBB', 0, 0, 2, 0) + b'\x00' * 4)
+        metadata._metadata_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_miriad_metadata(self):
+        meta = metadata.get_metadata(self.uv)
+        self.assertEqual(meta['nchan'], 64)
+        self.assertEqual(meta['sfreq'], [1.2, 1.21])
+        self.assertEqual(meta['nants'], 12)
+        self.assertEqual(meta['source'], '3C147')
+        self.assertEqual(meta['tsys'], 75.)
+        self.assertEqual(meta['inttime'], 30.)
+        self.assertEqual(meta['restfreq'], 1.4204)
+        # the first channel is at the start frequency, not at the rest frequency
+        self.assertAlmostEqual(calculations.get_freqstart(self.uv, 10) / 1e9, 1.2 + 10 * 1e-4)
+        self.assertEqual(len(metadata.get_channel_freqs(self.uv)), 128)
+        self.assertAlmostEqual(metadata.get_channel_freqs(self.uv)[64], 1.21)
+        self.assertEqual(readmirhead.getnchan(self.uv), 64)
+        self.assertAlmostEqual(readmirhead.getradec(self.uv).dec.rad, 0.87)
+
+    def test_sidecar(self):
+        metadata.get_metadata(self.uv)
+        with open(os.path.join(self.tmpdir, metadata.SIDECAR_FILE)) as f:
+            self.assertEqual(json.load(f)['target.mir']['metadata']['nchan'], 64)
+
+        def fail(dataset):
+            raise AssertionError("metadata extracted again")
+
+        read_miriad_metadata = metadata.read_miriad_metadata
+        metadata.read_miriad_metadata = fail
+        try:
+            # a new process answers from the sidecar until the dataset changes
+            metadata._metadata_cache.clear()
+            self.assertEqual(metadata.get_metadata(self.uv)['nchan'], 64)
+            mtime = os.path.getmtime(os.path.join(self.uv, 'visdata'))
+            os.utime(os.path.join(self.uv, 'visdata'), (mtime + 10, mtime + 10))
+            self.assertRaises(AssertionError, metadata.get_metadata, self.uv)
+        finally:
+            metadata.read_miriad_metadata = read_miriad_metadata
+        self.assertEqual(metadata.get_metadata(self.uv)['nchan'], 64)
+
+    def write_ms(self, restfreq=None):
+        import casacore.tables as pt
+        msname = os.path.join(self.tmpdir, 'target.MS')
+        main = pt.table(msname, pt.maketabdesc([pt.makescacoldesc('INTERVAL', 0.)]), nrow=1, ack=False)
+        main.putcell('INTERVAL', 0, 30.)
+        subtables = [('SPECTRAL_WINDOW', [pt.makearrcoldesc('CHAN_FREQ', 0.), pt.makearrcoldesc('CHAN_WIDTH', 0.)],
+                      {'CHAN_FREQ': np.array([[1.3e9, 1.3001e9]]), 'CHAN_WIDTH': np.array([[1e5, 1e5]])}),
+                     ('ANTENNA', [pt.makescacoldesc('NAME', '')], {'NAME': ['RT2']}),
+                     ('FIELD', [pt.makescacoldesc('NAME', ''), pt.makearrcoldesc('PHASE_DIR', 0.)],
+                      {'NAME': ['3C147'], 'PHASE_DIR': np.array([[[1.5, 0.87]]])})]
+        if restfreq is not None:
+            subtables.append(('SOURCE', [pt.makearrcoldesc('REST_FREQUENCY', 0.)],
+                              {'REST_FREQUENCY': np.array([[restfreq]])}))
+        for name, columns, values in subtables:
+            table = pt.table(os.path.join(msname, name), pt.maketabdesc(columns), nrow=1, ack=False)
+            for column, value in values.items():
+                table.putcol(column, value)
+            table.close()
+            main.putkeyword(name, 'Table: ' + os.path.join(msname, name))
+        main.close()
+        return msname
+
+    def test_ms_restfreq(self):
+        msname = self.write_ms()
+        self.assertAlmostEqual(metadata.read_ms_metadata(msname)['restfreq'], 1.3)
+        shutil.rmtree(msname)
+        msname = self.write_ms(restfreq=1.420405752e9)
+        meta = metadata.read_ms_metadata(msname)
+        self.assertAlmostEqual(meta['restfreq'], 1.420405752)
+        self.assertAlmostEqual(meta['sfreq'][0], 1.3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+import astropy.io.fits as pyfits
+from apercal.subs import mosaic_engine
+from apercal.subs.mosaic_accumulator import MosaicAccumulator
+
+
+class TestMosaicAccumulator(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(39)
+        nbeams = 12
+        ny, nx = 64, 80
+        y, x = np.mgrid[0:ny, 0:nx]
+        self.beams = []
+        self.images = []
+        for b in range(nbeams):
+            y0, x0 = rng.uniform(0, ny), rng.uniform(0, nx)
+            beam = np.exp(-((y - y0) ** 2 + (x - x0) ** 2) / (2. * 12. ** 2)).astype(np.float32)
+            beam[beam < 0.25] = np.nan
+            self.beams.append(beam)
+            self.images.append((np.nan_to_num(beam) * 0.1 + rng.normal(0, 1e-3, (ny, nx))).astype(np.float32))
+        self.noise = rng.uniform(1e-4, 3e-4, nbeams)
+        self.correlation = np.eye(nbeams) + 0.1 * (np.eye(nbeams, k=1) + np.eye(nbeams, k=-1))
+        self.inv_cov = np.linalg.inv(self.correlation * np.outer(self.noise, self.noise))
+        self.names = ['beam{:02d}'.format(b) for b in range(nbeams)]
+
+        self.header = pyfits.Header()
+        self.header['NAXIS'] = 2
+        self.header['NAXIS1'] = nx
+        self.header['NAXIS2'] = ny
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def weights(self, b, inv_cov):
+        return dict((self.names[n], inv_cov[b, n]) for n in range(len(self.names)) if inv_cov[b, n] != 0.)
+
+    def assert_mosaic(self, accumulator, beams, inv_cov):
+        mosaic, noise, _ = accumulator.get_mosaic()
+        ref_mosaic, ref_noise, _ = mosaic_engine.linear_mosaic(
+            [self.images[b] for b in beams], [self.beams[b] for b in beams], inv_cov[np.ix_(beams, beams)])
+        np.testing.assert_array_equal(np.isnan(mosaic), np.isnan(ref_mosaic))
+        np.testing.assert_allclose(mosaic, ref_mosaic, rtol=1e-4, atol=1e-7, equal_nan=True)
+        np.testing.assert_allclose(noise, ref_noise, rtol=1e-4, equal_nan=True)
+
+    def test_add_remove_replace(self):
+        accumulator = MosaicAccumulator(self.tmpdir, self.header)
+        beams = list(range(len(self.names)))
+        for b in beams:
+            accumulator.add_beam(self.names[b], self.images[b], self.beams[b], self.weights(b, self.inv_cov))
+        self.assert_mosaic(accumulator, beams, self.inv_cov)
+
+        # the accumulator is persistent, remove a beam that is not correlated with the others
+        accumulator = MosaicAccumulator(self.tmpdir)
+        inv_cov = self.inv_cov.copy()
+        inv_cov[0, 1] = inv_cov[1, 0] = 0.
+        accumulator.replace_beam(self.names[0], self.images[0], self.beams[0], self.weights(0, inv_cov))
+        accumulator.remove_beam(self.names[0])
+        self.assertEqual(accumulator.beams, self.names[1:])
+        self.assert_mosaic(accumulator, beams[1:], inv_cov)
+
+        # a reprocessed beam with a new image and noise only changes its own row and column
+        self.images[5] = self.images[5] * 1.5
+        self.noise[5] *= 2.
+        inv_cov = np.linalg.inv(self.correlation * np.outer(self.noise, self.noise))
+        inv_cov[0, 1] = inv_cov[1, 0] = 0.
+        accumulator.replace_beam(self.names[5], self.images[5], self.beams[5], self.weights(5, inv_cov))
+        self.assert_mosaic(accumulator, beams[1:], inv_cov)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import astropy.io.fits as pyfits
+from apercal.subs import mosaic_engine
+
+
+def miriad_chain(images, beams, inv_cov):
+    """
+    Linear mosaic done step by step in single precision like the maths calls in the mosaic module
+    """
+    nbeams = len(beams)
+    beams = [np.nan_to_num(b).astype(np.float32) for b in beams]
+    images = [np.nan_to_num(i).astype(np.float32) for i in images]
+    btci = []
+    for bm in range(nbeams):
+        total = beams[0] * np.float32(inv_cov[0, bm])
+        for b in range(1, nbeams):
+            total = beams[b] * np.float32(inv_cov[b, bm]) + total
+        btci.append(total)
+    variance = btci[0] * beams[0]
+    numerator = btci[0] * images[0]
+    for b in range(1, nbeams):
+        variance = btci[b] * beams[b] + variance
+        numerator = btci[b] * images[b] + numerator
+    ny, nx = variance.shape
+    max_variance = variance[ny // 4:ny // 4 + ny // 2, nx // 4:nx // 4 + nx // 2].max()
+    mask = variance > 0.01 * max_variance
+    mosaic = np.where(mask, numerator / np.where(mask, variance, 1.), np.nan)
+    noise = np.where(mask, 1. / np.sqrt(np.where(mask, variance, 1.)), np.nan)
+    return mosaic, noise
+
+
+class TestMosaicEngine(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(40)
+        nbeams = 40
+        ny, nx = 96, 128
+        y, x = np.mgrid[0:ny, 0:nx]
+        self.beams = []
+        self.images = []
+        for b in range(nbeams):
+            y0, x0 = rng.uniform(0, ny), rng.uniform(0, nx)
+            beam = np.exp(-((y - y0) ** 2 + (x - x0) ** 2) / (2. * 20. ** 2)).astype(np.float32)
+            # beam maps are masked below the cutoff
+            beam[beam < 0.25] = np.nan
+            self.beams.append(beam)
+            self.images.append((beam * 0.1 + rng.normal(0, 1e-3, (ny, nx))).astype(np.float32))
+        self.noise = noise = rng.uniform(1e-4, 3e-4, nbeams)
+        correlation = np.eye(nbeams) + 0.1 * (np.eye(nbeams, k=1) + np.eye(nbeams, k=-1))
+        self.inv_cov = np.linalg.inv(correlation * np.outer(noise, noise))
+
+    def test_linear_mosaic(self):
+        mosaic, noise, _ = mosaic_engine.linear_mosaic(self.images, self.beams, self.inv_cov, block_rows=17)
+        ref_mosaic, ref_noise = miriad_chain(self.images, self.beams, self.inv_cov)
+        np.testing.assert_array_equal(np.isnan(mosaic), np.isnan(ref_mosaic))
+        np.testing.assert_allclose(mosaic, ref_mosaic, rtol=1e-4, equal_nan=True)
+        np.testing.assert_allclose(noise, ref_noise, rtol=1e-4, equal_nan=True)
+
+    def test_sparse_inverse_covariance(self):
+        # without the ASKAP based correlation matrix only the diagonal is non-zero
+        inv_cov = np.diag(1. / self.noise ** 2)
+        self.assertEqual(mosaic_engine.sparse_inverse_covariance(inv_cov).nnz, len(self.beams))
+        mosaic, noise, _ = mosaic_engine.linear_mosaic(self.images, self.beams, inv_cov, block_rows=17)
+        ref_mosaic, ref_noise = miriad_chain(self.images, self.beams, inv_cov)
+        np.testing.assert_allclose(mosaic, ref_mosaic, rtol=1e-4, equal_nan=True)
+        np.testing.assert_allclose(noise, ref_noise, rtol=1e-4, equal_nan=True)
+
+    def test_stacked_weighted_sums(self):
+        # Stokes planes with their own noise, the first two planes have the same covariance matrix
+        rng = np.random.RandomState(38)
+        inv_covs = [self.inv_cov, self.inv_cov, np.diag(1. / self.noise ** 2)]
+        images = [[image, -image, image * rng.uniform(0.5, 2.)] for image in self.images]
+        numerator, variance = mosaic_engine.stacked_weighted_sums(images, self.beams, inv_covs, block_rows=17)
+        for plane, inv_cov in enumerate(inv_covs):
+            ref_mosaic, ref_noise = miriad_chain([i[plane] for i in images], self.beams, inv_cov)
+            mosaic, noise, _ = mosaic_engine.finalise_mosaic(numerator[plane], variance[plane])
+            np.testing.assert_allclose(mosaic, ref_mosaic, rtol=1e-4, equal_nan=True)
+            np.testing.assert_allclose(noise, ref_noise, rtol=1e-4, equal_nan=True)
+
+    def test_tiled_mosaic(self):
+        ny, nx = self.beams[0].shape
+        header = pyfits.Header()
+        header['CTYPE1'] = 'RA---NCP'
+        header['CTYPE2'] = 'DEC--NCP'
+        header['CRVAL1'] = 180.
+        header['CRVAL2'] = 30.
+        header['CDELT1'] = -4. / 3600.
+        header['CDELT2'] = 4. / 3600.
+        header['CRPIX1'] = nx // 2 + 1
+        header['CRPIX2'] = ny // 2 + 1
+        grid_header = mosaic_engine.get_grid_header(header, (ny, nx))
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            mosaic_file = os.path.join(tmpdir, 'mosaic.fits')
+            noise_file = os.path.join(tmpdir, 'noise.fits')
+            mosaic_engine.create_empty_fits(mosaic_file, grid_header)
+            mosaic_engine.create_empty_fits(noise_file, grid_header)
+            padding = 5
+            for tile in mosaic_engine.get_tiles((ny, nx), 40):
+                padded = mosaic_engine.pad_box(tile, padding, (ny, nx))
+                # the footprint of a tile on the full grid is the tile itself
+                tile_header = mosaic_engine.get_grid_header(
+                    grid_header, (padded[1] - padded[0], padded[3] - padded[2]), x0=padded[2], y0=padded[0])
+                self.assertEqual(mosaic_engine.get_sky_footprint(tile_header, grid_header), padded)
+                region = (slice(padded[0], padded[1]), slice(padded[2], padded[3]))
+                numerator, variance = mosaic_engine.weighted_sums(
+                    [i[region] for i in self.images], [b[region] for b in self.beams], self.inv_cov)
+                inner = (slice(tile[0] - padded[0], tile[1] - padded[0]),
+                         slice(tile[2] - padded[2], tile[3] - padded[2]))
+                mosaic_engine.write_tile(mosaic_file, numerator[inner], tile)
+                mosaic_engine.write_tile(noise_file, variance[inner], tile)
+            mosaic_engine.finalise_mosaic_files(mosaic_file, noise_file, block_rows=17)
+
+            ref_mosaic, ref_noise, _ = mosaic_engine.linear_mosaic(self.images, self.beams, self.inv_cov)
+            np.testing.assert_allclose(pyfits.getdata(mosaic_file), ref_mosaic, rtol=1e-5, equal_nan=True)
+            np.testing.assert_allclose(pyfits.getdata(noise_file), ref_noise, rtol=1e-5, equal_nan=True)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_linear_mosaic_files(self):
+        ny, nx = self.beams[0].shape
+        header = pyfits.Header()
+        header['NAXIS'] = 2
+        header['NAXIS1'] = nx
+        header['NAXIS2'] = ny
+        header['CTYPE1'] = 'RA---NCP'
+        header['CTYPE2'] = 'DEC--NCP'
+        header['CRVAL1'] = 180.
+        header['CRVAL2'] = 30.
+        header['CDELT1'] = -4. / 3600.
+        header['CDELT2'] = 4. / 3600.
+        header['CRPIX1'] = nx // 2 + 1
+        header['CRPIX2'] = ny // 2 + 1
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            image_files = []
+            beam_files = []
+            for index, (image, beam) in enumerate(zip(self.images, self.beams)):
+                image_files.append(os.path.join(tmpdir, 'image_{}.map'.format(index)))
+                beam_files.append(os.path.join(tmpdir, 'beam_{}.map'.format(index)))
+                mosaic_engine.write_image(image.astype(np.float32), header, mirimage=image_files[-1])
+                mosaic_engine.write_image(beam.astype(np.float32), header, mirimage=beam_files[-1])
+
+            # the masked beam maps stay memory-mapped and are masked for the rows that are read
+            beam, _ = mosaic_engine.load_miriad_plane(beam_files[0])
+            self.assertIsInstance(beam.data, np.memmap)
+            np.testing.assert_array_equal(beam[10:30, 5:], self.beams[0][10:30, 5:])
+            np.testing.assert_array_equal(beam[7], self.beams[0][7])
+
+            mosaic_file = os.path.join(tmpdir, 'mosaic_final.map')
+            noise_file = os.path.join(tmpdir, 'mosaic_noise.map')
+            mosaic_engine.linear_mosaic_files(image_files, beam_files, self.inv_cov, mosaic_file, noise_file)
+            ref_mosaic, ref_noise, _ = mosaic_engine.linear_mosaic(self.images, self.beams, self.inv_cov)
+            np.testing.assert_allclose(mosaic_engine.load_miriad_plane(mosaic_file)[0], ref_mosaic,
+                                       rtol=1e-5, equal_nan=True)
+            np.testing.assert_allclose(mosaic_engine.load_miriad_plane(noise_file)[0], ref_noise,
+                                       rtol=1e-5, equal_nan=True)
+            # the images are written as MIRIAD images only
+            self.assertEqual([name for name in os.listdir(tmpdir) if not name.endswith('.map')], [])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import astropy.io.fits as pyfits
+from apercal.subs import mosaic_utils
+from apercal.subs import robuststats
+from apercal.exceptions import ApercalException
+
+
+class TestBeamCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.image = os.path.join(self.tmpdir, 'beam_00.map')
+        os.mkdir(self.image)
+        for item, content in [('header', b'crval1 1.0'), ('image', b'\x00' * 64), ('history', b'maths')]:
+            with open(os.path.join(self.image, item), 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_image_checksum(self):
+        checksum = mosaic_utils.get_miriad_image_checksum(self.image)
+        # the history does not change the content of the image
+        with open(os.path.join(self.image, 'history'), 'ab') as f:
+            f.write(b'puthd')
+        self.assertEqual(mosaic_utils.get_miriad_image_checksum(self.image), checksum)
+        with open(os.path.join(self.image, 'header'), 'wb') as f:
+            f.write(b'crval1 2.0')
+        self.assertNotEqual(mosaic_utils.get_miriad_image_checksum(self.image), checksum)
+
+    def test_image_stamp(self):
+        stamp = mosaic_utils.get_image_stamp(self.image)
+        self.assertEqual([item[0] for item in stamp], ['header', 'image'])
+        with open(os.path.join(self.image, 'history'), 'ab') as f:
+            f.write(b'puthd')
+        self.assertEqual(mosaic_utils.get_image_stamp(self.image), stamp)
+        with open(os.path.join(self.image, 'image'), 'ab') as f:
+            f.write(b'\x00' * 4)
+        self.assertNotEqual(mosaic_utils.get_image_stamp(self.image), stamp)
+
+    def test_missing_primary_beam_path(self):
+        with self.assertRaises(ApercalException):
+            mosaic_utils.create_beam('01', self.tmpdir, corrtype='Correct',
+                                     cache_dir=os.path.join(self.tmpdir, 'cache'))
+
+    def test_regridded_beam_key(self):
+        grid = [('crval1', '1.0'), ('crval2', '60.0')]
+        key = mosaic_utils.get_regridded_beam_key(self.image, grid, engine='numpy')
+        self.assertEqual(mosaic_utils.get_regridded_beam_key(self.image, grid, engine='numpy'), key)
+        self.assertNotEqual(mosaic_utils.get_regridded_beam_key(self.image, grid[:1], engine='numpy'), key)
+        self.assertNotEqual(mosaic_utils.get_regridded_beam_key(self.image, grid, engine='miriad'), key)
+
+    def test_add_to_cache(self):
+        cached_image = os.path.join(self.tmpdir, 'cache', 'regrid_0.map')
+        mosaic_utils.add_to_cache(self.image, cached_image)
+        self.assertEqual(mosaic_utils.get_miriad_image_checksum(cached_image),
+                         mosaic_utils.get_miriad_image_checksum(self.image))
+        # adding it again keeps the cached image and leaves no temporary files
+        mosaic_utils.add_to_cache(self.image, cached_image)
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir, 'cache')), ['regrid_0.map'])
+
+
+class TestInverseCovariance(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.RandomState(50)
+        self.nbeams = 5
+        self.sigmas = {0: 1e-3, 1: 2e-3, 3: 1.5e-3}
+        for bm, sigma in self.sigmas.items():
+            pyfits.writeto(os.path.join(self.tmpdir, 'image_{:02d}.fits'.format(bm)),
+                           rng.normal(scale=sigma, size=(100, 100)).astype(np.float32))
+        self.imagefiles = os.path.join(self.tmpdir, 'image_{0}.fits')
+        self.noise_cor = np.identity(self.nbeams)
+        self.noise_cor[0, 1] = self.noise_cor[1, 0] = 0.3
+        self.noise_cor[1, 3] = self.noise_cor[3, 1] = 0.1
+        self.corr_matrix = os.path.join(self.tmpdir, 'correlation.txt')
+        np.savetxt(self.corr_matrix, self.noise_cor)
+        mosaic_utils._inverse_covariance_cache.clear()
+        mosaic_utils._image_checksum_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_inverted_covariance_matrix(self):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        # beam 2 has no image, beam 4 is not in the beam list
+        inv_cov = mosaic_utils.inverted_covariance_matrix(self.imagefiles, self.corr_matrix, self.nbeams,
+                                                          ['00', '01', '02', '03'], cache_dir=cache_dir)
+        sigma = np.array([robuststats.image_noise(self.imagefiles.format(str(bm).zfill(2)))
+                          if bm in self.sigmas else 0. for bm in range(self.nbeams)])
+        noise_cov = np.identity(self.nbeams)
+        for a in range(self.nbeams):
+            for b in range(self.nbeams):
+                if sigma[a] != 0 and sigma[b] != 0:
+                    noise_cov[a, b] = self.noise_cor[a, b] * sigma[a] * sigma[b]
+        np.testing.assert_allclose(inv_cov, np.linalg.inv(noise_cov), rtol=1e-8)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        # the same images are taken from the cache without measuring the noise again
+        def fail(images):
+            raise AssertionError("noise measured again")
+
+        images_noise = robuststats.images_noise
+        robuststats.images_noise = fail
+        try:
+            mosaic_utils._inverse_covariance_cache.clear()
+            cached = mosaic_utils.inverted_covariance_matrix(self.imagefiles, self.corr_matrix, self.nbeams,
+                                                             ['00', '01', '02', '03'], cache_dir=cache_dir)
+            np.testing.assert_array_equal(cached, inv_cov)
+        finally:
+            robuststats.images_noise = images_noise
+
+    def test_covariance_key(self):
+        images = dict((bm, self.imagefiles.format(str(bm).zfill(2))) for bm in self.sigmas)
+        key = mosaic_utils.get_covariance_key(images, self.corr_matrix, self.nbeams)
+        self.assertEqual(mosaic_utils.get_covariance_key(images, self.corr_matrix, self.nbeams), key)
+
+        # a repeated key only needs the stamps of the images
+        get_file_checksum = mosaic_utils.get_file_checksum
+        checksummed = []
+
+        def record(filename):
+            checksummed.append(filename)
+            return get_file_checksum(filename)
+
+        mosaic_utils.get_file_checksum = record
+        try:
+            self.assertEqual(mosaic_utils.get_covariance_key(images, self.corr_matrix, self.nbeams), key)
+        finally:
+            mosaic_utils.get_file_checksum = get_file_checksum
+        self.assertEqual(checksummed, [self.corr_matrix])
+
+        # copies of the images, e.g. in the directory of another mosaic, have the same key
+        copydir = os.path.join(self.tmpdir, 'copy')
+        os.makedirs(copydir)
+        copies = {}
+        for bm, image in images.items():
+            copies[bm] = os.path.join(copydir, os.path.basename(image))
+            shutil.copy(image, copies[bm])
+        self.assertEqual(mosaic_utils.get_covariance_key(copies, self.corr_matrix, self.nbeams), key)
+
+        pyfits.writeto(images[3], np.zeros((200, 200), dtype=np.float32), overwrite=True)
+        self.assertNotEqual(mosaic_utils.get_covariance_key(images, self.corr_matrix, self.nbeams), key)
+
+    def test_singular_matrix(self):
+        noise_cov = np.ones((3, 3))
+        np.testing.assert_allclose(mosaic_utils.invert_covariance_matrix(noise_cov), np.linalg.pinv(noise_cov))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+from apercal.subs import mirio
+from apercal.subs import readmirhead
+
+
+def header_record(name, data):
+    """
+    Record of the header item like MIRIAD writes it
+    """
+    padding = b'\x00' * ((16 - len(data) % 16) % 16)
+    return name.encode('ascii') + b'\x00' * (15 - len(name)) + struct.pack('B', len(data)) + data + padding
+
+
+def text_item(value):
+    return struct.pack('>i', 1) + value.encode('ascii')
+
+
+def int_item(value):
+    return struct.pack('>ii', 2, value)
+
+
+def real_item(value):
+    return struct.pack('>if', 4, value)
+
+
+def double_item(value):
+    return struct.pack('>iid', 5, 0, value)
+
+
+class TestReadMirHead(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.image = os.path.join(self.tmpdir, 'image_00.map')
+        os.mkdir(self.image)
+        items = [('naxis', int_item(3)), ('naxis1', int_item(3073)), ('naxis2', int_item(3073)),
+                 ('naxis3', int_item(1)), ('ctype1', text_item('RA---NCP')), ('ctype2', text_item('DEC--NCP')),
+                 ('ctype3', text_item('FREQ')), ('crval1', double_item(3.3)), ('crval2', double_item(0.9)),
+                 ('crval3', double_item(1.36)), ('cdelt3', double_item(0.0001)), ('crpix3', double_item(1.)),
+                 ('bmaj', real_item(5e-5)), ('bmin', real_item(4e-5)), ('bpa', real_item(10.))]
+        self.header = b''.join(header_record(name, data) for name, data in items)
+        with open(os.path.join(self.image, 'header'), 'wb') as f:
+            f.write(self.header)
+        # items larger than 64 bytes are in their own file
+        with open(os.path.join(self.image, 'object'), 'wb') as f:
+            f.write(text_item('A' * 80))
+
+        self.uv = os.path.join(self.tmpdir, 'target.mir')
+        os.mkdir(self.uv)
+        with open(os.path.join(self.uv, 'header'), 'wb') as f:
+            f.write(header_record('obstype', text_item('crosscorrelation')))
+        with open(os.path.join(self.uv, 'vartable'), 'w') as f:
+            f.write('a source\nd ra\nd dec\ni nschan\nd sfreq\nd sdf\n')
+        # visdata: size and data tokens aligned to 8 bytes, then the end of the record
+        tokens = [struct.pack('>BBBBi', 0, 0, 0, 0, 5), struct.pack('>BBBB', 0, 0, 1, 0) + b'3C147' + b'\x00' * 7]
+        for number, value in [(1, 1.5), (2, 0.87), (4, 1.2), (5, 0.000012)]:
+            tokens.append(struct.pack('>BBBBi', number, 0, 0, 0, 8))
+            tokens.append(struct.pack('>BBBBi', number, 0, 1, 0, 0) + struct.pack('>d', value))
+        tokens.append(struct.pack('>BBBBi', 3, 0, 0, 0, 4))
+        tokens.append(struct.pack('>BBBBi', 3, 0, 1, 0, 64))
+        tokens.append(struct.pack('>BBBB', 0, 0, 2, 0) + b'\x00' * 4)
+        with open(os.path.join(self.uv, 'visdata'), 'wb') as f:
+            f.write(b''.join(tokens))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_header_round_trip(self):
+        header = mirio.MiriadHeader(self.image)
+        self.assertEqual(header['ctype1'], 'RA---NCP')
+        self.assertEqual(header['naxis1'], 3073)
+        self.assertEqual(header['crval1'], 3.3)
+        self.assertEqual(header.get_type('bmaj'), 'real')
+        self.assertEqual(header['object'], 'A' * 80)
+        header.modified = True
+        header.save()
+        with open(os.path.join(self.image, 'header'), 'rb') as f:
+            self.assertEqual(f.read(), self.header)
+
+    def test_beam(self):
+        np.testing.assert_allclose(readmirhead.getbeamimage(self.image),
+                                   [5e-5 * 3600. * 180. / np.pi, 4e-5 * 3600. * 180. / np.pi, 10.], rtol=1e-6)
+        readmirhead.putbeamimage(self.image, [12., 10., -30.])
+        np.testing.assert_allclose(readmirhead.getbeamimage(self.image), [12., 10., -30.], rtol=1e-6)
+        # the beam items stay real and the other items are not changed
+        header = mirio.MiriadHeader(self.image)
+        self.assertEqual(header.get_type('bmaj'), 'real')
+        with open(os.path.join(self.image, 'header'), 'rb') as f:
+            self.assertEqual(len(f.read()), len(self.header))
+
+    def test_image_coordinates(self):
+        self.assertAlmostEqual(readmirhead.getradec(self.image).ra.rad, 3.3)
+        self.assertAlmostEqual(readmirhead.getradec(self.image).dec.rad, 0.9)
+        self.assertEqual(readmirhead.getnchan(self.image), 1)
+        self.assertAlmostEqual(readmirhead.getfreq(self.image), 1.36 + 0.5 * 0.0001)
+
+    def test_uv_variables(self):
+        self.assertEqual(mirio.get_uv_variables(self.uv)['source'], '3C147')
+        self.assertEqual(readmirhead.getnchan(self.uv), 64)
+        self.assertAlmostEqual(readmirhead.getfreq(self.uv), 1.2 + 32 * 0.000012)
+        self.assertAlmostEqual(readmirhead.getradec(self.uv).ra.rad, 1.5)
+        self.assertEqual(readmirhead.getradecsex(self.uv), '05:43:46,49:50:50')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import datetime
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+from apercal.subs import mirio
+from apercal.subs import readmirlog
+from apercal.exceptions import ApercalException
+
+
+class TestReadMirLog(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.tmpdir = tempfile.mkdtemp()
+        self.vis = os.path.join(self.tmpdir, 'target.mir')
+        os.mkdir(self.vis)
+        open(os.path.join(self.vis, 'header'), 'wb').close()
+        self.nants, self.nfeeds, self.nsols, self.nfbin, self.nchan = 12, 2, 5, 3, 20
+        ngains = self.nants * (self.nfeeds + 1)
+        header = mirio.MiriadHeader(self.vis)
+        for name, value in [('ngains', ngains), ('nfeeds', self.nfeeds), ('ntau', 1), ('nsols', self.nsols),
+                            ('nfbin', self.nfbin), ('nspect0', 2), ('nchan0', self.nchan)]:
+            header.set(name, value, type_name='int')
+        header.save()
+
+        shape = (self.nsols, self.nfbin, self.nants, self.nfeeds + 1)
+        self.gains = (rng.normal(1, 0.1, shape) + 1j * rng.normal(0, 0.1, shape)).astype(np.complex64)
+        self.times = 2458604.5 + np.arange(self.nsols) / 24.
+        self.bin_freqs = 1.3 + 0.05 * np.arange(self.nfbin)
+        # the average gains and the gains of the frequency bins
+        with open(os.path.join(self.vis, 'gains'), 'wb') as f:
+            f.write(b'\x00' * 8)
+            for sol in range(self.nsols):
+                f.write(struct.pack('>d', self.times[sol]))
+                f.write(self.gains[sol].mean(axis=0).astype('>c8').tobytes())
+        with open(os.path.join(self.vis, 'gainsf'), 'wb') as f:
+            f.write(b'\x00' * 8)
+            for sol in range(self.nsols):
+                f.write(struct.pack('>d', self.times[sol]))
+                for fbin in range(self.nfbin):
+                    f.write(struct.pack('>d', self.bin_freqs[fbin]))
+                    f.write(self.gains[sol, fbin].astype('>c8').tobytes())
+
+        self.bandpass = (rng.normal(1, 0.1, (self.nants, self.nfeeds, self.nchan)) + 0j).astype(np.complex64)
+        with open(os.path.join(self.vis, 'bandpass'), 'wb') as f:
+            f.write(b'\x00' * 8)
+            f.write(self.bandpass.astype('>c8').tobytes())
+        with open(os.path.join(self.vis, 'freqs'), 'wb') as f:
+            f.write(b'\x00' * 8)
+            for sfreq in [1.30, 1.31]:
+                f.write(struct.pack('>iidd', self.nchan // 2, 0, sfreq, 0.001))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_gains(self):
+        gains = readmirlog.read_gains(self.vis)
+        self.assertEqual(gains['gains'].shape, (self.nants, self.nfeeds, self.nfbin, self.nsols))
+        np.testing.assert_array_equal(gains['gains'], np.transpose(self.gains[..., :2], (2, 3, 1, 0)))
+        np.testing.assert_array_equal(gains['taus'], np.transpose(self.gains[..., 2], (2, 1, 0)))
+        np.testing.assert_array_equal(gains['freqs'][:, 0], self.bin_freqs)
+        self.assertEqual(readmirlog.get_ndims(self.vis), (self.nants, self.nfbin, self.nsols))
+
+        amps, times = readmirlog.get_amps(self.vis)
+        np.testing.assert_allclose(amps, np.abs(np.transpose(self.gains[..., 0], (2, 1, 0))), rtol=1e-6)
+        self.assertEqual(times[0], datetime.datetime(2019, 5, 1))
+        self.assertAlmostEqual((times[1] - times[0]).total_seconds(), 3600., places=3)
+
+    def test_bandpass(self):
+        bp_array, freqs = readmirlog.get_bp(self.vis)
+        self.assertEqual(bp_array.shape, (self.nants, self.nchan, 1))
+        np.testing.assert_allclose(bp_array[:, :, 0], np.abs(self.bandpass[:, 0]), rtol=1e-6)
+        np.testing.assert_allclose(freqs[[0, 9, 10]], [1.30, 1.309, 1.31])
+
+    def test_truncated_item(self):
+        with open(os.path.join(self.vis, 'gainsf'), 'rb+') as f:
+            f.truncate(100)
+        self.assertRaises(ApercalException, readmirlog.read_gains, self.vis)
+
+
+if __name__ == "__main__":
+    unittest.main()
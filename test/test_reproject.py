@@ -0,0 +1,105 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import astropy.io.fits as pyfits
+from astropy.wcs import WCS
+from apercal.subs import convim
+from apercal.subs import reproject
+
+
+def get_header(nx, ny, crval1, crval2, cdelt):
+    header = pyfits.Header()
+    header['NAXIS'] = 2
+    header['NAXIS1'] = nx
+    header['NAXIS2'] = ny
+    header['CTYPE1'] = 'RA---SIN'
+    header['CTYPE2'] = 'DEC--SIN'
+    header['CRVAL1'] = crval1
+    header['CRVAL2'] = crval2
+    header['CDELT1'] = -cdelt / 3600.
+    header['CDELT2'] = cdelt / 3600.
+    header['CRPIX1'] = nx // 2 + 1
+    header['CRPIX2'] = ny // 2 + 1
+    return header
+
+
+class TestReproject(unittest.TestCase):
+    def setUp(self):
+        self.header = get_header(80, 60, 180.1, 30.05, 10.)
+        self.template_header = get_header(120, 100, 180., 30., 8.)
+        self.template_header['CTYPE1'] = 'RA---NCP'
+        self.template_header['CTYPE2'] = 'DEC--NCP'
+
+    def sky(self, header):
+        # smooth function of the sky position, which bilinear interpolation follows closely
+        ny, nx = header['NAXIS2'], header['NAXIS1']
+        y, x = np.mgrid[0:ny, 0:nx]
+        ra, dec = WCS(header).celestial.wcs_pix2world(x, y, 0)
+        return np.cos(np.radians(ra - 180.) * 60.) * np.sin(np.radians(dec - 30.) * 60.)
+
+    def test_reproject_planes(self):
+        image = self.sky(self.header)
+        planes = np.stack([image, 2. * image, -image]).astype(np.float32)
+        rmap = reproject.compute_reprojection_map(self.header, self.template_header, block_rows=7)
+        template_shape = (self.template_header['NAXIS2'], self.template_header['NAXIS1'])
+        regridded = reproject.reproject_planes(planes, rmap, template_shape)
+        self.assertEqual(regridded.shape, (3,) + template_shape)
+
+        expected = self.sky(self.template_header)
+        covered = np.isfinite(regridded[0])
+        self.assertTrue(covered.sum() > 1000)
+        self.assertFalse(covered.all())
+        np.testing.assert_allclose(regridded[0][covered], expected[covered], atol=5e-3)
+        np.testing.assert_allclose(regridded[1], 2. * regridded[0], rtol=1e-6, equal_nan=True)
+        np.testing.assert_allclose(regridded[2], -regridded[0], rtol=1e-6, equal_nan=True)
+
+        # blanked pixels only blank their neighbourhood
+        planes[0, 30, 40] = np.nan
+        blanked = reproject.reproject_planes(planes[0], rmap, template_shape)
+        self.assertTrue(0 < (np.isnan(blanked) & covered).sum() <= 9)
+
+    def test_identical_grid(self):
+        image = np.random.RandomState(36).normal(size=(60, 80)).astype(np.float32)
+        rmap = reproject.compute_reprojection_map(self.header, self.header)
+        np.testing.assert_allclose(reproject.reproject_planes(image, rmap, image.shape), image, atol=1e-4)
+
+    def test_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            rmap = reproject.get_reprojection_map(self.header, self.template_header, tmpdir)
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+            cached = reproject.get_reprojection_map(self.header, self.template_header, tmpdir)
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+            for name in rmap:
+                np.testing.assert_array_equal(rmap[name], cached[name])
+            # another grid gets its own map
+            header = self.header.copy()
+            header['CRVAL2'] = 30.1
+            reproject.get_reprojection_map(header, self.template_header, tmpdir)
+            self.assertEqual(len(os.listdir(tmpdir)), 2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_regrid_miriad_image(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            image = os.path.join(tmpdir, 'image')
+            template = os.path.join(tmpdir, 'template')
+            output = os.path.join(tmpdir, 'regridded')
+            convim.numpytomir(self.sky(self.header).astype(np.float32), image, header=self.header)
+            convim.numpytomir(np.zeros((100, 120), dtype=np.float32), template, header=self.template_header)
+            reproject.regrid_miriad_image(image, output, template, os.path.join(tmpdir, 'cache'))
+            data, header = convim.mirtonumpy(output)
+            self.assertEqual(header['CTYPE1'], 'RA---NCP')
+            covered = np.isfinite(data)
+            self.assertTrue(covered.sum() > 1000)
+            np.testing.assert_allclose(data[covered], self.sky(self.template_header)[covered], atol=5e-3)
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['cache', 'image', 'regridded', 'template'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
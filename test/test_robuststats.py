@@ -0,0 +1,76 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import astropy.io.fits as pyfits
+from apercal.subs import convim
+from apercal.subs import mosaic_engine
+from apercal.subs import robuststats
+from apercal.exceptions import ApercalException
+
+
+def get_header(nx, ny):
+    header = pyfits.Header()
+    header['NAXIS'] = 3
+    header['NAXIS1'] = nx
+    header['NAXIS2'] = ny
+    header['NAXIS3'] = 2
+    for axis, ctype in [(1, 'RA---SIN'), (2, 'DEC--SIN'), (3, 'FREQ')]:
+        header['CTYPE{}'.format(axis)] = ctype
+        header['CRPIX{}'.format(axis)] = 1.
+    header['CRVAL1'], header['CDELT1'] = 180., -1e-3
+    header['CRVAL2'], header['CDELT2'] = 30., 1e-3
+    header['CRVAL3'], header['CDELT3'] = 1.4e9, 1e6
+    return header
+
+
+class TestRobustStats(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.RandomState(49)
+        self.sigmas = [1e-3, 2e-3, 5e-4, 4e-3]
+        self.images = []
+        for n, sigma in enumerate(self.sigmas):
+            data = rng.normal(scale=sigma, size=(2, 200, 240)).astype(np.float32)
+            # bright sources and blanked corners do not change the noise
+            data[0, 50:55, 60:65] = 100 * sigma
+            data[:, :10, :10] = np.nan
+            image = os.path.join(self.tmpdir, 'image_{:02d}'.format(n))
+            if n % 2 == 0:
+                convim.numpytomir(data, image, header=get_header(240, 200))
+            else:
+                image += '.fits'
+                pyfits.writeto(image, data, get_header(240, 200))
+            self.images.append(image)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_regions(self):
+        self.assertEqual(robuststats.get_region_slices((2, 200, 240), "'quarter(1)'"),
+                         (slice(0, 1), slice(50, 150), slice(60, 180)))
+        self.assertEqual(robuststats.get_region_slices((101, 75), 'quarter')[1:],
+                         mosaic_engine.get_quarter_region((101, 75)))
+        self.assertEqual(robuststats.get_region_slices((2, 200, 240), 'box(11,21,30,40)(2,2)'),
+                         (slice(1, 2), slice(20, 40), slice(10, 30)))
+        self.assertRaises(ApercalException, robuststats.get_region_slices, (200, 240), 'polygon(1,1,5,5,1,5)')
+        data = np.arange(2 * 200 * 240, dtype=np.float32).reshape(2, 200, 240)
+        self.assertEqual(robuststats.get_region_data(data, 'quarter(2)').max(), data[1, 149, 179])
+        image = self.images[0]
+        self.assertAlmostEqual(robuststats.region_max(image, 'quarter(1)'), 0.1, places=6)
+        self.assertLess(robuststats.region_max(image, 'quarter(2)'), 0.01)
+        self.assertLess(robuststats.region_min(image, 'box(1,1,240,200)'), -3e-3)
+
+    def test_noise(self):
+        for image, sigma in zip(self.images, self.sigmas):
+            self.assertLess(abs(robuststats.image_noise(image) / sigma - 1), 0.03)
+        data = robuststats.get_region_data(convim.mirtonumpy(self.images[0])[0])
+        self.assertLess(abs(robuststats.mad_noise(data) / self.sigmas[0] - 1), 0.03)
+        noise = robuststats.images_noise(self.images, threads=3)
+        np.testing.assert_allclose(noise, [robuststats.image_noise(image) for image in self.images])
+        self.assertTrue(np.isnan(robuststats.sigma_clipped_rms(np.full(10, np.nan))))
+
+
+if __name__ == "__main__":
+    unittest.main()